@@ -0,0 +1,198 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+
+from array import array
+
+
+class BrowsedShares:
+    """ Compact storage for the shared file list of a browsed user.
+
+    Parsed SharedFileList messages hold a Python list per file, which adds
+    up to hundreds of megabytes for large shares. Here, all files are kept
+    in flat columns instead: file names are packed into a single UTF-8 blob,
+    sizes and attributes are stored in arrays, and each directory refers to
+    a contiguous range of files.
+
+    Directories are added with add() or extend(), in the (directory, files)
+    format of SharedFileList.list. Iterating yields the same format, so
+    instances can stand in for such a list. """
+
+    NAME_SEPARATOR = b"\0"
+
+    def __init__(self, shares=None):
+
+        self.directories = []
+        self.totalsize = 0
+
+        self._dirindex = {}
+        self._dirfiles = array('I', [0])
+
+        self._names = bytearray()
+        self._nameoffsets = array('I', [0])
+        self._codes = bytearray()
+        self._sizes = array('Q')
+
+        self._exts = []
+        self._extindex = {}
+        self._fileexts = array('I')
+
+        self._attrs = array('I')
+        self._attroffsets = array('I', [0])
+
+        if shares:
+            self.extend(shares)
+
+    def __len__(self):
+        return len(self.directories)
+
+    def __contains__(self, directory):
+        return directory in self._dirindex
+
+    def __iter__(self):
+
+        for index, directory in enumerate(self.directories):
+            yield directory, self._get_files(index)
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        del state["_dirindex"]
+        del state["_extindex"]
+
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+
+        self._dirindex = {}
+        for index, directory in enumerate(self.directories):
+            self._dirindex.setdefault(directory, index)
+
+        self._extindex = {ext: index for index, ext in enumerate(self._exts)}
+
+    def add(self, directory, files):
+        """ Adds a directory and its files, a list of [code, name, size, ext, attrs] """
+
+        names = self._names
+        separator = self.NAME_SEPARATOR
+        sizes = self._sizes
+        maxsize = sys.maxsize
+
+        for code, name, size, ext, attrs in files:
+            names += name.encode("utf-8", "surrogatepass")
+            names += separator
+            self._nameoffsets.append(len(names))
+
+            self._codes.append(code)
+            sizes.append(size)
+
+            if size < maxsize:
+                self.totalsize += size
+
+            extindex = self._extindex.get(ext)
+
+            if extindex is None:
+                extindex = self._extindex[ext] = len(self._exts)
+                self._exts.append(ext)
+
+            self._fileexts.append(extindex)
+
+            self._attrs.extend(attrs)
+            self._attroffsets.append(len(self._attrs))
+
+        directory = sys.intern(directory)
+
+        # Keep the first one if a directory is listed twice, like the lists did
+        self._dirindex.setdefault(directory, len(self.directories))
+        self.directories.append(directory)
+        self._dirfiles.append(len(sizes))
+
+    def extend(self, shares):
+        """ Adds a list of (directory, files) tuples """
+
+        for directory, files in shares:
+            self.add(directory, files)
+
+    def get_files(self, directory):
+        """ Returns the files in a directory as a list of
+        [code, name, size, ext, attrs], or None if the directory isn't shared """
+
+        index = self._dirindex.get(directory)
+
+        if index is None:
+            return None
+
+        return self._get_files(index)
+
+    def _get_files(self, index):
+
+        names = self._names
+        nameoffsets = self._nameoffsets
+        attrs = self._attrs
+        attroffsets = self._attroffsets
+        exts = self._exts
+        files = []
+
+        for i in range(self._dirfiles[index], self._dirfiles[index + 1]):
+            files.append([
+                self._codes[i],
+                names[nameoffsets[i]:nameoffsets[i + 1] - 1].decode("utf-8", "surrogatepass"),
+                self._sizes[i],
+                exts[self._fileexts[i]],
+                attrs[attroffsets[i]:attroffsets[i + 1]].tolist()
+            ])
+
+        return files
+
+    def get_subdirectories(self, directory):
+        """ Returns the directories below a directory """
+
+        prefix = directory + "\\"
+        return [subdir for subdir in self.directories if subdir.startswith(prefix)]
+
+    def find(self, query):
+        """ Returns the directories whose path, or the name of one of their
+        files, contains query. query must be in lower case. """
+
+        names = self._names
+        nameoffsets = self._nameoffsets
+        dirfiles = self._dirfiles
+        separator = self.NAME_SEPARATOR.decode()
+        found = []
+
+        if separator in query:
+            return found
+
+        for index, directory in enumerate(self.directories):
+            if query in directory.lower():
+                found.append(directory)
+                continue
+
+            # The names of a directory are contiguous, and separated so that
+            # a match can't span two names
+            start = nameoffsets[dirfiles[index]]
+            end = nameoffsets[dirfiles[index + 1]]
+
+            if start != end and query in names[start:end].decode("utf-8", "surrogatepass").lower():
+                found.append(directory)
+
+        # Directories listed more than once only count once
+        return list(dict.fromkeys(found))
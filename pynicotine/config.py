@@ -40,6 +40,8 @@ from os.path import exists
 
 import _thread
 from pynicotine.logfacility import log
+from pynicotine.searchindex import WordIndex
+from pynicotine.sharestore import ShareStore
 
 if sys.platform == "win32":
     # Use semidbm for faster shelves on Windows
@@ -83,6 +85,7 @@ class Config:
         self.config_lock = _thread.allocate_lock()
         self.config_lock.acquire()
         self.frame = None
+        self.sharestore = None
         self.filename = filename
         self.data_dir = data_dir
         self.parser = configparser.RawConfigParser()
@@ -113,7 +116,8 @@ class Config:
                 "ipblocklist": {"72.172.88.*": "MediaDefender Bots"},
                 "autojoin": ["nicotine"],
                 "autoaway": 15,
-                "private_chatrooms": 0
+                "private_chatrooms": 0,
+                "networkbackend": "thread"
             },
 
             "transfers": {
@@ -167,6 +171,9 @@ class Config:
                 "bfileindex": {},
                 "bsharedmtimes": {},
                 "rescanonstartup": 0,
+                "scanworkers": 0,
+                "watchshares": 0,
+                "sharefilters": [],
                 "enablefilters": 1,
                 "downloadregexp": "",
                 "downloadfilters": [
@@ -652,84 +659,139 @@ class Config:
         self.sections["transfers"]["shared"] = [_convert_to_virtual(x) for x in self.sections["transfers"]["shared"]]
         self.sections["transfers"]["buddyshared"] = [_convert_to_virtual(x) for x in self.sections["transfers"]["buddyshared"]]
 
-        sharedfiles = None
-        bsharedfiles = None
-        sharedfilesstreams = None
-        bsharedfilesstreams = None
-        wordindex = None
-        bwordindex = None
-        fileindex = None
-        bfileindex = None
-        sharedmtimes = None
-        bsharedmtimes = None
-
-        shelves = [
-            os.path.join(self.data_dir, "files.db"),
-            os.path.join(self.data_dir, "buddyfiles.db"),
-            os.path.join(self.data_dir, "streams.db"),
-            os.path.join(self.data_dir, "buddystreams.db"),
-            os.path.join(self.data_dir, "wordindex.db"),
-            os.path.join(self.data_dir, "buddywordindex.db"),
-            os.path.join(self.data_dir, "fileindex.db"),
-            os.path.join(self.data_dir, "buddyfileindex.db"),
-            os.path.join(self.data_dir, "mtimes.db"),
-            os.path.join(self.data_dir, "buddymtimes.db")
-        ]
-
-        _opened_shelves = []
         _errors = []
-        for shelvefile in shelves:
-            try:
-                _opened_shelves.append(shelve.open(shelvefile, protocol=pickle.HIGHEST_PROTOCOL))
-            except Exception:
-                _errors.append(shelvefile)
-                try:
-                    os.unlink(shelvefile)
-                    _opened_shelves.append(shelve.open(shelvefile, flag='n', protocol=pickle.HIGHEST_PROTOCOL))
-                except Exception as ex:
-                    print(("Failed to unlink %s: %s" % (shelvefile, ex)))
-
-        sharedfiles = _opened_shelves.pop(0)
-        bsharedfiles = _opened_shelves.pop(0)
-        sharedfilesstreams = _opened_shelves.pop(0)
-        bsharedfilesstreams = _opened_shelves.pop(0)
-        wordindex = _opened_shelves.pop(0)
-        bwordindex = _opened_shelves.pop(0)
-        fileindex = _opened_shelves.pop(0)
-        bfileindex = _opened_shelves.pop(0)
-        sharedmtimes = _opened_shelves.pop(0)
-        bsharedmtimes = _opened_shelves.pop(0)
+        sharestore = self.openShareStore(_errors)
+
+        wordindex = self.openWordIndex("wordindex", _errors)
+        bwordindex = self.openWordIndex("buddywordindex", _errors)
 
         if _errors:
             log.addwarning(_("Failed to process the following databases: %(names)s") % {'names': '\n'.join(_errors)})
 
-            files = self.clearShares(
-                sharedfiles, bsharedfiles, sharedfilesstreams, bsharedfilesstreams,
-                wordindex, bwordindex, fileindex, bfileindex, sharedmtimes, bsharedmtimes
-            )
-
-            if files is not None:
-                sharedfiles, bsharedfiles, sharedfilesstreams, bsharedfilesstreams, wordindex, bwordindex, fileindex, bfileindex, sharedmtimes, bsharedmtimes = files
+            sharestore, wordindex, bwordindex = self.clearShares(sharestore)
 
             log.addwarning(_("Shared files database seems to be corrupted, rescan your shares"))
 
-        self.sections["transfers"]["sharedfiles"] = sharedfiles
-        self.sections["transfers"]["sharedfilesstreams"] = sharedfilesstreams
+        self.sharestore = sharestore
+
+        self.sections["transfers"]["sharedfiles"] = sharestore.folder_files(ShareStore.NORMAL)
+        self.sections["transfers"]["sharedfilesstreams"] = sharestore.folder_streams(ShareStore.NORMAL)
         self.sections["transfers"]["wordindex"] = wordindex
-        self.sections["transfers"]["fileindex"] = fileindex
-        self.sections["transfers"]["sharedmtimes"] = sharedmtimes
+        self.sections["transfers"]["fileindex"] = sharestore.file_index(ShareStore.NORMAL)
+        self.sections["transfers"]["sharedmtimes"] = sharestore.folder_mtimes(ShareStore.NORMAL)
 
-        self.sections["transfers"]["bsharedfiles"] = bsharedfiles
-        self.sections["transfers"]["bsharedfilesstreams"] = bsharedfilesstreams
+        self.sections["transfers"]["bsharedfiles"] = sharestore.folder_files(ShareStore.BUDDY)
+        self.sections["transfers"]["bsharedfilesstreams"] = sharestore.folder_streams(ShareStore.BUDDY)
         self.sections["transfers"]["bwordindex"] = bwordindex
-        self.sections["transfers"]["bfileindex"] = bfileindex
-        self.sections["transfers"]["bsharedmtimes"] = bsharedmtimes
+        self.sections["transfers"]["bfileindex"] = sharestore.file_index(ShareStore.BUDDY)
+        self.sections["transfers"]["bsharedmtimes"] = sharestore.folder_mtimes(ShareStore.BUDDY)
 
         # Setting the port range in numerical order
         self.sections["server"]["portrange"] = (min(self.sections["server"]["portrange"]), max(self.sections["server"]["portrange"]))
 
         self.config_lock.release()
 
+    def openShareStore(self, errors):
+        """ Opens the shares database, moving the shelves used by older
+        versions into it when it's new """
+
+        filename = os.path.join(self.data_dir, "shares.sqlite")
+
+        try:
+            sharestore = ShareStore(filename)
+
+        except Exception:
+            errors.append(filename)
+
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(filename + suffix)
+                except OSError:
+                    pass
+
+            return ShareStore(filename)
+
+        if sharestore.created:
+            self.migrateShelves(sharestore, errors)
+
+        return sharestore
+
+    def migrateShelves(self, sharestore, errors):
+
+        for share, prefix in ((ShareStore.NORMAL, ""), (ShareStore.BUDDY, "buddy")):
+            shelves = {}
+
+            for name in ("files", "streams", "fileindex", "mtimes"):
+                filename = os.path.join(self.data_dir, prefix + name + ".db")
+
+                try:
+                    shelves[name] = shelve.open(filename, flag='r', protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    # Not shared by an older version
+                    continue
+
+            if not shelves:
+                continue
+
+            try:
+                fileindex = shelves.get("fileindex", {})
+
+                sharestore.replace(
+                    share,
+                    shelves.get("files", {}),
+                    shelves.get("streams", {}),
+                    [fileindex.get(str(index)) for index in range(len(fileindex))],
+                    shelves.get("mtimes", {})
+                )
+            except Exception:
+                errors.append(os.path.join(self.data_dir, prefix + "files.db"))
+
+            for name, oldshelf in shelves.items():
+                oldshelf.close()
+
+                for suffix in ("", ".dat", ".dir", ".bak"):
+                    try:
+                        os.unlink(os.path.join(self.data_dir, prefix + name + ".db" + suffix))
+                    except OSError:
+                        pass
+
+    def openWordIndex(self, name, errors):
+        """ Loads a search index file, converting the shelve used by older
+        versions if there is no index file yet """
+
+        filename = os.path.join(self.data_dir, name + ".idx")
+        oldfilename = os.path.join(self.data_dir, name + ".db")
+
+        if exists(filename):
+            try:
+                return WordIndex.load(filename)
+            except Exception:
+                errors.append(filename)
+                return WordIndex(filename)
+
+        try:
+            oldindex = shelve.open(oldfilename, flag='r', protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # No index from an older version either
+            return WordIndex(filename)
+
+        try:
+            wordindex = WordIndex.from_dict(oldindex, filename)
+            wordindex.save()
+        except Exception:
+            errors.append(oldfilename)
+            wordindex = WordIndex(filename)
+
+        oldindex.close()
+
+        for suffix in ("", ".dat", ".dir", ".bak"):
+            try:
+                os.unlink(oldfilename + suffix)
+            except OSError:
+                pass
+
+        return wordindex
+
     def removeOldOption(self, section, option):
         if section in self.parser.sections():
             if option in self.parser.options(section):
@@ -739,95 +801,39 @@ class Config:
         if section in self.parser.sections():
             self.parser.remove_section(section)
 
-    def clearShares(
-        self, sharedfiles, bsharedfiles, sharedfilesstreams, bsharedfilesstreams,
-        wordindex, bwordindex, fileindex, bfileindex, sharedmtimes, bsharedmtimes
-    ):
+    def clearShares(self, sharestore):
 
         try:
-            if sharedfiles:
-                sharedfiles.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'files.db'))
-            except Exception:
-                pass
-            sharedfiles = shelve.open(os.path.join(self.data_dir, "files.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+            sharestore.clear()
 
-            if bsharedfiles:
-                bsharedfiles.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'buddyfiles.db'))
-            except Exception:
-                pass
-            bsharedfiles = shelve.open(os.path.join(self.data_dir, "buddyfiles.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as error:
+            log.addwarning(_("Error while writing database files: %s") % error)
 
-            if sharedfilesstreams:
-                sharedfilesstreams.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'streams.db'))
-            except Exception:
-                pass
-            sharedfilesstreams = shelve.open(os.path.join(self.data_dir, "streams.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+            # The database is beyond repair, start over
+            sharestore.close()
+            filename = sharestore.filename
 
-            if bsharedfilesstreams:
-                bsharedfilesstreams.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'buddystreams.db'))
-            except Exception:
-                pass
-            bsharedfilesstreams = shelve.open(os.path.join(self.data_dir, "buddystreams.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(filename + suffix)
+                except OSError:
+                    pass
 
-            if wordindex:
-                wordindex.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'wordindex.db'))
-            except Exception:
-                pass
-            wordindex = shelve.open(os.path.join(self.data_dir, "wordindex.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+            sharestore = ShareStore(filename)
 
-            if bwordindex:
-                bwordindex.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'buddywordindex.db'))
-            except Exception:
-                pass
-            bwordindex = shelve.open(os.path.join(self.data_dir, "buddywordindex.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+        wordindexes = []
 
-            if fileindex:
-                fileindex.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'fileindex.db'))
-            except Exception:
-                pass
-            fileindex = shelve.open(os.path.join(self.data_dir, "fileindex.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+        for name in ("wordindex.idx", "buddywordindex.idx"):
+            filename = os.path.join(self.data_dir, name)
 
-            if bfileindex:
-                bfileindex.close()
             try:
-                os.unlink(os.path.join(self.data_dir, 'buddyfileindex.db'))
-            except Exception:
+                os.unlink(filename)
+            except OSError:
                 pass
-            bfileindex = shelve.open(os.path.join(self.data_dir, "buddyfileindex.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
 
-            if sharedmtimes:
-                sharedmtimes.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'mtimes.db'))
-            except Exception:
-                pass
-            sharedmtimes = shelve.open(os.path.join(self.data_dir, "mtimes.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+            wordindexes.append(WordIndex(filename))
 
-            if bsharedmtimes:
-                bsharedmtimes.close()
-            try:
-                os.unlink(os.path.join(self.data_dir, 'buddymtimes.db'))
-            except Exception:
-                pass
-            bsharedmtimes = shelve.open(os.path.join(self.data_dir, "buddymtimes.db"), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
-        except Exception as error:
-            log.addwarning(_("Error while writing database files: %s") % error)
-            return None
-        return sharedfiles, bsharedfiles, sharedfilesstreams, bsharedfilesstreams, wordindex, bwordindex, fileindex, bfileindex, sharedmtimes, bsharedmtimes
+        return (sharestore,) + tuple(wordindexes)
 
     def writeConfig(self):
         self.writeConfiguration()
@@ -969,53 +975,27 @@ class Config:
         return (0, filename)
 
     def setBuddyShares(self, files, streams, wordindex, fileindex, mtimes):
-
-        storable_objects = [
-            (files, "bsharedfiles", "buddyfiles.db"),
-            (streams, "bsharedfilesstreams", "buddystreams.db"),
-            (mtimes, "bsharedmtimes", "buddymtimes.db"),
-            (wordindex, "bwordindex", "buddywordindex.db"),
-            (fileindex, "bfileindex", "buddyfileindex.db")
-        ]
-
-        self.storeObjects(storable_objects)
+        self.storeShares(ShareStore.BUDDY, "b", "buddywordindex.idx", files, streams, wordindex, fileindex, mtimes)
 
     def setShares(self, files, streams, wordindex, fileindex, mtimes):
+        self.storeShares(ShareStore.NORMAL, "", "wordindex.idx", files, streams, wordindex, fileindex, mtimes)
 
-        storable_objects = [
-            (files, "sharedfiles", "files.db"),
-            (streams, "sharedfilesstreams", "streams.db"),
-            (mtimes, "sharedmtimes", "mtimes.db"),
-            (wordindex, "wordindex", "wordindex.db"),
-            (fileindex, "fileindex", "fileindex.db")
-        ]
-
-        self.storeObjects(storable_objects)
-
-    def storeObjects(self, storable_objects):
+    def storeShares(self, share, prefix, indexfile, files, streams, wordindex, fileindex, mtimes):
 
         self.config_lock.acquire()
 
-        for (source, destination, filename) in storable_objects:
-            try:
-                self.sections["transfers"][destination].close()
-                self.sections["transfers"][destination] = shelve.open(os.path.join(self.data_dir, filename), flag='n', protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            # Search indexes are stored in their own format
+            wordindex.save(os.path.join(self.data_dir, indexfile))
+            self.sections["transfers"][prefix + "wordindex"] = wordindex
 
-                if "fileindex" in destination:
-                    index = 0
+            self.sharestore.replace(share, files, streams, fileindex, mtimes)
 
-                    for value in source:
-                        # The file index db is a list
-                        self.sections["transfers"][destination][str(index)] = value
-                        index += 1
-                else:
-                    for key in source:
-                        self.sections["transfers"][destination][key] = source[key]
-            except Exception as e:
-                log.addwarning(_("Can't save %s: %s") % (filename, e))
-                return
+        except Exception as e:
+            log.addwarning(_("Can't save %s: %s") % (self.sharestore.filename, e))
 
-        self.config_lock.release()
+        finally:
+            self.config_lock.release()
 
     def pushHistory(self, history, text, max):
         if text in history:
@@ -23,7 +23,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import re
-import time
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -43,6 +42,7 @@ import pynicotine.utils
 from pynicotine import pluginsystem
 from pynicotine import slskmessages
 from pynicotine import slskproto
+from pynicotine.browsedshares import BrowsedShares
 from pynicotine.gtkgui import imagedata
 from pynicotine.gtkgui import notifications
 from pynicotine.gtkgui import nowplaying
@@ -74,6 +74,7 @@ from pynicotine.gtkgui.utils import OpenUri
 from pynicotine.gtkgui.utils import PopupMenu
 from pynicotine.gtkgui.utils import ScrollBottom
 from pynicotine.logfacility import log
+from pynicotine.networkevents import NetworkEventBatcher
 from pynicotine.pynicotine import NetworkEventProcessor
 from pynicotine.upnp import UPnPPortMapping
 from pynicotine.utils import unescape
@@ -87,8 +88,7 @@ class NicotineFrame:
         self.clip_data = ""
         self.data_dir = data_dir
         self.configfile = config
-        self.transfermsgs = {}
-        self.transfermsgspostedtime = 0
+        self.networkbatcher = NetworkEventBatcher()
         self.manualdisconnect = 0
         self.away = 0
         self.exiting = 0
@@ -495,6 +495,8 @@ class NicotineFrame:
             if self.np.config.sections["transfers"]["enablebuddyshares"]:
                 self.OnBuddyRescan()
 
+        self.np.shares.updateWatcher()
+
         self.SetTabPositions()
 
         # Test if we want to do a port mapping
@@ -977,7 +979,7 @@ class NicotineFrame:
                 sharefile = bz2.BZ2File(share)
                 mylist = mypickle.load(sharefile)
                 sharefile.close()
-                if not isinstance(mylist, (list, dict)):
+                if not isinstance(mylist, (list, dict, BrowsedShares)):
                     raise TypeError("Bad data in file %(sharesdb)s" % {'sharesdb': share})
                 username = share.split(os.sep)[-1]
                 self.userbrowse.InitWindow(username, None)
@@ -1178,26 +1180,23 @@ class NicotineFrame:
             GLib.idle_add(self.OnNetworkEvent, msgs)
 
     def networkcallback(self, msgs):
-        curtime = time.time()
-        for i in msgs[:]:
-            if i.__class__ is slskmessages.DownloadFile or i.__class__ is slskmessages.UploadFile:
-                self.transfermsgs[i.conn] = i
-                msgs.remove(i)
-            if i.__class__ is slskmessages.ConnClose:
-                msgs = self.postTransferMsgs(msgs, curtime)
-        if curtime - self.transfermsgspostedtime > 1.0:
-            msgs = self.postTransferMsgs(msgs, curtime)
-        if len(msgs) > 0:
-            GLib.idle_add(self.OnNetworkEvent, msgs)
+        """ Called by the networking thread """
+
+        batch = self.networkbatcher.add(msgs)
+
+        if batch:
+            GLib.idle_add(self.OnNetworkEvent, batch)
+
+        elif self.networkbatcher.schedule_flush():
+            GLib.timeout_add(int(self.networkbatcher.interval * 1000), self.OnNetworkFlush)
 
-    def postTransferMsgs(self, msgs, curtime):
-        trmsgs = []
-        for (key, value) in self.transfermsgs.items():
-            trmsgs.append(value)
-        msgs = trmsgs + msgs
-        self.transfermsgs = {}
-        self.transfermsgspostedtime = curtime
-        return msgs
+    def OnNetworkFlush(self):
+        batch = self.networkbatcher.flush()
+
+        if batch:
+            self.OnNetworkEvent(batch)
+
+        return False
 
     def CellDataFunc(self, column, cellrenderer, model, iter, dummy="dummy"):
         colour = self.np.config.sections["ui"]["search"]
@@ -1353,6 +1352,8 @@ class NicotineFrame:
         if self.TrayApp.trayicon:
             self.TrayApp.destroy_trayicon()
 
+        self.np.shares.stopWatcher()
+
         # Closing up all shelves db
         for db in [
             "sharedfiles", "sharedfilesstreams", "wordindex",
@@ -1925,6 +1926,7 @@ class NicotineFrame:
         self.BuddySharesProgress.hide()
 
         self.np.shares.CompressShares("buddy")
+        self.np.shares.updateWatcher()
 
     def _RescanFinished(self, files, streams, wordindex, fileindex, mtimes):
 
@@ -1944,6 +1946,8 @@ class NicotineFrame:
         if self.np.transfers is not None:
             self.np.shares.sendNumSharedFoldersFiles()
 
+        self.np.shares.updateWatcher()
+
     def RescanFinished(self, files, streams, wordindex, fileindex, mtimes, type):
         if type == "buddy":
             GLib.idle_add(self._BuddyRescanFinished, files, streams, wordindex, fileindex, mtimes)
@@ -2111,6 +2115,7 @@ class NicotineFrame:
         self.SetTabPositions()
 
         if self.np.transfers is not None:
+            self.np.transfers.updateQueueMode()
             self.np.transfers.checkUploadQueue()
 
         if needrescan:
@@ -2128,6 +2133,8 @@ class NicotineFrame:
             if self.np.config.sections["transfers"]["enablebuddyshares"]:
                 self.OnBuddyRescan()
 
+        self.np.shares.updateWatcher()
+
         ConfigUnset = self.np.config.needConfig()
 
         if ConfigUnset > 1:
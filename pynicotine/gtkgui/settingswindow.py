@@ -648,6 +648,7 @@ class SharesFrame(buildFrame):
                 "shared": self.Shares,
                 "friendsonly": self.FriendsOnly,
                 "rescanonstartup": self.RescanOnStartup,
+                "watchshares": self.WatchShares,
                 "buddyshared": self.BuddyShares,
                 "enablebuddyshares": self.enableBuddyShares
             }
@@ -738,6 +739,7 @@ class SharesFrame(buildFrame):
             "transfers": {
                 "shared": self.shareddirs[:],
                 "rescanonstartup": self.RescanOnStartup.get_active(),
+                "watchshares": self.WatchShares.get_active(),
                 "buddyshared": self.bshareddirs[:],
                 "enablebuddyshares": buddies,
                 "friendsonly": friendsonly
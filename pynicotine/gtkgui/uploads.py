@@ -165,7 +165,6 @@ class Uploads(TransferList):
                     self.selected_transfers.add(i)
 
         TransferList.OnAbortTransfer(self, widget, False, False)
-        self.frame.np.transfers.calcUploadQueueSizes()
         self.frame.np.transfers.checkUploadQueue()
 
     def OnUploadTransfer(self, widget):
@@ -278,7 +277,6 @@ class Uploads(TransferList):
                     i.transfertimer.cancel()
                 self.remove_specific(i)
 
-        self.frame.np.transfers.calcUploadQueueSizes()
         self.frame.np.transfers.checkUploadQueue()
 
     def DoubleClick(self, event):
@@ -302,17 +300,14 @@ class Uploads(TransferList):
         self.select_transfers()
 
         TransferList.OnAbortTransfer(self, widget, remove, clear)
-        self.frame.np.transfers.calcUploadQueueSizes()
         self.frame.np.transfers.checkUploadQueue()
 
     def OnClearQueued(self, widget):
 
         TransferList.OnClearQueued(self, widget)
-        self.frame.np.transfers.calcUploadQueueSizes()
         self.frame.np.transfers.checkUploadQueue()
 
     def OnClearFailed(self, widget):
 
         TransferList.OnClearFailed(self, widget)
-        self.frame.np.transfers.calcUploadQueueSizes()
         self.frame.np.transfers.checkUploadQueue()
@@ -31,6 +31,7 @@ from gi.repository import Gtk as gtk
 
 from _thread import start_new_thread
 from pynicotine import slskmessages
+from pynicotine.browsedshares import BrowsedShares
 from pynicotine.gtkgui.dirchooser import ChooseDir
 from pynicotine.gtkgui.dialogs import ComboBoxDialog
 from pynicotine.gtkgui.utils import HideColumns
@@ -82,14 +83,13 @@ class UserBrowse:
         self.search_position = 0
         self.selected_files = []
 
-        self.shares = []
+        self.shares = BrowsedShares()
 
         # Iters for current DirStore
         self.directories = {}
 
         # Iters for current FileStore
         self.files = {}
-        self.totalsize = 0
 
         self.DirStore = gtk.TreeStore(str, str)
 
@@ -361,130 +361,79 @@ class UserBrowse:
 
     def MakeNewModel(self, list):
 
-        self.shares = list
+        self.ClearModel()
+        self.AddDirectories(list)
+        self.FinishModel()
+
+    def ClearModel(self):
+
+        self.shares = BrowsedShares()
         self.selected_folder = None
         self.selected_files = []
         self.directories.clear()
         self.files.clear()
         self.DirStore.clear()
 
-        # Compute the number of shared dirs and total size
-        self.totalsize = 0
-        for dir, files in self.shares:
-            for filedata in files:
-                if filedata[2] < maxsize:
-                    self.totalsize += filedata[2]
-                else:
-                    pass
+        # Directories are shown while they arrive, sort them when done
+        self.DirStore.set_sort_column_id(-1, gtk.SortType.ASCENDING)
+        self.FolderTreeView.set_model(self.DirStore)
 
-        self.AmountShared.set_text(_("Shared: %s") % HumanSize(self.totalsize))
-        self.NumDirectories.set_text(_("Dirs: %s") % len(self.shares))
+    def AddDirectories(self, list):
+        """ Adds a part of a shared file list to the directory tree """
 
-        # Generate the directory tree and select first directory
-        currentdir = self.BrowseGetDirs()
+        self.shares.extend(list)
 
-        sel = self.FolderTreeView.get_selection()
-        sel.unselect_all()
-        if currentdir in self.directories:
-            path = self.DirStore.get_path(self.directories[currentdir])
-            if path is not None:
-                sel.select_path(path)
+        for dir, files in list:
+            self.AddDirectory(dir)
 
-        self.FolderTreeView.set_sensitive(True)
-        self.FileTreeView.set_sensitive(True)
-        self.SaveButton.set_sensitive(True)
-
-        if self.ExpandButton.get_active():
-            self.FolderTreeView.expand_all()
-        else:
-            self.FolderTreeView.collapse_all()
+        self.AmountShared.set_text(_("Shared: %s") % HumanSize(self.shares.totalsize))
+        self.NumDirectories.set_text(_("Dirs: %s") % len(self.shares))
 
-    def BrowseGetDirs(self):
+    def AddDirectory(self, directory):
+        """ Adds a directory and its missing parents to self.directories and
+        the DirStore """
 
-        directory = ""
         dirseparator = '\\'
+        parent = None
+        current_path = None
 
-        # If there is no share
-
-        if self.shares == []:
+        for subdir in directory.split(dirseparator):
 
-            # Set the model of the treeviex
-            self.FolderTreeView.set_model(self.DirStore)
-
-            # Sort the DirStore
-            self.DirStore.set_sort_column_id(0, gtk.SortType.ASCENDING)
-
-            return directory
-
-        def builddicttree(p, s):
-            """
-                Build recursively a hierarchical dict containing raw subdir
-                'p' is a reference to the parent
-                's' a list of the subdir of a path
-
-                ex of 's': ['music', 'rock', 'doors']
-            """
-
-            if s:
-                subdir = s.pop(0)
-
-                if subdir not in p:
-                    p[subdir] = {}
-
-                builddicttree(p[subdir], s)
-
-        def buildgtktree(dictdir, parent, path):
-            """
-                Build recursively self.directories with iters pointing to directories
-                'dictdir' is a hierarchical dict containing raw subdir
-                'parent' is the iter pointing to the parent
-                'path' is the current raw path
-            """
-
-            # Foreach subdir
-            for subdir in list(dictdir.keys()):
-
-                if parent is None:
-                    # The first sudirs are attached to the root (None)
-                    current_path = subdir
-                else:
-                    # Other sudirs futher down the path are attached to their parent
-                    current_path = dirseparator.join([path, subdir])
+            if parent is None:
+                # The first sudirs are attached to the root (None)
+                current_path = subdir
+            else:
+                # Other sudirs futher down the path are attached to their parent
+                current_path = dirseparator.join([current_path, subdir])
 
+            if current_path not in self.directories:
                 self.directories[current_path] = self.DirStore.append(parent, [subdir, current_path])
 
-                # If there are subdirs futher down the path: recurse
-                if len(dictdir[subdir]):
-                    buildgtktree(dictdir[subdir], self.directories[current_path], current_path)
-
-        # For each shared dir we will complete the dictionnary
-        dictdir = {}
-
-        for dirshares, f in self.shares:
+            parent = self.directories[current_path]
 
-            # Split the path
-            s = dirshares.split(dirseparator)
+    def FinishModel(self):
 
-            # and build a hierarchical dictionnary containing raw subdir
-            if len(s) >= 1:
-                builddicttree(dictdir, s)
-
-        # Append data to the DirStore
-        buildgtktree(dictdir, None, None)
+        # Sort the DirStore
+        self.DirStore.set_sort_column_id(0, gtk.SortType.ASCENDING)
 
         # Select the first directory
-        sortlist = list(self.directories.keys())
-        sortlist.sort()
-
-        directory = sortlist[0]
+        sel = self.FolderTreeView.get_selection()
+        sel.unselect_all()
 
-        # Sort the DirStore
-        self.DirStore.set_sort_column_id(0, gtk.SortType.ASCENDING)
+        if self.directories:
+            currentdir = min(self.directories)
+            path = self.DirStore.get_path(self.directories[currentdir])
+            if path is not None:
+                sel.select_path(path)
 
-        # Set the model of the treeviex
-        self.FolderTreeView.set_model(self.DirStore)
+        self.FolderTreeView.set_sensitive(True)
+        self.FileTreeView.set_sensitive(True)
+        self.SaveButton.set_sensitive(True)
 
-        return directory
+        if self.ExpandButton.get_active():
+            self.FolderTreeView.expand_all()
+        else:
+            self.FolderTreeView.collapse_all()
 
     def SetDirectory(self, directory):
 
@@ -492,15 +441,9 @@ class UserBrowse:
         self.FileStore.clear()
         self.files.clear()
 
-        found_dir = False
+        files = self.shares.get_files(directory)
 
-        for d, f in self.shares:
-            if d == directory:
-                found_dir = True
-                files = f
-                break
-
-        if not found_dir:
+        if files is None:
             return
 
         for file in files:
@@ -559,8 +502,18 @@ class UserBrowse:
         self.frame.np.config.sections["columns"]["userbrowse_widths"] = widths
 
     def ShowInfo(self, msg):
-        self.conn = None
-        self.MakeNewModel(msg.list)
+
+        if msg.first:
+            self.ClearModel()
+
+        self.AddDirectories(msg.list)
+
+        if msg.last:
+            self.conn = None
+            self.FinishModel()
+        else:
+            # More parts of the list are on their way, keep updating the gauge
+            self.conn = msg.conn.conn
 
     def LoadShares(self, list):
         self.MakeNewModel(list)
@@ -659,11 +612,9 @@ class UserBrowse:
         # Check if folder already exists on system
         ldir = self.frame.np.transfers.FolderDestination(self.user, ldir)
 
-        for d, f in self.shares:
+        f = self.shares.get_files(dir)
 
-            # Find the wanted directory
-            if d != dir:
-                continue
+        if f is not None:
 
             priorityfiles = []
             normalfiles = []
@@ -705,35 +656,29 @@ class UserBrowse:
         if not recurse:
             return
 
-        for subdir, subf in self.shares:
-            if dir in subdir and dir != subdir:
-                self.DownloadDirectory(subdir, os.path.join(ldir, ""))
+        for subdir in self.shares.get_subdirectories(dir):
+            self.DownloadDirectory(subdir, os.path.join(ldir, ""))
 
     def OnDownloadFiles(self, widget, prefix=""):
 
         dir = self.selected_folder
+        files = self.shares.get_files(dir)
 
-        for d, f in self.shares:
-
-            # Find the wanted directory
-            if d != dir:
-                continue
-
-            for file in f:
+        if files is None:
+            return
 
-                # Find the wanted file
-                if file[1] not in self.selected_files:
-                    continue
+        for file in files:
 
-                path = "\\".join([dir, file[1]])
-                size = file[2]
-                h_bitrate, bitrate, h_length = GetResultBitrateLength(size, file[4])
+            # Find the wanted file
+            if file[1] not in self.selected_files:
+                continue
 
-                # Get the file
-                self.frame.np.transfers.getFile(self.user, path, prefix, size=size, bitrate=h_bitrate, length=h_length, checkduplicate=True)
+            path = "\\".join([dir, file[1]])
+            size = file[2]
+            h_bitrate, bitrate, h_length = GetResultBitrateLength(size, file[4])
 
-            # We have found the wanted directory: we can break out of the loop
-            break
+            # Get the file
+            self.frame.np.transfers.getFile(self.user, path, prefix, size=size, bitrate=h_bitrate, length=h_length, checkduplicate=True)
 
     def OnDownloadFilesTo(self, widget):
 
@@ -794,25 +739,18 @@ class UserBrowse:
         realpath = self.frame.np.shares.virtual2real(dir)
         ldir = dir.split("\\")[-1]
 
-        for d, f in self.shares:
-
-            # Find the wanted directory
-            if d != dir:
-                continue
-
-            for file in f:
-                filename = "\\".join([dir, file[1]])
-                realfilename = "\\".join([realpath, file[1]])
-                size = file[2]
-                self.frame.np.transfers.pushFile(user, filename, realfilename, ldir, size=size)
-                self.frame.np.transfers.checkUploadQueue()
+        for file in self.shares.get_files(dir) or []:
+            filename = "\\".join([dir, file[1]])
+            realfilename = "\\".join([realpath, file[1]])
+            size = file[2]
+            self.frame.np.transfers.pushFile(user, filename, realfilename, ldir, size=size)
+            self.frame.np.transfers.checkUploadQueue()
 
         if not recurse:
             return
 
-        for subdir, subf in self.shares:
-            if dir in subdir and dir != subdir:
-                self.UploadDirectoryTo(user, subdir, recurse)
+        for subdir in self.shares.get_subdirectories(dir):
+            self.UploadDirectoryTo(user, subdir)
 
     def OnUploadFiles(self, widget, prefix=""):
 
@@ -859,18 +797,7 @@ class UserBrowse:
 
     def FindMatches(self):
 
-        self.search_list = []
-
-        for directory, files in self.shares:
-
-            if self.query in directory.lower():
-                if directory not in self.search_list:
-                    self.search_list.append(directory)
-
-            for file in files:
-                if self.query in file[1].lower():
-                    if directory not in self.search_list:
-                        self.search_list.append(directory)
+        self.search_list = self.shares.find(self.query)
 
     def OnSearch(self, widget):
 
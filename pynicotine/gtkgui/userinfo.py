@@ -122,6 +122,11 @@ class UserTabs(IconNotebook):
 
         self.InitWindow(user, msg.conn)
         self.users[user].ShowInfo(msg)
+
+        if msg.__class__ is slskmessages.SharedFileList and not msg.first:
+            # Only draw attention to the tab for the first part of a file list
+            return
+
         self.request_changed(self.users[user].Main)
 
         if self.mytab is not None:
@@ -0,0 +1,166 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import OrderedDict
+
+
+class IndexedList(list):
+    """ List that also keeps track of its items by some of their values, so
+    that finding an item doesn't need going through all of them.
+
+    Subclasses name their indexes in INDEXES, as (name, function returning
+    the key of an item) pairs. Items with a key of None are left out of an
+    index. Items refer to the list they are in with their OWNER attribute,
+    and can only be in one list at a time. Items whose keys change tell the
+    list with _move(), other keys must not change while they are in it.
+
+    Lookups return a new list, in the order the items got the key looked
+    up, so it's safe to change or remove the items while going through
+    them. """
+
+    INDEXES = ()
+    OWNER = "_owner"
+    ITEM_NAME = "Item"
+
+    def __init__(self, items=()):
+
+        list.__init__(self)
+
+        self._members = set()
+        self._indexes = {name: {} for name, _key in self.INDEXES}
+
+        self.extend(items)
+
+    def __contains__(self, item):
+        return item in self._members
+
+    def __repr__(self):
+        # Items are logged with vars(), keep the contents of their list out of it
+        return "<%s of %i items>" % (self.__class__.__name__, len(self))
+
+    def _add(self, name, item, key):
+
+        if key is None:
+            return
+
+        index = self._indexes[name]
+
+        try:
+            index[key][item] = None
+        except KeyError:
+            # Keeps the order of lookups on Python versions where dicts don't
+            index[key] = OrderedDict(((item, None),))
+
+    def _remove(self, name, item, key):
+
+        if key is None:
+            return
+
+        index = self._indexes[name]
+        items = index[key]
+        del items[item]
+
+        if not items:
+            del index[key]
+
+    def _move(self, name, item, oldkey, newkey):
+
+        if oldkey == newkey:
+            return
+
+        self._remove(name, item, oldkey)
+        self._add(name, item, newkey)
+
+    def _lookup(self, name, key):
+        return list(self._indexes[name].get(key, ()))
+
+    def _count(self, name, key):
+        return len(self._indexes[name].get(key, ()))
+
+    def _register(self, item):
+
+        if getattr(item, self.OWNER) is not None:
+            raise ValueError("%s is already in a list" % self.ITEM_NAME)
+
+        setattr(item, self.OWNER, self)
+        self._members.add(item)
+
+        for name, key in self.INDEXES:
+            self._add(name, item, key(item))
+
+    def _unregister(self, item):
+
+        for name, key in self.INDEXES:
+            self._remove(name, item, key(item))
+
+        self._members.discard(item)
+        setattr(item, self.OWNER, None)
+
+    def append(self, item):
+
+        self._register(item)
+        list.append(self, item)
+
+    def extend(self, items):
+
+        for item in items:
+            self.append(item)
+
+    def insert(self, index, item):
+
+        self._register(item)
+        list.insert(self, index, item)
+
+    def remove(self, item):
+
+        if item not in self:
+            raise ValueError("%s is not in the list" % self.ITEM_NAME)
+
+        # Items are expected to have no __eq__, list.remove() finds the same object
+        list.remove(self, item)
+        self._unregister(item)
+
+    def pop(self, index=-1):
+
+        item = list.pop(self, index)
+        self._unregister(item)
+        return item
+
+    def clear(self):
+
+        for item in self:
+            self._unregister(item)
+
+        list.clear(self)
+
+    def __delitem__(self, index):
+
+        items = self[index] if isinstance(index, slice) else [self[index]]
+        list.__delitem__(self, index)
+
+        for item in items:
+            self._unregister(item)
+
+    def __setitem__(self, index, item):
+        raise TypeError("%ss can't be replaced, remove and append them instead" % self.ITEM_NAME)
+
+    def __iadd__(self, items):
+
+        self.extend(items)
+        return self
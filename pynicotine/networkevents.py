@@ -0,0 +1,179 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from pynicotine import slskmessages
+
+
+class NetworkEventBatcher:
+    """ Collects messages from the networking thread into batches for the UI
+    thread, so that busy rooms don't queue one main loop callback per message.
+
+    A batch is handed out at most max_flushes times per second, unless more
+    than max_pending messages are waiting. Messages that only report the
+    latest state of a user or connection replace earlier pending ones of the
+    same kind. File transfer progress is posted once per
+    TRANSFER_PROGRESS_INTERVAL, or when a connection closes.
+
+    add() is called from the networking thread, flush() from either thread. """
+
+    TRANSFER_PROGRESS_INTERVAL = 1.0
+
+    # Message class: attribute identifying what the message describes
+    COALESCED_MESSAGES = {
+        slskmessages.AddUser: "user",
+        slskmessages.GetUserStats: "user",
+        slskmessages.GetUserStatus: "user",
+        slskmessages.SetCurrentConnectionCount: None
+    }
+
+    # Progress updates, superseded by newer ones for the same connection
+    DROPPED_MESSAGES = {
+        slskmessages.PeerTransfer: "conn"
+    }
+
+    TRANSFER_MESSAGES = (slskmessages.DownloadFile, slskmessages.UploadFile)
+
+    def __init__(self, max_flushes=10, max_pending=10000, clock=time.monotonic):
+
+        self.interval = 1.0 / max_flushes
+        self.max_pending = max_pending
+
+        self.counters = {
+            "queued": 0,
+            "coalesced": 0,
+            "dropped": 0,
+            "flushes": 0
+        }
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_keys = {}
+        self._num_pending = 0
+        self._transfermsgs = {}
+        self._transfermsgs_time = 0
+        self._last_flush = 0
+        self._flush_scheduled = False
+
+    def add(self, msgs):
+        """ Queues messages, and returns a batch to post to the UI thread if
+        one is due, or None """
+
+        curtime = self._clock()
+
+        with self._lock:
+            closed = False
+
+            for msg in msgs:
+                self.counters["queued"] += 1
+                msgclass = msg.__class__
+
+                if msgclass in self.TRANSFER_MESSAGES:
+                    if msg.conn in self._transfermsgs:
+                        self.counters["dropped"] += 1
+
+                    self._transfermsgs[msg.conn] = msg
+                    continue
+
+                if msgclass is slskmessages.ConnClose:
+                    closed = True
+
+                if msgclass in self.COALESCED_MESSAGES:
+                    self._replace(msg, self.COALESCED_MESSAGES[msgclass], "coalesced")
+
+                elif msgclass in self.DROPPED_MESSAGES:
+                    self._replace(msg, self.DROPPED_MESSAGES[msgclass], "dropped")
+
+                self._pending.append(msg)
+                self._num_pending += 1
+
+            if closed or curtime - self._transfermsgs_time > self.TRANSFER_PROGRESS_INTERVAL:
+                self._post_transfer_msgs(curtime)
+
+            if not self._num_pending:
+                return None
+
+            if curtime - self._last_flush < self.interval and self._num_pending < self.max_pending:
+                return None
+
+            return self._flush(curtime)
+
+    def _replace(self, msg, attribute, counter):
+
+        key = (msg.__class__, getattr(msg, attribute) if attribute else None)
+        index = self._pending_keys.get(key)
+
+        if index is not None:
+            # Keep the newest message, in the position it arrived in
+            self._pending[index] = None
+            self._num_pending -= 1
+            self.counters[counter] += 1
+
+        self._pending_keys[key] = len(self._pending)
+
+    def _post_transfer_msgs(self, curtime):
+
+        if self._transfermsgs:
+            num_msgs = len(self._transfermsgs)
+
+            self._pending[:0] = self._transfermsgs.values()
+            self._num_pending += num_msgs
+            self._transfermsgs = {}
+
+            for key in self._pending_keys:
+                self._pending_keys[key] += num_msgs
+
+        self._transfermsgs_time = curtime
+
+    def _flush(self, curtime):
+
+        batch = [msg for msg in self._pending if msg is not None]
+
+        self._pending = []
+        self._pending_keys.clear()
+        self._num_pending = 0
+        self._last_flush = curtime
+        self.counters["flushes"] += 1
+
+        return batch
+
+    def schedule_flush(self):
+        """ Returns True if messages are held back and no delayed flush has
+        been scheduled yet. The caller should then call flush() after
+        self.interval seconds. """
+
+        with self._lock:
+            if self._flush_scheduled or not self._num_pending:
+                return False
+
+            self._flush_scheduled = True
+            return True
+
+    def flush(self):
+        """ Returns all pending messages, except file transfer progress """
+
+        with self._lock:
+            self._flush_scheduled = False
+
+            if not self._num_pending:
+                return []
+
+            return self._flush(self._clock())
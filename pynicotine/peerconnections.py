@@ -0,0 +1,115 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from operator import attrgetter
+
+from pynicotine.indexedlist import IndexedList
+
+
+class PeerConnection:
+    """
+    Holds information about a peer connection. Not every field may be set
+    to something. addr is (ip, port) address, conn is a socket object, msgs is
+    a list of outgoing pending messages, token is a reverse-handshake
+    number (protocol feature), init is a PeerInit protocol message. (read
+    slskmessages docstrings for explanation of these)
+    """
+
+    def __init__(self, addr=None, username=None, conn=None, msgs=None, token=None, init=None, conntimer=None, tryaddr=None):
+        self._table = None
+        self.__addr = self.__conn = self.__token = None
+        self.addr = addr
+        self.username = username
+        self.conn = conn
+        self.msgs = msgs
+        self.token = token
+        self.init = init
+        self.conntimer = conntimer
+        self.tryaddr = tryaddr
+
+    @property
+    def type(self):
+        return self.init.type if self.init is not None else None
+
+    def setaddr(self, addr):
+        oldaddr = self.__addr
+        self.__addr = addr
+
+        if self._table is not None:
+            self._table._move("addr", self, oldaddr, addr)
+
+    def getaddr(self):
+        return self.__addr
+    addr = property(getaddr, setaddr)
+
+    def setconn(self, conn):
+        oldconn = self.__conn
+        self.__conn = conn
+
+        if self._table is not None:
+            self._table._move("conn", self, oldconn, conn)
+
+    def getconn(self):
+        return self.__conn
+    conn = property(getconn, setconn)
+
+    def settoken(self, token):
+        oldtoken = self.__token
+        self.__token = token
+
+        if self._table is not None:
+            self._table._move("token", self, oldtoken, token)
+
+    def gettoken(self):
+        return self.__token
+    token = property(gettoken, settoken)
+
+
+class PeerConnectionTable(IndexedList):
+    """ List of peer connections that also keeps track of them by socket,
+    (username, type), address, token and type, so that handlers of peer
+    messages find their connection without going through all of them.
+
+    Connections report changes of their conn, addr and token to the table
+    they are in. Their username and init message must not change while they
+    are in it. """
+
+    INDEXES = (
+        ("conn", attrgetter("conn")),
+        ("usertype", attrgetter("username", "type")),
+        ("addr", attrgetter("addr")),
+        ("token", attrgetter("token")),
+        ("type", attrgetter("type"))
+    )
+    OWNER = "_table"
+    ITEM_NAME = "Peer connection"
+
+    def by_conn(self, conn):
+        return self._lookup("conn", conn)
+
+    def by_user_type(self, username, type):
+        return self._lookup("usertype", (username, type))
+
+    def by_addr(self, addr):
+        return self._lookup("addr", addr)
+
+    def by_token(self, token):
+        return self._lookup("token", token)
+
+    def by_type(self, type):
+        return self._lookup("type", type)
@@ -32,12 +32,13 @@ This is the actual client code. Actual GUI classes are in the separate modules
 import configparser
 import datetime
 import logging
+import math
 import os
-import queue
 import shutil
-import threading
+import sys
 import time
 from gettext import gettext as _
+from gi.repository import GLib
 from socket import socket
 
 from pynicotine import slskmessages
@@ -45,34 +46,17 @@ from pynicotine import slskproto
 from pynicotine import transfers
 from pynicotine.config import Config
 from pynicotine.geoip import IP2Location
+from pynicotine.peerconnections import PeerConnection
+from pynicotine.peerconnections import PeerConnectionTable
 from pynicotine.shares import Shares
 from pynicotine.slskmessages import PopupMessage
 from pynicotine.slskmessages import newId
+from pynicotine.timerqueue import TimerQueue
 from pynicotine.utils import CleanFile
 from pynicotine.utils import log
 from pynicotine.utils import unescape
 
 
-class PeerConnection:
-    """
-    Holds information about a peer connection. Not every field may be set
-    to something. addr is (ip, port) address, conn is a socket object, msgs is
-    a list of outgoing pending messages, token is a reverse-handshake
-    number (protocol feature), init is a PeerInit protocol message. (read
-    slskmessages docstrings for explanation of these)
-    """
-
-    def __init__(self, addr=None, username=None, conn=None, msgs=None, token=None, init=None, conntimer=None, tryaddr=None):
-        self.addr = addr
-        self.username = username
-        self.conn = conn
-        self.msgs = msgs
-        self.token = token
-        self.init = init
-        self.conntimer = conntimer
-        self.tryaddr = tryaddr
-
-
 class Timeout:
 
     def __init__(self, callback):
@@ -122,21 +106,30 @@ class NetworkEventProcessor:
         self.port = port
         self.config.frame = frame
         self.config.readConfig()
-        self.peerconns = []
+        self.peerconns = PeerConnectionTable()
         self.watchedusers = []
         self.ipblock_requested = {}
         self.ipignore_requested = {}
         self.ip_requested = []
         self.PrivateMessageQueue = {}
         self.users = {}
-        self.queue = queue.Queue(0)
+        self.queue = slskproto.WakeupQueue(0)
         self.shares = Shares(self)
 
         script_dir = os.path.dirname(__file__)
         file_path = os.path.join(script_dir, "geoip/ipcountrydb.bin")
         self.geoip = IP2Location.IP2Location(file_path, "SHARED_MEMORY")
 
-        self.protothread = slskproto.SlskProtoThread(self.frame.networkcallback, self.queue, self.bindip, self.port, self.config, self)
+        protothread_class = slskproto.SlskProtoThread
+
+        if self.config.sections["server"]["networkbackend"] == "asyncio":
+            if sys.version_info >= (3, 7):
+                from pynicotine.slskprotoasync import AsyncSlskProtoThread
+                protothread_class = AsyncSlskProtoThread
+            else:
+                log.addwarning(_("The asyncio network backend requires Python 3.7 or newer, falling back to the default backend"))
+
+        self.protothread = protothread_class(self.frame.networkcallback, self.queue, self.bindip, self.port, self.config, self)
 
         uselimit = self.config.sections["transfers"]["uselimit"]
         uploadlimit = self.config.sections["transfers"]["uploadlimit"]
@@ -176,11 +169,13 @@ class NetworkEventProcessor:
         self.requestedFolders = {}
         self.speed = 0
 
+        # Timeouts of connections, transfers and the server, run in the main loop
+        self.timers = TimerQueue(wakeup=self.wakeTimers)
+        self.timersource = None
+
         self.respondDistributed = True
         responddistributedtimeout = RespondToDistributedSearchesTimeout(self.callback)
-        self.respondDistributedTimer = threading.Timer(60, responddistributedtimeout.timeout)
-        self.respondDistributedTimer.setDaemon(True)
-        self.respondDistributedTimer.start()
+        self.respondDistributedTimer = self.timers.add(60, responddistributedtimeout.timeout)
 
         # Callback handlers for messages
         self.events = {
@@ -308,8 +303,8 @@ class NetworkEventProcessor:
 
         conn = None
 
-        for i in self.peerconns:
-            if i.username == user and i.init.type == 'P' and message.__class__ is not slskmessages.FileRequest:
+        if message.__class__ is not slskmessages.FileRequest:
+            for i in self.peerconns.by_user_type(user, 'P'):
                 conn = i
                 break
 
@@ -367,11 +362,8 @@ class NetworkEventProcessor:
 
             if token is not None:
                 timeout = 120.0
-                conntimeout = ConnectToPeerTimeout(self.peerconns[-1], self.callback)
-                timer = threading.Timer(timeout, conntimeout.timeout)
-                timer.setDaemon(True)
-                self.peerconns[-1].conntimer = timer
-                timer.start()
+                conntimeout = ConnectToPeerTimeout(conn, self.callback)
+                conn.conntimer = self.timers.add(timeout, conntimeout.timeout)
 
         if message.__class__ is slskmessages.TransferRequest and self.transfers is not None:
 
@@ -389,11 +381,23 @@ class NetworkEventProcessor:
         elif 0 < self.servertimeout < 600:
             self.servertimeout = self.servertimeout * 2
 
-        self.servertimer = threading.Timer(self.servertimeout, self.ServerTimeout)
-        self.servertimer.setDaemon(True)
-        self.servertimer.start()
+        self.servertimer = self.timers.add(self.servertimeout, self.ServerTimeout)
         logging.info(_("The server seems to be down or not responding, retrying in %i seconds") % (self.servertimeout))
 
+    def wakeTimers(self, delay):
+        """ Asks the main loop to run due timers in delay seconds """
+
+        if self.timersource is not None:
+            GLib.source_remove(self.timersource)
+
+        self.timersource = GLib.timeout_add(math.ceil(delay * 1000), self.runTimers)
+
+    def runTimers(self):
+
+        self.timersource = None
+        self.timers.run_due()
+        return False
+
     def ServerTimeout(self):
         if self.config.needConfig() <= 1:
             self.callback([slskmessages.ConnectToServer()])
@@ -456,9 +460,9 @@ class NetworkEventProcessor:
 
         elif msg.connobj.__class__ is slskmessages.OutConn:
 
-            for i in self.peerconns[:]:
+            for i in self.peerconns.by_addr(msg.connobj.addr):
 
-                if i.addr == msg.connobj.addr and i.conn is None:
+                if i.conn is None:
 
                     if i.token is None:
 
@@ -472,15 +476,11 @@ class NetworkEventProcessor:
                             if j.__class__ is slskmessages.TransferRequest and self.transfers is not None:
                                 self.transfers.gotConnectError(j.req)
 
-                        conntimeout = ConnectToPeerTimeout(i, self.callback)
-                        timer = threading.Timer(120.0, conntimeout.timeout)
-                        timer.setDaemon(True)
-                        timer.start()
-
                         if i.conntimer is not None:
                             i.conntimer.cancel()
 
-                        i.conntimer = timer
+                        conntimeout = ConnectToPeerTimeout(i, self.callback)
+                        i.conntimer = self.timers.add(120.0, conntimeout.timeout)
 
                     else:
                         for j in i.msgs:
@@ -591,21 +591,20 @@ class NetworkEventProcessor:
             self.frame.pluginhandler.ServerDisconnectNotification(userchoice)
 
         else:
-            for i in self.peerconns[:]:
-                if i.conn == conn:
-                    self.logMessage(_("Connection closed by peer: %s") % vars(i), debugLevel=3)
+            for i in self.peerconns.by_conn(conn):
+                self.logMessage(_("Connection closed by peer: %s") % vars(i), debugLevel=3)
 
-                    if i.conntimer is not None:
-                        i.conntimer.cancel()
+                if i.conntimer is not None:
+                    i.conntimer.cancel()
 
-                    if self.transfers is not None:
-                        self.transfers.ConnClose(conn, addr, i.username, error)
+                if self.transfers is not None:
+                    self.transfers.ConnClose(conn, addr, i.username, error)
 
-                    if i == self.GetParentConn():
-                        self.ParentConnClosed()
+                if i == self.GetParentConn():
+                    self.ParentConnClosed()
 
-                    self.peerconns.remove(i)
-                    break
+                self.peerconns.remove(i)
+                break
             else:
                 self.logMessage(
                     _("Removed connection closed by peer: %(conn_obj)s %(address)s") % {
@@ -690,12 +689,11 @@ class NetworkEventProcessor:
         user = ip = port = None
 
         # Get peer's username, ip and port
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-                if i.addr is not None:
-                    ip, port = i.addr
-                break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
+            if i.addr is not None:
+                ip, port = i.addr
+            break
 
         if user is None:
             # No peer connection
@@ -1068,8 +1066,8 @@ class NetworkEventProcessor:
 
     def GetPeerAddress(self, msg):
 
-        for i in self.peerconns:
-            if i.username == msg.user and i.addr == "in_progress":
+        for i in self.peerconns.by_addr("in_progress"):
+            if i.username == msg.user:
                 if msg.port != 0 or i.tryaddr == 10:
                     if i.tryaddr == 10:
                         self.logMessage(
@@ -1173,9 +1171,9 @@ class NetworkEventProcessor:
 
     def OutConn(self, msg):
 
-        for i in self.peerconns:
+        for i in self.peerconns.by_addr(msg.addr):
 
-            if i.addr == msg.addr and i.conn is None:
+            if i.conn is None:
 
                 if i.token is None:
                     i.init.conn = msg.conn
@@ -1301,10 +1299,9 @@ class NetworkEventProcessor:
 
             if type(peerconn) is socket:
 
-                for i in self.peerconns:
-                    if i.conn == peerconn:
-                        self.peerconns.remove(i)
-                        break
+                for i in self.peerconns.by_conn(peerconn):
+                    self.peerconns.remove(i)
+                    break
             else:
                 try:
                     self.peerconns.remove(peerconn)
@@ -1312,8 +1309,8 @@ class NetworkEventProcessor:
                     pass
 
     def UserInfoReply(self, msg):
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn and self.userinfo is not None:
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            if self.userinfo is not None:
                 # probably impossible to do this
                 if i.username != self.config.sections["server"]["login"]:
                     self.userinfo.ShowInfo(i.username, msg)
@@ -1324,12 +1321,11 @@ class NetworkEventProcessor:
         user = ip = port = None
 
         # Get peer's username, ip and port
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-                if i.addr is not None:
-                    ip, port = i.addr
-                break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
+            if i.addr is not None:
+                ip, port = i.addr
+            break
 
         if user is None:
             # No peer connection
@@ -1413,8 +1409,8 @@ class NetworkEventProcessor:
         )
 
     def SharedFileList(self, msg):
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn and self.userbrowse is not None:
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            if self.userbrowse is not None:
                 if i.username != self.config.sections["server"]["login"]:
                     self.userbrowse.ShowInfo(i.username, msg)
                     break
@@ -1436,9 +1432,9 @@ class NetworkEventProcessor:
 
     def PierceFireWall(self, msg):
 
-        for i in self.peerconns:
+        for i in self.peerconns.by_token(msg.token):
 
-            if i.token == msg.token and i.conn is None:
+            if i.conn is None:
 
                 if i.conntimer is not None:
                     i.conntimer.cancel()
@@ -1471,24 +1467,22 @@ class NetworkEventProcessor:
 
     def CantConnectToPeer(self, msg):
 
-        for i in self.peerconns[:]:
+        for i in self.peerconns.by_token(msg.token):
 
-            if i.token == msg.token:
-
-                if i.conntimer is not None:
-                    i.conntimer.cancel()
+            if i.conntimer is not None:
+                i.conntimer.cancel()
 
-                if i == self.GetParentConn():
-                    self.ParentConnClosed()
+            if i == self.GetParentConn():
+                self.ParentConnClosed()
 
-                self.peerconns.remove(i)
+            self.peerconns.remove(i)
 
-                self.logMessage(_("Can't connect to %s (either way), giving up") % (i.username), 3)
+            self.logMessage(_("Can't connect to %s (either way), giving up") % (i.username), 3)
 
-                for j in i.msgs:
-                    if j.__class__ in [slskmessages.TransferRequest, slskmessages.FileRequest] and self.transfers is not None:
-                        self.transfers.gotCantConnect(j.req)
-                break
+            for j in i.msgs:
+                if j.__class__ in [slskmessages.TransferRequest, slskmessages.FileRequest] and self.transfers is not None:
+                    self.transfers.gotCantConnect(j.req)
+            break
 
     def ConnectToPeerTimeout(self, msg):
         conn = msg.conn
@@ -1601,10 +1595,9 @@ class NetworkEventProcessor:
                             folder = j
 
             if many:
-                for i in self.peerconns:
-                    if i.conn is conn:
-                        username = i.username
-                        break
+                for i in self.peerconns.by_conn(conn):
+                    username = i.username
+                    break
 
                 self.frame.download_large_folder(username, folder, numfiles, msg)
             else:
@@ -1645,11 +1638,10 @@ class NetworkEventProcessor:
 
     def FileSearchRequest(self, msg):
         self.logMessage("%s %s" % (msg.__class__, vars(msg)), 4)
-        for i in self.peerconns:
-            if i.conn == msg.conn.conn:
-                user = i.username
-                self.shares.processSearchRequest(msg.searchterm, user, msg.searchid, direct=1)
-                break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
+            self.shares.processSearchRequest(msg.searchterm, user, msg.searchid, direct=1)
+            break
 
     def SearchRequest(self, msg):
         self.logMessage("%s %s" % (msg.__class__, vars(msg)), 4)
@@ -1683,9 +1675,7 @@ class NetworkEventProcessor:
                 self.respondDistributed = not self.respondDistributed
 
             responddistributedtimeout = RespondToDistributedSearchesTimeout(self.callback)
-            self.respondDistributedTimer = threading.Timer(self.config.sections["searches"]["distrib_ignore"], responddistributedtimeout.timeout)
-            self.respondDistributedTimer.setDaemon(True)
-            self.respondDistributedTimer.start()
+            self.respondDistributedTimer = self.timers.add(self.config.sections["searches"]["distrib_ignore"], responddistributedtimeout.timeout)
         else:
             # Always respond
             self.respondDistributed = True
@@ -1712,9 +1702,8 @@ class NetworkEventProcessor:
         self.logMessage("%s %s" % (msg.__class__, vars(msg)), 4)
 
     def GetParentConn(self):
-        for i in self.peerconns:
-            if i.init.type == 'D':
-                return i
+        for i in self.peerconns.by_type('D'):
+            return i
 
         return None
 
@@ -1731,16 +1720,15 @@ class NetworkEventProcessor:
 
         if not self.has_parent:
 
-            for i in self.peerconns[:]:
-                if i.init.type == 'D':
-                    """ We previously attempted to connect to all potential parents. Since we now
-                    have a parent, stop connecting to the others. """
+            for i in self.peerconns.by_type('D'):
+                """ We previously attempted to connect to all potential parents. Since we now
+                have a parent, stop connecting to the others. """
 
-                    if i.conn != msg.conn.conn:
-                        if i.conn is not None:
-                            self.queue.put(slskmessages.ConnClose(i.conn))
+                if i.conn != msg.conn.conn:
+                    if i.conn is not None:
+                        self.queue.put(slskmessages.ConnClose(i.conn))
 
-                        self.peerconns.remove(i)
+                    self.peerconns.remove(i)
 
             parent = self.GetParentConn()
 
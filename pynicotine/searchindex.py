@@ -0,0 +1,468 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap
+import os
+import struct
+import sys
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+HEADER = struct.Struct("<4sII")
+SNAPSHOT_HEADER = struct.Struct("<IQ")
+UINT32 = struct.Struct("<I")
+
+
+def intersect_postings(postings, limit=None):
+    """ Returns the sorted list of file indexes present in all of the sorted
+    posting lists in postings, or at most limit of the lowest ones.
+
+    Candidates are taken from the shortest list. The other lists are
+    searched by galloping from the position of the previous match, so long
+    lists are mostly skipped over instead of scanned. """
+
+    if not postings:
+        return []
+
+    postings = sorted(postings, key=len)
+    shortest = postings[0]
+    others = postings[1:]
+
+    if not others:
+        return list(shortest[:limit])
+
+    positions = [0] * len(others)
+    results = []
+
+    for value in shortest:
+        for i, other in enumerate(others):
+            pos = positions[i]
+            length = len(other)
+
+            if pos < length and other[pos] < value:
+                # Double the step until we overshoot, then bisect the last step
+                step = 1
+                end = pos + 1
+
+                while end < length and other[end] < value:
+                    pos = end
+                    step *= 2
+                    end = pos + step
+
+                pos = bisect_left(other, value, pos + 1, min(end, length))
+
+            positions[i] = pos
+
+            if pos >= length:
+                # No larger values left in this list, no more matches
+                return results
+
+            if other[pos] != value:
+                break
+        else:
+            results.append(value)
+
+            if len(results) == limit:
+                break
+
+    return results
+
+
+class SnapshotWords:
+    """ Sorted words of a mapped index file, as a sequence of UTF-8 encoded
+    words that can be searched with bisect """
+
+    def __init__(self, words, offsets):
+
+        self.words = words
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.words[self.offsets[i]:self.offsets[i + 1]])
+
+
+class WordIndex:
+    """ Search index of shared files, mapping each word found in file paths
+    to a sorted array('I') of the file indexes it appears in.
+
+    The index is stored in a binary file holding the sorted words, their
+    posting lists one after another, and the compressed SharedFileList
+    message of the share it was built from (filelist, bytes or a sequence
+    of bytes chunks). Loading maps the file into memory instead of reading
+    it, and posting lists are used in place. Lists that change are copied
+    into memory first, and changes are written when the index is saved or
+    closed. """
+
+    MAGIC = b"NPWI"
+    VERSION = 2
+
+    def __init__(self, filename=None):
+
+        self.filename = filename
+
+        self._filelist = None
+        self._postings = {}
+        self._modified = False
+
+        self._data = None
+        self._words = None
+        self._postingoffsets = None
+        self._allpostings = None
+
+    def __len__(self):
+        return sum(1 for _word in self)
+
+    @property
+    def filelist(self):
+        return self._filelist
+
+    @filelist.setter
+    def filelist(self, filelist):
+
+        self._filelist = filelist
+        self._modified = True
+
+    def __contains__(self, word):
+        return self._get(word) is not None
+
+    def __getitem__(self, word):
+
+        wordpostings = self._get(word)
+
+        if wordpostings is None:
+            raise KeyError(word)
+
+        return wordpostings
+
+    def __iter__(self):
+
+        postings = self._postings
+
+        if self._words is not None:
+            for word in self._words:
+                word = str(word, "utf-8", "surrogatepass")
+
+                if word not in postings:
+                    yield word
+
+        for word, wordpostings in postings.items():
+            if wordpostings is not None:
+                yield word
+
+    def _get(self, word):
+        """ Returns the posting list of a word, or None """
+
+        try:
+            return self._postings[word]
+        except KeyError:
+            pass
+
+        words = self._words
+
+        if words is None:
+            return None
+
+        key = word.encode("utf-8", "surrogatepass")
+        i = bisect_left(words, key)
+
+        if i == len(words) or words[i] != key:
+            return None
+
+        offsets = self._postingoffsets
+        return self._allpostings[offsets[i]:offsets[i + 1]]
+
+    def _get_mutable(self, word):
+        """ Returns the posting list of a word as an array, copying mapped
+        lists into memory, or None """
+
+        wordpostings = self._get(word)
+
+        if wordpostings is not None and not isinstance(wordpostings, array):
+            wordpostings = self._postings[word] = array('I', wordpostings)
+
+        return wordpostings
+
+    def add(self, words, index):
+        """ Adds a file index to the posting lists of words. Indexes must be
+        added in ascending order. """
+
+        for word in words:
+            wordpostings = self._get_mutable(word)
+
+            if wordpostings is None:
+                self._postings[word] = array('I', [index])
+                continue
+
+            if wordpostings[-1] != index:
+                wordpostings.append(index)
+
+        # The shares changed, the file list has to be compressed again
+        self._filelist = None
+        self._modified = True
+
+    def remove(self, words, index):
+        """ Removes a file index from the posting lists of words """
+
+        for word in words:
+            wordpostings = self._get_mutable(word)
+
+            if wordpostings is None:
+                continue
+
+            pos = bisect_left(wordpostings, index)
+
+            if pos < len(wordpostings) and wordpostings[pos] == index:
+                if len(wordpostings) == 1:
+                    # Hide words of the mapped file as well
+                    self._postings[word] = None
+                else:
+                    del wordpostings[pos]
+
+        self._filelist = None
+        self._modified = True
+
+    def search(self, terms, limit=None):
+        """ Returns the indexes of files matching all terms, at most limit """
+
+        postings = []
+
+        for term in terms:
+            wordpostings = self._get(term)
+
+            if wordpostings is None:
+                return []
+
+            postings.append(wordpostings)
+
+        return intersect_postings(postings, limit)
+
+    @classmethod
+    def from_dict(cls, wordindex, filename=None):
+        """ Converts a {word: [index, ...]} mapping, like the shelves of
+        older versions """
+
+        index = cls(filename)
+
+        for word in wordindex:
+            index._postings[word] = array('I', sorted(set(wordindex[word])))
+
+        index._modified = True
+        return index
+
+    @staticmethod
+    def _uint32s(view):
+        """ Returns a little-endian uint32 sequence in a buffer """
+
+        if sys.byteorder == "big":
+            values = array('I', view)
+            values.byteswap()
+            return values
+
+        return view.cast('I')
+
+    @classmethod
+    def load(cls, filename):
+
+        index = cls(filename)
+
+        with open(filename, "rb") as f:
+            if sys.platform == "win32":
+                # Mapped files can't be replaced when saving
+                data = f.read()
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, numwords = HEADER.unpack_from(data)
+
+        if magic != cls.MAGIC or version not in (1, cls.VERSION):
+            raise ValueError("%s is not a search index file" % filename)
+
+        if version == 1:
+            index._load_v1(data, numwords)
+            return index
+
+        numpostings, filelistsize = SNAPSHOT_HEADER.unpack_from(data, HEADER.size)
+        view = memoryview(data)
+        pos = HEADER.size + SNAPSHOT_HEADER.size
+
+        if filelistsize:
+            index._filelist = bytes(view[pos:pos + filelistsize])
+
+        pos += filelistsize + (-filelistsize % 4)
+
+        wordoffsets = cls._uint32s(view[pos:pos + (numwords + 1) * 4])
+        pos += (numwords + 1) * 4
+
+        index._postingoffsets = cls._uint32s(view[pos:pos + (numwords + 1) * 4])
+        pos += (numwords + 1) * 4
+
+        wordsize = wordoffsets[-1]
+        index._words = SnapshotWords(view[pos:pos + wordsize], wordoffsets)
+        pos += wordsize + (-wordsize % 4)
+
+        index._allpostings = cls._uint32s(view[pos:pos + numpostings * 4])
+        index._data = data
+
+        return index
+
+    def _load_v1(self, data, numwords):
+
+        pos = HEADER.size
+        postings = self._postings
+
+        with memoryview(data) as view:
+            for i in range(numwords):
+                wordlen, = UINT32.unpack_from(data, pos)
+                pos += 4
+                word = str(view[pos:pos + wordlen], "utf-8", "surrogatepass")
+                pos += wordlen
+
+                count, = UINT32.unpack_from(data, pos)
+                pos += 4
+                wordpostings = array('I')
+                wordpostings.frombytes(view[pos:pos + count * 4])
+                pos += count * 4
+
+                if sys.byteorder == "big":
+                    wordpostings.byteswap()
+
+                postings[word] = wordpostings
+
+    def save(self, filename=None):
+
+        if filename is not None:
+            self.filename = filename
+
+        encoded = sorted((word.encode("utf-8", "surrogatepass"), word) for word in self)
+        filelist = self._filelist or b""
+
+        if isinstance(filelist, (bytes, bytearray)):
+            filelist = (filelist,)
+
+        filelistsize = sum(len(chunk) for chunk in filelist)
+
+        wordoffsets = array('I', [0])
+        postingoffsets = array('I', [0])
+
+        for key, word in encoded:
+            wordoffsets.append(wordoffsets[-1] + len(key))
+            postingoffsets.append(postingoffsets[-1] + len(self._get(word)))
+
+        wordsize = wordoffsets[-1]
+
+        tmpfile = self.filename + ".new"
+
+        with open(tmpfile, "wb") as f:
+            f.write(HEADER.pack(self.MAGIC, self.VERSION, len(encoded)))
+            f.write(SNAPSHOT_HEADER.pack(postingoffsets[-1], filelistsize))
+
+            for chunk in filelist:
+                f.write(chunk)
+
+            f.write(bytes(-filelistsize % 4))
+
+            for offsets in (wordoffsets, postingoffsets):
+                if sys.byteorder == "big":
+                    offsets.byteswap()
+
+                offsets.tofile(f)
+
+            for key, _word in encoded:
+                f.write(key)
+
+            f.write(bytes(-wordsize % 4))
+
+            for _key, word in encoded:
+                wordpostings = self._get(word)
+
+                if sys.byteorder == "big":
+                    wordpostings = array('I', wordpostings)
+                    wordpostings.byteswap()
+
+                f.write(wordpostings)
+
+        os.replace(tmpfile, self.filename)
+        self._modified = False
+
+    def close(self):
+        """ Writes pending changes, like closing a shelf would """
+
+        if self._modified and self.filename is not None:
+            self.save()
+
+
+class SearchResultCache:
+    """ Least recently used cache of search responses, for queries that the
+    distributed network sends us over and over. Keys are normalized queries,
+    values whatever the caller needs to respond to them again. The cache
+    must be cleared when the shares change. """
+
+    def __init__(self, maxsize=1000):
+
+        self.maxsize = maxsize
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0
+        }
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+
+        lookups = self.counters["hits"] + self.counters["misses"]
+
+        if not lookups:
+            return 0.0
+
+        return self.counters["hits"] / lookups
+
+    def get(self, key):
+
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            self.counters["misses"] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry
+
+    def add(self, key, entry):
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+
+        if self._entries:
+            self._entries.clear()
+            self.counters["invalidations"] += 1
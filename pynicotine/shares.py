@@ -22,10 +22,9 @@
 
 import os
 import re
-import stat
 import string
-import sys
 import taglib
+import time
 import _thread
 from gettext import gettext as _
 
@@ -33,8 +32,48 @@ from gi.repository import GLib
 
 from pynicotine import slskmessages
 from pynicotine.logfacility import log
-from pynicotine.utils import displayTraceback
+from pynicotine.searchindex import SearchResultCache
+from pynicotine.searchindex import WordIndex
+from pynicotine.sharescanner import FileInfoCache
+from pynicotine.sharescanner import FileInfoScanner
+from pynicotine.sharescanner import get_scan_workers
+from pynicotine.sharescanner import ShareFilter
+from pynicotine.sharewatcher import create_share_watcher
 from pynicotine.utils import GetUserDirectories
+from pynicotine.virtualpaths import VirtualPathMapping
+
+
+def get_file_info(name, pathname):
+    """ Returns the (name, size, bitrateinfo, length) tuple of a file, and
+    None, or None and the error that occurred. Also runs in the share
+    scanner's worker processes. """
+
+    try:
+        audio = None
+        size = os.stat(pathname).st_size
+
+        if size > 0:
+            try:
+                audio = taglib.File(pathname)
+            except IOError:
+                pass
+
+        if audio is not None:
+            bitrateinfo = (int(audio.bitrate), int(False))  # Second argument used to be VBR (variable bitrate)
+            fileinfo = (name, size, bitrateinfo, int(audio.length))
+        else:
+            fileinfo = (name, size, None, None)
+
+        return fileinfo, None
+
+    except Exception as error:
+        return None, error
+
+
+def get_files_info(files):
+    """ Returns the results of get_file_info() for a list of (name, pathname) tuples """
+
+    return [get_file_info(name, pathname) for name, pathname in files]
 
 
 class Shares:
@@ -44,6 +83,12 @@ class Shares:
         self.config = self.np.config
         self.queue = self.np.queue
         self.LogMessage = self.np.logMessage
+        self.searchcache = SearchResultCache()
+        self.watcher = None
+        self.pendingchanges = {}
+        self.folderindexes = {"normal": None, "buddy": None}
+        self.pathmapping = self.pathmappingkey = None
+        self.sharefilter = self.sharefilterkey = None
         self.CompressedSharesBuddy = self.CompressedSharesNormal = None
         self.CompressShares("normal")
         self.CompressShares("buddy")
@@ -51,30 +96,51 @@ class Shares:
         self.translatepunctuation = str.maketrans(dict.fromkeys(string.punctuation, ' '))
 
     def real2virtual(self, path):
-        path = os.path.normpath(path)
 
-        for (virtual, real) in self._virtualmapping():
-            real = os.path.normpath(real)
+        virtualpath = self._pathmapping().real2virtual(path)
+
+        if virtualpath is None:
+            return "__INTERNAL_ERROR__" + os.path.normpath(path)
 
-            if path == real:
-                return virtual
-            if path.startswith(real + os.sep):
-                virtualpath = virtual + '\\' + path[len(real + os.sep):].replace(os.sep, '\\')
-                return virtualpath
-        return "__INTERNAL_ERROR__" + path
+        return virtualpath
 
     def virtual2real(self, path):
-        path = os.path.normpath(path)
 
-        for (virtual, real) in self._virtualmapping():
-            virtual = os.path.normpath(virtual)
+        realpath = self._pathmapping().virtual2real(path)
 
-            if path == virtual:
-                return real
-            if path.startswith(virtual + '\\'):
-                realpath = real + path[len(virtual):].replace('\\', os.sep)
-                return realpath
-        return "__INTERNAL_ERROR__" + path
+        if realpath is None:
+            return "__INTERNAL_ERROR__" + os.path.normpath(path)
+
+        return realpath
+
+    def _pathmapping(self):
+        """ Returns the VirtualPathMapping of the shared folders, which is only
+        built again when they change """
+
+        transfers = self.config.sections["transfers"]
+        key = (
+            tuple(transfers["shared"]),
+            transfers["enablebuddyshares"] and tuple(transfers["buddyshared"]),
+            transfers["sharedownloaddir"] and transfers["downloaddir"]
+        )
+
+        if key != self.pathmappingkey:
+            self.pathmapping = VirtualPathMapping(self._virtualmapping())
+            self.pathmappingkey = key
+
+        return self.pathmapping
+
+    def _sharefilter(self):
+        """ Returns the ShareFilter of the configured exclusion filters, which
+        is only built again when they change """
+
+        key = tuple(tuple(sharefilter) for sharefilter in self.config.sections["transfers"]["sharefilters"])
+
+        if key != self.sharefilterkey:
+            self.sharefilter = ShareFilter(key)
+            self.sharefilterkey = key
+
+        return self.sharefilter
 
     def _virtualmapping(self):
 
@@ -109,10 +175,11 @@ class Shares:
 
         try:
             sharedfolders = len(conf["transfers"][shared_db])
-            sharedfiles = len(conf["transfers"][index_db])
         except TypeError:
             sharedfolders = len(list(conf["transfers"][shared_db]))
-            sharedfiles = len(list(conf["transfers"][index_db]))
+
+        # Files removed by the share watcher keep their index, don't count them
+        sharedfiles = conf["transfers"][index_db].count()
 
         self.queue.put(slskmessages.SharedFoldersFiles(sharedfolders, sharedfiles))
 
@@ -130,16 +197,20 @@ class Shares:
 
     def _RescanShares(self, msg, type, rebuild=False):
 
+        config_dir, data_dir = GetUserDirectories()
+
         if type == "normal":
             name = _("Shares")
             mtimes = self.config.sections["transfers"]["sharedmtimes"]
             files = self.config.sections["transfers"]["sharedfiles"]
             filesstreams = self.config.sections["transfers"]["sharedfilesstreams"]
+            cachefile = os.path.join(data_dir, "fileinfo.cache")
         else:
             name = _("Buddy Shares")
             mtimes = self.config.sections["transfers"]["bsharedmtimes"]
             files = self.config.sections["transfers"]["bsharedfiles"]
             filesstreams = self.config.sections["transfers"]["bsharedfilesstreams"]
+            cachefile = os.path.join(data_dir, "buddyfileinfo.cache")
 
         try:
             files, streams, wordindex, fileindex, mtimes = self.rescandirs(
@@ -150,26 +221,39 @@ class Shares:
                 msg.yieldfunction,
                 self.np.frame.SharesProgress,
                 name=name,
-                rebuild=rebuild
+                rebuild=rebuild,
+                cachefile=cachefile
             )
 
+            # Peers browsing us get the same compressed list until the shares
+            # change, store it with the search index to have it at startup
+            wordindex.filelist = slskmessages.SharedFileList(None, streams).makeNetworkMessage()
+
             self.np.frame.RescanFinished(
                 files, streams, wordindex, fileindex, mtimes,
                 type
             )
         except Exception as ex:
-            config_dir, data_dir = GetUserDirectories()
             log.addwarning(
-                _("Failed to rebuild share, serious error occurred. If this problem persists delete %s/*.db and try again. If that doesn't help please file a bug report with the stack trace included (see terminal output after this message). Technical details: %s") % (data_dir, ex)
+                _("Failed to rebuild share, serious error occurred. If this problem persists delete %s/shares.sqlite and try again. If that doesn't help please file a bug report with the stack trace included (see terminal output after this message). Technical details: %s") % (data_dir, ex)
             )
             raise
 
-    def CompressShares(self, sharestype):
+    def CompressShares(self, sharestype, rebuild=False):
+        """ Prepares the compressed list of shared files sent to browsing
+        peers. Unless rebuild is True, the list stored with the search index
+        is used if there is one. """
 
         if sharestype == "normal":
             streams = self.config.sections["transfers"]["sharedfilesstreams"]
+            wordindex = self.config.sections["transfers"]["wordindex"]
         elif sharestype == "buddy":
             streams = self.config.sections["transfers"]["bsharedfilesstreams"]
+            wordindex = self.config.sections["transfers"]["bwordindex"]
+
+        # The search index was rebuilt
+        self.searchcache.clear()
+        self.folderindexes[sharestype] = None
 
         if streams is None:
             message = _("ERROR: No %(type)s shares database available") % {"type": sharestype}
@@ -178,7 +262,14 @@ class Shares:
             return
 
         m = slskmessages.SharedFileList(None, streams)
-        _thread.start_new_thread(m.makeNetworkMessage, (0, True))
+        if not rebuild and wordindex.filelist is not None:
+            m.built = wordindex.filelist
+
+            if not isinstance(m.built, slskmessages.MessageChunks):
+                # Loaded from the search index file
+                m.built = slskmessages.MessageChunks((m.built,))
+        else:
+            _thread.start_new_thread(m.makeNetworkMessage, (0, True))
 
         if sharestype == "normal":
             self.CompressedSharesNormal = m
@@ -191,14 +282,13 @@ class Shares:
         user = ip = port = None
 
         # Get peer's username, ip and port
-        for i in self.np.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-                if i.addr is not None:
-                    if len(i.addr) != 2:
-                        break
-                    ip, port = i.addr
-                break
+        for i in self.np.peerconns.by_conn(msg.conn.conn):
+            user = i.username
+            if i.addr is not None:
+                if len(i.addr) != 2:
+                    break
+                ip, port = i.addr
+            break
 
         if user is None:
             # No peer connection
@@ -236,24 +326,26 @@ class Shares:
         if checkuser == 1:
             # Send Normal Shares
             if self.newnormalshares:
-                self.CompressShares("normal")
+                self.CompressShares("normal", rebuild=True)
                 self.newnormalshares = False
             m = self.CompressedSharesNormal
 
         elif checkuser == 2:
             # Send Buddy Shares
             if self.newbuddyshares:
-                self.CompressShares("buddy")
+                self.CompressShares("buddy", rebuild=True)
                 self.newbuddyshares = False
             m = self.CompressedSharesBuddy
 
         else:
             # Nyah, Nyah
-            m = slskmessages.SharedFileList(msg.conn.conn, {})
-            m.makeNetworkMessage(nozlib=0)
+            m = slskmessages.SharedFileList(None, {})
 
-        m.conn = msg.conn.conn
-        self.queue.put(m)
+        # Simultaneous requests get messages of their own, sharing the
+        # compressed list instead of copying it
+        response = slskmessages.SharedFileList(msg.conn.conn, m.list)
+        response.built = m.built
+        self.queue.put(response)
 
     def FolderContentsRequest(self, msg):
 
@@ -261,11 +353,10 @@ class Shares:
         checkuser = None
         reason = ""
 
-        for i in self.np.peerconns:
-            if i.conn is msg.conn.conn:
-                username = i.username
-                checkuser, reason = self.np.CheckUser(username, None)
-                break
+        for i in self.np.peerconns.by_conn(msg.conn.conn):
+            username = i.username
+            checkuser, reason = self.np.CheckUser(username, None)
+            break
 
         if not username:
             return
@@ -320,37 +411,31 @@ class Shares:
 
         if checkuser == 2:
             wordindex = self.config.sections["transfers"]["bwordindex"]
+            fileindex = self.config.sections["transfers"]["bfileindex"]
         else:
             wordindex = self.config.sections["transfers"]["wordindex"]
+            fileindex = self.config.sections["transfers"]["fileindex"]
 
         # Don't count excluded words as matches (words starting with -)
         searchterm = re.sub(r'(\s)-\w+', r'\1', searchterm)
         terms = searchterm.lower().translate(self.translatepunctuation).split()
-        length = 0
-
-        try:
-            for i in terms:
-                if i in wordindex:
-                    length += 1
 
-            if length == 0 or length != len(terms):
-                return
+        # Popular queries reach us many times, reuse the matches and the
+        # compressed list of files we sent back for them
+        cachekey = (checkuser == 2, frozenset(terms), maxresults)
+        cached = self.searchcache.get(cachekey)
 
-            list = [wordindex[i] for i in terms if i in wordindex]
-        except ValueError:
-            # DB is closed, perhaps when rescanning share or closing Nicotine+
-            return
+        if cached is None:
+            results = wordindex.search(terms, maxresults)
+            filelist = None
 
-        shortest = min(list, key=len)
-        list.remove(shortest)
+            if results:
+                filelist = slskmessages.FileSearchResult(None, shares=results, fileindex=fileindex).packFileList()
 
-        for i in shortest[:]:
-            for j in list:
-                if i not in j:
-                    shortest.remove(i)
-                    break
+            cached = (results, filelist)
+            self.searchcache.add(cachekey, cached)
 
-        results = shortest[:maxresults]
+        results, filelist = cached
 
         if len(results) > 0 and self.np.transfers is not None:
 
@@ -362,18 +447,13 @@ class Shares:
             else:
                 geoip = 0
 
-            if checkuser == 2:
-                fileindex = self.config.sections["transfers"]["bfileindex"]
-            else:
-                fileindex = self.config.sections["transfers"]["fileindex"]
-
             fifoqueue = self.config.sections["transfers"]["fifoqueue"]
 
             message = slskmessages.FileSearchResult(
                 None,
                 self.config.sections["server"]["login"],
                 geoip, searchid, results, fileindex, slotsavail,
-                self.np.speed, queuesizes, fifoqueue
+                self.np.speed, queuesizes, fifoqueue, filelist
             )
 
             self.np.ProcessRequestToPeer(user, message)
@@ -394,7 +474,7 @@ class Shares:
                     }, 2)
 
     # Rescan directories in shared databases
-    def rescandirs(self, shared, oldmtimes, oldfiles, sharedfilesstreams, yieldfunction, progress=None, name="", rebuild=False):
+    def rescandirs(self, shared, oldmtimes, oldfiles, sharedfilesstreams, yieldfunction, progress=None, name="", rebuild=False, cachefile=None):
         """
         Check for modified or new files via OS's last mtime on a directory,
         or, if rebuild is True, all directories
@@ -417,7 +497,7 @@ class Shares:
 
         # Get list of files
         # returns dict in format { Directory : { File : metadata, ... }, ... }
-        newsharedfiles = self.getFilesList(newmtimes, oldmtimes, oldfiles, yieldfunction, progress, rebuild)
+        newsharedfiles = self.getFilesList(newmtimes, oldmtimes, oldfiles, yieldfunction, progress, rebuild, cachefile)
 
         # Pack shares data
         # returns dict in format { Directory : hex string of files+metadata, ... }
@@ -435,141 +515,207 @@ class Shares:
 
     # Get Modification Times
     def getDirsMtimes(self, dirs, yieldcall=None):
+        """ Returns the modification times of the shared folders and the
+        folders below them. Excluded folders are skipped along with everything
+        below them, so that later passes over the folders never see them. """
 
         list = {}
+        sharefilter = self._sharefilter()
 
         for folder in dirs:
 
             try:
-                if self.hiddenCheck(folder):
+                if sharefilter.excluded_path(folder):
                     continue
 
-                mtime = os.path.getmtime(folder)
-                list[folder] = mtime
-
-                for entry in os.scandir(folder):
-                    if entry.is_dir():
+                list[folder] = os.path.getmtime(folder)
 
-                        path = entry.path
-
-                        try:
-                            mtime = entry.stat().st_mtime
-                        except OSError as errtuple:
-                            message = _("Error while scanning %(path)s: %(error)s") % {
-                                'path': path,
-                                'error': errtuple
-                            }
-
-                            print(str(message))
-                            self.logMessage(message)
-                            continue
-
-                        list[path] = mtime
-                        dircontents = self.getDirsMtimes([path])
-                        for k in dircontents:
-                            list[k] = dircontents[k]
-
-                    if yieldcall is not None:
-                        yieldcall()
             except OSError as errtuple:
                 message = _("Error while scanning folder %(path)s: %(error)s") % {'path': folder, 'error': errtuple}
                 print(str(message))
                 self.logMessage(message)
                 continue
 
+            self.getSubdirsMtimes(folder, list, sharefilter, yieldcall)
+
         return list
 
+    def getSubdirsMtimes(self, folder, list, sharefilter, yieldcall=None):
+
+        try:
+            for entry in os.scandir(folder):
+                if entry.is_dir():
+
+                    path = entry.path
+
+                    try:
+                        if sharefilter.excluded_entry(entry):
+                            continue
+
+                        mtime = entry.stat().st_mtime
+                    except OSError as errtuple:
+                        message = _("Error while scanning %(path)s: %(error)s") % {
+                            'path': path,
+                            'error': errtuple
+                        }
+
+                        print(str(message))
+                        self.logMessage(message)
+                        continue
+
+                    list[path] = mtime
+                    self.getSubdirsMtimes(path, list, sharefilter)
+
+                if yieldcall is not None:
+                    yieldcall()
+        except OSError as errtuple:
+            message = _("Error while scanning folder %(path)s: %(error)s") % {'path': folder, 'error': errtuple}
+            print(str(message))
+            self.logMessage(message)
+
     # Check for new files
-    def getFilesList(self, mtimes, oldmtimes, oldlist, yieldcall=None, progress=None, rebuild=False):
-        """ Get a list of files with their filelength, bitrate and track length in seconds """
+    def getFilesList(self, mtimes, oldmtimes, oldlist, yieldcall=None, progress=None, rebuild=False, cachefile=None):
+        """ Get a list of files with their filelength, bitrate and track length in seconds.
+        Metadata is read by a pool of worker processes while the folders are walked,
+        unless the file is unchanged since it was last read according to the cache in cachefile. """
 
         list = {}
         count = 0
         lastpercent = 0.0
+        starttime = time.time()
+        skipped = False
 
-        for folder in mtimes:
+        workers = get_scan_workers(self.config.sections["transfers"]["scanworkers"])
+        sharefilter = self._sharefilter()
 
-            try:
-                count += 1
+        if cachefile is not None:
+            cache = FileInfoCache.load(cachefile)
+        else:
+            cache = FileInfoCache()
 
-                if progress:
-                    # Truncate the percentage to two decimal places to avoid sending data to the GUI thread too often
-                    percent = float("%.2f" % (float(count) / len(mtimes) * 0.75))
+        def addFileInfo(results):
+            nonlocal lastpercent
 
-                    if percent > lastpercent and percent <= 1.0:
-                        GLib.idle_add(progress.set_fraction, percent)
-                        lastpercent = percent
+            for (virtualdir, position, pathname, key, foldercount), (data, error) in results:
+                if data is not None:
+                    list[virtualdir][position] = data
+                    cache.add(key, data[2:])
+                else:
+                    self.logFileInfoError(pathname, error)
 
-                if self.hiddenCheck(folder):
-                    continue
+                lastpercent = self.setScanProgress(progress, foldercount, len(mtimes), lastpercent)
 
-                if not rebuild and folder in oldmtimes:
-                    if mtimes[folder] == oldmtimes[folder]:
-                        if os.path.exists(folder):
-                            try:
-                                virtualdir = self.real2virtual(folder)
-                                list[virtualdir] = oldlist[virtualdir]
+        with FileInfoScanner(get_files_info, workers) as scanner:
+            for folder in mtimes:
+
+                try:
+                    count += 1
+
+                    if not scanner.pending:
+                        lastpercent = self.setScanProgress(progress, count, len(mtimes), lastpercent)
+
+                    if not rebuild and folder in oldmtimes:
+                        if mtimes[folder] == oldmtimes[folder]:
+                            if os.path.exists(folder):
+                                try:
+                                    virtualdir = self.real2virtual(folder)
+                                    list[virtualdir] = oldlist[virtualdir]
+                                    skipped = True
+                                    continue
+                                except KeyError:
+                                    log.adddebug(_("Inconsistent cache for '%(vdir)s', rebuilding '%(dir)s'") % {
+                                        'vdir': virtualdir,
+                                        'dir': folder
+                                    })
+                            else:
+                                log.adddebug(_("Dropping missing folder %(dir)s") % {'dir': folder})
                                 continue
-                            except KeyError:
-                                log.adddebug(_("Inconsistent cache for '%(vdir)s', rebuilding '%(dir)s'") % {
-                                    'vdir': virtualdir,
-                                    'dir': folder
-                                })
-                        else:
-                            log.adddebug(_("Dropping missing folder %(dir)s") % {'dir': folder})
-                            continue
 
-                virtualdir = self.real2virtual(folder)
-                list[virtualdir] = []
+                    virtualdir = self.real2virtual(folder)
+                    files = list[virtualdir] = []
 
-                for entry in os.scandir(folder):
+                    for entry in os.scandir(folder):
 
-                    if entry.is_file():
-                        filename = entry.name
+                        if entry.is_file():
+                            filename = entry.name
 
-                        if self.hiddenCheck(folder, filename):
-                            continue
+                            if sharefilter.excluded_entry(entry):
+                                continue
 
-                        # Get the metadata of the file
-                        data = self.getFileInfo(filename, entry.path)
-                        if data is not None:
-                            list[virtualdir].append(data)
+                            # Get the metadata of the file, unless it's cached
+                            try:
+                                st = os.stat(entry.path)
+                            except OSError as error:
+                                self.logFileInfoError(entry.path, error)
+                                continue
 
-                    if yieldcall is not None:
-                        yieldcall()
-            except OSError as errtuple:
-                message = _("Error while scanning folder %(path)s: %(error)s") % {'path': folder, 'error': errtuple}
-                print(str(message))
-                self.logMessage(message)
-                continue
+                            key = FileInfoCache.key(st)
+                            cached = cache.get(key)
+
+                            if cached is not None:
+                                files.append((filename, st.st_size) + cached)
+                            else:
+                                # Keep the place of the file in the folder's list
+                                files.append(None)
+                                addFileInfo(scanner.add((virtualdir, len(files) - 1, entry.path, key, count), filename, entry.path))
+
+                        if yieldcall is not None:
+                            yieldcall()
+                except OSError as errtuple:
+                    message = _("Error while scanning folder %(path)s: %(error)s") % {'path': folder, 'error': errtuple}
+                    print(str(message))
+                    self.logMessage(message)
+                    continue
+
+            addFileInfo(scanner.finish())
+
+        if cache.misses:
+            # Drop files that couldn't be read
+            for virtualdir in list:
+                if None in list[virtualdir]:
+                    list[virtualdir] = [data for data in list[virtualdir] if data is not None]
+
+        if cachefile is not None:
+            # Files of unchanged folders weren't looked up, only drop entries after a full scan
+            cache.save(prune=not skipped)
+
+        self.logMessage(_("Scanned %(num)i files in %(time).1f seconds, %(hits)i unchanged files found in cache, %(misses)i files read") % {
+            'num': cache.hits + cache.misses,
+            'time': time.time() - starttime,
+            'hits': cache.hits,
+            'misses': cache.misses
+        })
 
         return list
 
+    def setScanProgress(self, progress, count, total, lastpercent):
+
+        if not progress:
+            return lastpercent
+
+        # Truncate the percentage to two decimal places to avoid sending data to the GUI thread too often
+        percent = float("%.2f" % (float(count) / total * 0.75))
+
+        if percent > lastpercent and percent <= 1.0:
+            GLib.idle_add(progress.set_fraction, percent)
+            return percent
+
+        return lastpercent
+
     # Get metadata via taglib
     def getFileInfo(self, name, pathname):
 
-        try:
-            audio = None
-            size = os.stat(pathname).st_size
+        fileinfo, error = get_file_info(name, pathname)
 
-            if size > 0:
-                try:
-                    audio = taglib.File(pathname)
-                except IOError:
-                    pass
+        if error is not None:
+            self.logFileInfoError(pathname, error)
 
-            if audio is not None:
-                bitrateinfo = (int(audio.bitrate), int(False))  # Second argument used to be VBR (variable bitrate)
-                fileinfo = (name, size, bitrateinfo, int(audio.length))
-            else:
-                fileinfo = (name, size, None, None)
+        return fileinfo
 
-            return fileinfo
+    def logFileInfoError(self, pathname, error):
 
-        except Exception as errtuple:
-            message = _("Error while scanning file %(path)s: %(error)s") % {'path': pathname, 'error': errtuple}
-            self.logMessage(message)
-            displayTraceback(sys.exc_info()[2])
+        message = _("Error while scanning file %(path)s: %(error)s") % {'path': pathname, 'error': error}
+        self.logMessage(message)
 
     # Get streams of files
     def getFilesStreams(self, mtimes, oldmtimes, oldstreams, newsharedfiles, rebuild=False, yieldcall=None):
@@ -580,9 +726,6 @@ class Shares:
 
             virtualdir = self.real2virtual(folder)
 
-            if self.hiddenCheck(folder):
-                continue
-
             if not rebuild and folder in oldmtimes:
 
                 if mtimes[folder] == oldmtimes[folder]:
@@ -607,29 +750,6 @@ class Shares:
 
         return streams
 
-    # Stop sharing any dot/hidden directories/files
-    def hiddenCheck(self, folder, filename=None):
-
-        subfolders = folder.split(os.sep)
-
-        # If any part of the directory structure start with a dot we exclude it
-        for part in subfolders:
-            if part.startswith("."):
-                return True
-
-        # If we're asked to check a file we exclude it if it start with a dot
-        if filename is not None and filename.startswith("."):
-            return True
-
-        # Check if file is marked as hidden on Windows
-        if sys.platform == "win32":
-            if filename is not None:
-                folder = os.path.join(folder, filename)
-
-            return os.stat(folder).st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN
-
-        return False
-
     # Pack all files and metadata in directory
     def getDirStream(self, dir):
 
@@ -671,7 +791,7 @@ class Shares:
     # Update Search index with new files
     def getFilesIndex(self, mtimes, oldmtimes, newsharedfiles, yieldcall=None, progress=None):
 
-        wordindex = {}
+        wordindex = WordIndex()
         fileindex = []
         index = 0
         count = len(mtimes)
@@ -690,19 +810,12 @@ class Shares:
                     GLib.idle_add(progress.set_fraction, percent)
                     lastpercent = percent
 
-            if self.hiddenCheck(folder):
-                continue
-
             for j in newsharedfiles[virtualdir]:
                 file = j[0]
                 fileindex.append((virtualdir + '\\' + file,) + j[1:])
 
                 # Collect words from filenames for Search index
-                for k in (virtualdir + " " + file).lower().translate(self.translatepunctuation).split():
-                    try:
-                        wordindex[k].append(index)
-                    except KeyError:
-                        wordindex[k] = [index]
+                wordindex.add(self.getIndexWords(virtualdir, file), index)
 
                 index += 1
 
@@ -711,6 +824,20 @@ class Shares:
 
         return wordindex, fileindex
 
+    def getIndexWords(self, dir, file):
+        return (dir + " " + file).lower().translate(self.translatepunctuation).split()
+
+    def excludedFromShares(self, dir, file):
+        """ Returns True if a downloaded file is left out of the shares by
+        the same filters as a rescan """
+
+        sharefilter = self._sharefilter()
+
+        try:
+            return sharefilter.excluded(file) or sharefilter.excluded_path(dir)
+        except OSError:
+            return True
+
     def addToShared(self, name):
         """ Add a file to the normal shares database """
 
@@ -723,25 +850,28 @@ class Shares:
         wordindex = config["transfers"]["wordindex"]
         fileindex = config["transfers"]["fileindex"]
 
-        shareddirs = [path for _name, path in config["transfers"]["shared"]]
-        shareddirs.append(config["transfers"]["downloaddir"])
-
         sharedmtimes = config["transfers"]["sharedmtimes"]
 
         dir = str(os.path.expanduser(os.path.dirname(name)))
         vdir = self.real2virtual(dir)
         file = str(os.path.basename(name))
 
-        shared[vdir] = shared.get(vdir, [])
+        if self.excludedFromShares(dir, file):
+            return
+
+        with self.config.sharestore.transaction():
+            shared[vdir] = shared.get(vdir, [])
 
-        if file not in [i[0] for i in shared[vdir]]:
-            fileinfo = self.getFileInfo(file, name)
-            shared[vdir] = shared[vdir] + [fileinfo]
-            sharedstreams[vdir] = self.getDirStream(shared[vdir])
-            words = self.getIndexWords(vdir, file, shareddirs)
-            self.addToIndex(wordindex, fileindex, words, vdir, fileinfo)
-            sharedmtimes[vdir] = os.path.getmtime(dir)
-            self.newnormalshares = True
+            if file not in [i[0] for i in shared[vdir]]:
+                fileinfo = self.getFileInfo(file, name)
+                shared[vdir] = shared[vdir] + [fileinfo]
+                sharedstreams[vdir] = self.getDirStream(shared[vdir])
+                words = self.getIndexWords(vdir, file)
+                self.addToIndex(wordindex, fileindex, words, vdir, fileinfo)
+                sharedmtimes[vdir] = os.path.getmtime(dir)
+                self.newnormalshares = True
+                self.folderindexes["normal"] = None
+                self.searchcache.clear()
 
         if config["transfers"]["enablebuddyshares"]:
             self.addToBuddyShared(name)
@@ -758,32 +888,289 @@ class Shares:
         bwordindex = config["transfers"]["bwordindex"]
         bfileindex = config["transfers"]["bfileindex"]
 
-        bshareddirs = [path for _name, path in config["transfers"]["shared"]]
-        bshareddirs += [path for _name, path in config["transfers"]["buddyshared"]]
-        bshareddirs.append(config["transfers"]["downloaddir"])
-
         bsharedmtimes = config["transfers"]["bsharedmtimes"]
 
         dir = str(os.path.expanduser(os.path.dirname(name)))
         vdir = self.real2virtual(dir)
         file = str(os.path.basename(name))
 
-        bshared[vdir] = bshared.get(vdir, [])
+        if self.excludedFromShares(dir, file):
+            return
+
+        with self.config.sharestore.transaction():
+            bshared[vdir] = bshared.get(vdir, [])
 
-        if file not in [i[0] for i in bshared[vdir]]:
-            fileinfo = self.getFileInfo(file, name)
-            bshared[vdir] = bshared[vdir] + [fileinfo]
-            bsharedstreams[vdir] = self.getDirStream(bshared[vdir])
-            words = self.getIndexWords(vdir, file, bshareddirs)
-            self.addToIndex(bwordindex, bfileindex, words, vdir, fileinfo)
-            bsharedmtimes[vdir] = os.path.getmtime(dir)
-            self.newbuddyshares = True
+            if file not in [i[0] for i in bshared[vdir]]:
+                fileinfo = self.getFileInfo(file, name)
+                bshared[vdir] = bshared[vdir] + [fileinfo]
+                bsharedstreams[vdir] = self.getDirStream(bshared[vdir])
+                words = self.getIndexWords(vdir, file)
+                self.addToIndex(bwordindex, bfileindex, words, vdir, fileinfo)
+                bsharedmtimes[vdir] = os.path.getmtime(dir)
+                self.newbuddyshares = True
+                self.folderindexes["buddy"] = None
+                self.searchcache.clear()
 
     def addToIndex(self, wordindex, fileindex, words, dir, fileinfo):
         index = len(fileindex)
-        for i in words:
-            if i not in wordindex:
-                wordindex[i] = [index]
+        wordindex.add(words, index)
+        fileindex[str(index)] = (dir + '\\' + fileinfo[0],) + fileinfo[1:]
+
+    def updateWatcher(self):
+        """ Starts watching the shared folders for changes if enabled, or
+        stops watching them """
+
+        transfers = self.config.sections["transfers"]
+
+        if not transfers["watchshares"]:
+            self.stopWatcher()
+            return
+
+        folders = []
+
+        for virtual, real in self._virtualmapping():
+            real = os.path.normpath(real)
+
+            if real not in folders:
+                folders.append(real)
+
+        if self.watcher is None or not self.watcher.is_alive() or self.watcher.folders != folders:
+            self.stopWatcher()
+
+            self.watcher = create_share_watcher(folders, self.readShareChanges)
+            self.watcher.start()
+
+        if self.pendingchanges:
+            # Changes that arrived during a rescan
+            changes = self.pendingchanges
+            self.pendingchanges = {}
+            self.applyShareChanges(changes)
+
+    def stopWatcher(self):
+
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def readShareChanges(self, changes):
+        """ Called by the share watcher thread. Reads the files that changed,
+        and updates the shares in the main thread. """
+
+        if changes is None:
+            GLib.idle_add(self.applyShareChanges, None)
+            return
+
+        folders = {}
+        sharefilter = self._sharefilter()
+
+        for folder, names in changes.items():
+            try:
+                if sharefilter.excluded_path(folder):
+                    continue
+
+                mtime = os.path.getmtime(folder)
+                entries = list(os.scandir(folder))
+
+            except OSError:
+                # The folder was removed
+                folders[folder] = None
+                continue
+
+            files = []
+
+            for entry in entries:
+                try:
+                    if not entry.is_file() or sharefilter.excluded_entry(entry):
+                        continue
+
+                except OSError:
+                    continue
+
+                fileinfo = None
+
+                if names is None or entry.name in names:
+                    fileinfo = self.getFileInfo(entry.name, entry.path)
+
+                    if fileinfo is None:
+                        continue
+
+                # Files without metadata keep the one already in the shares
+                files.append((entry.name, fileinfo))
+
+            folders[folder] = (mtime, files)
+
+        GLib.idle_add(self.applyShareChanges, folders)
+
+    def applyShareChanges(self, folders):
+        """ Patches the shares databases and search indexes with the folders
+        read by readShareChanges(), a dict of folder: (mtime, files), or
+        None for removed folders """
+
+        frame = self.np.frame
+        transfers = self.config.sections["transfers"]
+
+        if folders is None:
+            self.logMessage(_("Too many changes in shared folders, rescanning shares"))
+
+            if not transfers["friendsonly"]:
+                frame.OnRescan()
+
+            if transfers["enablebuddyshares"]:
+                frame.OnBuddyRescan()
+
+            return False
+
+        if frame.rescanning or frame.brescanning:
+            # The databases are being replaced, apply the changes when done
+            self.pendingchanges.update(folders)
+            return False
+
+        shared = transfers["shared"][:]
+
+        if transfers["sharedownloaddir"]:
+            shared.append((_("Downloaded"), transfers["downloaddir"]))
+
+        shares = [("normal", shared)]
+
+        if transfers["enablebuddyshares"]:
+            shares.append(("buddy", shared + transfers["buddyshared"]))
+
+        updated = False
+
+        for sharestype, mapping in shares:
+            roots = [os.path.normpath(real) for virtual, real in mapping]
+            sharefolders = {}
+
+            for folder, data in folders.items():
+                for root in roots:
+                    if folder == root or folder.startswith(root + os.sep):
+                        sharefolders[folder] = data
+                        break
+
+            if not sharefolders:
+                continue
+
+            with self.config.sharestore.transaction():
+                self.updateSharedFolders(sharestype, sharefolders)
+
+            updated = True
+
+            if sharestype == "normal":
+                self.newnormalshares = True
             else:
-                wordindex[i] = wordindex[i] + [index]
-        fileindex.append((os.path.join(dir, fileinfo[0]),) + fileinfo[1:])
+                self.newbuddyshares = True
+
+        if updated:
+            self.searchcache.clear()
+
+            if self.np.transfers is not None:
+                self.sendNumSharedFoldersFiles()
+
+        return False
+
+    def updateSharedFolders(self, sharestype, folders):
+        """ Replaces the files of changed folders in a shares database, and
+        drops removed folders along with their subfolders. Files of changed
+        folders get new search indexes, the old ones are left unused until
+        the next rescan. """
+
+        transfers = self.config.sections["transfers"]
+        prefix = "b" if sharestype == "buddy" else ""
+
+        shared = transfers[prefix + "sharedfiles"]
+        streams = transfers[prefix + "sharedfilesstreams"]
+        wordindex = transfers[prefix + "wordindex"]
+        fileindex = transfers[prefix + "fileindex"]
+        mtimes = transfers[prefix + "sharedmtimes"]
+
+        folderindexes = self.getFolderIndexes(sharestype, fileindex)
+
+        # The stored list is outdated, even if no indexed files changed
+        wordindex.filelist = None
+        sharedfolders = None
+
+        for folder in sorted(folders):
+            data = folders[folder]
+            virtualdir = self.real2virtual(folder)
+
+            if data is None:
+                if sharedfolders is None:
+                    sharedfolders = list(shared.keys())
+
+                removed = [virtualdir] + [vdir for vdir in sharedfolders if vdir.startswith(virtualdir + '\\')]
+
+                for vdir in removed:
+                    self.removeFromIndex(wordindex, fileindex, folderindexes.pop(vdir, []))
+
+                    if vdir in shared:
+                        del shared[vdir]
+
+                    if vdir in streams:
+                        del streams[vdir]
+
+                for path in [path for path in mtimes.keys() if path == folder or path.startswith(folder + os.sep)]:
+                    del mtimes[path]
+
+                continue
+
+            mtime, files = data
+            oldfiles = {fileinfo[0]: fileinfo for fileinfo in shared.get(virtualdir, [])}
+            newfiles = []
+
+            for name, fileinfo in files:
+                if fileinfo is None:
+                    fileinfo = oldfiles.get(name)
+
+                    if fileinfo is None:
+                        continue
+
+                newfiles.append(fileinfo)
+
+            if virtualdir not in shared and sharedfolders is not None:
+                sharedfolders.append(virtualdir)
+
+            shared[virtualdir] = newfiles
+            streams[virtualdir] = self.getDirStream(newfiles)
+            mtimes[folder] = mtime
+
+            self.removeFromIndex(wordindex, fileindex, folderindexes.pop(virtualdir, []))
+            indexes = folderindexes[virtualdir] = []
+
+            for fileinfo in newfiles:
+                indexes.append(len(fileindex))
+                self.addToIndex(wordindex, fileindex, self.getIndexWords(virtualdir, fileinfo[0]), virtualdir, fileinfo)
+
+        self.logMessage(_("Updated %(num)i changed folders in %(type)s shares") % {'num': len(folders), 'type': sharestype}, 2)
+
+    def getFolderIndexes(self, sharestype, fileindex):
+        """ Returns a dict mapping shared folders to the search indexes of
+        their files, built from the file index on first use """
+
+        folderindexes = self.folderindexes[sharestype]
+
+        if folderindexes is not None:
+            return folderindexes
+
+        folderindexes = self.folderindexes[sharestype] = {}
+
+        for key, fileinfo in fileindex.items():
+            if fileinfo is None:
+                continue
+
+            virtualdir = fileinfo[0].rsplit('\\', 1)[0]
+            folderindexes.setdefault(virtualdir, []).append(int(key))
+
+        return folderindexes
+
+    def removeFromIndex(self, wordindex, fileindex, indexes):
+
+        for index in indexes:
+            key = str(index)
+            fileinfo = fileindex.get(key)
+
+            if fileinfo is None:
+                continue
+
+            # Keep the place of the file, new files are numbered after the last one
+            wordindex.remove(self.getIndexWords(*fileinfo[0].rsplit('\\', 1)), index)
+            fileindex[key] = None
@@ -0,0 +1,321 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import fnmatch
+import multiprocessing
+import os
+import pickle
+import re
+import stat
+import sys
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from gettext import gettext as _
+
+from pynicotine.config import RestrictedUnpickler
+from pynicotine.logfacility import log
+
+
+def get_scan_workers(workers):
+    """ Returns the number of worker processes to use for a configured
+    number, where 0 means one per CPU """
+
+    if workers > 0:
+        return workers
+
+    return os.cpu_count() or 1
+
+
+class ShareFilter:
+    """ Decides which files and folders are left out of the shares: those
+    whose name starts with a dot, those marked as hidden on Windows, and
+    those matching one of the exclusion filters.
+
+    Filters are [pattern, escaped] pairs, like download filters. Escaped
+    patterns are wildcards such as *.nfo, others regular expressions. They
+    are compiled into a single expression, which has to match the whole
+    name, in any case. """
+
+    def __init__(self, filters=()):
+
+        expressions = []
+
+        for pattern, escaped in filters:
+            if escaped:
+                expression = fnmatch.translate(pattern)
+            else:
+                expression = "(?:%s)\\Z" % pattern
+
+            # Check each filter the way it's combined with the others
+            expression = "(?:%s)" % expression
+
+            try:
+                re.compile(expression)
+
+            except re.error as error:
+                log.addwarning(_("Ignoring invalid share filter %(filter)s: %(error)s") % {
+                    'filter': pattern,
+                    'error': error
+                })
+                continue
+
+            expressions.append(expression)
+
+        self._match = None
+
+        if expressions:
+            self._match = re.compile("|".join(expressions), re.IGNORECASE).match
+
+    def excluded(self, name):
+        """ Returns True if a file or folder name is excluded """
+
+        if name.startswith("."):
+            return True
+
+        return self._match is not None and self._match(name) is not None
+
+    def excluded_entry(self, entry):
+        """ Returns True if an os.DirEntry is excluded. May raise OSError. """
+
+        if self.excluded(entry.name):
+            return True
+
+        if sys.platform == "win32":
+            return bool(entry.stat().st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+
+        return False
+
+    def excluded_path(self, path):
+        """ Returns True if a folder or any folder above it is excluded. May
+        raise OSError. """
+
+        for part in path.split(os.sep):
+            if part and self.excluded(part):
+                return True
+
+        if sys.platform == "win32":
+            return bool(os.stat(path).st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+
+        return False
+
+
+class FileInfoScanner:
+    """ Reads the metadata of shared files in a pool of worker processes,
+    while the caller keeps walking the directories.
+
+    Files are added one at a time along with a tag, and sent to the workers
+    in batches. function is called with a list of (name, pathname) tuples,
+    and must return a list of results in the same order. It has to be a
+    module level function, so that it can be pickled. add() and finish()
+    return (tag, result) tuples in the order the files were added. At most
+    a few batches per worker are in flight at once.
+
+    With a single worker, files are processed in the calling thread. """
+
+    BATCH_SIZE = 64
+
+    def __init__(self, function, workers=1):
+
+        self.function = function
+        self.executor = None
+        self.maxpending = 2 * workers
+
+        self._batch = []
+        self._pending = deque()
+
+        if workers <= 1:
+            return
+
+        kwargs = {}
+
+        if sys.version_info >= (3, 7):
+            # Forking a process running GTK and networking threads isn't
+            # safe, start fresh interpreters instead
+            kwargs["mp_context"] = multiprocessing.get_context("spawn")
+
+        try:
+            self.executor = ProcessPoolExecutor(workers, **kwargs)
+        except (OSError, ImportError, NotImplementedError) as error:
+            log.addwarning(_("Unable to start share scanner processes, scanning in a single process: %s") % error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def pending(self):
+        """ Number of files added that haven't been returned yet """
+
+        return len(self._batch) + sum(len(tags) for _future, (tags, _files) in self._pending)
+
+    def add(self, tag, name, pathname):
+
+        self._batch.append((tag, name, pathname))
+
+        if len(self._batch) < self.BATCH_SIZE:
+            return []
+
+        self._submit()
+        return self._collect(wait=False)
+
+    def finish(self):
+        """ Returns the results of all remaining files """
+
+        self._submit()
+        return self._collect(wait=True)
+
+    def close(self):
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _submit(self):
+
+        if not self._batch:
+            return
+
+        tags = [tag for tag, _name, _pathname in self._batch]
+        files = [(name, pathname) for _tag, name, pathname in self._batch]
+        self._batch = []
+
+        future = None
+
+        if self.executor is not None:
+            try:
+                future = self.executor.submit(self.function, files)
+            except RuntimeError as error:
+                # The pool broke, e.g. a worker crashed on a corrupt file
+                log.addwarning(_("Share scanner processes stopped, scanning in a single process: %s") % error)
+                self.close()
+
+        self._pending.append((future, (tags, files)))
+
+    def _collect(self, wait):
+
+        results = []
+
+        while self._pending:
+            future, (tags, files) = self._pending[0]
+
+            if future is not None and not future.done() and not wait and len(self._pending) <= self.maxpending:
+                break
+
+            self._pending.popleft()
+
+            if future is None:
+                batchresults = self.function(files)
+            else:
+                try:
+                    batchresults = future.result()
+                except Exception as error:
+                    log.addwarning(_("Share scanner process failed, scanning files again in a single process: %s") % error)
+                    self.close()
+                    batchresults = self.function(files)
+
+            results.extend(zip(tags, batchresults))
+
+        return results
+
+
+class FileInfoCache:
+    """ Metadata of scanned files, keyed by (st_dev, st_ino, st_size,
+    st_mtime_ns), so that rescans only read the tags of files that changed,
+    even when their folder or the whole share is scanned again.
+
+    Values are the (bitrateinfo, length) of a file. When pruning, only the
+    entries looked up or added since the cache was loaded are saved, which
+    drops files that are no longer shared. Scans that skip folders don't
+    look up their files, and have to keep the other entries. """
+
+    def __init__(self, filename=None):
+
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}
+        self._seen = {}
+
+    @staticmethod
+    def key(st):
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    @classmethod
+    def load(cls, filename):
+
+        cache = cls(filename)
+
+        try:
+            with open(filename, "rb") as f:
+                cache._entries = RestrictedUnpickler(f).load()
+
+        except FileNotFoundError:
+            pass
+
+        except Exception as error:
+            log.addwarning(_("Unable to load file metadata cache %(file)s, all files will be scanned: %(error)s") % {
+                'file': filename,
+                'error': error
+            })
+
+        return cache
+
+    def get(self, key):
+
+        value = self._entries.get(key)
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._seen[key] = value
+        return value
+
+    def add(self, key, value):
+        self._seen[key] = value
+
+    def save(self, prune=True):
+
+        if prune:
+            entries = self._seen
+        else:
+            entries = self._entries
+            entries.update(self._seen)
+
+        tmpfile = self.filename + ".new"
+
+        try:
+            with open(tmpfile, "wb") as f:
+                pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmpfile, self.filename)
+
+        except Exception as error:
+            log.addwarning(_("Unable to save file metadata cache %(file)s: %(error)s") % {
+                'file': self.filename,
+                'error': error
+            })
+            return
+
+        self._entries = entries
+        self._seen = {}
@@ -0,0 +1,449 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sqlite3
+import threading
+
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS folders (
+    share INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    numfiles INTEGER,
+    stream BLOB,
+    PRIMARY KEY (share, path)
+);
+CREATE TABLE IF NOT EXISTS files (
+    share INTEGER NOT NULL,
+    folder TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    bitrate INTEGER,
+    vbr INTEGER,
+    length INTEGER,
+    PRIMARY KEY (share, folder, position)
+);
+CREATE TABLE IF NOT EXISTS fileindex (
+    share INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    bitrate INTEGER,
+    vbr INTEGER,
+    length INTEGER,
+    PRIMARY KEY (share, id)
+);
+CREATE TABLE IF NOT EXISTS mtimes (
+    share INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL,
+    PRIMARY KEY (share, path)
+);
+"""
+
+
+def pack_fileinfo(fileinfo):
+    """ Splits a (name, size, bitrateinfo, length) tuple into columns """
+
+    name, size, bitrateinfo, length = fileinfo
+
+    if bitrateinfo is None:
+        return name, size, None, None, length
+
+    return name, size, bitrateinfo[0], bitrateinfo[1], length
+
+
+def unpack_fileinfo(row):
+
+    name, size, bitrate, vbr, length = row
+
+    if bitrate is None:
+        return name, size, None, length
+
+    return name, size, (bitrate, vbr), length
+
+
+class ShareStore:
+    """ Database of the normal and buddy shares, in a single SQLite file.
+
+    Each share has folder, file, file index and modification time tables.
+    Dict-like views of them stand in for the shelves older versions used,
+    see folder_files(), folder_streams(), file_index() and folder_mtimes().
+    Single writes are committed right away, and writes made in a
+    transaction() are committed together. The connection is shared by the
+    main thread and the share scanner, and only used by one at a time. """
+
+    NORMAL = 0
+    BUDDY = 1
+    VERSION = 1
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.lock = threading.RLock()
+
+        self._depth = 0
+        self._conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+
+        try:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+
+            self.created = not self._conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'metadata'").fetchone()[0]
+
+            with self.transaction():
+                for statement in SCHEMA.split(";"):
+                    if statement.strip():
+                        self._conn.execute(statement)
+
+                self._conn.execute("INSERT OR IGNORE INTO metadata VALUES ('version', ?)", (self.VERSION,))
+
+            version = self.get_metadata("version")
+
+            if version != self.VERSION:
+                raise sqlite3.DatabaseError("Unknown shares database version %s" % version)
+
+        except Exception:
+            self._conn.close()
+            raise
+
+    @contextmanager
+    def transaction(self):
+
+        with self.lock:
+            if not self._depth:
+                self._conn.execute("BEGIN")
+
+            self._depth += 1
+
+            try:
+                yield self._conn
+
+            except Exception:
+                self._depth -= 1
+
+                if not self._depth:
+                    self._conn.execute("ROLLBACK")
+
+                raise
+
+            self._depth -= 1
+
+            if not self._depth:
+                self._conn.execute("COMMIT")
+
+    def execute(self, sql, parameters=()):
+
+        with self.lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    def get_metadata(self, key):
+
+        rows = self.execute("SELECT value FROM metadata WHERE key = ?", (key,))
+
+        if not rows:
+            return None
+
+        return rows[0][0]
+
+    def folder_files(self, share):
+        return FolderFiles(self, share)
+
+    def folder_streams(self, share):
+        return FolderStreams(self, share)
+
+    def file_index(self, share):
+        return FileIndex(self, share)
+
+    def folder_mtimes(self, share):
+        return FolderMtimes(self, share)
+
+    def replace(self, share, files, streams, fileindex, mtimes):
+        """ Replaces the contents of a share after a rescan, in a single
+        transaction. fileindex is a list of file tuples, where the position
+        of a file is its index. """
+
+        with self.transaction() as conn:
+            for table in ("folders", "files", "fileindex", "mtimes"):
+                conn.execute("DELETE FROM %s WHERE share = ?" % table, (share,))
+
+            conn.executemany(
+                "INSERT INTO folders VALUES (?, ?, ?, NULL)",
+                ((share, folder, len(files[folder])) for folder in files))
+
+            conn.executemany(
+                "INSERT OR IGNORE INTO folders VALUES (?, ?, NULL, NULL)",
+                ((share, folder) for folder in streams))
+
+            conn.executemany(
+                "UPDATE folders SET stream = ? WHERE share = ? AND path = ?",
+                ((bytes(streams[folder]), share, folder) for folder in streams))
+
+            conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((share, folder, position) + pack_fileinfo(fileinfo)
+                 for folder in files for position, fileinfo in enumerate(files[folder])))
+
+            conn.executemany(
+                "INSERT INTO fileindex VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((share, index) + pack_fileinfo(fileinfo)
+                 for index, fileinfo in enumerate(fileindex) if fileinfo is not None))
+
+            conn.executemany(
+                "INSERT INTO mtimes VALUES (?, ?, ?)",
+                ((share, folder, mtimes[folder]) for folder in mtimes))
+
+    def clear(self):
+
+        with self.transaction() as conn:
+            for table in ("folders", "files", "fileindex", "mtimes"):
+                conn.execute("DELETE FROM %s" % table)
+
+    def close(self):
+
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ShareStoreMapping(MutableMapping):
+    """ Dict-like view of a table of a share in a ShareStore """
+
+    def __init__(self, store, share):
+
+        self.store = store
+        self.share = share
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [key for key, _value in self.items()]
+
+    def get(self, key, default=None):
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def close(self):
+        self.store.close()
+
+
+class FolderFiles(ShareStoreMapping):
+    """ Virtual folder: list of (name, size, bitrateinfo, length) tuples """
+
+    def __getitem__(self, folder):
+
+        with self.store.lock:
+            rows = self.store.execute(
+                "SELECT numfiles FROM folders WHERE share = ? AND path = ? AND numfiles IS NOT NULL", (self.share, folder))
+
+            if not rows:
+                raise KeyError(folder)
+
+            if not rows[0][0]:
+                return []
+
+            return [unpack_fileinfo(row) for row in self.store.execute(
+                "SELECT name, size, bitrate, vbr, length FROM files WHERE share = ? AND folder = ? ORDER BY position",
+                (self.share, folder))]
+
+    def __setitem__(self, folder, files):
+
+        with self.store.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO folders VALUES (?, ?, NULL, NULL)", (self.share, folder))
+            conn.execute("UPDATE folders SET numfiles = ? WHERE share = ? AND path = ?", (len(files), self.share, folder))
+            conn.execute("DELETE FROM files WHERE share = ? AND folder = ?", (self.share, folder))
+            conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((self.share, folder, position) + pack_fileinfo(fileinfo) for position, fileinfo in enumerate(files)))
+
+    def __delitem__(self, folder):
+
+        if folder not in self:
+            raise KeyError(folder)
+
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM files WHERE share = ? AND folder = ?", (self.share, folder))
+            conn.execute("UPDATE folders SET numfiles = NULL WHERE share = ? AND path = ?", (self.share, folder))
+            conn.execute(
+                "DELETE FROM folders WHERE share = ? AND path = ? AND stream IS NULL", (self.share, folder))
+
+    def __contains__(self, folder):
+        return bool(self.store.execute(
+            "SELECT 1 FROM folders WHERE share = ? AND path = ? AND numfiles IS NOT NULL", (self.share, folder)))
+
+    def __len__(self):
+        return self.store.execute(
+            "SELECT COUNT(*) FROM folders WHERE share = ? AND numfiles IS NOT NULL", (self.share,))[0][0]
+
+    def keys(self):
+        return [row[0] for row in self.store.execute(
+            "SELECT path FROM folders WHERE share = ? AND numfiles IS NOT NULL", (self.share,))]
+
+    def items(self):
+
+        folders = {folder: [] for folder in self.keys()}
+
+        for row in self.store.execute(
+                "SELECT folder, name, size, bitrate, vbr, length FROM files WHERE share = ? ORDER BY folder, position",
+                (self.share,)):
+            folders[row[0]].append(unpack_fileinfo(row[1:]))
+
+        return list(folders.items())
+
+
+class FolderStreams(ShareStoreMapping):
+    """ Virtual folder: packed file list, as sent in SharedFileList messages """
+
+    def __getitem__(self, folder):
+
+        rows = self.store.execute(
+            "SELECT stream FROM folders WHERE share = ? AND path = ? AND stream IS NOT NULL", (self.share, folder))
+
+        if not rows:
+            raise KeyError(folder)
+
+        return rows[0][0]
+
+    def __setitem__(self, folder, stream):
+
+        with self.store.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO folders VALUES (?, ?, NULL, NULL)", (self.share, folder))
+            conn.execute("UPDATE folders SET stream = ? WHERE share = ? AND path = ?", (bytes(stream), self.share, folder))
+
+    def __delitem__(self, folder):
+
+        if folder not in self:
+            raise KeyError(folder)
+
+        with self.store.transaction() as conn:
+            conn.execute("UPDATE folders SET stream = NULL WHERE share = ? AND path = ?", (self.share, folder))
+            conn.execute(
+                "DELETE FROM folders WHERE share = ? AND path = ? AND numfiles IS NULL", (self.share, folder))
+
+    def __contains__(self, folder):
+        return bool(self.store.execute(
+            "SELECT 1 FROM folders WHERE share = ? AND path = ? AND stream IS NOT NULL", (self.share, folder)))
+
+    def __len__(self):
+        return self.store.execute(
+            "SELECT COUNT(*) FROM folders WHERE share = ? AND stream IS NOT NULL", (self.share,))[0][0]
+
+    def items(self):
+        return self.store.execute(
+            "SELECT path, stream FROM folders WHERE share = ? AND stream IS NOT NULL", (self.share,))
+
+
+class FileIndex(ShareStoreMapping):
+    """ str(index): (virtual path, size, bitrateinfo, length) of a file, or
+    None if the file was removed. Removed files keep their index, so that
+    new files are numbered after the last one. """
+
+    def __getitem__(self, key):
+
+        rows = self.store.execute(
+            "SELECT path, size, bitrate, vbr, length FROM fileindex WHERE share = ? AND id = ?", (self.share, int(key)))
+
+        if not rows:
+            raise KeyError(key)
+
+        if not rows[0][0]:
+            # Removed file
+            return None
+
+        return unpack_fileinfo(rows[0])
+
+    def __setitem__(self, key, fileinfo):
+
+        if fileinfo is None:
+            self.store.execute(
+                "UPDATE fileindex SET path = '', size = NULL, bitrate = NULL, vbr = NULL, length = NULL "
+                "WHERE share = ? AND id = ?", (self.share, int(key)))
+            return
+
+        self.store.execute(
+            "INSERT OR REPLACE INTO fileindex VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.share, int(key)) + pack_fileinfo(fileinfo))
+
+    def __delitem__(self, key):
+        self.store.execute("DELETE FROM fileindex WHERE share = ? AND id = ?", (self.share, int(key)))
+
+    def __contains__(self, key):
+        return bool(self.store.execute("SELECT 1 FROM fileindex WHERE share = ? AND id = ?", (self.share, int(key))))
+
+    def __len__(self):
+        """ Number of indexes in use, including removed files. This is the
+        index of the next file added, use count() for the number of files. """
+
+        return self.store.execute(
+            "SELECT COALESCE(MAX(id) + 1, 0) FROM fileindex WHERE share = ?", (self.share,))[0][0]
+
+    def count(self):
+        """ Number of files in the index, without removed files """
+
+        return self.store.execute(
+            "SELECT COUNT(*) FROM fileindex WHERE share = ? AND path != ''", (self.share,))[0][0]
+
+    def items(self):
+        return [(str(row[0]), unpack_fileinfo(row[1:])) for row in self.store.execute(
+            "SELECT id, path, size, bitrate, vbr, length FROM fileindex WHERE share = ? AND path != '' ORDER BY id",
+            (self.share,))]
+
+
+class FolderMtimes(ShareStoreMapping):
+    """ Real folder path: modification time """
+
+    def __getitem__(self, folder):
+
+        rows = self.store.execute("SELECT mtime FROM mtimes WHERE share = ? AND path = ?", (self.share, folder))
+
+        if not rows:
+            raise KeyError(folder)
+
+        return rows[0][0]
+
+    def __setitem__(self, folder, mtime):
+        self.store.execute("INSERT OR REPLACE INTO mtimes VALUES (?, ?, ?)", (self.share, folder, mtime))
+
+    def __delitem__(self, folder):
+
+        if folder not in self:
+            raise KeyError(folder)
+
+        self.store.execute("DELETE FROM mtimes WHERE share = ? AND path = ?", (self.share, folder))
+
+    def __contains__(self, folder):
+        return bool(self.store.execute("SELECT 1 FROM mtimes WHERE share = ? AND path = ?", (self.share, folder)))
+
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(*) FROM mtimes WHERE share = ?", (self.share,))[0][0]
+
+    def items(self):
+        return self.store.execute("SELECT path, mtime FROM mtimes WHERE share = ?", (self.share,))
@@ -0,0 +1,393 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from gettext import gettext as _
+
+from pynicotine.logfacility import log
+
+# inotify(7) event masks
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def merge_changes(changes, newchanges):
+    """ Merges newchanges into changes. Both map folders to the set of
+    file names to read again, or None to read all files of the folder. """
+
+    for folder, names in newchanges.items():
+        if folder not in changes:
+            changes[folder] = None if names is None else set(names)
+
+        elif changes[folder] is not None:
+            if names is None:
+                changes[folder] = None
+            else:
+                changes[folder].update(names)
+
+
+class ShareWatcher(threading.Thread):
+    """ Watches shared folders for changes in a thread of its own.
+
+    Changes are reported to callback as a dict, mapping folders to the set
+    of file names created, modified, moved or deleted in them, or None if
+    any file of the folder may have changed. A folder that was removed is
+    reported as well, and callback has to find out it's gone. Changes are
+    held back until none arrived for delay seconds, but no longer than
+    maxdelay, so that copying or moving many files results in a single call.
+
+    If changes were lost, callback is called with None, and everything
+    should be scanned again. """
+
+    DELAY = 2.0
+    MAXDELAY = 30.0
+
+    def __init__(self, folders, callback, delay=DELAY, maxdelay=MAXDELAY):
+
+        threading.Thread.__init__(self, name="ShareWatcher")
+        self.daemon = True
+
+        self.folders = [os.path.normpath(folder) for folder in folders]
+        self.callback = callback
+        self.delay = delay
+        self.maxdelay = maxdelay
+
+        self.ready = threading.Event()
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+
+        pending = {}
+        firstchange = lastchange = 0
+
+        try:
+            self.start_watching()
+            self.ready.set()
+
+            while not self._stopped.is_set():
+                timeout = None
+
+                if pending:
+                    curtime = time.monotonic()
+                    timeout = max(0, min(lastchange + self.delay, firstchange + self.maxdelay) - curtime)
+
+                changes = self.read_changes(timeout)
+
+                if self._stopped.is_set():
+                    break
+
+                curtime = time.monotonic()
+
+                if changes is None:
+                    # Events were lost, there's no point in sending what we have
+                    pending = {}
+                    self.callback(None)
+                    continue
+
+                if changes:
+                    if not pending:
+                        firstchange = curtime
+
+                    lastchange = curtime
+                    merge_changes(pending, changes)
+
+                if pending and (curtime - lastchange >= self.delay or curtime - firstchange >= self.maxdelay):
+                    self.callback(pending)
+                    pending = {}
+
+        except Exception as error:
+            log.addwarning(_("Stopped watching shared folders for changes: %s") % error)
+
+        finally:
+            self.stop_watching()
+
+    def start_watching(self):
+        pass
+
+    def stop_watching(self):
+        pass
+
+    def read_changes(self, timeout):
+        """ Waits up to timeout seconds, or until stopped if timeout is None,
+        and returns the changes seen meanwhile. This watcher sees none. """
+
+        self._stopped.wait(timeout)
+        return {}
+
+
+class PollingShareWatcher(ShareWatcher):
+    """ Compares the modification times of all shared folders every interval
+    seconds. Folders change when files are added, removed or renamed in them,
+    but not when the contents of a file change, so modified files are only
+    noticed by a rescan. """
+
+    INTERVAL = 60.0
+
+    def __init__(self, folders, callback, interval=INTERVAL, **kwargs):
+
+        ShareWatcher.__init__(self, folders, callback, **kwargs)
+
+        self.interval = interval
+        self._mtimes = {}
+        self._nextpoll = 0
+
+    def start_watching(self):
+
+        self._mtimes = self.get_mtimes()
+        self._nextpoll = time.monotonic() + self.interval
+
+    def get_mtimes(self):
+
+        mtimes = {}
+        folders = list(self.folders)
+
+        while folders:
+            folder = folders.pop()
+
+            try:
+                mtimes[folder] = os.stat(folder).st_mtime_ns
+
+                for entry in os.scandir(folder):
+                    if entry.is_dir():
+                        folders.append(entry.path)
+
+            except OSError:
+                continue
+
+        return mtimes
+
+    def read_changes(self, timeout):
+
+        waittime = self._nextpoll - time.monotonic()
+
+        if timeout is not None and timeout < waittime:
+            self._stopped.wait(timeout)
+            return {}
+
+        if self._stopped.wait(max(0, waittime)):
+            return {}
+
+        self._nextpoll = time.monotonic() + self.interval
+
+        oldmtimes = self._mtimes
+        mtimes = self._mtimes = self.get_mtimes()
+        changes = {}
+
+        for folder, mtime in mtimes.items():
+            if oldmtimes.get(folder) != mtime:
+                changes[folder] = None
+
+        for folder in oldmtimes:
+            if folder not in mtimes:
+                changes[folder] = None
+
+        return changes
+
+
+class InotifyShareWatcher(ShareWatcher):
+    """ Watches shared folders with the inotify API of Linux. Every folder
+    below the shared ones needs a watch of its own, and there are only
+    /proc/sys/fs/inotify/max_user_watches of them. """
+
+    FILE_EVENTS = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    WATCH_MASK = FILE_EVENTS | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    _libc = None
+
+    def __init__(self, folders, callback, **kwargs):
+
+        ShareWatcher.__init__(self, folders, callback, **kwargs)
+
+        self._fd = None
+        self._paths = {}
+        self._full = False
+
+    @classmethod
+    def get_libc(cls):
+
+        if cls._libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+            cls._libc = libc
+
+        return cls._libc
+
+    @classmethod
+    def is_available(cls):
+
+        if not sys.platform.startswith("linux"):
+            return False
+
+        try:
+            libc = cls.get_libc()
+            return hasattr(libc, "inotify_init1") and hasattr(libc, "inotify_add_watch")
+
+        except OSError:
+            return False
+
+    def start_watching(self):
+
+        libc = self.get_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self._fd = fd
+
+        for folder in self.folders:
+            self.add_watches(folder)
+
+    def stop_watching(self):
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+        self._paths.clear()
+
+    def add_watches(self, folder, changes=None):
+        """ Watches a folder and the folders below it. If changes is given,
+        the folders are new and all their files are added to it. """
+
+        libc = self.get_libc()
+
+        for path, _dirs, _files in os.walk(folder, followlinks=True):
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK)
+
+            if wd < 0:
+                error = ctypes.get_errno()
+
+                if error == errno.ENOSPC and not self._full:
+                    self._full = True
+                    log.addwarning(_("Too many shared folders to watch for changes, increase the limit in /proc/sys/fs/inotify/max_user_watches and restart"))
+
+                continue
+
+            # Watching a folder again, e.g. after it was moved, reuses its watch
+            self._paths[wd] = path
+
+            if changes is not None:
+                changes[path] = None
+
+    def read_changes(self, timeout):
+
+        # Wake up every now and then to see if we were stopped
+        if timeout is None or timeout > 1:
+            timeout = 1
+
+        readable, _writable, _exceptional = select.select([self._fd], [], [], timeout)
+
+        if not readable:
+            return {}
+
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return {}
+
+        return self.parse_events(data)
+
+    def parse_events(self, data):
+
+        changes = {}
+        pos = 0
+
+        while pos < len(data):
+            wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b"\0"))
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                return None
+
+            path = self._paths.get(wd)
+
+            if path is None:
+                continue
+
+            if mask & IN_IGNORED:
+                # The folder was removed or moved away
+                del self._paths[wd]
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changes.setdefault(path, set())
+                continue
+
+            if mask & IN_ISDIR:
+                subfolder = os.path.join(path, name)
+
+                # Subfolders are looked up when the folder itself is updated
+                changes.setdefault(path, set())
+
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_watches(subfolder, changes)
+                else:
+                    changes[subfolder] = None
+
+                continue
+
+            if mask & self.FILE_EVENTS:
+                names = changes.setdefault(path, set())
+
+                if names is not None:
+                    names.add(name)
+
+        return changes
+
+
+def create_share_watcher(folders, callback, **kwargs):
+    """ Returns a watcher for the best method available on this system """
+
+    if InotifyShareWatcher.is_available():
+        return InotifyShareWatcher(folders, callback, **kwargs)
+
+    return PollingShareWatcher(folders, callback, **kwargs)
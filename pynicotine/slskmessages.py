@@ -43,6 +43,33 @@ def newId():
     return Id
 
 
+class MessageChunks:
+    """ Contents of a large message kept as a list of bytes chunks, which
+    are queued for sending as they are instead of being joined first.
+    Instances are never modified, so the same chunks can be sent to several
+    connections at once. """
+
+    __slots__ = ("chunks", "size")
+
+    def __init__(self, chunks=()):
+        self.chunks = tuple(chunk for chunk in chunks if chunk)
+        self.size = sum(len(chunk) for chunk in self.chunks)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __bytes__(self):
+        return b"".join(self.chunks)
+
+    def prepend(self, data):
+        """ Returns the chunks with data, e.g. a message header, in front """
+
+        return MessageChunks((data,) + self.chunks)
+
+
 class InternalMessage:
     pass
 
@@ -202,11 +229,126 @@ class DebugMessage(InternalMessage):
         self.debugLevel = debugLevel
 
 
+"""
+Codecs
+"""
+
+# Precompiled structs for the protocol's little-endian integer types
+UINT16 = struct.Struct("<H")
+INT32 = struct.Struct("<i")
+UINT32 = struct.Struct("<I")
+UINT64 = struct.Struct("<Q")
+
+UINT32_SIZE = UINT32.size
+UINT64_SIZE = UINT64.size
+
+# Header of a zlib stream at the default compression level, and its checksum
+ZLIB_HEADER = b"\x78\x9c"
+ZLIB_CHECKSUM = struct.Struct(">I")
+ADLER32_BASE = 65521
+
+
+def read_uint16(message, start=0):
+    """ Reads a little-endian unsigned short from message (bytes, bytearray
+    or memoryview) at offset start. Returns the offset of the next field
+    and the value. Like the rest of the readers, this raises struct.error
+    if the message is too short. """
+
+    return start + UINT16.size, UINT16.unpack_from(message, start)[0]
+
+
+def read_int32(message, start=0):
+    return start + UINT32_SIZE, INT32.unpack_from(message, start)[0]
+
+
+def read_uint32(message, start=0):
+    return start + UINT32_SIZE, UINT32.unpack_from(message, start)[0]
+
+
+def read_uint64(message, start=0):
+    """ Some clients send 32-bit file sizes at the end of a message, so fall
+    back to an unsigned int if there's no room for a long long """
+
+    try:
+        return start + UINT64_SIZE, UINT64.unpack_from(message, start)[0]
+    except struct.error:
+        return start + UINT32_SIZE, UINT32.unpack_from(message, start)[0]
+
+
+def read_string(message, start=0, rawbytes=False):
+    """ Reads a length-prefixed string, decoded as UTF-8 (or Latin-1 if that
+    fails) unless rawbytes is True """
+
+    try:
+        length = UINT32.unpack_from(message, start)[0]
+    except struct.error:
+        # Missing length bytes are treated as zeroes
+        length = UINT32.unpack(bytes(message[start:start + UINT32_SIZE]).ljust(UINT32_SIZE, b"\0"))[0]
+
+    start += UINT32_SIZE
+    end = start + length
+    string = bytes(message[start:end])
+
+    if rawbytes:
+        return end, string
+
+    try:
+        return end, string.decode("utf-8")
+    except UnicodeDecodeError:
+        return end, findBestEncoding(string, ['utf-8', 'iso-8859-1'])
+
+
+def compress_segment(data):
+    """ Compresses data into a segment that join_compressed() can place in
+    the middle of a zlib stream. Returns the raw deflate blocks, which end
+    with a full flush, along with the length and Adler-32 checksum of data. """
+
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+    return compressed, len(data), zlib.adler32(data)
+
+
+def adler32_combine(adler1, adler2, length2):
+    """ Returns the Adler-32 checksum of two concatenated pieces of data,
+    given the checksums of both and the length of the second one """
+
+    rem = length2 % ADLER32_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1 + (adler1 >> 16) + (adler2 >> 16) - rem) % ADLER32_BASE
+    sum1 = (sum1 + (adler2 & 0xffff) - 1) % ADLER32_BASE
+
+    return sum1 | (sum2 << 16)
+
+
+def join_compressed(header, segment, footer):
+    """ Returns a zlib stream of header, the data of a segment returned by
+    compress_segment() and footer, without compressing the segment again.
+    The deflate state is reset after header, so the segment doesn't refer
+    back to it. """
+
+    compressed, length, checksum = segment
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    stream = bytearray(ZLIB_HEADER)
+    stream.extend(compressor.compress(header))
+    stream.extend(compressor.flush(zlib.Z_FULL_FLUSH))
+    stream.extend(compressed)
+    stream.extend(compressor.compress(footer))
+    stream.extend(compressor.flush())
+
+    checksum = adler32_combine(zlib.adler32(header), checksum, length)
+    stream.extend(ZLIB_CHECKSUM.pack(zlib.adler32(footer, checksum)))
+
+    return bytes(stream)
+
+
 class SlskMessage:
     """ This is a parent class for all protocol messages. """
     def getObject(self, message, type, start=0, getintasshort=False, getsignedint=False, getunsignedlonglong=False, printerror=True, rawbytes=False):
         """ Returns object of specified type, extracted from message (which is
-        a binary array). start is an offset."""
+        a binary array). start is an offset. Message classes use the faster
+        read_* functions instead, this is kept for plugins."""
         intsize = struct.calcsize("<I")
         try:
             if type is int:
@@ -250,16 +392,16 @@ class SlskMessage:
         binary array."""
         if type(object) is int:
             if unsignedint:
-                return struct.pack("<I", object)
+                return UINT32.pack(object)
             elif unsignedlonglong:
-                return struct.pack("<Q", object)
+                return UINT64.pack(object)
             else:
-                return struct.pack("<i", object)
+                return INT32.pack(object)
         elif type(object) is bytes:
-            return struct.pack("<i", len(object)) + object
+            return INT32.pack(len(object)) + object
         elif type(object) is str:
             encoded = object.encode("utf-8", 'replace')
-            return struct.pack("<i", len(encoded)) + encoded
+            return INT32.pack(len(encoded)) + encoded
 
         log.addwarning(_("Warning: unknown object type %s") % type(object) + " " + "in message %(type)s" % {'type': self.__class__})
         return b""
@@ -337,11 +479,11 @@ class Login(ServerMessage):
     def parseNetworkMessage(self, message):
         pos, self.success = 1, message[0]
         if not self.success:
-            pos, self.reason = self.getObject(message, bytes, pos)
+            pos, self.reason = read_string(message, pos)
 
         else:
-            pos, self.banner = self.getObject(message, bytes, pos)
-        if len(message[pos:]) > 0:
+            pos, self.banner = read_string(message, pos)
+        if len(message) > pos:
             try:
                 pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
                 # Unknown number
@@ -349,8 +491,8 @@ class Login(ServerMessage):
                 log.addwarning("Error unpacking IP address: %s" % error)
             try:
                 # MD5 hexdigest of the password you sent
-                if len(message[pos:]) > 0:
-                    pos, self.checksum = self.getObject(message, bytes, pos)
+                if len(message) > pos:
+                    pos, self.checksum = read_string(message, pos)
                 # print self.checksum
             except Exception:
                 # Not an official client on the official server
@@ -382,9 +524,9 @@ class GetPeerAddress(ServerMessage):
         return self.packObject(self.user)
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
+        pos, self.user = read_string(message)
         pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-        pos, self.port = self.getObject(message, int, pos, 1)
+        pos, self.port = pos + 4, read_uint16(message, pos)[1]
 
 
 class AddUser(ServerMessage):
@@ -406,18 +548,18 @@ class AddUser(ServerMessage):
         return self.packObject(self.user)
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
+        pos, self.user = read_string(message)
         pos, self.userexists = pos + 1, message[pos]
-        if message[pos:]:
-            pos, self.status = self.getObject(message, int, pos)
-            pos, self.avgspeed = self.getObject(message, int, pos)
-            pos, self.downloadnum = self.getObject(message, int, pos, getunsignedlonglong=True)
+        if len(message) > pos:
+            pos, self.status = read_uint32(message, pos)
+            pos, self.avgspeed = read_uint32(message, pos)
+            pos, self.downloadnum = read_uint64(message, pos)
 
-            pos, self.files = self.getObject(message, int, pos)
-            pos, self.dirs = self.getObject(message, int, pos)
+            pos, self.files = read_uint32(message, pos)
+            pos, self.dirs = read_uint32(message, pos)
 
-            if message[pos:]:
-                pos, self.country = self.getObject(message, bytes, pos)
+            if len(message) > pos:
+                pos, self.country = read_string(message, pos)
 
 
 class RemoveUser(ServerMessage):
@@ -442,8 +584,8 @@ class GetUserStatus(ServerMessage):
         return self.packObject(self.user)
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.status = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.status = read_uint32(message, pos)
         # Exception handler is for Soulfind compatibility
         try:
             pos, self.privileged = pos + 1, message[pos]
@@ -462,9 +604,9 @@ class SayChatroom(ServerMessage):
         return self.packObject(self.room) + self.packObject(self.msg)
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, self.msg = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
+        pos, self.msg = read_string(message, pos)
 
 
 class JoinRoom(ServerMessage):
@@ -483,43 +625,41 @@ class JoinRoom(ServerMessage):
         return self.packObject(self.room)
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos1 = pos
-        pos, self.users = self.getUsers(message[pos:])
-        pos = pos1 + pos
+        pos, self.room = read_string(message)
+        pos, self.users = self.getUsers(message, pos)
 
-        if len(message[pos:]) > 0:
+        if len(message) > pos:
             self.private = True
-            pos, self.owner = self.getObject(message, bytes, pos)
-        if len(message[pos:]) > 0 and self.private:
-            pos, numops = self.getObject(message, int, pos)
+            pos, self.owner = read_string(message, pos)
+        if len(message) > pos and self.private:
+            pos, numops = read_uint32(message, pos)
             for i in range(numops):
-                pos, operator = self.getObject(message, bytes, pos)
+                pos, operator = read_string(message, pos)
                 self.operators.append(operator)
 
-    def getUsers(self, message):
-        pos, numusers = self.getObject(message, int)
+    def getUsers(self, message, pos=0):
+        pos, numusers = read_uint32(message, pos)
         users = []
         for i in range(numusers):
-            pos, username = self.getObject(message, bytes, pos)
+            pos, username = read_string(message, pos)
             users.append([username, None, None, None, None, None, None, None, None])
-        pos, statuslen = self.getObject(message, int, pos)
+        pos, statuslen = read_uint32(message, pos)
         for i in range(statuslen):
-            pos, users[i][1] = self.getObject(message, int, pos)
-        pos, statslen = self.getObject(message, int, pos)
+            pos, users[i][1] = read_uint32(message, pos)
+        pos, statslen = read_uint32(message, pos)
         for i in range(statslen):
-            pos, users[i][2] = self.getObject(message, int, pos, getsignedint=True)
-            pos, users[i][3] = self.getObject(message, int, pos)
-            pos, users[i][4] = self.getObject(message, int, pos)
-            pos, users[i][5] = self.getObject(message, int, pos)
-            pos, users[i][6] = self.getObject(message, int, pos)
-        pos, slotslen = self.getObject(message, int, pos)
+            pos, users[i][2] = read_int32(message, pos)
+            pos, users[i][3] = read_uint32(message, pos)
+            pos, users[i][4] = read_uint32(message, pos)
+            pos, users[i][5] = read_uint32(message, pos)
+            pos, users[i][6] = read_uint32(message, pos)
+        pos, slotslen = read_uint32(message, pos)
         for i in range(slotslen):
-            pos, users[i][7] = self.getObject(message, int, pos)
-        if len(message[pos:]) > 0:
-            pos, countrylen = self.getObject(message, int, pos)
+            pos, users[i][7] = read_uint32(message, pos)
+        if len(message) > pos:
+            pos, countrylen = read_uint32(message, pos)
             for i in range(countrylen):
-                pos, users[i][8] = self.getObject(message, bytes, pos)
+                pos, users[i][8] = read_string(message, pos)
 
         usersdict = {}
         for i in users:
@@ -538,22 +678,22 @@ class LeaveRoom(ServerMessage):
         return self.packObject(self.room)
 
     def parseNetworkMessage(self, message):
-        self.room = self.getObject(message, bytes)[1]
+        self.room = read_string(message)[1]
 
 
 class UserJoinedRoom(ServerMessage):
     """ Server code: 16 """
     """ The server tells us someone has just joined a room we're in. """
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.username = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.username = read_string(message, pos)
         i = [None, None, None, None, None, None, None, None]
-        pos, i[0] = self.getObject(message, int, pos)
-        pos, i[1] = self.getObject(message, int, pos, getsignedint=True)
+        pos, i[0] = read_uint32(message, pos)
+        pos, i[1] = read_int32(message, pos)
         for j in range(2, 7):
-            pos, i[j] = (self.getObject(message, int, pos))
-        if len(message[pos:]) > 0:
-            pos, i[7] = self.getObject(message, bytes, pos)
+            pos, i[j] = (read_uint32(message, pos))
+        if len(message) > pos:
+            pos, i[7] = read_string(message, pos)
         self.userdata = UserData(i)
 
 
@@ -561,8 +701,8 @@ class UserLeftRoom(ServerMessage):
     """ Server code: 17 """
     """ The server tells us someone has just left a room we're in. """
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.username = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.username = read_string(message, pos)
 
 
 class ConnectToPeer(ServerMessage):
@@ -586,13 +726,13 @@ class ConnectToPeer(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.type = self.getObject(message, bytes, pos)
+        pos, self.user = read_string(message)
+        pos, self.type = read_string(message, pos)
         pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-        pos, self.port = self.getObject(message, int, pos, 1)
-        pos, self.token = self.getObject(message, int, pos)
+        pos, self.port = pos + 4, read_uint16(message, pos)[1]
+        pos, self.token = read_uint32(message, pos)
 
-        if len(message[pos:]) > 0:
+        if len(message) > pos:
             pos, self.privileged = pos + 1, message[pos]
 
 
@@ -611,10 +751,10 @@ class MessageUser(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.msgid = self.getObject(message, int)
-        pos, self.timestamp = self.getObject(message, int, pos)
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, self.msg = self.getObject(message, bytes, pos)
+        pos, self.msgid = read_uint32(message)
+        pos, self.timestamp = read_uint32(message, pos)
+        pos, self.user = read_string(message, pos)
+        pos, self.msg = read_string(message, pos)
 
 
 class MessageAcked(ServerMessage):
@@ -651,9 +791,9 @@ class FileSearch(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.searchid = self.getObject(message, int, pos)
-        pos, self.searchterm = self.getObject(message, bytes, pos)
+        pos, self.user = read_string(message)
+        pos, self.searchid = read_uint32(message, pos)
+        pos, self.searchterm = read_string(message, pos)
 
 
 class SetStatus(ServerMessage):
@@ -729,11 +869,11 @@ class GetUserStats(ServerMessage):
         return self.packObject(self.user)
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.avgspeed = self.getObject(message, int, pos, getsignedint=True)
-        pos, self.downloadnum = self.getObject(message, int, pos, getunsignedlonglong=True)
-        pos, self.files = self.getObject(message, int, pos)
-        pos, self.dirs = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.avgspeed = read_int32(message, pos)
+        pos, self.downloadnum = read_uint64(message, pos)
+        pos, self.files = read_uint32(message, pos)
+        pos, self.dirs = read_uint32(message, pos)
 
 
 class QueuedDownloads(ServerMessage):
@@ -741,8 +881,8 @@ class QueuedDownloads(ServerMessage):
     """ The server sends this to indicate if someone has download slots available
     or not. DEPRECIATED """
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.slotsfull = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.slotsfull = read_uint32(message, pos)
 
 
 class Relogged(ServerMessage):
@@ -772,9 +912,9 @@ class UserSearch(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.searchid = self.getObject(message, int, pos)
-        pos, self.searchterm = self.getObject(message, bytes, pos)
+        pos, self.user = read_string(message)
+        pos, self.searchid = read_uint32(message, pos)
+        pos, self.searchterm = read_string(message, pos)
 
 
 class AddThingILike(ServerMessage):
@@ -814,19 +954,19 @@ class Recommendations(ServerMessage):
     def unpack_recommendations(self, message, pos=0):
         self.recommendations = {}
         self.unrecommendations = {}
-        pos, num = self.getObject(message, int, pos)
+        pos, num = read_uint32(message, pos)
         for i in range(num):
-            pos, key = self.getObject(message, bytes, pos)
-            pos, rating = self.getObject(message, int, pos, getsignedint=True)
+            pos, key = read_string(message, pos)
+            pos, rating = read_int32(message, pos)
             self.recommendations[key] = rating
 
-        if len(message[pos:]) == 0:
+        if len(message) <= pos:
             return
 
-        pos, num2 = self.getObject(message, int, pos)
+        pos, num2 = read_uint32(message, pos)
         for i in range(num2):
-            pos, key = self.getObject(message, bytes, pos)
-            pos, rating = self.getObject(message, int, pos, getsignedint=True)
+            pos, key = read_string(message, pos)
+            pos, rating = read_int32(message, pos)
             self.unrecommendations[key] = rating
 
 
@@ -852,17 +992,17 @@ class UserInterests(ServerMessage):
 
     def parseNetworkMessage(self, message, pos=0):
         # Receive a users' interests
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, likesnum = self.getObject(message, int, pos)
+        pos, self.user = read_string(message, pos)
+        pos, likesnum = read_uint32(message, pos)
         self.likes = []
         for i in range(likesnum):
-            pos, key = self.getObject(message, bytes, pos)
+            pos, key = read_string(message, pos)
             self.likes.append(key)
 
-        pos, hatesnum = self.getObject(message, int, pos)
+        pos, hatesnum = read_uint32(message, pos)
         self.hates = []
         for i in range(hatesnum):
-            pos, key = self.getObject(message, bytes, pos)
+            pos, key = read_string(message, pos)
             self.hates.append(key)
 
 
@@ -884,23 +1024,23 @@ class PlaceInLineResponse(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.req = self.getObject(message, int, pos)
-        pos, self.place = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.req = read_uint32(message, pos)
+        pos, self.place = read_uint32(message, pos)
 
 
 class RoomAdded(ServerMessage):
     """ Server code: 62 """
     """ The server tells us a new room has been added. """
     def parseNetworkMessage(self, message):
-        self.room = self.getObject(message, bytes)[1]
+        self.room = read_string(message)[1]
 
 
 class RoomRemoved(ServerMessage):
     """ Server code: 63 """
     """ The server tells us a room has been removed. """
     def parseNetworkMessage(self, message):
-        self.room = self.getObject(message, bytes)[1]
+        self.room = read_string(message)[1]
 
 
 class RoomList(ServerMessage):
@@ -912,32 +1052,32 @@ class RoomList(ServerMessage):
         return b""
 
     def parseNetworkMessage(self, message):
-        pos, numrooms = self.getObject(message, int)
+        pos, numrooms = read_uint32(message)
         self.rooms = []
         self.ownedprivaterooms = []
         self.otherprivaterooms = []
         for i in range(numrooms):
-            pos, room = self.getObject(message, bytes, pos)
+            pos, room = read_string(message, pos)
             self.rooms.append([room, None])
-        pos, numusercounts = self.getObject(message, int, pos)
+        pos, numusercounts = read_uint32(message, pos)
         for i in range(numusercounts):
-            pos, usercount = self.getObject(message, int, pos)
+            pos, usercount = read_uint32(message, pos)
             self.rooms[i][1] = usercount
-        if len(message[pos:]) == 0:
+        if len(message) <= pos:
             return
         (pos, self.ownedprivaterooms) = self._getRooms(pos, message)
         (pos, self.otherprivaterooms) = self._getRooms(pos, message)
 
     def _getRooms(self, originalpos, message):
         try:
-            pos, numberofrooms = self.getObject(message, int, originalpos)
+            pos, numberofrooms = read_uint32(message, originalpos)
             rooms = []
             for i in range(numberofrooms):
-                pos, room = self.getObject(message, bytes, pos)
+                pos, room = read_string(message, pos)
                 rooms.append([room, None])
-            pos, numberofusers = self.getObject(message, int, pos)
+            pos, numberofusers = read_uint32(message, pos)
             for i in range(numberofusers):
-                pos, usercount = self.getObject(message, int, pos)
+                pos, usercount = read_uint32(message, pos)
                 rooms[i][1] = usercount
             return (pos, rooms)
         except Exception as error:
@@ -950,19 +1090,19 @@ class ExactFileSearch(ServerMessage):
     """ Someone is searching for a file with an exact name. DEPRECIATED
     (no results even with official client) """
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.req = self.getObject(message, int, pos)
-        pos, self.file = self.getObject(message, bytes, pos)
-        pos, self.folder = self.getObject(message, bytes, pos)
-        pos, self.size = self.getObject(message, int, pos, getunsignedlonglong=True)
-        pos, self.checksum = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.req = read_uint32(message, pos)
+        pos, self.file = read_string(message, pos)
+        pos, self.folder = read_string(message, pos)
+        pos, self.size = read_uint64(message, pos)
+        pos, self.checksum = read_uint32(message, pos)
 
 
 class AdminMessage(ServerMessage):
     """ Server code: 66 """
     """ A global message from the server admin has arrived. """
     def parseNetworkMessage(self, message):
-        self.msg = self.getObject(message, bytes)[1]
+        self.msg = read_string(message)[1]
 
 
 class GlobalUserList(JoinRoom):
@@ -994,13 +1134,13 @@ class TunneledMessage(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.code = self.getObject(message, int, pos)
-        pos, self.req = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.code = read_uint32(message, pos)
+        pos, self.req = read_uint32(message, pos)
         pos, self.ip = pos + 4, socket.inet_ntoa(self.strrev(message[pos:pos + 4]))
-        pos, port = self.getObject(message, int, pos, 1)
+        pos, port = pos + 4, read_uint16(message, pos)[1]
         self.addr = (self.ip, port)
-        pos, self.msg = self.getObject(message, bytes, pos)
+        pos, self.msg = read_string(message, pos)
 
 
 class PrivilegedUsers(ServerMessage):
@@ -1014,9 +1154,9 @@ class PrivilegedUsers(ServerMessage):
         except Exception:
             pass
         self.users = []
-        pos, numusers = self.getObject(message, int)
+        pos, numusers = read_uint32(message)
         for i in range(numusers):
-            pos, user = self.getObject(message, bytes, pos)
+            pos, user = read_string(message, pos)
             self.users.append(user)
 
 
@@ -1046,42 +1186,42 @@ class ParentMinSpeed(ServerMessage):
     """ Server code: 83 """
     """ UNUSED """
     def parseNetworkMessage(self, message):
-        pos, self.num = self.getObject(message, int)
+        pos, self.num = read_uint32(message)
 
 
 class ParentSpeedRatio(ParentMinSpeed):
     """ Server code: 84 """
     """ UNUSED """
     def parseNetworkMessage(self, message):
-        pos, self.num = self.getObject(message, int)
+        pos, self.num = read_uint32(message)
 
 
 class ParentInactivityTimeout(ServerMessage):
     """ Server code: 86 """
     """ DEPRECIATED """
     def parseNetworkMessage(self, message):
-        pos, self.seconds = self.getObject(message, int)
+        pos, self.seconds = read_uint32(message)
 
 
 class SearchInactivityTimeout(ServerMessage):
     """ Server code: 87 """
     """ DEPRECIATED """
     def parseNetworkMessage(self, message):
-        pos, self.seconds = self.getObject(message, int)
+        pos, self.seconds = read_uint32(message)
 
 
 class MinParentsInCache(ServerMessage):
     """ Server code: 88 """
     """ DEPRECIATED """
     def parseNetworkMessage(self, message):
-        pos, self.num = self.getObject(message, int)
+        pos, self.num = read_uint32(message)
 
 
 class DistribAliveInterval(ServerMessage):
     """ Server code: 90 """
     """ DEPRECIATED """
     def parseNetworkMessage(self, message):
-        pos, self.seconds = self.getObject(message, int)
+        pos, self.seconds = read_uint32(message)
 
 
 class AddToPrivileged(ServerMessage):
@@ -1089,7 +1229,7 @@ class AddToPrivileged(ServerMessage):
     """ The server sends us the username of a new privileged user, which we
     add to our list of global privileged users. """
     def parseNetworkMessage(self, message):
-        l2, self.user = self.getObject(message, bytes)
+        l2, self.user = read_string(message)
 
 
 class CheckPrivileges(ServerMessage):
@@ -1100,7 +1240,7 @@ class CheckPrivileges(ServerMessage):
         return b""
 
     def parseNetworkMessage(self, message):
-        pos, self.seconds = self.getObject(message, int)
+        pos, self.seconds = read_uint32(message)
 
 
 class SearchRequest(ServerMessage):
@@ -1108,10 +1248,10 @@ class SearchRequest(ServerMessage):
     """ The server sends us search requests from other users. """
     def parseNetworkMessage(self, message):
         pos, self.code = 1, message[0]
-        pos, self.something = self.getObject(message, int, pos)
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, self.searchid = self.getObject(message, int, pos)
-        pos, self.searchterm = self.getObject(message, bytes, pos)
+        pos, self.something = read_uint32(message, pos)
+        pos, self.user = read_string(message, pos)
+        pos, self.searchid = read_uint32(message, pos)
+        pos, self.searchterm = read_string(message, pos)
 
 
 class AcceptChildren(ServerMessage):
@@ -1132,11 +1272,11 @@ class PossibleParents(ServerMessage):
     need more possible parents, through a HaveNoParent message. """
     def parseNetworkMessage(self, message: bytes):
         self.list = {}
-        pos, num = self.getObject(message, int)
+        pos, num = read_uint32(message)
         for i in range(num):
-            pos, username = self.getObject(message, bytes, pos)
+            pos, username = read_string(message, pos)
             pos, self.ip = pos + 4, socket.inet_ntoa(message[pos:pos + 4][::-1])
-            pos, port = self.getObject(message, int, pos)
+            pos, port = read_uint32(message, pos)
             self.list[username] = (self.ip, port)
 
 
@@ -1148,7 +1288,7 @@ class WishlistSearch(FileSearch):
 class WishlistInterval(ServerMessage):
     """ Server code: 104 """
     def parseNetworkMessage(self, message):
-        pos, self.seconds = self.getObject(message, int)
+        pos, self.seconds = read_uint32(message)
 
 
 class SimilarUsers(ServerMessage):
@@ -1162,10 +1302,10 @@ class SimilarUsers(ServerMessage):
 
     def parseNetworkMessage(self, message):
         self.users = {}
-        pos, num = self.getObject(message, int)
+        pos, num = read_uint32(message)
         for i in range(num):
-            pos, user = self.getObject(message, bytes, pos)
-            pos, rating = self.getObject(message, int, pos)
+            pos, user = read_string(message, pos)
+            pos, rating = read_uint32(message, pos)
             self.users[user] = rating
 
 
@@ -1182,7 +1322,7 @@ class ItemRecommendations(GlobalRecommendations):
         return self.packObject(self.thing)
 
     def parseNetworkMessage(self, message):
-        pos, self.thing = self.getObject(message, bytes)
+        pos, self.thing = read_string(message)
         self.unpack_recommendations(message, pos)
 
 
@@ -1199,10 +1339,10 @@ class ItemSimilarUsers(ServerMessage):
 
     def parseNetworkMessage(self, message):
         self.users = []
-        pos, self.thing = self.getObject(message, bytes)
-        pos, num = self.getObject(message, int, pos)
+        pos, self.thing = read_string(message)
+        pos, num = read_uint32(message, pos)
         for i in range(num):
-            pos, user = self.getObject(message, bytes, pos)
+            pos, user = read_string(message, pos)
             self.users.append(user)
 
 
@@ -1218,11 +1358,11 @@ class RoomTickerState(ServerMessage):
         self.msgs = {}
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, n = self.getObject(message, int, pos)
+        pos, self.room = read_string(message)
+        pos, n = read_uint32(message, pos)
         for i in range(n):
-            pos, user = self.getObject(message, bytes, pos)
-            pos, msg = self.getObject(message, bytes, pos)
+            pos, user = read_string(message, pos)
+            pos, msg = read_string(message, pos)
             self.msgs[user] = msg
 
 
@@ -1238,9 +1378,9 @@ class RoomTickerAdd(ServerMessage):
         self.msg = None
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, self.msg = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
+        pos, self.msg = read_string(message, pos)
 
 
 class RoomTickerRemove(ServerMessage):
@@ -1254,8 +1394,8 @@ class RoomTickerRemove(ServerMessage):
         self.room = room
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
 
 
 class RoomTickerSet(ServerMessage):
@@ -1305,9 +1445,9 @@ class RoomSearch(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.searchid = self.getObject(message, int, pos)
-        pos, self.searchterm = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.searchid = read_uint32(message, pos)
+        pos, self.searchterm = read_string(message, pos)
 
     def __repr__(self):
         return "RoomSearch(room=%s, requestid=%s, text=%s)" % (self.room, self.searchid, self.searchterm)
@@ -1335,7 +1475,7 @@ class UserPrivileged(ServerMessage):
         return self.packObject(self.user)
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes, 0)
+        pos, self.user = read_string(message, 0)
         pos, self.privileged = pos + 1, bool(message[pos])
 
 
@@ -1363,8 +1503,8 @@ class NotifyPrivileges(ServerMessage):
         self.user = user
 
     def parseNetworkMessage(self, message):
-        pos, self.token = self.getObject(message, int)
-        pos, self.user = self.getObject(message, bytes, pos)
+        pos, self.token = read_uint32(message)
+        pos, self.user = read_string(message, pos)
 
     def makeNetworkMessage(self):
         msg = bytearray()
@@ -1380,7 +1520,7 @@ class AckNotifyPrivileges(ServerMessage):
         self.token = token
 
     def parseNetworkMessage(self, message):
-        pos, self.token = self.getObject(message, int)
+        pos, self.token = read_uint32(message)
 
     def makeNetworkMessage(self):
         return self.packObject(self.token, unsignedint=True)
@@ -1390,7 +1530,7 @@ class BranchLevel(ServerMessage):
     """ Server code: 126 """
     """ TODO: implement fully """
     def parseNetworkMessage(self, message):
-        pos, self.value = self.getObject(message, int)
+        pos, self.value = read_uint32(message)
         # print message.__repr__()
 
 
@@ -1399,7 +1539,7 @@ class BranchRoot(ServerMessage):
     """ TODO: implement fully """
     def parseNetworkMessage(self, message):
         # pos, self.value = self.getObject(message, types.IntType)
-        pos, self.user = self.getObject(message, bytes)
+        pos, self.user = read_string(message)
         # print self.something, self.user
 
 
@@ -1407,7 +1547,7 @@ class ChildDepth(ServerMessage):
     """ Server code: 129 """
     """ TODO: implement fully """
     def parseNetworkMessage(self, message):
-        pos, self.value = self.getObject(message, int)
+        pos, self.value = read_uint32(message)
 
 
 class PrivateRoomUsers(ServerMessage):
@@ -1420,11 +1560,11 @@ class PrivateRoomUsers(ServerMessage):
         self.users = users
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.numusers = self.getObject(message, int, pos)
+        pos, self.room = read_string(message)
+        pos, self.numusers = read_uint32(message, pos)
         self.users = []
         for i in range(self.numusers):
-            pos, user = self.getObject(message, bytes, pos)
+            pos, user = read_string(message, pos)
             self.users.append(user)
 
 
@@ -1457,8 +1597,8 @@ class PrivateRoomAddUser(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
 
 
 class PrivateRoomRemoveUser(ServerMessage):
@@ -1476,8 +1616,8 @@ class PrivateRoomRemoveUser(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
 
 
 class PrivateRoomDismember(ServerMessage):
@@ -1510,7 +1650,7 @@ class PrivateRoomSomething(ServerMessage):
         return self.packObject(self.room)
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
+        pos, self.room = read_string(message)
         self.debug()
 
 
@@ -1521,7 +1661,7 @@ class PrivateRoomAdded(ServerMessage):
         self.room = room
 
     def parseNetworkMessage(self, message):
-        self.room = self.getObject(message, bytes)[1]
+        self.room = read_string(message)[1]
 
 
 class PrivateRoomRemoved(ServerMessage):
@@ -1531,7 +1671,7 @@ class PrivateRoomRemoved(ServerMessage):
         self.room = room
 
     def parseNetworkMessage(self, message):
-        self.room = self.getObject(message, bytes)[1]
+        self.room = read_string(message)[1]
 
 
 class PrivateRoomToggle(ServerMessage):
@@ -1560,7 +1700,7 @@ class ChangePassword(ServerMessage):
         return self.packObject(self.password)
 
     def parseNetworkMessage(self, message):
-        pos, self.password = self.getObject(message, bytes)
+        pos, self.password = read_string(message)
 
 
 class PrivateRoomAddOperator(ServerMessage):
@@ -1578,8 +1718,8 @@ class PrivateRoomAddOperator(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
 
 
 class PrivateRoomRemoveOperator(ServerMessage):
@@ -1597,8 +1737,8 @@ class PrivateRoomRemoveOperator(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
 
 
 class PrivateRoomOperatorAdded(ServerMessage):
@@ -1609,7 +1749,7 @@ class PrivateRoomOperatorAdded(ServerMessage):
         self.room = room
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
+        pos, self.room = read_string(message)
 
 
 class PrivateRoomOperatorRemoved(ServerMessage):
@@ -1623,7 +1763,7 @@ class PrivateRoomOperatorRemoved(ServerMessage):
         return self.packObject(self.room)
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
+        pos, self.room = read_string(message)
 
 
 class PrivateRoomOwned(ServerMessage):
@@ -1635,11 +1775,11 @@ class PrivateRoomOwned(ServerMessage):
         self.number = number
 
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.number = self.getObject(message, int, pos)
+        pos, self.room = read_string(message)
+        pos, self.number = read_uint32(message, pos)
         self.operators = []
         for i in range(self.number):
-            pos, user = self.getObject(message, bytes, pos)
+            pos, user = read_string(message, pos)
             self.operators.append(user)
 
 
@@ -1664,9 +1804,9 @@ class PublicRoomMessage(ServerMessage):
     """ The server sends this when a new message has been written in a public
     room (every single line written in every public room). """
     def parseNetworkMessage(self, message):
-        pos, self.room = self.getObject(message, bytes)
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, self.msg = self.getObject(message, bytes, pos)
+        pos, self.room = read_string(message)
+        pos, self.user = read_string(message, pos)
+        pos, self.msg = read_string(message, pos)
 
 
 class CantConnectToPeer(ServerMessage):
@@ -1687,7 +1827,7 @@ class CantConnectToPeer(ServerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.token = self.getObject(message, int)
+        pos, self.token = read_uint32(message)
 
 # These are probably leftovers, not sure what to do with them
 
@@ -1719,7 +1859,7 @@ class PierceFireWall(PeerMessage):
         return self.packObject(self.token, unsignedint=True)
 
     def parseNetworkMessage(self, message):
-        pos, self.token = self.getObject(message, int)
+        pos, self.token = read_uint32(message)
 
 
 class PeerInit(PeerMessage):
@@ -1742,9 +1882,9 @@ class PeerInit(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.user = self.getObject(message, bytes)
-        pos, self.type = self.getObject(message, bytes, pos)
-        pos, self.token = self.getObject(message, int, pos)
+        pos, self.user = read_string(message)
+        pos, self.type = read_string(message, pos)
+        pos, self.token = read_uint32(message, pos)
 
 
 class GetSharedFileList(PeerMessage):
@@ -1763,11 +1903,21 @@ class GetSharedFileList(PeerMessage):
 class SharedFileList(PeerMessage):
     """ Peer code: 5 """
     """ A peer responds with a list of shared files when we've sent
-    a GetSharedFileList. """
-    def __init__(self, conn, shares=None):
+    a GetSharedFileList. Large lists are parsed while they arrive (see
+    SharedFileListDecoder), and handed to the UI thread in several parts.
+    first and last tell which part of the list a message holds.
+
+    Our own list is compressed into MessageChunks of about CHUNK_SIZE bytes,
+    which responses to simultaneous browse requests share. """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, conn, shares=None, first=True, last=True):
         self.conn = conn
         self.list = shares
         self.built = None
+        self.first = first
+        self.last = last
 
     def parseNetworkMessage(self, message, nozlib=False):
         try:
@@ -1781,35 +1931,40 @@ class SharedFileList(PeerMessage):
 
     def _parseNetworkMessage(self, message):
         shares = []
-        pos, ndir = self.getObject(message, int)
+        pos, ndir = read_uint32(message)
         for i in range(ndir):
-            pos, directory = self.getObject(message, bytes, pos)
-            pos, nfiles = self.getObject(message, int, pos)
-            files = []
-            for j in range(nfiles):
-                pos, code = pos + 1, message[pos]
-                pos, name = self.getObject(message, bytes, pos)
-                pos, size = self.getObject(message, int, pos, getunsignedlonglong=True, printerror=False)
-                if message[pos - 1] == '\xff':
-                    # Buggy SLSK?
-                    # Some file sizes will be huge if unpacked as a signed
-                    # LongType, namely somewhere in the area of 17179869 Terabytes.
-                    # It would seem these files are indeed big, but in the Gigabyte range.
-                    # The following will undo the damage (and if we fuck up it
-                    # doesn't matter, it can never be worse than reporting 17
-                    # exabytes for a single file)
-                    size = struct.unpack("Q", '\xff' * struct.calcsize("Q"))[0] - size
-                pos, ext = self.getObject(message, bytes, pos, printerror=False)
-                pos, numattr = self.getObject(message, int, pos, printerror=False)
-                attrs = []
-                for k in range(numattr):
-                    pos, attrnum = self.getObject(message, int, pos, printerror=False)
-                    pos, attr = self.getObject(message, int, pos, printerror=False)
-                    attrs.append(attr)
-                files.append([code, name, size, ext, attrs])
-            shares.append((directory, files))
+            pos, directory = self.parseDirectory(message, pos)
+            shares.append(directory)
         self.list = shares
 
+    @staticmethod
+    def parseDirectory(message, pos):
+        pos, directory = read_string(message, pos)
+        pos, nfiles = read_uint32(message, pos)
+        files = []
+        for j in range(nfiles):
+            pos, code = pos + 1, message[pos]
+            pos, name = read_string(message, pos)
+            pos, size = read_uint64(message, pos)
+            if message[pos - 1] == '\xff':
+                # Buggy SLSK?
+                # Some file sizes will be huge if unpacked as a signed
+                # LongType, namely somewhere in the area of 17179869 Terabytes.
+                # It would seem these files are indeed big, but in the Gigabyte range.
+                # The following will undo the damage (and if we fuck up it
+                # doesn't matter, it can never be worse than reporting 17
+                # exabytes for a single file)
+                size = struct.unpack("Q", '\xff' * struct.calcsize("Q"))[0] - size
+            pos, ext = read_string(message, pos)
+            pos, numattr = read_uint32(message, pos)
+            attrs = []
+            for k in range(numattr):
+                pos, attrnum = read_uint32(message, pos)
+                pos, attr = read_uint32(message, pos)
+                attrs.append(attr)
+            files.append([code, name, size, ext, attrs])
+        return pos, (directory, files)
+
     def makeNetworkMessage(self, nozlib=0, rebuild=False):
         # Elaborate hack, to save CPU
         # Store packed message contents in self.built, and use
@@ -1817,26 +1972,137 @@ class SharedFileList(PeerMessage):
         if not rebuild and self.built is not None:
             return self.built
 
-        msg = bytearray()
-
         try:
-            msg.extend(self.packObject(len(self.list)))
+            header = self.packObject(len(self.list))
         except TypeError:
-            msg.extend(self.packObject(len(list(self.list))))
+            header = self.packObject(len(list(self.list)))
 
-        for key in self.list:
-            try:
+        if nozlib:
+            msg = bytearray(header)
+
+            # Databases fetch all streams at once faster than one by one
+            for key, stream in self.list.items():
                 msg.extend(self.packObject(key.replace(os.sep, "\\")))
-                msg.extend(self.list[key])
-            except KeyError:
-                pass
-        if not nozlib:
-            self.built = zlib.compress(msg)
-        else:
+                msg.extend(stream)
+
             self.built = msg
+            return self.built
+
+        # Compress one folder at a time, and keep the compressed data in
+        # chunks, so that the uncompressed list is never held in memory
+        compressor = zlib.compressobj()
+        chunks = []
+        pending = [compressor.compress(header)]
+        pendingsize = len(pending[0])
+
+        for key, stream in self.list.items():
+            for data in (self.packObject(key.replace(os.sep, "\\")), stream):
+                compressed = compressor.compress(data)
+
+                if not compressed:
+                    continue
+
+                pending.append(compressed)
+                pendingsize += len(compressed)
+
+                if pendingsize >= self.CHUNK_SIZE:
+                    chunks.append(b"".join(pending))
+                    pending = []
+                    pendingsize = 0
+
+        pending.append(compressor.flush())
+        chunks.append(b"".join(pending))
+
+        self.built = MessageChunks(chunks)
         return self.built
 
 
+class SharedFileListDecoder:
+    """ Decompresses and parses the payload of a SharedFileList message while
+    it arrives, instead of buffering and decompressing all of it first. Only
+    the compressed chunk being fed, and the decompressed data of the
+    directory being parsed are held in memory. """
+
+    INPUT_CHUNK_SIZE = 16 * 1024
+    DECOMPRESS_SIZE = 256 * 1024
+
+    def __init__(self, size):
+        self.size = size
+        self.received = 0
+        self.failed = False
+
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+        self._numdirs = None
+        self._numparsed = 0
+
+    @property
+    def done(self):
+        return self.received >= self.size
+
+    def feed(self, data):
+        """ Generator that yields (directory, files) tuples parsed from data,
+        the next chunk of compressed bytes """
+
+        self.received += len(data)
+
+        if self.failed:
+            return
+
+        try:
+            with memoryview(data) as view:
+                for offset in range(0, len(view), self.INPUT_CHUNK_SIZE):
+                    chunk = view[offset:offset + self.INPUT_CHUNK_SIZE]
+
+                    while chunk:
+                        decompressed = self._decompressor.decompress(chunk, self.DECOMPRESS_SIZE)
+                        chunk = self._decompressor.unconsumed_tail
+
+                        yield from self._parse(decompressed, final=False)
+
+            if self.done:
+                yield from self._parse(self._decompressor.flush(), final=True)
+
+        except (zlib.error, struct.error, IndexError) as error:
+            log.addwarning(_("Exception during parsing %(area)s: %(exception)s") % {'area': 'SharedFileList', 'exception': error})
+            self.failed = True
+
+    def _parse(self, data, final):
+
+        buf = self._buffer
+        buf += data
+        pos = 0
+
+        with memoryview(buf) as view:
+            if self._numdirs is None:
+                if len(buf) < 4 and not final:
+                    return
+
+                pos, self._numdirs = read_uint32(view)
+
+            while self._numparsed < self._numdirs:
+                try:
+                    newpos, directory = SharedFileList.parseDirectory(view, pos)
+                except (struct.error, IndexError):
+                    if final:
+                        raise
+                    break
+
+                if newpos > len(buf) and not final:
+                    # Truncated string, wait for the rest of the directory
+                    break
+
+                pos = newpos
+                self._numparsed += 1
+                yield directory
+
+        if self._numparsed >= self._numdirs:
+            # Ignore anything after the list of public directories
+            pos = len(buf)
+
+        del buf[:pos]
+
+
 class FileSearchRequest(PeerMessage):
     """ Peer code: 8 """
     """ We send this to the peer when we search for a file.
@@ -1855,15 +2121,17 @@ class FileSearchRequest(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.searchid = self.getObject(message, int)
-        pos, self.searchterm = self.getObject(message, bytes, pos)
+        pos, self.searchid = read_uint32(message)
+        pos, self.searchterm = read_string(message, pos)
 
 
 class FileSearchResult(PeerMessage):
     """ Peer code: 9 """
     """ The peer sends this when it has a file search match. The
-    token/ticket is taken from original FileSearchRequest message. """
-    def __init__(self, conn, user=None, geoip=None, token=None, shares=None, fileindex=None, freeulslots=None, ulspeed=None, inqueue=None, fifoqueue=None):
+    token/ticket is taken from original FileSearchRequest message.
+    filelist is the compressed list of files from packFileList(), if it
+    was cached from an earlier search. """
+    def __init__(self, conn, user=None, geoip=None, token=None, shares=None, fileindex=None, freeulslots=None, ulspeed=None, inqueue=None, fifoqueue=None, filelist=None):
         self.conn = conn
         self.user = user
         self.geoip = geoip
@@ -1874,6 +2142,7 @@ class FileSearchResult(PeerMessage):
         self.ulspeed = ulspeed
         self.inqueue = inqueue
         self.fifoqueue = fifoqueue
+        self.filelist = filelist
         self.pos = 0
 
     def parseNetworkMessage(self, message):
@@ -1885,42 +2154,42 @@ class FileSearchResult(PeerMessage):
             self.list = {}
 
     def _parseNetworkMessage(self, message):
-        self.pos, self.user = self.getObject(message, bytes)
-        self.pos, self.token = self.getObject(message, int, self.pos)
-        self.pos, nfiles = self.getObject(message, int, self.pos)
+        self.pos, self.user = read_string(message)
+        self.pos, self.token = read_uint32(message, self.pos)
+        self.pos, nfiles = read_uint32(message, self.pos)
         shares = []
         for i in range(nfiles):
             self.pos, code = self.pos + 1, message[self.pos]
-            self.pos, name = self.getObject(message, bytes, self.pos)
+            self.pos, name = read_string(message, self.pos)
             # suppressing errors with unpacking, can be caused by incorrect sizetype
-            self.pos, size = self.getObject(message, int, self.pos, getunsignedlonglong=True, printerror=False)
-            self.pos, ext = self.getObject(message, bytes, self.pos, printerror=False)
-            self.pos, numattr = self.getObject(message, int, self.pos, printerror=False)
+            self.pos, size = read_uint64(message, self.pos)
+            self.pos, ext = read_string(message, self.pos)
+            self.pos, numattr = read_uint32(message, self.pos)
             attrs = []
             if numattr:
                 for j in range(numattr):
-                    self.pos, attrnum = self.getObject(message, int, self.pos, printerror=False)
-                    self.pos, attr = self.getObject(message, int, self.pos, printerror=False)
+                    self.pos, attrnum = read_uint32(message, self.pos)
+                    self.pos, attr = read_uint32(message, self.pos)
                     attrs.append(attr)
             shares.append([code, name, size, ext, attrs])
         self.list = shares
         self.pos, self.freeulslots = self.pos + 1, message[self.pos]
-        self.pos, self.ulspeed = self.getObject(message, int, self.pos, getsignedint=True)
-        self.pos, self.inqueue = self.getObject(message, int, self.pos, getunsignedlonglong=True)
+        self.pos, self.ulspeed = read_int32(message, self.pos)
+        self.pos, self.inqueue = read_uint64(message, self.pos)
 
-    def makeNetworkMessage(self):
+    def packFileList(self):
         filelist = []
         for i in self.list:
             try:
-                filelist.append(self.fileindex[str(i)])
+                fileinfo = self.fileindex[str(i)]
             except Exception:
-                pass
+                continue
 
-        queuesize = self.inqueue[0]
+            # Files removed from the shares since the last rescan
+            if fileinfo is not None:
+                filelist.append(fileinfo)
 
         msg = bytearray()
-        msg.extend(self.packObject(self.user))
-        msg.extend(self.packObject(self.token, unsignedint=True))
         msg.extend(self.packObject(len(filelist), unsignedint=True))
 
         for fileinfo in filelist:
@@ -1944,11 +2213,24 @@ class FileSearchResult(PeerMessage):
                 msg.extend(self.packObject(2))
                 msg.extend(self.packObject(fileinfo[2][1]))
 
-        msg.extend(bytes([self.freeulslots]))
-        msg.extend(self.packObject(self.ulspeed, unsignedint=True))
-        msg.extend(self.packObject(queuesize, unsignedlonglong=True))
+        return compress_segment(msg)
 
-        return zlib.compress(msg)
+    def makeNetworkMessage(self):
+        if self.filelist is None:
+            self.filelist = self.packFileList()
+
+        queuesize = self.inqueue[0]
+
+        header = bytearray()
+        header.extend(self.packObject(self.user))
+        header.extend(self.packObject(self.token, unsignedint=True))
+
+        footer = bytearray()
+        footer.extend(bytes([self.freeulslots]))
+        footer.extend(self.packObject(self.ulspeed, unsignedint=True))
+        footer.extend(self.packObject(queuesize, unsignedlonglong=True))
+
+        return join_compressed(header, self.filelist, footer)
 
 
 class UserInfoRequest(PeerMessage):
@@ -1978,16 +2260,16 @@ class UserInfoReply(PeerMessage):
         self.uploadallowed = uploadallowed
 
     def parseNetworkMessage(self, message):
-        pos, self.descr = self.getObject(message, bytes)
+        pos, self.descr = read_string(message)
         pos, self.has_pic = pos + 1, message[pos]
         if self.has_pic:
-            pos, self.pic = self.getObject(message, bytes, pos, 0, 0, True, True)  # Raw bytes
-        pos, self.totalupl = self.getObject(message, int, pos)
-        pos, self.queuesize = self.getObject(message, int, pos)
+            pos, self.pic = read_string(message, pos, rawbytes=True)  # Raw bytes
+        pos, self.totalupl = read_uint32(message, pos)
+        pos, self.queuesize = read_uint32(message, pos)
         pos, self.slotsavail = pos + 1, message[pos]
 
-        if len(message[pos:]) >= 4:
-            pos, self.uploadallowed = self.getObject(message, int, pos)
+        if len(message) - pos >= 4:
+            pos, self.uploadallowed = read_uint32(message, pos)
 
     def makeNetworkMessage(self):
         msg = bytearray()
@@ -2023,10 +2305,10 @@ class PMessageUser(PeerMessage):
                 self.packObject(self.msg))
 
     def parseNetworkMessage(self, message):
-        pos, self.msgid = self.getObject(message, int)
-        pos, self.timestamp = self.getObject(message, int, pos)
-        pos, self.user = self.getObject(message, bytes, pos)
-        pos, self.msg = self.getObject(message, bytes, pos)
+        pos, self.msgid = read_uint32(message)
+        pos, self.timestamp = read_uint32(message, pos)
+        pos, self.user = read_string(message, pos)
+        pos, self.msg = read_string(message, pos)
 
 
 class FolderContentsRequest(PeerMessage):
@@ -2044,8 +2326,8 @@ class FolderContentsRequest(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.something = self.getObject(message, int)
-        pos, self.dir = self.getObject(message, bytes, pos)
+        pos, self.something = read_uint32(message)
+        pos, self.dir = read_string(message, pos)
 
 
 class FolderContentsResponse(PeerMessage):
@@ -2067,26 +2349,26 @@ class FolderContentsResponse(PeerMessage):
 
     def _parseNetworkMessage(self, message):
         shares = {}
-        pos, nfolders = self.getObject(message, int)
+        pos, nfolders = read_uint32(message)
         for h in range(nfolders):
-            pos, folder = self.getObject(message, bytes, pos)
+            pos, folder = read_string(message, pos)
             shares[folder] = {}
-            pos, ndir = self.getObject(message, int, pos)
+            pos, ndir = read_uint32(message, pos)
 
             for i in range(ndir):
-                pos, directory = self.getObject(message, bytes, pos)
-                pos, nfiles = self.getObject(message, int, pos)
+                pos, directory = read_string(message, pos)
+                pos, nfiles = read_uint32(message, pos)
                 shares[folder][directory] = []
                 for j in range(nfiles):
                     pos, code = pos + 1, message[pos]
-                    pos, name = self.getObject(message, bytes, pos, printerror=False)
-                    pos, size = self.getObject(message, int, pos, getunsignedlonglong=True, printerror=False)
-                    pos, ext = self.getObject(message, bytes, pos, printerror=False)
-                    pos, numattr = self.getObject(message, int, pos, printerror=False)
+                    pos, name = read_string(message, pos)
+                    pos, size = read_uint64(message, pos)
+                    pos, ext = read_string(message, pos)
+                    pos, numattr = read_uint32(message, pos)
                     attrs = []
                     for k in range(numattr):
-                        pos, attrnum = self.getObject(message, int, pos, printerror=False)
-                        pos, attr = self.getObject(message, int, pos, printerror=False)
+                        pos, attrnum = read_uint32(message, pos)
+                        pos, attr = read_uint32(message, pos)
                         attrs.append(attr)
                     shares[folder][directory].append([code, name, size, ext, attrs])
         self.list = shares
@@ -2145,11 +2427,11 @@ class TransferRequest(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.direction = self.getObject(message, int)
-        pos, self.req = self.getObject(message, int, pos)
-        pos, self.file = self.getObject(message, bytes, pos)
+        pos, self.direction = read_uint32(message)
+        pos, self.req = read_uint32(message, pos)
+        pos, self.file = read_string(message, pos)
         if self.direction == 1:
-            pos, self.filesize = self.getObject(message, int, pos, getunsignedlonglong=True)
+            pos, self.filesize = read_uint64(message, pos)
 
 
 class TransferResponse(PeerMessage):
@@ -2177,13 +2459,13 @@ class TransferResponse(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.req = self.getObject(message, int)
+        pos, self.req = read_uint32(message)
         pos, self.allowed = pos + 1, message[pos]
-        if message[pos:]:
+        if len(message) > pos:
             if self.allowed:
-                pos, self.filesize = self.getObject(message, int, pos, getunsignedlonglong=True)
+                pos, self.filesize = read_uint64(message, pos)
             else:
-                pos, self.reason = self.getObject(message, bytes, pos)
+                pos, self.reason = read_string(message, pos)
 
 
 class PlaceholdUpload(PeerMessage):
@@ -2197,7 +2479,7 @@ class PlaceholdUpload(PeerMessage):
         return self.packObject(self.file)
 
     def parseNetworkMessage(self, message):
-        pos, self.file = self.getObject(message, bytes)
+        pos, self.file = read_string(message)
 
 
 class QueueUpload(PlaceholdUpload):
@@ -2220,8 +2502,8 @@ class PlaceInQueue(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.filename = self.getObject(message, bytes)
-        pos, self.place = self.getObject(message, int, pos)
+        pos, self.filename = read_string(message)
+        pos, self.place = read_uint32(message, pos)
 
 
 class UploadFailed(PlaceholdUpload):
@@ -2244,8 +2526,8 @@ class QueueFailed(PeerMessage):
         return msg
 
     def parseNetworkMessage(self, message):
-        pos, self.file = self.getObject(message, bytes)
-        pos, self.reason = self.getObject(message, bytes, pos)
+        pos, self.file = read_string(message)
+        pos, self.reason = read_string(message, pos)
 
 
 class PlaceInQueueRequest(PlaceholdUpload):
@@ -2326,10 +2608,10 @@ class DistribSearch(DistribMessage):
             return False
 
     def _parseNetworkMessage(self, message):
-        pos, self.unknown = self.getObject(message, int, printerror=False)
-        pos, self.user = self.getObject(message, bytes, pos, printerror=False)
-        pos, self.searchid = self.getObject(message, int, pos, printerror=False)
-        pos, self.searchterm = self.getObject(message, bytes, pos, printerror=False)
+        pos, self.unknown = read_uint32(message)
+        pos, self.user = read_string(message, pos)
+        pos, self.searchid = read_uint32(message, pos)
+        pos, self.searchterm = read_string(message, pos)
 
 
 class DistribBranchLevel(DistribMessage):
@@ -2339,7 +2621,7 @@ class DistribBranchLevel(DistribMessage):
         self.conn = conn
 
     def parseNetworkMessage(self, message):
-        pos, self.value = self.getObject(message, int)
+        pos, self.value = read_uint32(message)
         # print message.__repr__()
 
 
@@ -2351,7 +2633,7 @@ class DistribBranchRoot(DistribMessage):
 
     def parseNetworkMessage(self, message):
         # pos, self.value = self.getObject(message, types.IntType)
-        pos, self.user = self.getObject(message, bytes)
+        pos, self.user = read_string(message)
         # print self.something, self.user
 
 
@@ -2362,7 +2644,7 @@ class DistribChildDepth(DistribMessage):
         self.conn = conn
 
     def parseNetworkMessage(self, message):
-        pos, self.value = self.getObject(message, int)
+        pos, self.value = read_uint32(message)
         # print self.something, self.user
 
 
@@ -2387,7 +2669,7 @@ class DistribServerSearch(DistribMessage):
             return False
 
     def _parseNetworkMessage(self, message):
-        pos, self.unknown = self.getObject(message, int, getunsignedlonglong=True, printerror=False)
-        pos, self.user = self.getObject(message, bytes, pos, printerror=False)
-        pos, self.searchid = self.getObject(message, int, pos, printerror=False)
-        pos, self.searchterm = self.getObject(message, bytes, pos, printerror=False)
+        pos, self.unknown = read_uint64(message)
+        pos, self.user = read_string(message, pos)
+        pos, self.searchid = read_uint32(message, pos)
+        pos, self.searchterm = read_string(message, pos)
@@ -22,14 +22,17 @@
 This module implements Soulseek networking protocol.
 """
 
-import select
+import errno
+import io
+import os
+import queue
 import selectors
 import socket
 import struct
 import sys
 import threading
 import time
-from collections import defaultdict
+from collections import deque
 from errno import EINTR
 from gettext import gettext as _
 
@@ -85,6 +88,7 @@ from pynicotine.slskmessages import LeavePublicRoom
 from pynicotine.slskmessages import LeaveRoom
 from pynicotine.slskmessages import Login
 from pynicotine.slskmessages import MessageAcked
+from pynicotine.slskmessages import MessageChunks
 from pynicotine.slskmessages import MessageUser
 from pynicotine.slskmessages import MinParentsInCache
 from pynicotine.slskmessages import PossibleParents
@@ -151,6 +155,7 @@ from pynicotine.slskmessages import SetStatus
 from pynicotine.slskmessages import SetUploadLimit
 from pynicotine.slskmessages import SetWaitPort
 from pynicotine.slskmessages import SharedFileList
+from pynicotine.slskmessages import SharedFileListDecoder
 from pynicotine.slskmessages import SharedFoldersFiles
 from pynicotine.slskmessages import SimilarUsers
 from pynicotine.slskmessages import TransferRequest
@@ -196,6 +201,152 @@ else:
     # and bump this limit
     MAXFILELIMIT = min(max(int(hardlimit * 0.75), 50), 1024)
 
+# sendfile() errors that mean the file or socket can't be used with it,
+# in which case uploads fall back to reading file data into the output buffer
+SENDFILE_UNSUPPORTED_ERRORS = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP)
+
+
+class ConnectionBuffer:
+    """
+    Growable byte buffer used for connection input and output. New data
+    is appended to the end of a bytearray, and consumed data is skipped by
+    advancing a read cursor, so neither operation copies the unread data.
+    The consumed part of the bytearray is dropped once it makes up at least
+    half of the buffer.
+
+    Output buffers can also queue MessageChunks, which are kept as they are
+    after the bytearray. Data added while chunks are queued is queued after
+    them, to keep everything in order.
+    """
+
+    __slots__ = ("_data", "_start", "_chunks", "_chunkstart", "_chunksize")
+
+    COMPACT_THRESHOLD = 64 * 1024
+
+    def __init__(self, data=b""):
+        self._data = bytearray(data)
+        self._start = 0
+
+        self._chunks = deque()
+        self._chunkstart = 0
+        self._chunksize = 0
+
+    def __len__(self):
+        return len(self._data) - self._start + self._chunksize
+
+    def __getitem__(self, key):
+        """ Indexing returns an int and slicing returns a bytes copy,
+        relative to the read cursor. """
+
+        if self._chunks:
+            # Rarely needed, join everything instead of looking up chunks
+            data = bytes(self._data[self._start:]) + b"".join(self._chunks)[self._chunkstart:]
+            return data[key]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+
+            if step != 1:
+                raise ValueError("ConnectionBuffer does not support extended slices")
+
+            if stop <= start:
+                return b""
+
+            with memoryview(self._data) as view:
+                return bytes(view[self._start + start:self._start + stop])
+
+        if key < 0:
+            key += len(self)
+
+        if not 0 <= key < len(self):
+            raise IndexError("buffer index out of range")
+
+        return self._data[self._start + key]
+
+    def __iadd__(self, data):
+        self.extend(data)
+        return self
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self[:])
+
+    def extend(self, data):
+
+        if isinstance(data, MessageChunks):
+            self._chunks.extend(data)
+            self._chunksize += len(data)
+
+        elif self._chunks:
+            self._chunks.append(bytes(data))
+            self._chunksize += len(data)
+
+        else:
+            self._data += data
+
+    def consume(self, size):
+        """ Drops size bytes from the start of the buffer """
+
+        buffered = len(self._data) - self._start
+
+        if size < buffered:
+            self._start += size
+
+            if self._start >= self.COMPACT_THRESHOLD and self._start * 2 >= len(self._data):
+                del self._data[:self._start]
+                self._start = 0
+
+            return
+
+        del self._data[:]
+        self._start = 0
+        size -= buffered
+
+        chunks = self._chunks
+
+        while size > 0 and chunks:
+            remaining = len(chunks[0]) - self._chunkstart
+
+            if size < remaining:
+                self._chunkstart += size
+                self._chunksize -= size
+                return
+
+            chunks.popleft()
+            self._chunkstart = 0
+            self._chunksize -= remaining
+            size -= remaining
+
+    def clear(self):
+        del self._data[:]
+        self._start = 0
+
+        self._chunks.clear()
+        self._chunkstart = 0
+        self._chunksize = 0
+
+    def view(self, size=None):
+        """ Returns a memoryview of the first size bytes (all unread bytes
+        if size is None). If chunks are queued, the view ends at the end of
+        the bytearray or chunk it starts in. Release it before the buffer is
+        modified again, preferably by using it as a context manager. """
+
+        if self._start == len(self._data) and self._chunks:
+            data = self._chunks[0]
+            start = self._chunkstart
+        else:
+            data = self._data
+            start = self._start
+
+        end = len(data)
+
+        if size is not None:
+            end = min(start + size, end)
+
+        return memoryview(data)[start:end]
+
+    def unpack_from(self, fmt, offset=0):
+        return struct.unpack_from(fmt, self._data, self._start + offset)
+
 
 class Connection:
     """
@@ -210,8 +361,8 @@ class Connection:
             raise ValueError('obuf is of type {}: {}'.format(type(obuf).__name__, ibuf))
         self.conn = conn
         self.addr = addr
-        self.ibuf = ibuf  # type: bytes
-        self.obuf = obuf  # type: bytes
+        self.ibuf = ConnectionBuffer(ibuf)
+        self.obuf = ConnectionBuffer(obuf)
         self.init = None
         self.lastreadlength = 100 * 1024
 
@@ -236,10 +387,10 @@ class PeerConnection(Connection):
         self.init = init
         self.piercefw = None
         self.lastactive = time.time()
+        self.filelist = None
+        self.filelistparts = 0
 
-        self.starttime = None  # Used for upload bandwidth management
-        self.sentbytes2 = 0
-        self.readbytes2 = 0
+        self.usesendfile = hasattr(os, "sendfile")
 
 
 class PeerConnectionInProgress:
@@ -253,6 +404,224 @@ class PeerConnectionInProgress:
         self.lastactive = time.time()
 
 
+class TokenBucket:
+    """ Token bucket used for bandwidth limiting. Tokens (bytes) are added
+    at rate bytes per second, up to capacity. A rate of 0 means unlimited. """
+
+    BURST_TIME = 0.5
+    MIN_CAPACITY = 1024
+
+    __slots__ = ("rate", "capacity", "tokens", "lastupdate", "_clock")
+
+    def __init__(self, rate, clock):
+        self._clock = clock
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0
+        self.lastupdate = clock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+        self.capacity = max(int(rate * self.BURST_TIME), self.MIN_CAPACITY)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _refill(self):
+        curtime = self._clock()
+        elapsed = curtime - self.lastupdate
+        self.lastupdate = curtime
+
+        if elapsed > 0:
+            self.tokens = min(self.tokens + elapsed * self.rate, self.capacity)
+
+    def available(self):
+        self._refill()
+        return int(self.tokens)
+
+    def consume(self, amount):
+        self.tokens = max(self.tokens - amount, 0)
+
+    def delay(self, amount):
+        """ Returns the number of seconds until amount tokens are available """
+
+        self._refill()
+
+        if self.tokens >= amount:
+            return 0
+
+        return (amount - self.tokens) / self.rate
+
+
+class BandwidthScheduler:
+    """ Hands out send or receive allowances to transfer connections.
+
+    Every transfer has its own token bucket. With a per-transfer limit, it is
+    refilled at the full limit. With a total limit, it is refilled at an equal
+    share of the limit, and a global token bucket caps the sum. Transfers that
+    have used up their own share may borrow from the global bucket once it
+    fills up, i.e. when other transfers don't use their share. Every call is
+    O(1) per transfer. """
+
+    MIN_ALLOWANCE = 1024
+    BORROW_RESERVE = 0.75
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._rate = 0
+        self._pertransfer = False
+        self._bucket = TokenBucket(0, clock)
+        self._transfers = {}
+
+    def set_limit(self, rate, pertransfer=False):
+        """ Sets the limit in bytes per second. A rate of 0 removes the limit. """
+
+        self._rate = rate
+        self._pertransfer = pertransfer
+        self._bucket.set_rate(rate)
+
+    def add_transfer(self, key):
+        self._transfers[key] = TokenBucket(0, self._clock)
+
+    def remove_transfer(self, key):
+        self._transfers.pop(key, None)
+
+    def _get_bucket(self, key):
+        bucket = self._transfers[key]
+
+        if self._pertransfer:
+            rate = self._rate
+        else:
+            rate = self._rate / len(self._transfers)
+
+        if bucket.rate != rate:
+            bucket.set_rate(rate)
+
+        return bucket
+
+    def allowance(self, key):
+        """ Returns the number of bytes a transfer may send or receive now,
+        or None if there is no limit """
+
+        if self._rate <= 0 or key not in self._transfers:
+            return None
+
+        bucket = self._get_bucket(key)
+        available = bucket.available()
+
+        if not self._pertransfer:
+            shared = self._bucket.available()
+
+            if available >= self.MIN_ALLOWANCE:
+                available = min(available, shared)
+            else:
+                # Borrow bandwidth other transfers don't use
+                available = min(shared - int(self._bucket.capacity * self.BORROW_RESERVE), bucket.capacity)
+
+        if available < self.MIN_ALLOWANCE:
+            return 0
+
+        return available
+
+    def consume(self, key, amount):
+        if self._rate <= 0 or key not in self._transfers:
+            return
+
+        self._get_bucket(key).consume(amount)
+
+        if not self._pertransfer:
+            self._bucket.consume(amount)
+
+    def delay(self, key):
+        """ Returns the number of seconds until a throttled transfer should
+        be given a new allowance """
+
+        if self._rate <= 0 or key not in self._transfers:
+            return 0
+
+        bucket = self._get_bucket(key)
+        delay = bucket.delay(max(bucket.capacity // 4, self.MIN_ALLOWANCE))
+
+        if self._pertransfer:
+            return delay
+
+        # Whichever comes first: our own share refilling, or enough unused bandwidth to borrow
+        return min(
+            max(delay, self._bucket.delay(self.MIN_ALLOWANCE)),
+            self._bucket.delay(int(self._bucket.capacity * self.BORROW_RESERVE) + self.MIN_ALLOWANCE)
+        )
+
+
+class WakeupQueue(queue.Queue):
+    """ A Queue that can be waited on with select(). Putting a message makes
+    the queue readable until clear_wakeup() is called, so the networking
+    thread wakes up as soon as the UI thread queues something for it.
+
+    An eventfd is used where available, and a socket pair otherwise. """
+
+    def __init__(self, maxsize=0):
+        queue.Queue.__init__(self, maxsize)
+
+        self._signalled = False
+
+        if hasattr(os, "eventfd"):
+            self._eventfd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self._reader = self._writer = None
+        else:
+            self._eventfd = None
+            self._reader, self._writer = socket.socketpair()
+            self._reader.setblocking(False)
+            self._writer.setblocking(False)
+
+    def fileno(self):
+        if self._eventfd is not None:
+            return self._eventfd
+        return self._reader.fileno()
+
+    def _put(self, item):
+        # Called by put() with the queue mutex held
+        queue.Queue._put(self, item)
+
+        if self._signalled:
+            return
+
+        self._signalled = True
+
+        try:
+            if self._eventfd is not None:
+                os.eventfd_write(self._eventfd, 1)
+            else:
+                self._writer.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            # Already readable
+            pass
+
+    def clear_wakeup(self):
+        """ Called by the consumer before it drains the queue """
+
+        with self.mutex:
+            if not self._signalled:
+                return
+
+            self._signalled = False
+
+            try:
+                if self._eventfd is not None:
+                    os.eventfd_read(self._eventfd)
+                else:
+                    while self._reader.recv(4096):
+                        pass
+            except (BlockingIOError, InterruptedError):
+                pass
+
+    def close(self):
+        if self._eventfd is not None:
+            os.close(self._eventfd)
+        else:
+            self._reader.close()
+            self._writer.close()
+
+
 class SlskProtoThread(threading.Thread):
     """ This is a networking thread that actually does all the communication.
     It sends data to the UI thread via a callback function and receives data
@@ -392,6 +761,9 @@ class SlskProtoThread(threading.Thread):
     # - With Windows, based on #473, it would seem these connections are never removed
     CONNECTION_MAX_IDLE = 60
     CONNCOUNT_UI_INTERVAL = 0.5
+    SELECT_TIMEOUT = 0.5
+    IDLE_CHECK_INTERVAL = 1
+    FILELIST_PART_SIZE = 500
 
     def __init__(self, ui_callback, queue, bindip, port, config, eventprocessor):
         """ ui_callback is a UI callback function to be called with messages
@@ -417,11 +789,15 @@ class SlskProtoThread(threading.Thread):
         self._p.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._conns = {}
         self._connsinprogress = {}
-        self._uploadlimit = (self._calcLimitNone, 0)
-        self._downloadlimit = (self._calcDLimitByTotal, self._config.sections["transfers"]["downloadlimit"])
-        self._limits = {}
-        self._dlimits = {}
+        self.selector = selectors.DefaultSelector()
+        self._pending_input = set()
+        self._read_throttled = set()
+        self._write_throttled = set()
+        self._upload_scheduler = BandwidthScheduler()
+        self._download_scheduler = BandwidthScheduler()
+        self._download_scheduler.set_limit(self._config.sections["transfers"]["downloadlimit"] * 1024)
         self.last_conncount_ui_update = time.time()
+        self.last_idle_check = time.time()
         # GeoIP Config
         self._geoip = None
         # GeoIP Database
@@ -460,82 +836,156 @@ class SlskProtoThread(threading.Thread):
     def _isDownload(self, conn):
         return conn.__class__ is PeerConnection and conn.filedown is not None
 
-    def _calcUploadSpeed(self, i):
-        curtime = time.time()
-        if i.starttime is None:
-            i.starttime = curtime
-        elapsed = curtime - i.starttime
-        if elapsed == 0:
-            return 0
-        else:
-            return i.sentbytes2 / elapsed
-
-    def _calcLimitByTransfer(self, conns, i):
-        max = self._uploadlimit[1] * 1024.0
-        limit = max - self._calcUploadSpeed(i) + 1024
-        if limit < 1024.0:
-            return int(0)
-        return int(limit)
-
-    def _calcLimitByTotal(self, conns, i):
-        max = self._uploadlimit[1] * 1024.0
-        bw = 0.0
-        for j in list(conns.values()):
-            if self._isUpload(j):
-                bw += self._calcUploadSpeed(j)
-        limit = max - bw + 1024
-        if limit < 1024.0:
-            return int(0)
-        return int(limit)
-
-    def _calcDownloadSpeed(self, i):
-        curtime = time.time()
-        if i.starttime is None:
-            i.starttime = curtime
-        elapsed = curtime - i.starttime
-        if elapsed == 0:
-            return 0
-        else:
-            return i.readbytes2 / elapsed
-
-    def _calcDLimitByTotal(self, conns, i):
-        max = self._downloadlimit[1] * 1024.0
-        bw = 0.0
-        for j in conns:
-            if self._isDownload(j):
-                bw += self._calcDownloadSpeed(j)
-        limit = max - bw + 1023
-        if limit < 1024.0:
-            return int(0)
-        return int(limit)
-
-    def _calcLimitNone(self, conns, i):
-        return None
-
-    def select(self, input_list, output_list, selector):
-        # Select Networking Input and Output sockets
-        timeout = 0.5
+    def _register_socket(self, sock, events):
+        """ Adds a socket to the long-lived selector. Each socket is only
+        registered once, when it enters _conns or _connsinprogress. """
 
         try:
-            if sys.platform == "win32":
-                input, output, exc = multiselect(input_list, output_list, [], timeout)
-            else:
-                event_masks = defaultdict(int)
-
-                for fileobj in input_list:
-                    event_masks[fileobj] |= selectors.EVENT_READ
-                for fileobj in output_list:
-                    event_masks[fileobj] |= selectors.EVENT_WRITE
+            self.selector.register(sock, events)
 
-                for fileobj, event_masks in event_masks.items():
-                    selector.register(fileobj, event_masks)
+        except KeyError:
+            # A socket that was closed without being unregistered still holds this file descriptor
+            self.selector.unregister(sock)
+            self.selector.register(sock, events)
 
-                key_events = selector.select(timeout)
-                input = [key.fileobj for key, event in key_events if event & selectors.EVENT_READ]
-                output = [key.fileobj for key, event in key_events if event & selectors.EVENT_WRITE]
-        except Exception:
+        except (OSError, ValueError):
             # The selector chosen by the selectors module didn't work? Fall back to the select() syscall
-            input, output, exc = select.select(input_list, output_list, [], timeout)
+            self._fallback_selector()
+            self.selector.register(sock, events)
+
+    def _unregister_socket(self, sock):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _fallback_selector(self):
+        if isinstance(self.selector, selectors.SelectSelector):
+            return
+
+        selector = selectors.SelectSelector()
+
+        for key in self.selector.get_map().values():
+            selector.register(key.fileobj, key.events)
+
+        self.selector.close()
+        self.selector = selector
+
+    def _wants_write(self, sock, conn):
+        """ Returns True if a connection has pending output, i.e. a non-empty
+        output buffer or an active upload with more file data to send. """
+
+        if len(conn.obuf) > 0:
+            return True
+
+        if sock is self._server_socket or conn.__class__ is not PeerConnection:
+            return False
+
+        fileupl = conn.fileupl
+        return fileupl is not None and fileupl.offset is not None and fileupl.offset + fileupl.sentbytes < fileupl.size
+
+    def _update_interest(self, sock):
+        """ Toggles read and write interest for a socket. Only touches the
+        selector when the output buffer goes empty <-> non-empty, or when a
+        transfer is throttled by a bandwidth limit. """
+
+        conn = self._conns.get(sock)
+
+        if conn is None:
+            return
+
+        events = 0
+
+        if sock not in self._read_throttled:
+            events |= selectors.EVENT_READ
+
+        if sock not in self._write_throttled and self._wants_write(sock, conn):
+            events |= selectors.EVENT_WRITE
+
+        try:
+            key = self.selector.get_key(sock)
+        except (KeyError, ValueError):
+            key = None
+
+        if key is None:
+            if events:
+                self._register_socket(sock, events)
+
+        elif not events:
+            self._unregister_socket(sock)
+
+        elif key.events != events:
+            self.selector.modify(sock, events)
+
+    def _add_connection(self, sock, conn):
+        self._conns[sock] = conn
+        self._register_socket(sock, selectors.EVENT_READ)
+
+    def _remove_connection(self, sock):
+        self._unregister_socket(sock)
+        self._pending_input.discard(sock)
+        self._read_throttled.discard(sock)
+        self._write_throttled.discard(sock)
+        self._upload_scheduler.remove_transfer(sock)
+        self._download_scheduler.remove_transfer(sock)
+
+        try:
+            del self._conns[sock]
+        except KeyError:
+            pass
+
+    def _add_connection_in_progress(self, sock, conn):
+        self._connsinprogress[sock] = conn
+        self._register_socket(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _remove_connection_in_progress(self, sock):
+        self._unregister_socket(sock)
+        del self._connsinprogress[sock]
+
+    def _check_throttled(self):
+        """ Transfers that hit a bandwidth limit have their read or write
+        interest removed. Give it back once the limit allows transferring
+        again. Returns the time until the next throttled transfer can resume. """
+
+        timeout = self.SELECT_TIMEOUT
+
+        for throttled, scheduler in ((self._write_throttled, self._upload_scheduler),
+                                     (self._read_throttled, self._download_scheduler)):
+            for sock in throttled.copy():
+                delay = scheduler.delay(sock)
+
+                if delay <= 0:
+                    throttled.discard(sock)
+                    self._update_interest(sock)
+                else:
+                    timeout = min(timeout, delay)
+
+        return timeout
+
+    def select(self, timeout):
+        # Select Networking Input and Output sockets
+
+        if sys.platform == "win32":
+            input_list = []
+            output_list = []
+
+            for key in self.selector.get_map().values():
+                if key.events & selectors.EVENT_READ:
+                    input_list.append(key.fileobj)
+                if key.events & selectors.EVENT_WRITE:
+                    output_list.append(key.fileobj)
+
+            input, output, exc = multiselect(input_list, output_list, [], timeout)
+            return set(input), set(output)
+
+        input = set()
+        output = set()
+
+        for key, events in self.selector.select(timeout):
+            if events & selectors.EVENT_READ:
+                input.add(key.fileobj)
+            if events & selectors.EVENT_WRITE:
+                output.add(key.fileobj)
 
         return input, output
 
@@ -549,31 +999,32 @@ class SlskProtoThread(threading.Thread):
         connsinprogress = self._connsinprogress
         queue = self._queue
 
+        self._register_socket(p, selectors.EVENT_READ)
+
+        if isinstance(queue, WakeupQueue):
+            self._register_socket(queue, selectors.EVENT_READ)
+
+        input = output = set()
+
         while not self._want_abort:
+            if queue in input:
+                queue.clear_wakeup()
+
             if not queue.empty():
                 conns, connsinprogress, server_socket = self.process_queue(queue, conns, connsinprogress, server_socket)
+
+                if server_socket is not self._server_socket:
+                    for i in conns.copy():
+                        if conns[i].__class__ is ServerConnection and i is not server_socket:
+                            self._remove_connection(i)
+
                 self._server_socket = server_socket
-            for i in conns.copy():
-                if conns[i].__class__ is ServerConnection and i is not server_socket:
-                    del conns[i]
-            outsocks = [i for i in list(conns.keys()) if len(conns[i].obuf) > 0 or (i is not server_socket and conns[i].fileupl is not None and conns[i].fileupl.offset is not None)]
-            outsock = []
-            self._limits = {}
-            self._dlimits = {}
-            for i in outsocks:
-                if self._isUpload(conns[i]):
-                    limit = self._uploadlimit[0](conns, conns[i])
-                    if limit is None or limit > 0:
-                        self._limits[i] = limit
-                        outsock.append(i)
 
-                else:
-                    outsock.append(i)
+            timeout = self._check_throttled()
+
             try:
                 # Select Networking Input and Output sockets
-                input_list = list(conns.keys()) + list(connsinprogress.keys()) + [p]
-                output_list = list(connsinprogress.keys()) + outsock
-                input, output = self.select(input_list, output_list, selectors.DefaultSelector())
+                input, output = self.select(timeout)
 
                 numsockets = 0
                 if p is not None:
@@ -586,7 +1037,6 @@ class SlskProtoThread(threading.Thread):
                     self._ui_callback([SetCurrentConnectionCount(numsockets)])
                     self.last_conncount_ui_update = time.time()
 
-            # print "Sockets open: %s = %s + %s + %s (+1)" % (len(conns.keys()+connsinprogress.keys()+[p]+outsock), len(conns.keys()),  len(connsinprogress.keys()), len(outsock))
             except OSError as error:
                 if len(error.args) == 2 and error.args[0] == EINTR:
                     # Error recieved; but we don't care :)
@@ -603,14 +1053,14 @@ class SlskProtoThread(threading.Thread):
                     self.killOverflowConnection(conns)
                 continue
             # Write Output
-            for (key, value) in conns.items():
-                if key in output:
+            for key in output:
+                if key in conns:
                     try:
                         self.writeData(server_socket, conns, key)
                     except socket.error as err:
-                        self._ui_callback([ConnectError(value, err)])
+                        self._ui_callback([ConnectError(conns[key], err)])
             # Listen / Peer Port
-            if p in input[:]:
+            if p in input:
                 try:
                     incconn, incaddr = p.accept()
                 except Exception:
@@ -624,28 +1074,26 @@ class SlskProtoThread(threading.Thread):
                         })
                         log.add(message, 3)
                     else:
-                        conns[incconn] = PeerConnection(incconn, incaddr, b"", b"")
+                        self._add_connection(incconn, PeerConnection(incconn, incaddr, b"", b""))
                         self._ui_callback([IncConn(incconn, incaddr)])
 
             # Manage Connections
-            curtime = time.time()
-            for connection_in_progress in connsinprogress.copy():
-                if (curtime - connsinprogress[connection_in_progress].lastactive) > self.IN_PROGRESS_STALE_AFTER:
-                    connection_in_progress.close()
-                    del connsinprogress[connection_in_progress]
-                    continue
+            for connection_in_progress in (input | output) & connsinprogress.keys():
                 try:
                     msgObj = connsinprogress[connection_in_progress].msgObj
                     if connection_in_progress in input:
                         connection_in_progress.recv(0)
                 except socket.error as err:
                     self._ui_callback([ConnectError(msgObj, err)])
+                    self._remove_connection_in_progress(connection_in_progress)
                     connection_in_progress.close()
-                    del connsinprogress[connection_in_progress]
                 else:
                     if connection_in_progress in output:
+                        self._remove_connection_in_progress(connection_in_progress)
+
                         if connection_in_progress is server_socket:
-                            conns[server_socket] = ServerConnection(server_socket, msgObj.addr, b"", b"")
+                            self._add_connection(server_socket, ServerConnection(server_socket, msgObj.addr, b"", b""))
+                            self._update_interest(server_socket)
                             self._ui_callback([ServerConn(server_socket, msgObj.addr)])
                         else:
                             ip, port = self.getIpPort(msgObj.addr)
@@ -654,38 +1102,29 @@ class SlskProtoThread(threading.Thread):
                                 log.add(message, 3)
                                 connection_in_progress.close()
                             else:
-                                conns[connection_in_progress] = PeerConnection(connection_in_progress, msgObj.addr, b"", b"", msgObj.init)
+                                self._add_connection(
+                                    connection_in_progress,
+                                    PeerConnection(connection_in_progress, msgObj.addr, b"", b"", msgObj.init)
+                                )
                                 self._ui_callback([OutConn(connection_in_progress, msgObj.addr)])
-                        del connsinprogress[connection_in_progress]
             # Process Data
-            for connection in conns.copy():
+            pending_input = self._pending_input
+            self._pending_input = set()
+
+            for connection in (input | pending_input) & conns.keys():
                 ip, port = self.getIpPort(conns[connection].addr)
-                # print("ip: {}:{}  p: {}, conn: {}".format(ip, port, p, connection))
                 if self.ipBlocked(ip) and connection is not self._server_socket:
                     message = "Blocking peer connection to IP: %(ip)s Port: %(port)s" % {"ip": ip, "port": port}
                     log.add(message, 3)
+                    self._remove_connection(connection)
                     connection.close()
-                    del conns[connection]
                     continue
 
                 if connection in input:
-                    if self._isDownload(conns[connection]):
-                        limit = self._downloadlimit[0](conns, connection)
-                        if limit is None or limit > 0:
-                            self._dlimits[connection] = limit
-                        # if connection in self._dlimits:
-                        # FIXME: Fix this Ugly download limit hack (sleep)
-                        # time.sleep(1.0)
-
-                        try:
-                            self.readData(conns, connection)
-                        except socket.error as err:
-                            self._ui_callback([ConnectError(conns[connection], err)])
-                    else:
-                        try:
-                            self.readData(conns, connection)
-                        except socket.error as err:
-                            self._ui_callback([ConnectError(conns[connection], err)])
+                    try:
+                        self.readData(conns, connection)
+                    except socket.error as err:
+                        self._ui_callback([ConnectError(conns[connection], err)])
                 if connection in conns and len(conns[connection].ibuf) > 0:
                     if connection is server_socket:
                         msgs, conns[server_socket].ibuf = self.process_server_input(conns[server_socket].ibuf)
@@ -701,36 +1140,50 @@ class SlskProtoThread(threading.Thread):
                             msgs, conns[connection] = self.process_distrib_input(conns[connection], conns[connection].ibuf)
                             self._ui_callback(msgs)
                         if conns[connection].conn is None:
-                            del conns[connection]
+                            self._remove_connection(connection)
 
             # ---------------------------
             # Server Pings used to get us banned
             # ---------------------------
             # Timeout Connections
             curtime = time.time()
-            for connection in conns.copy():
-                if connection is not server_socket and connection is not p:
-                    if curtime - conns[connection].lastactive > self.CONNECTION_MAX_IDLE:
-                        self._ui_callback([ConnClose(connection, conns[connection].addr)])
-                        connection.close()
-                        # print "Closed_run", conns[i].addr
-                        del conns[connection]
-                #  Was 30 seconds
+            if (curtime - self.last_idle_check) > self.IDLE_CHECK_INTERVAL:
+                self.last_idle_check = curtime
+                self.close_idle_connections(conns, connsinprogress, curtime)
+
             if server_socket in conns:
                 if curtime - conns[server_socket].lastping > 120:
                     conns[server_socket].lastping = curtime
                     queue.put(ServerPing())
 
             self._ui_callback([])
-            if self._downloadlimit[1] and self._downloadlimit[1] > 0:
-                time.sleep(0.1)
 
         # Close Server Port
         if server_socket is not None:
             server_socket.close()
+        self.selector.close()
         # print "Networking thread aborted"
         self._stopped = 1
 
+    def close_idle_connections(self, conns, connsinprogress, curtime):
+        """ Closes stale connections in progress and idle peer connections.
+        This walks every socket, so it only runs every IDLE_CHECK_INTERVAL
+        seconds instead of on every loop iteration. """
+
+        for connection_in_progress in connsinprogress.copy():
+            if (curtime - connsinprogress[connection_in_progress].lastactive) > self.IN_PROGRESS_STALE_AFTER:
+                self._remove_connection_in_progress(connection_in_progress)
+                connection_in_progress.close()
+
+        for connection in conns.copy():
+            if connection is not self._server_socket and connection is not self._p:
+                if curtime - conns[connection].lastactive > self.CONNECTION_MAX_IDLE:
+                    self._ui_callback([ConnClose(connection, conns[connection].addr)])
+                    self._remove_connection(connection)
+                    connection.close()
+                    # print "Closed_run", conns[i].addr
+            #  Was 30 seconds
+
     # randomly selects a safe connection to kill and closes the socket--
     # Will not kill upload, download, or server connections
     def killOverflowConnection(self, conns):
@@ -748,7 +1201,10 @@ class SlskProtoThread(threading.Thread):
         if victim_conn is None:
             return False
 
-        del conns[victim_conn]
+        if conns is self._connsinprogress:
+            self._remove_connection_in_progress(victim_conn)
+        else:
+            self._remove_connection(victim_conn)
         # if endpoint is not connected, will get an exception on sockets...
         try:
             pn = victim_conn.getpeername()
@@ -800,66 +1256,153 @@ class SlskProtoThread(threading.Thread):
 
         return ip, port
 
+    def _canSendFile(self, conn):
+        """ Uploads are sent with sendfile() once all other queued output has
+        been sent, so file data doesn't need to be copied through Python """
+
+        return conn.__class__ is PeerConnection and conn.usesendfile and len(conn.obuf) == 0 and \
+            conn.fileupl is not None and conn.fileupl.offset is not None
+
+    def _abortUpload(self, i, conn, strerror):
+        """ Gives up on an upload whose file can't be read anymore, instead of
+        polling a writable socket that has nothing left to send """
+
+        self._ui_callback([FileError(conn, conn.fileupl.file, strerror), ConnClose(i, conn.addr)])
+        self._remove_connection(i)
+        i.close()
+
+    def _sendFile(self, i, conn, limit):
+        """ Sends file data of an upload with sendfile(), and returns the
+        number of bytes sent, or None if the upload was aborted """
+
+        fileupl = conn.fileupl
+        position = fileupl.offset + fileupl.sentbytes
+        count = fileupl.size - position
+
+        if limit is not None:
+            count = min(count, limit)
+
+        if count <= 0:
+            return 0
+
+        try:
+            sent = os.sendfile(i.fileno(), fileupl.file.fileno(), position, count)
+
+            if sent == 0:
+                # End of file before the size we announced, the file was truncated
+                self._abortUpload(i, conn, _("File %s is smaller than expected") % fileupl.file.name)
+                return None
+
+            return sent
+
+        except BlockingIOError:
+            return 0
+
+        except io.UnsupportedOperation:
+            # Not a real file, read it into the output buffer instead
+            pass
+
+        except ValueError:
+            self._abortUpload(i, conn, _("File was closed during the upload"))
+            return None
+
+        except OSError as error:
+            if error.errno not in SENDFILE_UNSUPPORTED_ERRORS:
+                raise
+
+        conn.usesendfile = False
+
+        try:
+            fileupl.file.seek(position)
+        except IOError as strerror:
+            self._ui_callback([FileError(conn, fileupl.file, strerror)])
+        except ValueError:
+            self._abortUpload(i, conn, _("File was closed during the upload"))
+            return None
+
+        return 0
+
     def writeData(self, server_socket, conns, i):
-        if i in self._limits:
-            limit = self._limits[i]
-        else:
-            limit = None
+        limit = self._upload_scheduler.allowance(i)
+
+        if limit == 0:
+            # Upload limit reached, stop polling this socket for writing for now
+            self._write_throttled.add(i)
+            self._update_interest(i)
+            return
 
         conns[i].lastactive = time.time()
         i.setblocking(0)
-        if limit is None:
-            bytes_send = i.send(conns[i].obuf)
+
+        if i is not server_socket and self._canSendFile(conns[i]):
+            bytes_send = self._sendFile(i, conns[i], limit)
+
+            if bytes_send is None:
+                return
         else:
-            bytes_send = i.send(conns[i].obuf[:limit])
+            with conns[i].obuf.view(limit) as view:
+                bytes_send = i.send(view)
+
+            conns[i].obuf.consume(bytes_send)
 
         i.setblocking(1)
-        conns[i].obuf = conns[i].obuf[bytes_send:]
         if i is not server_socket:
             if conns[i].fileupl is not None and conns[i].fileupl.offset is not None:
                 conns[i].fileupl.sentbytes += bytes_send
-                conns[i].sentbytes2 += bytes_send
+                self._upload_scheduler.consume(i, bytes_send)
                 try:
-                    if conns[i].fileupl.offset + conns[i].fileupl.sentbytes + len(conns[i].obuf) < conns[i].fileupl.size:
+                    # With sendfile(), file data is sent straight from the file descriptor
+                    if not conns[i].usesendfile and \
+                            conns[i].fileupl.offset + conns[i].fileupl.sentbytes + len(conns[i].obuf) < conns[i].fileupl.size:
                         bytestoread = bytes_send * 2 - len(conns[i].obuf) + 10 * 1024
                         if bytestoread > 0:
                             read = conns[i].fileupl.file.read(bytestoread)
-                            conns[i].obuf = conns[i].obuf + read
+                            conns[i].obuf.extend(read)
+
+                            if not read and not conns[i].obuf:
+                                self._abortUpload(i, conns[i], _("File %s is smaller than expected") % conns[i].fileupl.file.name)
+                                return
                 except IOError as strerror:
                     self._ui_callback([FileError(conns[i], conns[i].fileupl.file, strerror)])
                 except ValueError:
-                    pass
+                    self._abortUpload(i, conns[i], _("File was closed during the upload"))
+                    return
 
                 if bytes_send > 0:
                     self._ui_callback([conns[i].fileupl])
 
+        self._update_interest(i)
+
     def readData(self, conns, i):
         # Check for a download limit
-        if i in self._dlimits:
-            limit = self._dlimits[i]
-        else:
-            limit = None
+        limit = self._download_scheduler.allowance(i)
+
+        if limit == 0:
+            # Download limit reached, stop polling this socket for reading for now
+            self._read_throttled.add(i)
+            self._update_interest(i)
+            return
+
         conns[i].lastactive = time.time()
-        if limit is None:
-            # Unlimited download data
-            data = i.recv(conns[i].lastreadlength)
-            conns[i].ibuf = conns[i].ibuf + data
-            if len(data) >= conns[i].lastreadlength // 2:
-                conns[i].lastreadlength = conns[i].lastreadlength * 2
-        else:
+        readlength = conns[i].lastreadlength
+
+        if limit is not None:
             # Speed Limited Download data (transfers)
-            data = i.recv(conns[i].lastreadlength)
-            conns[i].ibuf += data
-            conns[i].lastreadlength = limit
-            conns[i].readbytes2 += len(data)
+            readlength = min(readlength, limit)
+
+        data = i.recv(readlength)
+        conns[i].ibuf.extend(data)
+        self._download_scheduler.consume(i, len(data))
+
+        if len(data) >= conns[i].lastreadlength // 2:
+            conns[i].lastreadlength = conns[i].lastreadlength * 2
 
         if not data:
             self._ui_callback([ConnClose(i, conns[i].addr)])
+            self._remove_connection(i)
             i.close()
-            # print "Closed", conns[i].addr
-            del conns[i]
 
-    def process_server_input(self, msgBuffer: bytes):
+    def process_server_input(self, msgBuffer):
         """ Server has sent us something, this function retrieves messages
         from the msgBuffer, creates message objects and returns them and the rest
         of the msgBuffer.
@@ -867,32 +1410,39 @@ class SlskProtoThread(threading.Thread):
         msgs = []
         # Server messages are 8 bytes or greater in length
         while len(msgBuffer) >= 8:
-            msgsize, msgtype = struct.unpack("<ii", msgBuffer[:8])
+            msgsize, msgtype = msgBuffer.unpack_from("<ii")
             if msgsize + 4 > len(msgBuffer):
                 break
             elif msgtype in self.serverclasses:
                 msg = self.serverclasses[msgtype]()
-                msg.parseNetworkMessage(msgBuffer[8:msgsize + 4])
-                msgs.append(msg)
+                try:
+                    msg.parseNetworkMessage(msgBuffer[8:msgsize + 4])
+                except struct.error as error:
+                    log.addwarning(_("Unable to parse server message %(type)s: %(error)s") % {'type': msg.__class__.__name__, 'error': error})
+                else:
+                    msgs.append(msg)
             else:
                 msgs.append(_("Server message type %(type)i size %(size)i contents %(msgBuffer)s unknown") % {'type': msgtype, 'size': msgsize - 4, 'msgBuffer': msgBuffer[8:msgsize + 4].__repr__()})
-            msgBuffer = msgBuffer[msgsize + 4:]
+            if msgsize >= 0:
+                msgBuffer.consume(msgsize + 4)
+            else:
+                msgBuffer.clear()
         return msgs, msgBuffer
 
     def parseFileReq(self, conn, msgBuffer):
         msg = None
         # File Request messages are 4 bytes or greater in length
         if len(msgBuffer) >= 4:
-            reqnum = struct.unpack("<i", msgBuffer[:4])[0]
+            reqnum = msgBuffer.unpack_from("<i")[0]
             msg = FileRequest(conn.conn, reqnum)
-            msgBuffer = msgBuffer[4:]
+            msgBuffer.consume(4)
         return msg, msgBuffer
 
     def parseOffset(self, conn, msgBuffer):
         offset = None
         if len(msgBuffer) >= 8:
-            offset = struct.unpack("<Q", msgBuffer[:8])[0]
-            msgBuffer = msgBuffer[8:]
+            offset = msgBuffer.unpack_from("<Q")[0]
+            msgBuffer.consume(8)
         return offset, msgBuffer
 
     def process_file_input(self, conn, msgBuffer):
@@ -908,17 +1458,18 @@ class SlskProtoThread(threading.Thread):
                 msgs.append(filereq)
                 conn.filereq = filereq
         elif conn.filedown is not None:
-            leftbytes = conn.bytestoread - conn.filereadbytes
+            leftbytes = max(min(conn.bytestoread - conn.filereadbytes, len(msgBuffer)), 0)
             if leftbytes > 0:
                 try:
-                    conn.filedown.file.write(msgBuffer[:leftbytes])
+                    with msgBuffer.view(leftbytes) as view:
+                        conn.filedown.file.write(view)
                 except IOError as strerror:
                     self._ui_callback([FileError(conn, conn.filedown.file, strerror)])
                 except ValueError:
                     pass
-            self._ui_callback([DownloadFile(conn.conn, len(msgBuffer[:leftbytes]), conn.filedown.file)])
-            conn.filereadbytes = conn.filereadbytes + len(msgBuffer[:leftbytes])
-            msgBuffer = msgBuffer[leftbytes:]
+            self._ui_callback([DownloadFile(conn.conn, leftbytes, conn.filedown.file)])
+            conn.filereadbytes = conn.filereadbytes + leftbytes
+            msgBuffer.consume(leftbytes)
         elif conn.fileupl is not None:
             if conn.fileupl.offset is None:
                 offset, msgBuffer = self.parseOffset(conn, msgBuffer)
@@ -931,6 +1482,7 @@ class SlskProtoThread(threading.Thread):
                         pass
                     conn.fileupl.offset = offset
                     self._ui_callback([conn.fileupl])
+                    self._update_interest(conn.conn)
 
         conn.ibuf = msgBuffer
         return msgs, conn
@@ -942,11 +1494,20 @@ class SlskProtoThread(threading.Thread):
         and the rest of the msgBuffer.
         """
         msgs = []
-        while (conn.init is None or conn.init.type not in ['F', 'D']) and len(msgBuffer) >= 8:
-            msgsize = struct.unpack("<i", msgBuffer[:4])[0]
-            if len(msgBuffer) >= 8:
-                msgtype = struct.unpack("<i", msgBuffer[4:8])[0]
-                self._ui_callback([PeerTransfer(conn, msgsize, len(msgBuffer) - 4, self.peerclasses.get(msgtype, None))])
+        if conn.filelist is not None:
+            self.process_shared_file_list_input(conn, msgBuffer, msgs)
+
+        while conn.filelist is None and (conn.init is None or conn.init.type not in ['F', 'D']) and len(msgBuffer) >= 8:
+            msgsize, msgtype = msgBuffer.unpack_from("<ii")
+            self._ui_callback([PeerTransfer(conn, msgsize, len(msgBuffer) - 4, self.peerclasses.get(msgtype, None))])
+            if conn.init is not None and conn.init.type == 'P' and msgsize >= 4 and self.peerclasses.get(msgtype) is SharedFileList:
+                # Parse shared file lists while they arrive, browsing
+                # large shares would use a lot of memory otherwise
+                conn.filelist = SharedFileListDecoder(msgsize - 4)
+                conn.filelistparts = 0
+                msgBuffer.consume(8)
+                self.process_shared_file_list_input(conn, msgBuffer, msgs)
+                continue
             if msgsize + 4 > len(msgBuffer):
                 break
             elif conn.init is None:
@@ -974,6 +1535,7 @@ class SlskProtoThread(threading.Thread):
                         "Unknown peer init code: {}, message contents ".format(msgBuffer[4]) +
                         "{}".format(msgBuffer[5:msgsize + 4].__repr__())
                     ))
+                    self._unregister_socket(conn.conn)
                     conn.conn.close()
                     self._ui_callback([ConnClose(conn.conn, conn.addr)])
                     conn.conn = None
@@ -982,7 +1544,6 @@ class SlskProtoThread(threading.Thread):
                     break
             elif conn.init.type == 'P':
                 # Unpack Peer Messages
-                msgtype = struct.unpack("<i", msgBuffer[4:8])[0]
                 if msgtype in self.peerclasses:
                     try:
                         msg = self.peerclasses[msgtype](conn)
@@ -1031,12 +1592,42 @@ class SlskProtoThread(threading.Thread):
                 # Unknown Message type
                 msgs.append(_("Can't handle connection type %s") % (conn.init.type))
             if msgsize >= 0:
-                msgBuffer = msgBuffer[msgsize + 4:]
+                msgBuffer.consume(msgsize + 4)
             else:
-                msgBuffer = b""
+                msgBuffer.clear()
         conn.ibuf = msgBuffer
         return msgs, conn
 
+    def process_shared_file_list_input(self, conn, msgBuffer, msgs):
+        """ Feeds the payload of a SharedFileList message to the decoder of
+        the connection as it arrives, and appends the directories parsed so
+        far to msgs as SharedFileList messages of up to
+        FILELIST_PART_SIZE directories each """
+
+        decoder = conn.filelist
+        size = min(len(msgBuffer), decoder.size - decoder.received)
+        part = []
+
+        with msgBuffer.view(size) as data:
+            for directory in decoder.feed(data):
+                part.append(directory)
+
+                if len(part) >= self.FILELIST_PART_SIZE:
+                    msgs.append(SharedFileList(conn, part, first=(conn.filelistparts == 0), last=False))
+                    conn.filelistparts += 1
+                    part = []
+
+        msgBuffer.consume(size)
+        self._ui_callback([PeerTransfer(conn, decoder.size + 4, decoder.received + 4, SharedFileList)])
+
+        if decoder.done:
+            msgs.append(SharedFileList(conn, part, first=(conn.filelistparts == 0), last=True))
+            conn.filelist = None
+
+        elif part:
+            msgs.append(SharedFileList(conn, part, first=(conn.filelistparts == 0), last=False))
+            conn.filelistparts += 1
+
     def process_distrib_input(self, conn, msgBuffer):
         """ We have a distributed network connection, parent has sent us
         something, this function retrieves messages
@@ -1045,7 +1636,7 @@ class SlskProtoThread(threading.Thread):
         """
         msgs = []
         while len(msgBuffer) >= 5:
-            msgsize = struct.unpack("<i", msgBuffer[:4])[0]
+            msgsize = msgBuffer.unpack_from("<i")[0]
             if msgsize + 4 > len(msgBuffer):
                 break
             msgtype = msgBuffer[4]
@@ -1055,26 +1646,59 @@ class SlskProtoThread(threading.Thread):
                 msgs.append(msg)
             else:
                 msgs.append(_("Distrib message type %(type)i size %(size)i contents %(msgBuffer)s unknown") % {'type': msgtype, 'size': msgsize - 1, 'msgBuffer': msgBuffer[5:msgsize + 4].__repr__()})
+                self._unregister_socket(conn.conn)
                 conn.conn.close()
                 self._ui_callback([ConnClose(conn.conn, conn.addr)])
                 conn.conn = None
                 break
             if msgsize >= 0:
-                msgBuffer = msgBuffer[msgsize + 4:]
+                msgBuffer.consume(msgsize + 4)
             else:
-                msgBuffer = b""
+                msgBuffer.clear()
         conn.ibuf = msgBuffer
         return msgs, conn
 
-    def _resetCounters(self, conns):
-        curtime = time.time()
-        for i in list(conns.values()):
-            if self._isUpload(i):
-                i.starttime = curtime
-                i.sentbytes2 = 0
-            if self._isDownload(i):
-                i.starttime = curtime
-                i.sentbytes2 = 0
+    def pack_server_message(self, msgObj):
+        msg = msgObj.makeNetworkMessage()
+        if msg == '' or msg is None:
+            msg = b''
+        return struct.pack("<ii", len(msg) + 4, self.servercodes[msgObj.__class__]) + msg
+
+    def pack_peer_message(self, conn, msgObj):
+        """ Packs Peer and File and Search Messages, and keeps track of init and
+        file request messages sent over the connection. Returns None if nothing
+        should be sent. """
+        if msgObj.__class__ is PierceFireWall:
+            conn.piercefw = msgObj
+            msg = msgObj.makeNetworkMessage()
+            return struct.pack("<i", len(msg) + 1) + bytes(chr(0), 'ascii') + msg
+
+        if msgObj.__class__ is PeerInit:
+            conn.init = msgObj
+            msg = msgObj.makeNetworkMessage()
+            if conn.piercefw is None:
+                return struct.pack("<i", len(msg) + 1) + bytes(chr(1), 'ascii') + msg
+            return None
+
+        if msgObj.__class__ is FileRequest:
+            conn.filereq = msgObj
+            return msgObj.makeNetworkMessage()
+
+        if msgObj.__class__ is FileSearchResult and msgObj.geoip and self.geoip and self._geoip:
+            cc = self.geoip.get_all(conn.addr[0]).country_short
+            if cc == "-" and self._geoip[0]:
+                return None
+            elif cc != "-" and self._geoip[1][0].find(cc) >= 0:
+                return None
+
+        msg = msgObj.makeNetworkMessage()
+        header = struct.pack("<ii", len(msg) + 4, self.peercodes[msgObj.__class__])
+
+        if isinstance(msg, MessageChunks):
+            # Large messages are sent without copying their contents
+            return msg.prepend(header)
+
+        return header + msg
 
     def process_queue(self, queue, conns, connsinprogress, server_socket, maxsockets=MAXFILELIMIT):
         """ Processes messages sent by UI thread. server_socket is a server connection
@@ -1093,14 +1717,9 @@ class SlskProtoThread(threading.Thread):
         for msgObj in msgList:
             if issubclass(msgObj.__class__, ServerMessage):
                 try:
-                    msg = msgObj.makeNetworkMessage()
-                    if msg == '' or msg is None:
-                        msg = b''
                     if server_socket in conns:
-
-                        conns[server_socket].obuf += \
-                            struct.pack("<ii", len(msg) + 4, self.servercodes[msgObj.__class__]) + \
-                            msg
+                        conns[server_socket].obuf += self.pack_server_message(msgObj)
+                        self._update_interest(server_socket)
                     else:
                         queue.put(msgObj)
                         needsleep = True
@@ -1109,38 +1728,16 @@ class SlskProtoThread(threading.Thread):
                     self._ui_callback([_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msgObj.__class__, 'msg_obj': vars(msgObj), 'error': str(error)}])
             elif issubclass(msgObj.__class__, PeerMessage):
                 if msgObj.conn in conns:
-                    # Pack Peer and File and Search Messages
-                    if msgObj.__class__ is PierceFireWall:
-                        conns[msgObj.conn].piercefw = msgObj
-                        msg = msgObj.makeNetworkMessage()
-                        conns[msgObj.conn].obuf += struct.pack("<i", len(msg) + 1) + \
-                            bytes(chr(0), 'ascii') + \
-                            msg
-                    elif msgObj.__class__ is PeerInit:
-                        conns[msgObj.conn].init = msgObj
-                        msg = msgObj.makeNetworkMessage()
-                        if conns[msgObj.conn].piercefw is None:
-                            conns[msgObj.conn].obuf += struct.pack("<i", len(msg) + 1) + \
-                                bytes(chr(1), 'ascii') + \
-                                msg
-
-                    elif msgObj.__class__ is FileRequest:
-                        conns[msgObj.conn].filereq = msgObj
-                        msg = msgObj.makeNetworkMessage()
+                    msg = self.pack_peer_message(conns[msgObj.conn], msgObj)
+                    if msg is not None:
                         conns[msgObj.conn].obuf += msg
+
+                    if msgObj.__class__ is PeerInit or msgObj.__class__ is FileRequest:
+                        self._pending_input.add(msgObj.conn)
+                    if msgObj.__class__ is FileRequest:
                         self._ui_callback([msgObj])
-                    else:
-                        checkuser = 1
-                        if msgObj.__class__ is FileSearchResult and msgObj.geoip and self.geoip and self._geoip:
-                            cc = self.geoip.get_all(conns[msgObj.conn].addr[0]).country_short
-                            if cc == "-" and self._geoip[0]:
-                                checkuser = 0
-                            elif cc != "-" and self._geoip[1][0].find(cc) >= 0:
-                                checkuser = 0
-                        if checkuser:
-                            msg = msgObj.makeNetworkMessage()
-                            conns[msgObj.conn].obuf += struct.pack("<ii", len(msg) + 4, self.peercodes[msgObj.__class__]) + \
-                                msg
+
+                    self._update_interest(msgObj.conn)
                 else:
                     if msgObj.__class__ not in [PeerInit, PierceFireWall, FileSearchResult]:
                         message = _("Can't send the message over the closed connection: %(type)s %(msg_obj)s") % {'type': msgObj.__class__, 'msg_obj': vars(msgObj)}
@@ -1155,15 +1752,14 @@ class SlskProtoThread(threading.Thread):
                             server_socket.setblocking(0)
                             server_socket.connect_ex(msgObj.addr)
                             server_socket.setblocking(1)
-                            connsinprogress[server_socket] = PeerConnectionInProgress(server_socket, msgObj)
+                            self._add_connection_in_progress(server_socket, PeerConnectionInProgress(server_socket, msgObj))
                             numsockets += 1
                         except socket.error as err:
                             self._ui_callback([ConnectError(msgObj, err)])
                 elif msgObj.__class__ is ConnClose and msgObj.conn in conns:
-                    msgObj.conn.close()
-                    # print "Close3", conns[msgObj.conn].addr
                     self._ui_callback([ConnClose(msgObj.conn, conns[msgObj.conn].addr)])
-                    del conns[msgObj.conn]
+                    self._remove_connection(msgObj.conn)
+                    msgObj.conn.close()
                 elif msgObj.__class__ is OutConn:
                     if msgObj.addr[1] == 0:
                         self._ui_callback([ConnectError(msgObj, (0, "Port cannot be zero"))])
@@ -1175,11 +1771,10 @@ class SlskProtoThread(threading.Thread):
                                 conn.bind((self._bindip, 0))
                             conn.connect_ex(msgObj.addr)
                             conn.setblocking(1)
-                            connsinprogress[conn] = PeerConnectionInProgress(conn, msgObj)
+                            self._add_connection_in_progress(conn, PeerConnectionInProgress(conn, msgObj))
                             numsockets += 1
                         except socket.error as xxx_todo_changeme:
                             (errnum, strerror) = xxx_todo_changeme.args
-                            import errno
                             if errno.errorcode.get(errnum, "") == 'EMFILE':
                                 queue.put(msgObj)
                                 needsleep = True
@@ -1188,28 +1783,25 @@ class SlskProtoThread(threading.Thread):
                 elif msgObj.__class__ is DownloadFile and msgObj.conn in conns:
                     conns[msgObj.conn].filedown = msgObj
 
-                    conns[msgObj.conn].obuf = conns[msgObj.conn].obuf \
-                        + struct.pack("<Q", msgObj.offset) \
-                        + struct.pack("<i", 0)
+                    conns[msgObj.conn].obuf += struct.pack("<Q", msgObj.offset) + struct.pack("<i", 0)
                     conns[msgObj.conn].bytestoread = msgObj.filesize - msgObj.offset
+                    self._pending_input.add(msgObj.conn)
+                    self._download_scheduler.add_transfer(msgObj.conn)
+                    self._update_interest(msgObj.conn)
                     self._ui_callback([DownloadFile(msgObj.conn, 0, msgObj.file)])
                 elif msgObj.__class__ is UploadFile and msgObj.conn in conns:
                     conns[msgObj.conn].fileupl = msgObj
-                    self._resetCounters(conns)
+                    self._pending_input.add(msgObj.conn)
+                    self._upload_scheduler.add_transfer(msgObj.conn)
                 elif msgObj.__class__ is SetGeoBlock:
                     self._geoip = msgObj.config
                 elif msgObj.__class__ is SetUploadLimit:
                     if msgObj.uselimit:
-                        if msgObj.limitby:
-                            cb = self._calcLimitByTotal
-                        else:
-                            cb = self._calcLimitByTransfer
+                        self._upload_scheduler.set_limit(msgObj.limit * 1024, pertransfer=not msgObj.limitby)
                     else:
-                        cb = self._calcLimitNone
-                    self._resetCounters(conns)
-                    self._uploadlimit = (cb, msgObj.limit)
+                        self._upload_scheduler.set_limit(0)
                 elif msgObj.__class__ is SetDownloadLimit:
-                    self._downloadlimit = (self._calcDLimitByTotal, msgObj.limit)
+                    self._download_scheduler.set_limit(msgObj.limit * 1024)
         if needsleep:
             time.sleep(1)
 
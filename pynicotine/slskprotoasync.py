@@ -0,0 +1,622 @@
+# Copyright (C) 2020 Nicotine+ Team
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module implements an asyncio based networking backend for the Soulseek
+protocol. It's an alternative to SlskProtoThread, selected with the
+"networkbackend" option in the server section of the config, and follows
+the same contract: messages from the UI thread are read from a Queue, and
+messages for the UI thread are passed to a callback function.
+
+Every connection is handled by an asyncio protocol, and the asyncio transport
+of a connection is the conn object the UI thread sees in messages. Timeouts
+use loop timers, so no threads are created per connection or transfer.
+Requires Python 3.7 or newer.
+"""
+
+import asyncio
+import errno
+import queue
+import struct
+import threading
+import time
+from gettext import gettext as _
+
+from pynicotine.logfacility import log
+from pynicotine.slskmessages import ConnClose
+from pynicotine.slskmessages import ConnectError
+from pynicotine.slskmessages import DownloadFile
+from pynicotine.slskmessages import FileError
+from pynicotine.slskmessages import FileRequest
+from pynicotine.slskmessages import FileSearchResult
+from pynicotine.slskmessages import IncConn
+from pynicotine.slskmessages import InternalMessage
+from pynicotine.slskmessages import MessageChunks
+from pynicotine.slskmessages import OutConn
+from pynicotine.slskmessages import PeerInit
+from pynicotine.slskmessages import PeerMessage
+from pynicotine.slskmessages import PierceFireWall
+from pynicotine.slskmessages import ServerConn
+from pynicotine.slskmessages import ServerMessage
+from pynicotine.slskmessages import ServerPing
+from pynicotine.slskmessages import SetCurrentConnectionCount
+from pynicotine.slskmessages import SetDownloadLimit
+from pynicotine.slskmessages import SetGeoBlock
+from pynicotine.slskmessages import SetUploadLimit
+from pynicotine.slskmessages import UploadFile
+from pynicotine.slskproto import MAXFILELIMIT
+from pynicotine.slskproto import PeerConnection
+from pynicotine.slskproto import ServerConnection
+from pynicotine.slskproto import SlskProtoThread
+from pynicotine.slskproto import WakeupQueue
+
+
+class SlskProtocol(asyncio.Protocol):
+    """ Base protocol for all connection types. Incoming data is added to
+    the input buffer of the connection, and parsed by process_input(), as
+    peer messages unless a subclass handles another connection type.
+    msgObj is the ServerConn or OutConn message of outgoing connections. """
+
+    def __init__(self, proto, msgObj=None):
+        self.proto = proto
+        self.msgObj = msgObj
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.proto.connection_made(transport, self.msgObj)
+
+    def data_received(self, data):
+        conn = self.proto._conns.get(self.transport)
+
+        if conn is None:
+            return
+
+        conn.lastactive = time.time()
+        conn.ibuf.extend(data)
+        self.process_input(conn)
+
+    def process_input(self, conn):
+        msgs, conn = self.proto.process_peer_input(conn, conn.ibuf)
+        self.proto._ui_callback(msgs)
+        return conn
+
+    def connection_lost(self, exc):
+        self.proto.connection_lost(self.transport, exc)
+
+
+class ServerProtocol(SlskProtocol):
+
+    def process_input(self, conn):
+        msgs, conn.ibuf = self.proto.process_server_input(conn.ibuf)
+        self.proto._ui_callback(msgs)
+
+
+class PeerProtocol(SlskProtocol):
+    """ 'P' connections, and incoming connections that haven't sent a
+    PeerInit yet """
+
+    def process_input(self, conn):
+        conn = SlskProtocol.process_input(self, conn)
+
+        if conn.conn is not None and conn.init is not None and conn.init.type in ('F', 'D'):
+            self.proto.switch_protocol(self.transport, conn)
+
+
+class FileTransferProtocol(SlskProtocol, asyncio.BufferedProtocol):
+    """ 'F' connections. Reads into a fixed buffer, so the size of each read
+    can be capped by the download limit. """
+
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, proto, msgObj=None):
+        SlskProtocol.__init__(self, proto, msgObj)
+        self._readbuf = bytearray(self.READ_SIZE)
+
+    def get_buffer(self, sizehint):
+        size = self.READ_SIZE
+        limit = self.proto._download_scheduler.allowance(self.transport)
+
+        if limit is not None:
+            size = min(size, max(limit, self.proto._download_scheduler.MIN_ALLOWANCE))
+
+        return memoryview(self._readbuf)[:size]
+
+    def buffer_updated(self, nbytes):
+        with memoryview(self._readbuf)[:nbytes] as data:
+            self.data_received(data)
+
+        self.proto.throttle_download(self.transport, nbytes)
+
+    def process_input(self, conn):
+        msgs, conn = self.proto.process_file_input(conn, conn.ibuf)
+        self.proto._ui_callback(msgs)
+
+
+class DistribProtocol(SlskProtocol):
+    """ 'D' connections (distributed network) """
+
+    def process_input(self, conn):
+        msgs, conn = self.proto.process_distrib_input(conn, conn.ibuf)
+        self.proto._ui_callback(msgs)
+
+
+class AsyncSlskProtoThread(SlskProtoThread):
+    """ This is a networking thread that runs an asyncio event loop. Like
+    SlskProtoThread, it sends data to the UI thread via a callback function
+    and receives data via a Queue object. """
+
+    protocols = {
+        'P': PeerProtocol,
+        'F': FileTransferProtocol,
+        'D': DistribProtocol
+    }
+
+    SERVER_PING_INTERVAL = 120
+
+    def __init__(self, ui_callback, queue, bindip, port, config, eventprocessor):
+        self._loop = None
+        self._listener = None
+        self._server_socket = None
+        self._connecting = 0
+        self._pending_server_msgs = []
+        self._idle_timers = {}
+        self._upload_tasks = {}
+
+        SlskProtoThread.__init__(self, ui_callback, queue, bindip, port, config, eventprocessor)
+
+    def run(self):
+        """ Actual networking loop is here."""
+        self.selector.close()
+
+        self._loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        self._listener = loop.run_until_complete(
+            loop.create_server(lambda: PeerProtocol(self), sock=self._p, backlog=1024)
+        )
+
+        loop.call_soon(self._periodic_update)
+
+        watch_queue = isinstance(self._queue, WakeupQueue)
+
+        if watch_queue:
+            try:
+                loop.add_reader(self._queue, self._process_queue)
+            except NotImplementedError:
+                # Proactor event loop on Windows
+                watch_queue = False
+
+        if not watch_queue:
+            reader = threading.Thread(target=self._read_queue, daemon=True)
+            reader.start()
+
+        try:
+            if not self._want_abort:
+                loop.run_forever()
+        finally:
+            if watch_queue:
+                loop.remove_reader(self._queue)
+
+            self._listener.close()
+
+            for transport in list(self._conns):
+                transport.abort()
+
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            # print "Networking thread aborted"
+            self._stopped = 1
+
+    def abort(self):
+        """ Call this to abort the thread"""
+        self._want_abort = 1
+
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _process_queue(self):
+        self._queue.clear_wakeup()
+
+        while not self._queue.empty():
+            self.process_message(self._queue.get())
+
+    def _read_queue(self):
+        """ Runs in a helper thread, and hands messages from the UI thread
+        over to the event loop as soon as they arrive """
+
+        while not self._want_abort:
+            try:
+                msgObj = self._queue.get(timeout=self.SELECT_TIMEOUT)
+            except queue.Empty:
+                continue
+
+            try:
+                self._loop.call_soon_threadsafe(self.process_message, msgObj)
+            except RuntimeError:
+                # Event loop was closed
+                break
+
+    def _num_sockets(self):
+        # The listening socket, open connections and connections in progress
+        return 1 + len(self._conns) + self._connecting
+
+    def _periodic_update(self):
+        self._ui_callback([SetCurrentConnectionCount(self._num_sockets())])
+
+        self._loop.call_later(self.CONNCOUNT_UI_INTERVAL, self._periodic_update)
+
+    def _server_ping(self):
+        if self._server_socket in self._conns:
+            self.send_data(self._server_socket, self.pack_server_message(ServerPing()))
+            self._loop.call_later(self.SERVER_PING_INTERVAL, self._server_ping)
+
+    def socketStillActive(self, conn):
+        try:
+            connection = self._conns[conn]
+        except KeyError:
+            return False
+        return conn.get_write_buffer_size() > 0 or len(connection.ibuf) > 0
+
+    # Connection management
+
+    def _add_connection(self, transport, conn):
+        self._conns[transport] = conn
+        self._idle_timers[transport] = self._loop.call_later(self.CONNECTION_MAX_IDLE, self._check_idle, transport)
+
+    def _unregister_socket(self, sock):
+        # The transport is closed by the caller, and removed in connection_lost()
+        pass
+
+    def _check_idle(self, transport):
+        conn = self._conns.get(transport)
+
+        if conn is None:
+            return
+
+        idle = time.time() - conn.lastactive
+
+        if transport is self._server_socket or idle < self.CONNECTION_MAX_IDLE:
+            delay = max(self.CONNECTION_MAX_IDLE - idle, 1)
+            self._idle_timers[transport] = self._loop.call_later(delay, self._check_idle, transport)
+            return
+
+        self.close_connection(transport)
+
+    def _can_open_socket(self):
+        """ Keeps the number of sockets below MAXFILELIMIT, closing a peer
+        connection without a transfer to make room if needed """
+
+        if self._num_sockets() < MAXFILELIMIT:
+            return True
+
+        return self.killOverflowConnection(self._conns)
+
+    def killOverflowConnection(self, conns):
+        victim_conn = None
+
+        for transport, conn in conns.items():
+            if self._isUpload(conn) or self._isDownload(conn) or transport is self._server_socket:
+                continue
+
+            if transport.is_closing():
+                continue
+
+            victim_conn = transport
+            break
+
+        if victim_conn is None:
+            return False
+
+        print('Killing overflow connection ', victim_conn.get_extra_info("peername"))
+        self.close_connection(victim_conn)
+
+        # Release the file descriptor now, instead of after flushing the write buffer
+        victim_conn.abort()
+        return True
+
+    def close_connection(self, transport):
+        conn = self._conns.get(transport)
+
+        if conn is not None and conn.conn is not None:
+            self._ui_callback([ConnClose(transport, conn.addr)])
+            conn.conn = None
+
+        transport.close()
+
+    def connection_lost(self, transport, exc):
+        conn = self._conns.pop(transport, None)
+        timer = self._idle_timers.pop(transport, None)
+        task = self._upload_tasks.pop(transport, None)
+
+        self._upload_scheduler.remove_transfer(transport)
+        self._download_scheduler.remove_transfer(transport)
+
+        if timer is not None:
+            timer.cancel()
+
+        if task is not None:
+            task.cancel()
+
+        if transport is self._server_socket:
+            self._server_socket = None
+
+        if conn is not None and conn.conn is not None:
+            self._ui_callback([ConnClose(transport, conn.addr)])
+
+    def connection_made(self, transport, msgObj):
+        if msgObj.__class__ is ServerConn:
+            self._server_socket = transport
+            self._add_connection(transport, ServerConnection(transport, msgObj.addr, b"", b""))
+            self._ui_callback([ServerConn(transport, msgObj.addr)])
+
+            pending_msgs = self._pending_server_msgs
+            self._pending_server_msgs = []
+
+            for pending_msg in pending_msgs:
+                self.process_message(pending_msg)
+
+            self._loop.call_later(self.SERVER_PING_INTERVAL, self._server_ping)
+            return
+
+        if msgObj is not None:
+            self._add_connection(transport, PeerConnection(transport, msgObj.addr, b"", b"", msgObj.init))
+            self._ui_callback([OutConn(transport, msgObj.addr)])
+            return
+
+        # Incoming connection
+        addr = transport.get_extra_info("peername")
+        ip, port = self.getIpPort(addr)
+
+        if not self._can_open_socket():
+            transport.abort()
+            return
+
+        if self.ipBlocked(ip):
+            message = _("Ignoring connection request from blocked IP Address %(ip)s:%(port)s" % {
+                'ip': ip,
+                'port': port
+            })
+            log.add(message, 3)
+            transport.abort()
+            return
+
+        self._add_connection(transport, PeerConnection(transport, addr, b"", b""))
+        self._ui_callback([IncConn(transport, addr)])
+
+    def switch_protocol(self, transport, conn):
+        """ Hands a connection over to the protocol of its type ('P', 'F' or
+        'D') after a PeerInit, and parses the rest of the input with it """
+
+        protocol_class = self.protocols.get(conn.init.type, PeerProtocol)
+
+        if transport.get_protocol().__class__ is protocol_class:
+            return
+
+        protocol = protocol_class(self)
+        protocol.transport = transport
+        transport.set_protocol(protocol)
+
+        if len(conn.ibuf) > 0:
+            protocol.process_input(conn)
+
+    def _process_pending_input(self, transport):
+        conn = self._conns.get(transport)
+
+        if conn is not None and conn.conn is not None and len(conn.ibuf) > 0:
+            transport.get_protocol().process_input(conn)
+
+    async def _connect(self, msgObj, protocol_class):
+        kwargs = {}
+
+        if self._bindip:
+            kwargs["local_addr"] = (self._bindip, 0)
+
+        self._connecting += 1
+
+        try:
+            # The connection is set up in connection_made()
+            await asyncio.wait_for(
+                self._loop.create_connection(
+                    lambda: protocol_class(self, msgObj), msgObj.addr[0], msgObj.addr[1], **kwargs
+                ),
+                self.IN_PROGRESS_STALE_AFTER
+            )
+
+        except asyncio.TimeoutError:
+            pass
+
+        except OSError as err:
+            if err.errno == errno.EMFILE:
+                self._loop.call_later(1, self.process_message, msgObj)
+            else:
+                self._ui_callback([ConnectError(msgObj, err)])
+
+        finally:
+            self._connecting -= 1
+
+    def connect_to_peer(self, msgObj):
+        ip, port = self.getIpPort(msgObj.addr)
+
+        if self.ipBlocked(ip):
+            message = "Blocking peer connection in progress to IP: %(ip)s Port: %(port)s" % {"ip": ip, "port": port}
+            log.add(message, 3)
+            return
+
+        if not self._can_open_socket():
+            # Try again once a connection was closed
+            self._loop.call_later(1, self.process_message, msgObj)
+            return
+
+        init_type = msgObj.init.type if msgObj.init is not None else 'P'
+        self._loop.create_task(self._connect(msgObj, self.protocols.get(init_type, PeerProtocol)))
+
+    def send_data(self, transport, data):
+        if transport.is_closing():
+            return
+
+        self._conns[transport].lastactive = time.time()
+
+        if isinstance(data, MessageChunks):
+            transport.writelines(data.chunks)
+            return
+
+        transport.write(data)
+
+    # Transfers
+
+    def throttle_download(self, transport, nbytes):
+        scheduler = self._download_scheduler
+        scheduler.consume(transport, nbytes)
+
+        if scheduler.allowance(transport) == 0:
+            transport.pause_reading()
+            self._loop.call_later(scheduler.delay(transport), transport.resume_reading)
+
+    def _update_interest(self, sock):
+        """ Called once the offset of an upload is known. Starts sending the
+        file. """
+
+        conn = self._conns.get(sock)
+
+        if conn is None or conn.fileupl is None or conn.fileupl.offset is None or sock in self._upload_tasks:
+            return
+
+        self._upload_tasks[sock] = self._loop.create_task(self.upload_file(sock, conn))
+
+    async def upload_file(self, transport, conn):
+        """ Sends file data with loop.sendfile(), which uses os.sendfile()
+        where possible, in chunks capped by the upload limit """
+
+        fileupl = conn.fileupl
+        scheduler = self._upload_scheduler
+
+        while not transport.is_closing():
+            position = fileupl.offset + fileupl.sentbytes
+            count = fileupl.size - position
+
+            if count <= 0:
+                break
+
+            limit = scheduler.allowance(transport)
+
+            if limit == 0:
+                await asyncio.sleep(scheduler.delay(transport))
+                continue
+
+            if limit is not None:
+                count = min(count, limit)
+
+            try:
+                sent = await self._loop.sendfile(transport, fileupl.file, position, count)
+
+            except (OSError, ValueError) as strerror:
+                if not transport.is_closing():
+                    self._ui_callback([FileError(conn, fileupl.file, strerror)])
+                break
+
+            if sent == 0:
+                # End of file before the size we announced, the file was truncated
+                self._ui_callback([FileError(conn, fileupl.file, _("File %s is smaller than expected") % fileupl.file.name)])
+                self.close_connection(transport)
+                break
+
+            conn.lastactive = time.time()
+            fileupl.sentbytes += sent
+            scheduler.consume(transport, sent)
+            self._ui_callback([fileupl])
+
+        self._upload_tasks.pop(transport, None)
+
+    # Messages from the UI thread
+
+    def process_message(self, msgObj):
+        """ Processes a message sent by UI thread """
+
+        if issubclass(msgObj.__class__, ServerMessage):
+            if self._server_socket not in self._conns:
+                self._pending_server_msgs.append(msgObj)
+                return
+
+            try:
+                self.send_data(self._server_socket, self.pack_server_message(msgObj))
+            except Exception as error:
+                print(_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msgObj.__class__, 'msg_obj': vars(msgObj), 'error': str(error)})
+                self._ui_callback([_("Error packaging message: %(type)s %(msg_obj)s, %(error)s") % {'type': msgObj.__class__, 'msg_obj': vars(msgObj), 'error': str(error)}])
+
+        elif issubclass(msgObj.__class__, PeerMessage):
+            conn = self._conns.get(msgObj.conn)
+
+            if conn is None:
+                if msgObj.__class__ not in [PeerInit, PierceFireWall, FileSearchResult]:
+                    message = _("Can't send the message over the closed connection: %(type)s %(msg_obj)s") % {'type': msgObj.__class__, 'msg_obj': vars(msgObj)}
+                    log.add(message, 3)
+                return
+
+            msg = self.pack_peer_message(conn, msgObj)
+
+            if msg is not None:
+                self.send_data(msgObj.conn, msg)
+
+            if msgObj.__class__ is PeerInit:
+                self.switch_protocol(msgObj.conn, conn)
+
+            elif msgObj.__class__ is FileRequest:
+                self._ui_callback([msgObj])
+                self._process_pending_input(msgObj.conn)
+
+        elif issubclass(msgObj.__class__, InternalMessage):
+            if msgObj.__class__ is ServerConn:
+                if not self._can_open_socket():
+                    self._loop.call_later(1, self.process_message, msgObj)
+                    return
+
+                self._loop.create_task(self._connect(msgObj, ServerProtocol))
+
+            elif msgObj.__class__ is ConnClose and msgObj.conn in self._conns:
+                self.close_connection(msgObj.conn)
+
+            elif msgObj.__class__ is OutConn:
+                if msgObj.addr[1] == 0:
+                    self._ui_callback([ConnectError(msgObj, (0, "Port cannot be zero"))])
+                else:
+                    self.connect_to_peer(msgObj)
+
+            elif msgObj.__class__ is DownloadFile and msgObj.conn in self._conns:
+                conn = self._conns[msgObj.conn]
+                conn.filedown = msgObj
+                conn.bytestoread = msgObj.filesize - msgObj.offset
+
+                self.send_data(msgObj.conn, struct.pack("<Q", msgObj.offset) + struct.pack("<i", 0))
+                self._download_scheduler.add_transfer(msgObj.conn)
+                self._ui_callback([DownloadFile(msgObj.conn, 0, msgObj.file)])
+                self._process_pending_input(msgObj.conn)
+
+            elif msgObj.__class__ is UploadFile and msgObj.conn in self._conns:
+                self._conns[msgObj.conn].fileupl = msgObj
+                self._upload_scheduler.add_transfer(msgObj.conn)
+                self._process_pending_input(msgObj.conn)
+
+            elif msgObj.__class__ is SetGeoBlock:
+                self._geoip = msgObj.config
+
+            elif msgObj.__class__ is SetUploadLimit:
+                if msgObj.uselimit:
+                    self._upload_scheduler.set_limit(msgObj.limit * 1024, pertransfer=not msgObj.limitby)
+                else:
+                    self._upload_scheduler.set_limit(0)
+
+            elif msgObj.__class__ is SetDownloadLimit:
+                self._download_scheduler.set_limit(msgObj.limit * 1024)
@@ -0,0 +1,174 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+import time
+
+from gettext import gettext as _
+
+from pynicotine.logfacility import log
+
+
+class TimerHandle:
+    """ A timer added to a TimerQueue, that can be cancelled until it
+    runs """
+
+    __slots__ = ("deadline", "callback", "args", "_queue")
+
+    def __init__(self, queue, deadline, callback, args):
+
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self._queue = queue
+
+    @property
+    def active(self):
+        return self.callback is not None
+
+    def cancel(self):
+        self._queue.cancel(self)
+
+
+class TimerQueue:
+    """ Runs callbacks after a delay, without a thread per timer. Timers are
+    kept in a heap ordered by deadline, and cancelled timers are dropped
+    from it once they make up most of it.
+
+    Someone has to call run_due() when timers are due, usually a main loop.
+    wakeup(delay) is called whenever run_due() should be called earlier
+    than requested before, and once run_due() has run the due timers, for
+    the next one. It replaces earlier requests, and is called with a lock
+    held, so it must not use the queue itself. Timers can be added and
+    cancelled from any thread, callbacks run in the thread calling
+    run_due(). """
+
+    def __init__(self, wakeup=None, clock=time.monotonic):
+
+        self.wakeup = wakeup
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = 0
+        self._cancelled = 0
+        self._wakeup_deadline = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def add(self, delay, callback, *args):
+        """ Calls callback(*args) in delay seconds, and returns a handle to
+        cancel it """
+
+        with self._lock:
+            deadline = self._clock() + delay
+            handle = TimerHandle(self, deadline, callback, args)
+
+            heapq.heappush(self._heap, (deadline, self._seq, handle))
+            self._seq += 1
+
+            if self._wakeup_deadline is None or deadline < self._wakeup_deadline:
+                self._request_wakeup(deadline, delay)
+
+        return handle
+
+    def _request_wakeup(self, deadline, delay):
+
+        self._wakeup_deadline = deadline
+
+        if self.wakeup is not None:
+            self.wakeup(delay)
+
+    def cancel(self, handle):
+        """ Makes sure a timer doesn't run, if it hasn't already """
+
+        with self._lock:
+            if handle.callback is None:
+                return
+
+            handle.callback = handle.args = None
+            self._cancelled += 1
+
+            if self._cancelled > 64 and self._cancelled > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if entry[2].callback is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def clear(self):
+
+        with self._lock:
+            for _deadline, _seq, handle in self._heap:
+                handle.callback = handle.args = None
+
+            self._heap.clear()
+            self._cancelled = 0
+
+    def next_timeout(self):
+        """ Returns the number of seconds until the next timer is due, or
+        None if there are no timers """
+
+        with self._lock:
+            self._drop_cancelled()
+
+            if not self._heap:
+                return None
+
+            return max(0, self._heap[0][0] - self._clock())
+
+    def _drop_cancelled(self):
+
+        heap = self._heap
+
+        while heap and heap[0][2].callback is None:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+
+    def run_due(self):
+        """ Runs the callbacks of due timers, and returns the number of
+        seconds until the next timer is due, or None """
+
+        while True:
+            with self._lock:
+                self._drop_cancelled()
+                heap = self._heap
+                curtime = self._clock()
+
+                if not heap:
+                    self._wakeup_deadline = None
+                    return None
+
+                deadline = heap[0][0]
+
+                if deadline > curtime:
+                    self._request_wakeup(deadline, deadline - curtime)
+                    return deadline - curtime
+
+                _deadline, _seq, handle = heapq.heappop(heap)
+                callback, args = handle.callback, handle.args
+                handle.callback = handle.args = None
+
+            try:
+                callback(*args)
+
+            except Exception as error:
+                log.addwarning(_("Timer callback %(callback)s failed: %(error)s") % {
+                    'callback': callback,
+                    'error': error
+                })
@@ -0,0 +1,182 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from operator import attrgetter
+
+from pynicotine.indexedlist import IndexedList
+
+
+class Transfer(object):
+    """ This class holds information about a single transfer. """
+
+    __slots__ = ("__conn", "user", "realfilename", "filename",
+                 "path", "__req", "size", "file", "starttime", "lasttime",
+                 "offset", "currentbytes", "lastbytes", "speed", "timeelapsed",
+                 "timeleft", "__timequeued", "transfertimer", "requestconn",
+                 "modifier", "place", "bitrate", "length", "iter", "__status", "laststatuschange",
+                 "_registry")
+
+    def __init__(
+        self, conn=None, user=None, realfilename=None, filename=None,
+        path=None, status=None, req=None, size=None, file=None, starttime=None,
+        offset=None, currentbytes=None, speed=None, timeelapsed=None,
+        timeleft=None, timequeued=None, transfertimer=None, requestconn=None,
+        modifier=None, place=0, bitrate=None, length=None, iter=None
+    ):
+        self._registry = None
+        self.__conn = self.__req = self.__status = self.__timequeued = None
+        self.user = user
+        self.realfilename = realfilename  # Sent as is to the user announcing what file we're sending
+        self.filename = filename
+        self.conn = conn
+        self.path = path  # Used for ???
+        self.modifier = modifier
+        self.req = req
+        self.size = size
+        self.file = file
+        self.starttime = starttime
+        self.lasttime = starttime
+        self.offset = offset
+        self.currentbytes = currentbytes
+        self.lastbytes = currentbytes
+        self.speed = speed
+        self.timeelapsed = timeelapsed
+        self.timeleft = timeleft
+        self.timequeued = timequeued
+        self.transfertimer = transfertimer
+        self.requestconn = None
+        self.place = place  # Queue position
+        self.bitrate = bitrate
+        self.length = length
+        self.iter = iter
+        self.setstatus(status)
+
+    def setstatus(self, status):
+        oldstatus = self.__status
+        self.__status = status
+        self.laststatuschange = time.time()
+
+        if self._registry is not None:
+            self._registry._changed(self, "status", oldstatus, status)
+
+    def getstatus(self):
+        return self.__status
+    status = property(getstatus, setstatus)
+
+    def setconn(self, conn):
+        oldconn = self.__conn
+        self.__conn = conn
+
+        if self._registry is not None:
+            self._registry._changed(self, "conn", oldconn, conn)
+
+    def getconn(self):
+        return self.__conn
+    conn = property(getconn, setconn)
+
+    def setreq(self, req):
+        oldreq = self.__req
+        self.__req = req
+
+        if self._registry is not None:
+            self._registry._changed(self, "req", oldreq, req)
+
+    def getreq(self):
+        return self.__req
+    req = property(getreq, setreq)
+
+    def settimequeued(self, timequeued):
+        self.__timequeued = timequeued
+
+        if self._registry is not None:
+            self._registry._changed(self)
+
+    def gettimequeued(self):
+        return self.__timequeued
+    timequeued = property(gettimequeued, settimequeued)
+
+
+class TransferRegistry(IndexedList):
+    """ List of transfers that also keeps track of them by connection,
+    request token, user, (user, filename) and status, so that handlers of
+    transfer messages find their transfers without going through all of
+    them.
+
+    Transfers report changes of their conn, req, status and timequeued to
+    the registry they are in. Their user and filename must not change while
+    they are in it.
+
+    If a scheduler is given, such as an UploadScheduler, it's told about
+    every transfer added, removed or changed. """
+
+    INDEXES = (
+        ("conn", attrgetter("conn")),
+        ("req", attrgetter("req")),
+        ("user", attrgetter("user")),
+        ("file", attrgetter("user", "filename")),
+        ("status", attrgetter("status"))
+    )
+    OWNER = "_registry"
+    ITEM_NAME = "Transfer"
+
+    def __init__(self, transfers=(), scheduler=None):
+
+        self.scheduler = scheduler
+        IndexedList.__init__(self, transfers)
+
+    def _changed(self, transfer, name=None, oldkey=None, newkey=None):
+
+        if name is not None:
+            self._move(name, transfer, oldkey, newkey)
+
+        if self.scheduler is not None:
+            self.scheduler.update(transfer)
+
+    def _register(self, transfer):
+
+        IndexedList._register(self, transfer)
+
+        if self.scheduler is not None:
+            self.scheduler.add(transfer)
+
+    def _unregister(self, transfer):
+
+        if self.scheduler is not None:
+            self.scheduler.remove(transfer)
+
+        IndexedList._unregister(self, transfer)
+
+    def by_conn(self, conn):
+        return self._lookup("conn", conn)
+
+    def by_req(self, req):
+        return self._lookup("req", req)
+
+    def by_user(self, user):
+        return self._lookup("user", user)
+
+    def by_file(self, user, filename):
+        return self._lookup("file", (user, filename))
+
+    def by_status(self, status):
+        return self._lookup("status", status)
+
+    def count_status(self, status):
+        return self._count("status", status)
@@ -34,7 +34,6 @@ import os.path
 import re
 import shutil
 import stat
-import threading
 import time
 from gettext import gettext as _
 from gi.repository import GLib
@@ -44,62 +43,14 @@ from pynicotine import slskmessages
 from pynicotine import utils
 from pynicotine.logfacility import log
 from pynicotine.slskmessages import newId
+from pynicotine.transferregistry import Transfer
+from pynicotine.transferregistry import TransferRegistry
+from pynicotine.uploadscheduler import UploadScheduler
 from pynicotine.utils import executeCommand
 from pynicotine.utils import CleanFile
 from pynicotine.utils import GetResultBitrateLength
 
 
-class Transfer(object):
-    """ This class holds information about a single transfer. """
-
-    __slots__ = ("conn", "user", "realfilename", "filename",
-                 "path", "req", "size", "file", "starttime", "lasttime",
-                 "offset", "currentbytes", "lastbytes", "speed", "timeelapsed",
-                 "timeleft", "timequeued", "transfertimer", "requestconn",
-                 "modifier", "place", "bitrate", "length", "iter", "__status", "laststatuschange")
-
-    def __init__(
-        self, conn=None, user=None, realfilename=None, filename=None,
-        path=None, status=None, req=None, size=None, file=None, starttime=None,
-        offset=None, currentbytes=None, speed=None, timeelapsed=None,
-        timeleft=None, timequeued=None, transfertimer=None, requestconn=None,
-        modifier=None, place=0, bitrate=None, length=None, iter=None
-    ):
-        self.user = user
-        self.realfilename = realfilename  # Sent as is to the user announcing what file we're sending
-        self.filename = filename
-        self.conn = conn
-        self.path = path  # Used for ???
-        self.modifier = modifier
-        self.req = req
-        self.size = size
-        self.file = file
-        self.starttime = starttime
-        self.lasttime = starttime
-        self.offset = offset
-        self.currentbytes = currentbytes
-        self.lastbytes = currentbytes
-        self.speed = speed
-        self.timeelapsed = timeelapsed
-        self.timeleft = timeleft
-        self.timequeued = timequeued
-        self.transfertimer = transfertimer
-        self.requestconn = None
-        self.place = place  # Queue position
-        self.bitrate = bitrate
-        self.length = length
-        self.iter = iter
-        self.setstatus(status)
-
-    def setstatus(self, status):
-        self.__status = status
-        self.laststatuschange = time.time()
-
-    def getstatus(self):
-        return self.__status
-    status = property(getstatus, setstatus)
-
-
 class TransferTimeout:
     def __init__(self, req, callback):
         self.req = req
@@ -116,14 +67,21 @@ class Transfers:
     PRE_TRANSFER = ["Queued"]
     TRANSFER = ["Requesting file", "Initializing transfer", "Transferring"]
 
+    # Upload queue tiers, privileged users and privileged buddies go first
+    PRIVILEGED_TIER = 0
+    REGULAR_TIER = 1
+
     def __init__(self, downloads, peerconns, queue, eventprocessor, users):
 
         self.peerconns = peerconns
         self.queue = queue
         self.eventprocessor = eventprocessor
-        self.downloads = []
-        self.uploads = []
+        self.downloads = TransferRegistry()
+        self.uploadscheduler = UploadScheduler(
+            self.getUploadTier, fifo=eventprocessor.config.sections["transfers"]["fifoqueue"])
+        self.uploads = TransferRegistry(scheduler=self.uploadscheduler)
         self.privilegedusers = []
+        self.privilegedbuddies = set()
         self.RequestedUploadQueue = []
         getstatus = {}
 
@@ -177,10 +135,6 @@ class Transfers:
         self.downloadspanel = None
         self.uploadspanel = None
 
-        # queue sizes
-        self.privcount = 0
-        self.usersqueued = {}
-        self.privusersqueued = {}
         self.geoip = self.eventprocessor.geoip
 
         # Check for failed downloads if option is enabled (1 min delay)
@@ -198,12 +152,7 @@ class Transfers:
 
         if user not in self.privilegedusers:
             self.privilegedusers.append(user)
-
-        if user in self.usersqueued:
-            self.privusersqueued.setdefault(user, 0)
-            self.privusersqueued[user] += self.usersqueued[user]
-            self.privcount += self.usersqueued[user]
-            del self.usersqueued[user]
+            self.uploadscheduler.update_user(user)
 
     def getAddUser(self, msg):
         """ Server tells us it'll notify us about a change in user's status """
@@ -214,8 +163,8 @@ class Transfers:
     def GetUserStatus(self, msg):
         """ We get a status of a user and if he's online, we request a file from him """
 
-        for i in self.downloads:
-            if msg.user == i.user and i.status in ["Queued", "Getting status", "User logged off", "Connection closed by peer", "Aborted", "Cannot connect", "Paused"]:
+        for i in self.downloads.by_user(msg.user):
+            if i.status in ["Queued", "Getting status", "User logged off", "Connection closed by peer", "Aborted", "Cannot connect", "Paused"]:
                 if msg.status != 0:
                     if i.status not in ["Queued", "Aborted", "Cannot connect", "Paused"]:
                         self.getFile(i.user, i.filename, i.path, i)
@@ -224,8 +173,8 @@ class Transfers:
                         i.status = "User logged off"
                         self.downloadspanel.update(i)
 
-        for i in self.uploads[:]:
-            if msg.user == i.user and i.status != "Finished":
+        for i in self.uploads.by_user(msg.user):
+            if i.status != "Finished":
                 if msg.status != 0:
                     if i.status == "Getting status":
                         self.pushFile(i.user, i.filename, i.realfilename, i.path, i)
@@ -242,8 +191,8 @@ class Transfers:
         path = utils.CleanPath(path, absolute=True)
 
         if checkduplicate:
-            for i in self.downloads:
-                if i.user == user and i.filename == filename and i.path == path:
+            for i in self.downloads.by_file(user, filename):
+                if i.path == path:
                     # Don't add duplicate downloads
                     return
 
@@ -312,15 +261,14 @@ class Transfers:
 
     def UploadFailed(self, msg):
 
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-                break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
+            break
         else:
             return
 
-        for i in self.downloads:
-            if i.user == user and i.filename == msg.file and (i.conn is not None or i.status in ["Connection closed by peer", "Establishing connection", "Waiting for download"]):
+        for i in self.downloads.by_file(user, msg.file):
+            if i.conn is not None or i.status in ["Connection closed by peer", "Establishing connection", "Waiting for download"]:
                 self.AbortTransfer(i)
                 self.getFile(i.user, i.filename, i.path, i)
                 self.eventprocessor.logTransfer(
@@ -334,55 +282,47 @@ class Transfers:
 
     def gettingAddress(self, req):
 
-        for i in self.downloads:
-            if i.req == req:
-                i.status = "Getting address"
-                self.downloadspanel.update(i)
+        for i in self.downloads.by_req(req):
+            i.status = "Getting address"
+            self.downloadspanel.update(i)
 
-        for i in self.uploads:
-            if i.req == req:
-                i.status = "Getting address"
-                self.uploadspanel.update(i)
+        for i in self.uploads.by_req(req):
+            i.status = "Getting address"
+            self.uploadspanel.update(i)
 
     def gotAddress(self, req):
         """ A connection is in progress, we got the address for a user we need
         to connect to."""
 
-        for i in self.downloads:
-            if i.req == req:
-                i.status = "Connecting"
-                self.downloadspanel.update(i)
+        for i in self.downloads.by_req(req):
+            i.status = "Connecting"
+            self.downloadspanel.update(i)
 
-        for i in self.uploads:
-            if i.req == req:
-                i.status = "Connecting"
-                self.uploadspanel.update(i)
+        for i in self.uploads.by_req(req):
+            i.status = "Connecting"
+            self.uploadspanel.update(i)
 
     def gotConnectError(self, req):
         """ We couldn't connect to the user, now we are waitng for him to
         connect to us. Note that all this logic is handled by the network
         event processor, we just provide a visual feedback to the user."""
 
-        for i in self.downloads:
-            if i.req == req:
-                i.status = "Waiting for peer to connect"
-                self.downloadspanel.update(i)
+        for i in self.downloads.by_req(req):
+            i.status = "Waiting for peer to connect"
+            self.downloadspanel.update(i)
 
-        for i in self.uploads:
-            if i.req == req:
-                i.status = "Waiting for peer to connect"
-                self.uploadspanel.update(i)
+        for i in self.uploads.by_req(req):
+            i.status = "Waiting for peer to connect"
+            self.uploadspanel.update(i)
 
     def gotCantConnect(self, req):
         """ We can't connect to the user, either way. """
 
-        for i in self.downloads:
-            if i.req == req:
-                self._getCantConnectDownload(i)
+        for i in self.downloads.by_req(req):
+            self._getCantConnectDownload(i)
 
-        for i in self.uploads:
-            if i.req == req:
-                self._getCantConnectUpload(i)
+        for i in self.uploads.by_req(req):
+            self._getCantConnectUpload(i)
 
     def _getCantConnectDownload(self, i):
 
@@ -401,9 +341,8 @@ class Transfers:
         i.req = None
         curtime = time.time()
 
-        for j in self.uploads:
-            if j.user == i.user:
-                j.timequeued = curtime
+        for j in self.uploads.by_user(i.user):
+            j.timequeued = curtime
 
         self.uploadspanel.update(i)
 
@@ -417,42 +356,37 @@ class Transfers:
         """ A transfer connection has been established,
         now exchange initialisation messages."""
 
-        for i in self.downloads:
-            if i.req == req:
-                i.status = "Initializing transfer"
-                self.downloadspanel.update(i)
+        for i in self.downloads.by_req(req):
+            i.status = "Initializing transfer"
+            self.downloadspanel.update(i)
 
-        for i in self.uploads:
-            if i.req == req:
-                i.status = "Initializing transfer"
-                self.uploadspanel.update(i)
+        for i in self.uploads.by_req(req):
+            i.status = "Initializing transfer"
+            self.uploadspanel.update(i)
 
     def gotConnect(self, req, conn):
         """ A connection has been established, now exchange initialisation
         messages."""
 
-        for i in self.downloads:
-            if i.req == req:
-                i.status = "Requesting file"
-                i.requestconn = conn
-                self.downloadspanel.update(i)
+        for i in self.downloads.by_req(req):
+            i.status = "Requesting file"
+            i.requestconn = conn
+            self.downloadspanel.update(i)
 
-        for i in self.uploads:
-            if i.req == req:
-                i.status = "Requesting file"
-                i.requestconn = conn
-                self.uploadspanel.update(i)
+        for i in self.uploads.by_req(req):
+            i.status = "Requesting file"
+            i.requestconn = conn
+            self.uploadspanel.update(i)
 
     def TransferRequest(self, msg):
 
         user = response = None
 
         if msg.conn is not None:
-            for i in self.peerconns:
-                if i.conn is msg.conn.conn:
-                    user = i.username
-                    conn = msg.conn.conn
-                    addr = msg.conn.addr[0]
+            for i in self.peerconns.by_conn(msg.conn.conn):
+                user = i.username
+                conn = msg.conn.conn
+                addr = msg.conn.addr[0]
         elif msg.tunneleduser is not None:
             user = msg.tunneleduser
             conn = None
@@ -474,30 +408,27 @@ class Transfers:
 
     def TransferRequestDownloads(self, msg, user, conn, addr):
 
-        for i in self.downloads:
-            if i.filename == msg.file and user == i.user:
-                # Remote peer is signalling a tranfer is ready, attempting to download it
+        for i in self.downloads.by_file(user, msg.file):
+            # Remote peer is signalling a tranfer is ready, attempting to download it
 
-                """ If the file is larger than 2GB, the SoulseekQt client seems to
-                send a malformed file size (0 bytes) in the TransferRequest response.
-                In that case, we rely on the cached, correct file size we received when
-                we initially added the download. """
-                if msg.filesize > 0:
-                    i.size = msg.filesize
+            """ If the file is larger than 2GB, the SoulseekQt client seems to
+            send a malformed file size (0 bytes) in the TransferRequest response.
+            In that case, we rely on the cached, correct file size we received when
+            we initially added the download. """
+            if msg.filesize > 0:
+                i.size = msg.filesize
 
-                i.req = msg.req
-                i.status = "Waiting for download"
-                transfertimeout = TransferTimeout(i.req, self.eventprocessor.frame.callback)
+            i.req = msg.req
+            i.status = "Waiting for download"
+            transfertimeout = TransferTimeout(i.req, self.eventprocessor.frame.callback)
 
-                if i.transfertimer is not None:
-                    i.transfertimer.cancel()
+            if i.transfertimer is not None:
+                i.transfertimer.cancel()
 
-                i.transfertimer = threading.Timer(30.0, transfertimeout.timeout)
-                i.transfertimer.setDaemon(True)
-                i.transfertimer.start()
-                response = slskmessages.TransferResponse(conn, 1, req=i.req)
-                self.downloadspanel.update(i)
-                break
+            i.transfertimer = self.eventprocessor.timers.add(30.0, transfertimeout.timeout)
+            response = slskmessages.TransferResponse(conn, 1, req=i.req)
+            self.downloadspanel.update(i)
+            break
         else:
             # If this file is not in your download queue, then it must be
             # a remotely initated download and someone is manually uploading to you
@@ -587,7 +518,6 @@ class Transfers:
             )
             self._appendUpload(user, msg.file, newupload)
             self.uploadspanel.update(newupload)
-            self.addQueued(user, realpath)
             return response
 
         # All checks passed, starting a new upload.
@@ -602,25 +532,22 @@ class Transfers:
         )
 
         self._appendUpload(user, msg.file, transferobj)
-        transferobj.transfertimer = threading.Timer(30.0, transfertimeout.timeout)
-        transferobj.transfertimer.setDaemon(True)
-        transferobj.transfertimer.start()
+        transferobj.transfertimer = self.eventprocessor.timers.add(30.0, transfertimeout.timeout)
         self.uploadspanel.update(transferobj)
         return response
 
     def _appendUpload(self, user, filename, transferobj):
 
-        for i in self.uploads:
-            if i.user == user and i.filename == filename:
-                self.uploads.remove(i)
-                self.uploadspanel.remove_specific(i, True)
+        for i in self.uploads.by_file(user, filename):
+            self.uploads.remove(i)
+            self.uploadspanel.remove_specific(i, True)
 
         self.uploads.append(transferobj)
 
     def fileIsUploadQueued(self, user, filename):
 
-        for i in self.uploads:
-            if i.user == user and i.filename == filename and i.status in self.PRE_TRANSFER + self.TRANSFER:
+        for i in self.uploads.by_file(user, filename):
+            if i.status in self.PRE_TRANSFER + self.TRANSFER:
                 return True
 
         return False
@@ -632,7 +559,7 @@ class Transfers:
         if not uploadslimit:
             return False
 
-        sizelist = [i.size for i in self.uploads if i.user == user and i.status == "Queued"]
+        sizelist = [i.size for i in self.uploads.by_user(user) if i.status == "Queued"]
 
         size = sum(sizelist)
         return size >= uploadslimit
@@ -644,7 +571,7 @@ class Transfers:
         if not filelimit:
             return False
 
-        numfiles = len([i for i in self.uploads if i.user == user and i.status == "Queued"])
+        numfiles = len([i for i in self.uploads.by_user(user) if i.status == "Queued"])
 
         return numfiles >= filelimit
 
@@ -652,9 +579,8 @@ class Transfers:
         """ Peer remotely(?) queued a download (upload here) """
 
         user = None
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
 
         if user is None:
             return
@@ -699,7 +625,6 @@ class Transfers:
                 )
                 self._appendUpload(user, msg.file, newupload)
                 self.uploadspanel.update(newupload)
-                self.addQueued(user, msg.file)
                 self.eventprocessor.frame.pluginhandler.UploadQueuedNotification(user, msg.file, realpath)
 
             else:
@@ -718,10 +643,9 @@ class Transfers:
 
         username = None
 
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                username = i.username
-                break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            username = i.username
+            break
 
         if username is None:
             return
@@ -775,12 +699,11 @@ class Transfers:
 
     def QueueFailed(self, msg):
 
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
 
-        for i in self.downloads:
-            if i.user == user and i.filename == msg.file and i.status == "Queued":
+        for i in self.downloads.by_file(user, msg.file):
+            if i.status == "Queued":
                 i.status = msg.reason
                 self.downloadspanel.update(i)
                 break
@@ -809,7 +732,7 @@ class Transfers:
         return False
 
     def getTransferringUsers(self):
-        return [i.user for i in self.uploads if i.req is not None or i.conn is not None or i.status == "Getting status"]  # some file is being transfered
+        return self.uploadscheduler.active_users  # some file is being transfered
 
     def transferNegotiating(self):
 
@@ -817,7 +740,7 @@ class Transfers:
         now = time.time()
         count = 0
 
-        for i in self.uploads:
+        for i in self.uploadscheduler.active:
             if (now - i.laststatuschange) < 30:  # if a status hasn't changed in the last 30 seconds the connection is probably never going to work, ignoring it.
 
                 if i.req is not None:
@@ -835,7 +758,7 @@ class Transfers:
         limit_upload_slots = self.eventprocessor.config.sections["transfers"]["useupslots"]
         limit_upload_speed = self.eventprocessor.config.sections["transfers"]["uselimit"]
 
-        bandwidthlist = [i.speed for i in self.uploads if i.conn is not None and i.speed is not None]
+        bandwidthlist = [i.speed for i in self.uploadscheduler.active if i.conn is not None and i.speed is not None]
         currently_negotiating = self.transferNegotiating()
 
         if limit_upload_slots:
@@ -872,10 +795,7 @@ class Transfers:
 
         if msg.reason is not None:
 
-            for i in self.downloads:
-
-                if i.req != msg.req:
-                    continue
+            for i in self.downloads.by_req(msg.req):
 
                 i.status = msg.reason
                 i.req = None
@@ -892,10 +812,7 @@ class Transfers:
 
                 self.checkUploadQueue()
 
-            for i in self.uploads:
-
-                if i.req != msg.req:
-                    continue
+            for i in self.uploads.by_req(msg.req):
 
                 i.status = msg.reason
                 i.req = None
@@ -921,10 +838,7 @@ class Transfers:
                 self.checkUploadQueue()
 
         elif msg.filesize is not None:
-            for i in self.downloads:
-
-                if i.req != msg.req:
-                    continue
+            for i in self.downloads.by_req(msg.req):
 
                 i.size = msg.filesize
                 i.status = "Establishing connection"
@@ -933,10 +847,7 @@ class Transfers:
                 self.downloadspanel.update(i)
                 break
         else:
-            for i in self.uploads:
-
-                if i.req != msg.req:
-                    continue
+            for i in self.uploads.by_req(msg.req):
 
                 i.status = "Establishing connection"
                 self.eventprocessor.ProcessRequestToPeer(i.user, slskmessages.FileRequest(None, msg.req))
@@ -948,10 +859,7 @@ class Transfers:
 
     def TransferTimeout(self, msg):
 
-        for i in (self.downloads + self.uploads):
-
-            if i.req != msg.req:
-                continue
+        for i in self.downloads.by_req(msg.req) + self.uploads.by_req(msg.req):
 
             if i.status in ["Queued", "User logged off", "Paused"] + self.COMPLETED_TRANSFERS:
                 continue
@@ -960,9 +868,8 @@ class Transfers:
             i.req = None
             curtime = time.time()
 
-            for j in self.uploads:
-                if j.user == i.user:
-                    j.timequeued = curtime
+            for j in self.uploads.by_user(i.user):
+                j.timequeued = curtime
 
             if i.user not in self.eventprocessor.watchedusers:
                 self.queue.put(slskmessages.AddUser(i.user))
@@ -980,15 +887,13 @@ class Transfers:
         """ Got an incoming file request. Could be an upload request or a
         request to get the file that was previously queued"""
 
-        for i in self.downloads:
-            if msg.req == i.req:
-                self._FileRequestDownload(msg, i)
-                return
+        for i in self.downloads.by_req(msg.req):
+            self._FileRequestDownload(msg, i)
+            return
 
-        for i in self.uploads:
-            if msg.req == i.req:
-                self._FileRequestUpload(msg, i)
-                return
+        for i in self.uploads.by_req(msg.req):
+            self._FileRequestUpload(msg, i)
+            return
 
         self.queue.put(slskmessages.ConnClose(msg.conn))
 
@@ -1171,10 +1076,7 @@ class Transfers:
 
         needupdate = True
 
-        for i in self.downloads:
-
-            if i.conn != msg.conn:
-                continue
+        for i in self.downloads.by_conn(msg.conn):
 
             try:
 
@@ -1336,10 +1238,7 @@ class Transfers:
 
         needupdate = True
 
-        for i in self.uploads:
-
-            if i.conn != msg.conn:
-                continue
+        for i in self.uploads.by_conn(msg.conn):
 
             if i.transfertimer is not None:
                 i.transfertimer.cancel()
@@ -1399,9 +1298,8 @@ class Transfers:
                 i.speed = 0
                 i.timeleft = ""
 
-                for j in self.uploads:
-                    if j.user == i.user:
-                        j.timequeued = curtime
+                for j in self.uploads.by_user(i.user):
+                    j.timequeued = curtime
 
                 self.eventprocessor.logTransfer(
                     _("Upload finished: %(user)s, file %(file)s") % {
@@ -1432,7 +1330,6 @@ class Transfers:
         if self.eventprocessor.config.sections["transfers"]["autoclear_uploads"]:
             self.uploads.remove(transfer)
             self.uploadspanel.remove_specific(transfer, True)
-            self.calcUploadQueueSizes()
             self.checkUploadQueue()
 
     def BanUser(self, user, ban_message=None):
@@ -1449,7 +1346,7 @@ class Transfers:
         else:
             banmsg = _("Banned")
 
-        list = [i for i in self.uploads if i.user == user]
+        list = self.uploads.by_user(user)
         for upload in list:
             if upload.status == "Queued":
                 self.eventprocessor.ProcessRequestToPeer(user, slskmessages.QueueFailed(None, file=upload.filename, reason=banmsg))
@@ -1487,130 +1384,40 @@ class Transfers:
         if not self.allowNewUploads():
             return
 
-        transfercandidate = None
-        trusers = self.getTransferringUsers()
-
-        # List of transfer instances of users who are not currently transferring
-        list = [i for i in self.uploads if i.user not in trusers and i.status == "Queued"]
-
-        # Sublist of privileged users transfers
-        listprivileged = [i for i in list if self.isPrivileged(i.user)]
-
-        if len(listprivileged) > 0:
-            # Upload to a privileged user
-            # Only Privileged users' files will get selected
-            list = listprivileged
-
-        if len(list) == 0:
-            return
+        self.checkPrivilegedBuddies()
 
-        if self.eventprocessor.config.sections["transfers"]["fifoqueue"]:
-            # FIFO
-            # Get the first item in the list
-            transfercandidate = list[0]
-        else:
-            # Round Robin
-            # Get first transfer that was queued less than one second from now
-            mintimequeued = time.time() + 1
-            for i in list:
-                if i.timequeued < mintimequeued:
-                    transfercandidate = i
-                    # Break loop
-                    mintimequeued = i.timequeued
+        # FIFO picks the first file queued by users who are not currently
+        # transferring, Round Robin the file of the user who waited longest.
+        # Privileged users' files are picked first.
+        transfercandidate = self.uploadscheduler.next_candidate()
 
         if transfercandidate is not None:
             self.pushFile(
                 user=transfercandidate.user, filename=transfercandidate.filename,
                 realfilename=transfercandidate.realfilename, transfer=transfercandidate
             )
-            self.removeQueued(transfercandidate.user, transfercandidate.filename)
-
-    def PlaceInQueueRequest(self, msg):
-
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                user = i.username
-
-        def listUsers():
-            users = []
-            for i in self.uploads:
-                if i.user not in users:
-                    users.append(i.user)
-            return users
-
-        def countTransfers(username):
-            transfers = []
-            for i in self.uploads:
-                if i.status == "Queued":
-                    if i.user == username:
-                        transfers.append(i)
-            return len(transfers)
 
-        if self.eventprocessor.config.sections["transfers"]["fifoqueue"]:
+    def updateQueueMode(self):
+        """ Switches the upload queue between FIFO and Round Robin, after the
+        fifoqueue setting changed """
 
-            # Number of transfers queued by non-privileged users
-            count = 0
+        self.uploadscheduler.fifo = self.eventprocessor.config.sections["transfers"]["fifoqueue"]
 
-            # Number of transfers queued by privileged users
-            countpriv = 0
+    def PlaceInQueueRequest(self, msg):
 
-            # Place in the queue for msg.file
-            place = 0
+        user = None
 
-            for i in self.uploads:
-                # Ignore non-queued files
-                if i.status == "Queued":
-                    if self.isPrivileged(i.user):
-                        countpriv += 1
-                    else:
-                        count += 1
-
-                    # Stop counting on the matching file
-                    if i.user == user and i.filename == msg.file:
-                        if self.isPrivileged(user):
-                            # User is privileged so we only
-                            # count priv'd transfers
-                            place = countpriv
-                        else:
-                            # Count all transfers
-                            place = count + countpriv
-                        break
-        else:
-            # Todo
-            list = listpriv = {user: time.time()}  # noqa: F841
-            countpriv = 0
-            trusers = self.getTransferringUsers()
-            count = 0
-            place = 0
-            transfers = 0
-
-            for i in self.uploads:
-                # Ignore non-queued files
-                if i.status == "Queued":
-                    if i.user == user:
-                        if self.isPrivileged(user):
-                            # User is privileged so we only
-                            # count priv'd transfers
-                            listpriv[i.user] = i.timequeued
-                            place += 1
-                        else:
-                            # Count all transfers
-                            place += 1
-                        # Stop counting on the matching file
-                        if i.filename == msg.file:
-                            break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            user = i.username
 
-            uploadUsers = listUsers()
-            userTransfers = {}
+        if user is None:
+            return
 
-            for username in uploadUsers:
-                userTransfers[username] = countTransfers(username)
-                if username is not user:
-                    if userTransfers[username] >= place:
-                        if username not in trusers:
-                            transfers += place
+        place = 0
 
-            place += transfers
+        for i in self.uploads.by_file(user, msg.file):
+            if i.status == "Queued":
+                place = self.uploadscheduler.place(i)
 
         self.queue.put(slskmessages.PlaceInQueue(msg.conn.conn, msg.file, place))
 
@@ -1627,51 +1434,20 @@ class Transfers:
 
         return time_string
 
-    def calcUploadQueueSizes(self):
-        # queue sizes
-        self.privcount = 0
-        self.usersqueued = {}
-        self.privusersqueued = {}
-
-        for i in self.uploads:
-            if i.status == "Queued":
-                self.addQueued(i.user, i.filename)
-
     def getUploadQueueSizes(self, username=None):
 
+        scheduler = self.uploadscheduler
+
         if self.eventprocessor.config.sections["transfers"]["fifoqueue"]:
-            count = 0
-            for i in self.uploads:
-                if i.status == "Queued":
-                    count += 1
+            count = scheduler.num_queued()
             return count, count
         else:
             if self.isPrivileged(username):
-                return len(self.privusersqueued), len(self.privusersqueued)
+                count = scheduler.num_queued_users(self.PRIVILEGED_TIER)
+                return count, count
             else:
-                return len(self.usersqueued) + self.privcount, self.privcount
-
-    def addQueued(self, user, filename):
-
-        if user in self.privilegedusers:
-            self.privusersqueued.setdefault(user, 0)
-            self.privusersqueued[user] += 1
-            self.privcount += 1
-        else:
-            self.usersqueued.setdefault(user, 0)
-            self.usersqueued[user] += 1
-
-    def removeQueued(self, user, filename):
-
-        if user in self.privilegedusers:
-            self.privusersqueued[user] -= 1
-            self.privcount -= 1
-            if self.privusersqueued[user] == 0:
-                del self.privusersqueued[user]
-        else:
-            self.usersqueued[user] -= 1
-            if self.usersqueued[user] == 0:
-                del self.usersqueued[user]
+                privcount = scheduler.num_queued(self.PRIVILEGED_TIER)
+                return scheduler.num_queued_users(self.REGULAR_TIER) + privcount, privcount
 
     def getTotalUploadsAllowed(self):
 
@@ -1681,7 +1457,7 @@ class Transfers:
             maxupslots = self.eventprocessor.config.sections["transfers"]["uploadslots"]
             return maxupslots
         else:
-            lst = [i for i in self.uploads if i.conn is not None]
+            lst = [i for i in self.uploadscheduler.active if i.conn is not None]
             if self.allowNewUploads():
                 return len(lst) + 1
             else:
@@ -1703,6 +1479,28 @@ class Transfers:
         else:
             return False
 
+    def checkPrivilegedBuddies(self):
+        """ Moves buddies to their new upload tier when their privileges
+        changed in the buddy list or settings """
+
+        preferfriends = self.eventprocessor.config.sections["transfers"]["preferfriends"]
+        buddies = {i[0] for i in self.eventprocessor.config.sections["server"]["userlist"] if preferfriends or i[3]}
+
+        if buddies == self.privilegedbuddies:
+            return
+
+        for user in buddies ^ self.privilegedbuddies:
+            self.uploadscheduler.update_user(user)
+
+        self.privilegedbuddies = buddies
+
+    def getUploadTier(self, user):
+
+        if self.isPrivileged(user):
+            return self.PRIVILEGED_TIER
+
+        return self.REGULAR_TIER
+
     def isPrivileged(self, user):
 
         if user in self.privilegedusers or self.UserListPrivileged(user):
@@ -1714,17 +1512,17 @@ class Transfers:
         """ The remote user has closed the connection either because
         he logged off, or because there's a network problem. """
 
-        for i in self.downloads:
-            if i.conn != conn:
-                continue
-
+        for i in self.downloads.by_conn(conn):
             self._ConnClose(conn, addr, i, "download")
 
-        for i in self.uploads:
-            if type(error) is not ConnectionRefusedError and i.conn != conn:
-                continue
-            elif i.user != user:
-                # Connection refused, cancel all of user's transfers
+        if type(error) is ConnectionRefusedError:
+            # Connection refused, cancel all of user's transfers
+            uploads = self.uploads.by_user(user)
+        else:
+            uploads = self.uploads.by_conn(conn)
+
+        for i in uploads:
+            if i.user != user:
                 continue
 
             self._ConnClose(conn, addr, i, "upload")
@@ -1756,9 +1554,8 @@ class Transfers:
                 self.AutoClearUpload(i)
 
         curtime = time.time()
-        for j in self.uploads:
-            if j.user == i.user:
-                j.timequeued = curtime
+        for j in self.uploads.by_user(i.user):
+            j.timequeued = curtime
 
         i.conn = None
 
@@ -1789,29 +1586,20 @@ class Transfers:
         """ The server tells us our place in queue for a particular transfer."""
 
         username = None
-        for i in self.peerconns:
-            if i.conn is msg.conn.conn:
-                username = i.username
-                break
+        for i in self.peerconns.by_conn(msg.conn.conn):
+            username = i.username
+            break
 
         if username:
-            for i in self.downloads:
-                if i.user != username:
-                    continue
-
-                if i.filename != msg.filename:
-                    continue
-
+            for i in self.downloads.by_file(username, msg.filename):
                 i.place = msg.place
                 self.downloadspanel.update(i)
 
     def FileError(self, msg):
         """ Networking thread encountered a local file error"""
 
-        for i in self.downloads + self.uploads:
+        for i in self.downloads.by_conn(msg.conn.conn) + self.uploads.by_conn(msg.conn.conn):
 
-            if i.conn != msg.conn.conn:
-                continue
             i.status = "Local file error"
 
             try:
@@ -1835,10 +1623,9 @@ class Transfers:
         skip the files in subfolders"""
 
         username = None
-        for i in self.peerconns:
-            if i.conn is conn:
-                username = i.username
-                break
+        for i in self.peerconns.by_conn(conn):
+            username = i.username
+            break
 
         if username is None:
             return
@@ -0,0 +1,414 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+
+from bisect import bisect_left
+from bisect import insort
+
+
+class FenwickTree:
+    """ Counts at positions 0, 1, 2..., growing as needed, that can be
+    changed and summed up to a position in O(log n) """
+
+    def __init__(self):
+
+        # One-based tree, with room for a power of two positions
+        self._tree = [0, 0]
+        self.total = 0
+
+    def add(self, pos, count):
+
+        tree = self._tree
+        i = pos + 1
+
+        while i >= len(tree):
+            # Positions of the new half only add up the old half at its end
+            capacity = len(tree) - 1
+            tree.extend([0] * capacity)
+            tree[2 * capacity] = tree[capacity]
+
+        while i < len(tree):
+            tree[i] += count
+            i += i & -i
+
+        self.total += count
+
+    def sum(self, pos):
+        """ Returns the sum of counts up to and including pos """
+
+        tree = self._tree
+        i = min(pos + 1, len(tree) - 1)
+        total = 0
+
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+
+        return total
+
+
+class UploadScheduler:
+    """ Decides which queued upload to start next, and where queued uploads
+    are in the queue, without going through all uploads every time.
+
+    Each user has a queue of their queued uploads, in the order the uploads
+    were added. Users with queued uploads and none in progress wait in a
+    heap of their tier, keyed by the first upload in their queue: its place
+    in the order uploads were added (FIFO), or the time it was queued (round
+    robin). Tiers are numbers returned by get_tier(user), and users of a
+    lower tier are served before anyone of a higher one. Queued uploads are
+    also counted in a FenwickTree per tier, by the order they were added,
+    and waiting users by the length of their queue.
+
+    The registry holding the uploads reports added, removed and changed
+    transfers. Tiers are looked up when a user queues their first upload,
+    call update_user() when they change. """
+
+    QUEUED = "Queued"
+
+    def __init__(self, get_tier, fifo=False):
+
+        self.get_tier = get_tier
+
+        self._fifo = fifo
+        self._nextseq = 0
+
+        self._transfers = {}    # transfer: [seq, queued, active]
+        self._queues = {}       # user: [(seq, transfer), ...]
+        self._tiers = {}        # user: tier, for users with queued uploads
+        self._active = {}       # transfer: None, for uploads in progress
+        self._activeusers = {}  # user: number of uploads in progress
+        self._entries = {}      # user: (tier, heap entry), for waiting users
+        self._heaps = {}        # tier: heap of (key, user) entries
+
+        self._queuedcounts = {}  # tier: FenwickTree of queued uploads by seq
+        self._usercounts = {}    # tier: number of users with queued uploads
+        self._waiting = {}       # user: queue length, for waiting users
+        self._waitingcounts = FenwickTree()  # waiting users by queue length
+
+    @property
+    def fifo(self):
+        return self._fifo
+
+    @fifo.setter
+    def fifo(self, fifo):
+
+        fifo = bool(fifo)
+
+        if fifo == self._fifo:
+            return
+
+        self._fifo = fifo
+        self._reschedule_all()
+
+    @property
+    def active(self):
+        """ Uploads being negotiated or transferred """
+
+        return list(self._active)
+
+    @property
+    def active_users(self):
+        """ Users with uploads being negotiated or transferred """
+
+        return list(self._activeusers)
+
+    def is_active(self, user):
+        return user in self._activeusers
+
+    def queued(self, user):
+        """ Returns the queued uploads of a user, in the order they will be
+        started """
+
+        return [transfer for _seq, transfer in self._queues.get(user, ())]
+
+    def num_queued(self, tier=None):
+        """ Returns the number of queued uploads, of a tier or all tiers """
+
+        if tier is not None:
+            counts = self._queuedcounts.get(tier)
+            return counts.total if counts is not None else 0
+
+        return sum(counts.total for counts in self._queuedcounts.values())
+
+    def num_queued_users(self, tier=None):
+        """ Returns the number of users with queued uploads, of a tier or
+        all tiers """
+
+        if tier is not None:
+            return self._usercounts.get(tier, 0)
+
+        return len(self._queues)
+
+    def place(self, transfer):
+        """ Returns the place of a queued upload in the queue, or 0 if it
+        isn't queued.
+
+        With FIFO, uploads added before it count, but only those of its
+        user's tier and higher tiers. With round robin, every waiting user
+        with as many queued uploads gets a turn before each of the uploads
+        of its user up to this one. """
+
+        state = self._transfers.get(transfer)
+
+        if state is None or not state[1]:
+            return 0
+
+        seq = state[0]
+        user = transfer.user
+
+        if self._fifo:
+            usertier = self._tiers[user]
+            return sum(counts.sum(seq) for tier, counts in self._queuedcounts.items() if tier <= usertier)
+
+        queue = self._queues[user]
+        num = bisect_left(queue, (seq,)) + 1
+
+        # Waiting users with at least num queued uploads, besides this one
+        others = self._waitingcounts.total - self._waitingcounts.sum(num - 1)
+
+        if self._waiting.get(user, 0) >= num:
+            others -= 1
+
+        return num + num * others
+
+    @staticmethod
+    def is_in_progress(transfer):
+        return transfer.req is not None or transfer.conn is not None or transfer.status == "Getting status"
+
+    def add(self, transfer):
+
+        if self._nextseq >= 2 * len(self._transfers) + 4096:
+            self._renumber()
+
+        self._transfers[transfer] = [self._nextseq, False, False]
+        self._nextseq += 1
+
+        self.update(transfer)
+
+    def remove(self, transfer):
+
+        seq, queued, active = self._transfers.pop(transfer)
+        user = transfer.user
+
+        if queued:
+            self._dequeue(user, seq)
+
+        if active:
+            self._deactivate(transfer)
+
+        self._reschedule(user)
+
+    def update(self, transfer):
+        """ Takes note of changes to the status, connection, request or
+        queue time of an upload """
+
+        state = self._transfers.get(transfer)
+
+        if state is None:
+            return
+
+        seq, wasqueued, wasactive = state
+        user = transfer.user
+
+        queued = (transfer.status == self.QUEUED)
+        active = self.is_in_progress(transfer)
+
+        if queued != wasqueued:
+            if queued:
+                self._enqueue(user, seq, transfer)
+            else:
+                self._dequeue(user, seq)
+
+            state[1] = queued
+
+        if active != wasactive:
+            if active:
+                self._active[transfer] = None
+                self._activeusers[user] = self._activeusers.get(user, 0) + 1
+            else:
+                self._deactivate(transfer)
+
+            state[2] = active
+
+        self._reschedule(user)
+
+    def update_user(self, user):
+        """ Moves a user with queued uploads to their current tier """
+
+        oldtier = self._tiers.get(user)
+
+        if oldtier is None:
+            return
+
+        tier = self.get_tier(user)
+
+        if tier == oldtier:
+            return
+
+        oldcounts = self._queuedcounts[oldtier]
+        counts = self._get_queuedcounts(tier)
+
+        for seq, _transfer in self._queues[user]:
+            oldcounts.add(seq, -1)
+            counts.add(seq, 1)
+
+        self._usercounts[oldtier] -= 1
+        self._usercounts[tier] = self._usercounts.get(tier, 0) + 1
+        self._tiers[user] = tier
+
+        self._reschedule(user)
+
+    def next_candidate(self):
+        """ Returns the queued upload to start next, or None """
+
+        for tier in sorted(self._heaps):
+            heap = self._heaps[tier]
+
+            while heap:
+                entry = heap[0]
+                user = entry[1]
+
+                if self._entries.get(user, (None, None))[1] is entry:
+                    return self._queues[user][0][1]
+
+                # The user's turn changed since the entry was added
+                heapq.heappop(heap)
+
+            del self._heaps[tier]
+
+        return None
+
+    def _get_queuedcounts(self, tier):
+
+        counts = self._queuedcounts.get(tier)
+
+        if counts is None:
+            counts = self._queuedcounts[tier] = FenwickTree()
+
+        return counts
+
+    def _enqueue(self, user, seq, transfer):
+
+        queue = self._queues.get(user)
+
+        if queue is None:
+            queue = self._queues[user] = []
+            tier = self._tiers[user] = self.get_tier(user)
+            self._usercounts[tier] = self._usercounts.get(tier, 0) + 1
+
+        insort(queue, (seq, transfer))
+        self._get_queuedcounts(self._tiers[user]).add(seq, 1)
+
+    def _dequeue(self, user, seq):
+
+        queue = self._queues[user]
+        tier = self._tiers[user]
+
+        del queue[bisect_left(queue, (seq,))]
+        self._queuedcounts[tier].add(seq, -1)
+
+        if not queue:
+            del self._queues[user]
+            del self._tiers[user]
+            self._usercounts[tier] -= 1
+
+    def _deactivate(self, transfer):
+
+        user = transfer.user
+        del self._active[transfer]
+
+        if self._activeusers[user] == 1:
+            del self._activeusers[user]
+        else:
+            self._activeusers[user] -= 1
+
+    def _renumber(self):
+        """ Numbers uploads from 0 again, once many were removed, to keep the
+        FenwickTrees small """
+
+        for seq, state in enumerate(sorted(self._transfers.values())):
+            state[0] = seq
+
+        self._nextseq = len(self._transfers)
+        self._queuedcounts.clear()
+
+        for user, queue in self._queues.items():
+            counts = self._get_queuedcounts(self._tiers[user])
+            queue[:] = [(self._transfers[transfer][0], transfer) for _seq, transfer in queue]
+
+            for seq, _transfer in queue:
+                counts.add(seq, 1)
+
+        self._reschedule_all()
+
+    def _reschedule_all(self):
+
+        self._entries.clear()
+        self._heaps.clear()
+
+        for user in self._queues:
+            self._reschedule(user)
+
+    def _reschedule(self, user):
+        """ Puts a user in the heap of their tier if they're waiting to
+        upload, and drops their previous entry """
+
+        queue = self._queues.get(user)
+        oldtier, oldentry = self._entries.pop(user, (None, None))
+        waiting = bool(queue) and user not in self._activeusers
+
+        length = len(queue) if waiting else 0
+        oldlength = self._waiting.pop(user, 0)
+
+        if length != oldlength:
+            if oldlength:
+                self._waitingcounts.add(oldlength, -1)
+
+            if length:
+                self._waitingcounts.add(length, 1)
+
+        if not waiting:
+            return
+
+        self._waiting[user] = length
+
+        tier = self._tiers[user]
+        seq, transfer = queue[0]
+
+        if self._fifo:
+            key = (seq,)
+        else:
+            key = (transfer.timequeued or 0, seq)
+
+        if oldtier == tier and oldentry[0] == key:
+            # Still in the right place
+            self._entries[user] = (oldtier, oldentry)
+            return
+
+        entry = (key, user)
+        self._entries[user] = (tier, entry)
+
+        heap = self._heaps.setdefault(tier, [])
+        heapq.heappush(heap, entry)
+
+        if len(heap) > 2 * len(self._entries) + 64:
+            # Drop entries of users whose turn changed
+            heap[:] = [entry for entry in heap if self._entries.get(entry[1], (None, None))[1] is entry]
+            heapq.heapify(heap)
@@ -0,0 +1,105 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+
+class VirtualPathMapping:
+    """ Translates between the real paths of shared files and the virtual
+    paths peers see, for a list of (virtual, real) shared folders.
+
+    Both kinds of paths are kept in a trie of their components, so that a
+    lookup only follows the components of the path instead of comparing it
+    to every shared folder. Each trie node is a dict of child components,
+    holding the (order, target) of a shared folder under the None key. If
+    shared folders are nested, the one listed first wins, whatever the
+    length of its path. """
+
+    def __init__(self, mapping):
+
+        self._reals = {}
+        self._virtuals = {}
+
+        for order, (virtual, real) in enumerate(mapping):
+            self._add(self._reals, os.path.normpath(real).split(os.sep), (order, virtual))
+            self._add(self._virtuals, os.path.normpath(virtual).split("\\"), (order, real))
+
+    @staticmethod
+    def _add(node, components, value):
+
+        for component in components:
+            node = node.setdefault(component, {})
+
+        # Keep the first one if a folder is shared twice
+        node.setdefault(None, value)
+
+    @staticmethod
+    def _find(node, components):
+        """ Returns the number of components matched and the target of the
+        first shared folder the components lie in, or None """
+
+        found = None
+
+        for depth, component in enumerate(components, 1):
+            node = node.get(component)
+
+            if node is None:
+                break
+
+            value = node.get(None)
+
+            if value is not None and (found is None or value[0] < found[1][0]):
+                found = depth, value
+
+        if found is None:
+            return None
+
+        depth, (_order, target) = found
+        return depth, target
+
+    def real2virtual(self, path):
+        """ Returns the virtual path of a real path, or None if it isn't shared """
+
+        components = os.path.normpath(path).split(os.sep)
+        found = self._find(self._reals, components)
+
+        if found is None:
+            return None
+
+        depth, virtual = found
+
+        if depth == len(components):
+            return virtual
+
+        return virtual + "\\" + "\\".join(components[depth:])
+
+    def virtual2real(self, path):
+        """ Returns the real path of a virtual path, or None if it isn't shared """
+
+        components = os.path.normpath(path).split("\\")
+        found = self._find(self._virtuals, components)
+
+        if found is None:
+            return None
+
+        depth, real = found
+
+        if depth == len(components):
+            return real
+
+        return real + os.sep + os.sep.join(components[depth:])
@@ -0,0 +1,97 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the memory use of a browsed 300k file share stored as parsed
+SharedFileList lists, and as BrowsedShares, along with the time it takes
+to search it.
+
+Run with: python3 -m test.benchmarks.bench_browsed_shares
+"""
+
+import gc
+import time
+import tracemalloc
+
+from pynicotine.browsedshares import BrowsedShares
+
+NUM_DIRS = 6000
+FILES_PER_DIR = 50
+QUERY = "track title 49."
+
+
+def iter_shares():
+    # Fresh objects for every file, like SharedFileList.parseNetworkMessage() creates
+    for i in range(NUM_DIRS):
+        yield "@@music\\Artist %i\\Album %i" % (i // 10, i), [
+            [1, "Artist %i - Track title %i.mp3" % (i, j), 5000000 + j, "mp3", [320, 240, 0]]
+            for j in range(FILES_PER_DIR)
+        ]
+
+
+def measure(name, build):
+    gc.collect()
+    tracemalloc.start()
+
+    shares = build(iter_shares())
+
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("%-30s %8.1f MB" % (name, size / 1024 / 1024))
+    return shares
+
+
+def find_in_lists(shares, query):
+    # The search UserBrowse.FindMatches() used to do
+    search_list = []
+
+    for directory, files in shares:
+        if query in directory.lower():
+            if directory not in search_list:
+                search_list.append(directory)
+
+        for file in files:
+            if query in file[1].lower():
+                if directory not in search_list:
+                    search_list.append(directory)
+
+    return search_list
+
+
+def search(name, find, shares):
+    start = time.perf_counter()
+    found = find(shares, QUERY)
+    elapsed = time.perf_counter() - start
+
+    print("%-30s %8.3f s, %i directories" % (name, elapsed, len(found)))
+
+
+def main():
+    print("%i directories, %i files" % (NUM_DIRS, NUM_DIRS * FILES_PER_DIR))
+
+    lists = measure("Lists", list)
+    search("Search lists", find_in_lists, lists)
+    del lists
+
+    compact = measure("BrowsedShares", BrowsedShares)
+    search("Search BrowsedShares", BrowsedShares.find, compact)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the old immutable bytes buffers with ConnectionBuffer when
+receiving a 50 MB SharedFileList (browse) response, and when sending
+50 MB of upload data.
+
+Run with: python3 -m test.benchmarks.bench_connection_buffer
+"""
+
+import os
+import struct
+import time
+
+from pynicotine.slskproto import ConnectionBuffer
+
+PAYLOAD_SIZE = 50 * 1024 * 1024
+SEND_SIZE = 64 * 1024
+
+
+def make_browse_response():
+    # SharedFileList, peer code 5. The payload is random, so it doesn't
+    # compress, like the zlib data of a real browse response.
+    payload = os.urandom(PAYLOAD_SIZE)
+    return struct.pack("<ii", len(payload) + 4, 5) + payload
+
+
+def chunks(data):
+    # Mimics readData(), which doubles the read length after full reads
+    readlength = 100 * 1024
+    pos = 0
+
+    while pos < len(data):
+        chunk = data[pos:pos + readlength]
+        pos += len(chunk)
+
+        if len(chunk) >= readlength // 2:
+            readlength *= 2
+
+        yield chunk
+
+
+def receive_bytes(data):
+    ibuf = b""
+
+    for chunk in chunks(data):
+        ibuf = ibuf + chunk
+
+        while len(ibuf) >= 8:
+            msgsize = struct.unpack("<i", ibuf[:4])[0]
+
+            if msgsize + 4 > len(ibuf):
+                break
+
+            message = ibuf[8:msgsize + 4]
+            ibuf = ibuf[msgsize + 4:]
+
+    return message
+
+
+def receive_buffer(data):
+    ibuf = ConnectionBuffer()
+
+    for chunk in chunks(data):
+        ibuf.extend(chunk)
+
+        while len(ibuf) >= 8:
+            msgsize = ibuf.unpack_from("<i")[0]
+
+            if msgsize + 4 > len(ibuf):
+                break
+
+            message = ibuf[8:msgsize + 4]
+            ibuf.consume(msgsize + 4)
+
+    return message
+
+
+def send_bytes(data):
+    obuf = data
+
+    while obuf:
+        sent = len(obuf[:SEND_SIZE])
+        obuf = obuf[sent:]
+
+
+def send_buffer(data):
+    obuf = ConnectionBuffer(data)
+
+    while obuf:
+        with obuf.view(SEND_SIZE) as view:
+            sent = len(view)
+
+        obuf.consume(sent)
+
+
+def run(name, function, data):
+    start = time.perf_counter()
+    function(data)
+    elapsed = time.perf_counter() - start
+
+    print("%-40s %8.3f s %10.1f MB/s" % (name, elapsed, len(data) / elapsed / 1024 / 1024))
+
+
+def main():
+    data = make_browse_response()
+
+    run("receive browse response (bytes)", receive_bytes, data)
+    run("receive browse response (ConnectionBuffer)", receive_buffer, data)
+    run("send upload data (bytes)", send_bytes, data)
+    run("send upload data (ConnectionBuffer)", send_buffer, data)
+
+
+if __name__ == '__main__':
+    main()
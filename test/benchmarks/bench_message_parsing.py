@@ -0,0 +1,228 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares parse throughput of the legacy getObject() based parsers with the
+precompiled struct readers, for a 100k file SharedFileList, a burst of
+1000 FileSearchResult messages and a JoinRoom message with 5000 users.
+
+Run with: python3 -m test.benchmarks.bench_message_parsing
+"""
+
+import time
+import zlib
+
+from pynicotine import slskmessages
+from pynicotine.slskmessages import FileSearchResult
+from pynicotine.slskmessages import JoinRoom
+from pynicotine.slskmessages import SharedFileList
+from pynicotine.slskmessages import UserData
+
+NUM_DIRS = 2000
+FILES_PER_DIR = 50
+NUM_RESULTS = 1000
+FILES_PER_RESULT = 20
+NUM_USERS = 5000
+
+
+class LegacySharedFileList(SharedFileList):
+
+    def _parseNetworkMessage(self, message):
+        shares = []
+        pos, ndir = self.getObject(message, int)
+        for i in range(ndir):
+            pos, directory = self.getObject(message, bytes, pos)
+            pos, nfiles = self.getObject(message, int, pos)
+            files = []
+            for j in range(nfiles):
+                pos, code = pos + 1, message[pos]
+                pos, name = self.getObject(message, bytes, pos)
+                pos, size = self.getObject(message, int, pos, getunsignedlonglong=True, printerror=False)
+                pos, ext = self.getObject(message, bytes, pos, printerror=False)
+                pos, numattr = self.getObject(message, int, pos, printerror=False)
+                attrs = []
+                for k in range(numattr):
+                    pos, attrnum = self.getObject(message, int, pos, printerror=False)
+                    pos, attr = self.getObject(message, int, pos, printerror=False)
+                    attrs.append(attr)
+                files.append([code, name, size, ext, attrs])
+            shares.append((directory, files))
+        self.list = shares
+
+
+class LegacyFileSearchResult(FileSearchResult):
+
+    def _parseNetworkMessage(self, message):
+        self.pos, self.user = self.getObject(message, bytes)
+        self.pos, self.token = self.getObject(message, int, self.pos)
+        self.pos, nfiles = self.getObject(message, int, self.pos)
+        shares = []
+        for i in range(nfiles):
+            self.pos, code = self.pos + 1, message[self.pos]
+            self.pos, name = self.getObject(message, bytes, self.pos)
+            self.pos, size = self.getObject(message, int, self.pos, getunsignedlonglong=True, printerror=False)
+            self.pos, ext = self.getObject(message, bytes, self.pos, printerror=False)
+            self.pos, numattr = self.getObject(message, int, self.pos, printerror=False)
+            attrs = []
+            if numattr:
+                for j in range(numattr):
+                    self.pos, attrnum = self.getObject(message, int, self.pos, printerror=False)
+                    self.pos, attr = self.getObject(message, int, self.pos, printerror=False)
+                    attrs.append(attr)
+            shares.append([code, name, size, ext, attrs])
+        self.list = shares
+        self.pos, self.freeulslots = self.pos + 1, message[self.pos]
+        self.pos, self.ulspeed = self.getObject(message, int, self.pos, getsignedint=True)
+        self.pos, self.inqueue = self.getObject(message, int, self.pos, getunsignedlonglong=True)
+
+
+class LegacyJoinRoom(JoinRoom):
+
+    def parseNetworkMessage(self, message):
+        pos, self.room = self.getObject(message, bytes)
+        pos1 = pos
+        pos, self.users = self.getUsers(message[pos:])
+        pos = pos1 + pos
+
+    def getUsers(self, message):
+        pos, numusers = self.getObject(message, int)
+        users = []
+        for i in range(numusers):
+            pos, username = self.getObject(message, bytes, pos)
+            users.append([username, None, None, None, None, None, None, None, None])
+        pos, statuslen = self.getObject(message, int, pos)
+        for i in range(statuslen):
+            pos, users[i][1] = self.getObject(message, int, pos)
+        pos, statslen = self.getObject(message, int, pos)
+        for i in range(statslen):
+            pos, users[i][2] = self.getObject(message, int, pos, getsignedint=True)
+            pos, users[i][3] = self.getObject(message, int, pos)
+            pos, users[i][4] = self.getObject(message, int, pos)
+            pos, users[i][5] = self.getObject(message, int, pos)
+            pos, users[i][6] = self.getObject(message, int, pos)
+        pos, slotslen = self.getObject(message, int, pos)
+        for i in range(slotslen):
+            pos, users[i][7] = self.getObject(message, int, pos)
+        if len(message[pos:]) > 0:
+            pos, countrylen = self.getObject(message, int, pos)
+            for i in range(countrylen):
+                pos, users[i][8] = self.getObject(message, bytes, pos)
+
+        usersdict = {}
+        for i in users:
+            usersdict[i[0]] = UserData(i[1:])
+
+        return pos, usersdict
+
+
+def pack_file(msg, packer, index):
+    msg.extend(bytes([1]))
+    msg.extend(packer.packObject("Artist - Track title %i.mp3" % index))
+    msg.extend(packer.packObject(5000000 + index, unsignedlonglong=True))
+    msg.extend(packer.packObject("mp3"))
+    msg.extend(packer.packObject(3))
+
+    for attr, value in enumerate((320, 240, 0)):
+        msg.extend(packer.packObject(attr))
+        msg.extend(packer.packObject(value))
+
+
+def make_shared_file_list():
+    packer = slskmessages.SlskMessage()
+    msg = bytearray(packer.packObject(NUM_DIRS))
+
+    for i in range(NUM_DIRS):
+        msg.extend(packer.packObject("@@music\\Artist %i\\Album" % i))
+        msg.extend(packer.packObject(FILES_PER_DIR))
+
+        for j in range(FILES_PER_DIR):
+            pack_file(msg, packer, j)
+
+    return zlib.compress(msg)
+
+
+def make_search_result(token):
+    packer = slskmessages.SlskMessage()
+    msg = bytearray()
+    msg.extend(packer.packObject("user%i" % token))
+    msg.extend(packer.packObject(token))
+    msg.extend(packer.packObject(FILES_PER_RESULT))
+
+    for i in range(FILES_PER_RESULT):
+        pack_file(msg, packer, i)
+
+    msg.extend(bytes([1]))
+    msg.extend(packer.packObject(100000))
+    msg.extend(packer.packObject(0, unsignedlonglong=True))
+
+    return zlib.compress(msg)
+
+
+def make_join_room():
+    packer = slskmessages.SlskMessage()
+    msg = bytearray(packer.packObject("nicotine"))
+
+    msg.extend(packer.packObject(NUM_USERS))
+    for i in range(NUM_USERS):
+        msg.extend(packer.packObject("user%i" % i))
+
+    msg.extend(packer.packObject(NUM_USERS))
+    for i in range(NUM_USERS):
+        msg.extend(packer.packObject(2))
+
+    msg.extend(packer.packObject(NUM_USERS))
+    for i in range(NUM_USERS):
+        for value in (100000, 0, 500, 1000, 100):
+            msg.extend(packer.packObject(value))
+
+    msg.extend(packer.packObject(NUM_USERS))
+    for i in range(NUM_USERS):
+        msg.extend(packer.packObject(0))
+
+    msg.extend(packer.packObject(NUM_USERS))
+    for i in range(NUM_USERS):
+        msg.extend(packer.packObject("US"))
+
+    return bytes(msg)
+
+
+def run(name, messages, msgclass, count):
+    start = time.perf_counter()
+
+    for message in messages:
+        msgclass(None).parseNetworkMessage(message)
+
+    elapsed = time.perf_counter() - start
+    print("%-40s %8.3f s %12.0f items/s" % (name, elapsed, count / elapsed))
+
+
+def main():
+    browse = [make_shared_file_list()]
+    results = [make_search_result(token) for token in range(NUM_RESULTS)]
+    joinroom = [make_join_room()]
+
+    run("SharedFileList (getObject)", browse, LegacySharedFileList, NUM_DIRS * FILES_PER_DIR)
+    run("SharedFileList (read_*)", browse, SharedFileList, NUM_DIRS * FILES_PER_DIR)
+    run("FileSearchResult (getObject)", results, LegacyFileSearchResult, NUM_RESULTS * FILES_PER_RESULT)
+    run("FileSearchResult (read_*)", results, FileSearchResult, NUM_RESULTS * FILES_PER_RESULT)
+    run("JoinRoom (getObject)", joinroom, LegacyJoinRoom, NUM_USERS)
+    run("JoinRoom (read_*)", joinroom, JoinRoom, NUM_USERS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares finding the peer connections of 100k peer messages, among 2k
+connections, by going through all connections like the message handlers
+used to, and with PeerConnectionTable. Connections close and new ones are
+made while the messages arrive.
+
+Run with: python3 -m test.benchmarks.bench_peer_connections
+"""
+
+import random
+import time
+
+from pynicotine.peerconnections import PeerConnection
+from pynicotine.peerconnections import PeerConnectionTable
+from pynicotine.slskmessages import PeerInit
+
+NUM_CONNECTIONS = 2000
+NUM_MESSAGES = 100000
+
+
+class Socket:
+    pass
+
+
+def make_conn(i):
+
+    conn = PeerConnection(
+        username="user%i" % i, addr=("10.0.%i.%i" % (i // 256 % 256, i % 256), 2234),
+        init=PeerInit(None, "me", "P", 0), msgs=[]
+    )
+
+    if i % 4:
+        conn.conn = Socket()
+    else:
+        # Waiting for the peer to connect to us
+        conn.token = i
+
+    return conn
+
+
+def make_messages():
+
+    rng = random.Random(0)
+    messages = []
+
+    for _i in range(NUM_MESSAGES):
+        kind = rng.random()
+        i = rng.randrange(NUM_CONNECTIONS)
+
+        if kind < 0.8:
+            # Most messages arrive on a connection, e.g. QueueUpload
+            messages.append(("conn", i))
+        elif kind < 0.9:
+            # ProcessRequestToPeer() looks for a connection to the user
+            messages.append(("user", i))
+        elif kind < 0.95:
+            messages.append(("token", i))
+        else:
+            messages.append(("close", i))
+
+    return messages
+
+
+def scan(peerconns, kind, value):
+    # Message handlers before PeerConnectionTable
+
+    if kind == "conn":
+        for i in peerconns:
+            if i.conn is value:
+                return i
+
+    elif kind == "user":
+        for i in peerconns:
+            if i.username == value and i.init.type == 'P':
+                return i
+
+    elif kind == "token":
+        for i in peerconns:
+            if i.token == value and i.conn is None:
+                return i
+
+    return None
+
+
+def lookup(peerconns, kind, value):
+
+    if kind == "conn":
+        matches = peerconns.by_conn(value)
+
+    elif kind == "user":
+        matches = peerconns.by_user_type(value, 'P')
+
+    elif kind == "token":
+        matches = [i for i in peerconns.by_token(value) if i.conn is None]
+
+    return matches[0] if matches else None
+
+
+def replay(name, peerconns, find, messages):
+
+    conns = list(peerconns)
+    found = 0
+    start = time.perf_counter()
+
+    for kind, i in messages:
+        conn = conns[i]
+
+        if kind == "close":
+            # The connection closes, and the user connects again
+            if conn.conn is not None:
+                peerconns.remove(find(peerconns, "conn", conn.conn))
+                conns[i] = make_conn(i)
+                peerconns.append(conns[i])
+
+            continue
+
+        if kind == "conn":
+            value = conn.conn
+        elif kind == "user":
+            value = conn.username
+        else:
+            value = conn.token
+
+        if value is not None and find(peerconns, kind, value) is conn:
+            found += 1
+
+    print("%-40s %6.3f s" % (name, time.perf_counter() - start))
+    return found
+
+
+def main():
+
+    messages = make_messages()
+    print("%i peer messages, %i connections" % (NUM_MESSAGES, NUM_CONNECTIONS))
+
+    conns = [make_conn(i) for i in range(NUM_CONNECTIONS)]
+    scanned = replay("find connection (scan)", list(conns), scan, messages)
+
+    conns = [make_conn(i) for i in range(NUM_CONNECTIONS)]
+    indexed = replay("find connection (PeerConnectionTable)", PeerConnectionTable(conns), lookup, messages)
+
+    assert scanned == indexed
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures how long it takes to open the shares database and search index
+of a 500k file share at startup, and to answer a first search and browse
+request. Also compares loading the search index by mapping it, and by
+reading it into memory like the first index format did.
+
+Run with: python3 -m test.benchmarks.bench_share_snapshot
+"""
+
+import os
+import shutil
+import string
+import struct
+import tempfile
+import time
+
+from pynicotine import slskmessages
+from pynicotine.searchindex import WordIndex
+from pynicotine.sharestore import ShareStore
+
+NUM_DIRS = 10000
+FILES_PER_DIR = 50
+QUERY = ["artist", "title", "49"]
+
+PUNCTUATION = str.maketrans(dict.fromkeys(string.punctuation, ' '))
+
+
+def build_share():
+    files = {}
+    streams = {}
+    fileindex = []
+    wordindex = WordIndex()
+    message = slskmessages.SlskMessage()
+
+    for i in range(NUM_DIRS):
+        folder = "music\\Artist %i\\Album %i" % (i // 10, i)
+        folderfiles = files[folder] = []
+        stream = bytearray(message.packObject(FILES_PER_DIR))
+
+        for j in range(FILES_PER_DIR):
+            name = "Artist %i - Track title %i.mp3" % (i, j)
+            fileinfo = (name, 5000000 + j, (320, 0), 240)
+            folderfiles.append(fileinfo)
+
+            stream.extend(bytes([1]))
+            stream.extend(message.packObject(name))
+            stream.extend(message.packObject(fileinfo[1], unsignedlonglong=True))
+            stream.extend(message.packObject("mp3"))
+            stream.extend(message.packObject(0))
+
+            words = (folder + " " + name).lower().translate(PUNCTUATION).split()
+            wordindex.add(words, len(fileindex))
+            fileindex.append((folder + "\\" + name,) + fileinfo[1:])
+
+        streams[folder] = stream
+
+    wordindex.filelist = slskmessages.SharedFileList(None, streams).makeNetworkMessage()
+    return files, streams, wordindex, fileindex
+
+
+def save_version_1(wordindex, filename):
+    # The format of the first index files, read into memory when loading
+    with open(filename, "wb") as f:
+        f.write(struct.pack("<4sII", b"NPWI", 1, len(wordindex)))
+
+        for word in wordindex:
+            postings = wordindex[word]
+            key = word.encode("utf-8", "surrogatepass")
+            f.write(struct.pack("<I", len(key)) + key)
+            f.write(struct.pack("<I", len(postings)))
+            f.write(postings)
+
+
+def startup(data_dir, indexfile):
+    start = time.perf_counter()
+
+    store = ShareStore(os.path.join(data_dir, "shares.sqlite"))
+    fileindex = store.file_index(ShareStore.NORMAL)
+    streams = store.folder_streams(ShareStore.NORMAL)
+    wordindex = WordIndex.load(os.path.join(data_dir, indexfile))
+    loaded = time.perf_counter()
+
+    results = wordindex.search(QUERY, 50)
+    slskmessages.FileSearchResult(None, shares=results, fileindex=fileindex).packFileList()
+    searched = time.perf_counter()
+
+    filelist = wordindex.filelist
+
+    if filelist is None:
+        filelist = slskmessages.SharedFileList(None, streams).makeNetworkMessage()
+
+    browsed = time.perf_counter()
+    store.close()
+
+    print("%-22s open %6.3f s, first search %6.3f s, browse list %6.3f s" % (
+        indexfile, loaded - start, searched - loaded, browsed - searched))
+
+
+def main():
+    print("%i directories, %i files" % (NUM_DIRS, NUM_DIRS * FILES_PER_DIR))
+
+    data_dir = tempfile.mkdtemp()
+
+    try:
+        files, streams, wordindex, fileindex = build_share()
+
+        store = ShareStore(os.path.join(data_dir, "shares.sqlite"))
+        store.replace(ShareStore.NORMAL, files, streams, fileindex, {})
+        store.close()
+
+        wordindex.save(os.path.join(data_dir, "wordindex.idx"))
+        save_version_1(wordindex, os.path.join(data_dir, "wordindex-v1.idx"))
+        del files, streams, wordindex, fileindex
+
+        startup(data_dir, "wordindex-v1.idx")
+        startup(data_dir, "wordindex.idx")
+
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
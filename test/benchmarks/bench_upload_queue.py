@@ -0,0 +1,142 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares picking the next queued upload of 20k uploads from 2k users, and
+starting it, then answering queue place requests for them (FIFO), by going
+through all uploads like checkUploadQueue() and PlaceInQueueRequest() used
+to, and with UploadScheduler.
+
+Run with: python3 -m test.benchmarks.bench_upload_queue
+"""
+
+import time
+
+from pynicotine.transferregistry import Transfer
+from pynicotine.transferregistry import TransferRegistry
+from pynicotine.uploadscheduler import UploadScheduler
+
+NUM_USERS = 2000
+NUM_UPLOADS = 20000
+NUM_STARTED = 500
+NUM_PLACES = 2000
+
+
+def next_candidate(uploads, privileged):
+    # Transfers.checkUploadQueue() before UploadScheduler, round robin
+    trusers = [i.user for i in uploads if i.req is not None or i.conn is not None or i.status == "Getting status"]
+    candidates = [i for i in uploads if i.user not in trusers and i.status == "Queued"]
+    listprivileged = [i for i in candidates if i.user in privileged]
+
+    if listprivileged:
+        candidates = listprivileged
+
+    transfercandidate = None
+    mintimequeued = time.time() + 1
+
+    for i in candidates:
+        if i.timequeued < mintimequeued:
+            transfercandidate = i
+            mintimequeued = i.timequeued
+
+    return transfercandidate
+
+
+def place_in_queue(uploads, privileged, transfer):
+    # Transfers.PlaceInQueueRequest() before UploadScheduler, FIFO
+    count = countpriv = place = 0
+
+    for i in uploads:
+        if i.status == "Queued":
+            if i.user in privileged:
+                countpriv += 1
+            else:
+                count += 1
+
+            if i is transfer:
+                place = countpriv if i.user in privileged else count + countpriv
+                break
+
+    return place
+
+
+def run_places(name, function, transfers):
+    start = time.perf_counter()
+    places = [function(transfer) for transfer in transfers]
+
+    print("%-36s %6.3f s" % (name, time.perf_counter() - start))
+    return places
+
+
+def run(name, function, uploads):
+    # Start uploads one after another, and finish them right away to
+    # keep the number of uploads in progress low
+    start = time.perf_counter()
+    started = []
+
+    for i in range(NUM_STARTED):
+        transfer = function()
+        transfer.status = "Getting status"
+        transfer.status = "Finished"
+
+        for j in uploads.by_user(transfer.user):
+            j.timequeued = NUM_UPLOADS + i
+
+        started.append(transfer)
+
+    print("%-36s %6.3f s" % (name, time.perf_counter() - start))
+    return started
+
+
+def make_uploads(scheduler=None):
+    uploads = TransferRegistry(scheduler=scheduler)
+
+    for i in range(NUM_UPLOADS):
+        uploads.append(Transfer(
+            user="user%i" % (i % NUM_USERS), filename="%i.mp3" % i, status="Queued", timequeued=i
+        ))
+
+    return uploads
+
+
+def main():
+    privileged = {"user%i" % i for i in range(0, NUM_USERS, 100)}
+
+    print("%i queued uploads from %i users, starting %i" % (NUM_UPLOADS, NUM_USERS, NUM_STARTED))
+
+    uploads = make_uploads()
+    scanned = run("next upload (scan)", lambda: next_candidate(uploads, privileged), uploads)
+
+    scheduler = UploadScheduler(lambda user: 0 if user in privileged else 1)
+    uploads = make_uploads(scheduler)
+    scheduled = run("next upload (UploadScheduler)", scheduler.next_candidate, uploads)
+
+    assert [i.filename for i in scanned] == [i.filename for i in scheduled]
+
+    scheduler.fifo = True
+    transfers = uploads.by_status("Queued")[::len(uploads) // NUM_PLACES]
+
+    print("%i queue place requests" % len(transfers))
+    scanned = run_places("queue place (scan)", lambda transfer: place_in_queue(uploads, privileged, transfer), transfers)
+    scheduled = run_places("queue place (UploadScheduler)", scheduler.place, transfers)
+
+    assert scanned == scheduled
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Compares looking up the virtual paths of 100k shared folders, and the real
+paths of their files, by searching the share list for every path, and with
+VirtualPathMapping.
+
+Run with: python3 -m test.benchmarks.bench_virtual_paths
+"""
+
+import os
+import time
+
+from pynicotine.virtualpaths import VirtualPathMapping
+
+NUM_SHARES = 20
+NUM_FOLDERS = 100000
+
+
+def real2virtual(mapping, path):
+    # Shares.real2virtual() before VirtualPathMapping
+    path = os.path.normpath(path)
+
+    for (virtual, real) in mapping[:]:
+        real = os.path.normpath(real)
+
+        if path == real:
+            return virtual
+        if path.startswith(real + os.sep):
+            return virtual + '\\' + path[len(real + os.sep):].replace(os.sep, '\\')
+    return None
+
+
+def virtual2real(mapping, path):
+    # Shares.virtual2real() before VirtualPathMapping
+    path = os.path.normpath(path)
+
+    for (virtual, real) in mapping[:]:
+        virtual = os.path.normpath(virtual)
+
+        if path == virtual:
+            return real
+        if path.startswith(virtual + '\\'):
+            return real + path[len(virtual):].replace('\\', os.sep)
+    return None
+
+
+def run(name, function, paths):
+    start = time.perf_counter()
+
+    for path in paths:
+        function(path)
+
+    print("%-36s %6.3f s" % (name, time.perf_counter() - start))
+
+
+def main():
+    mapping = [
+        ("Share %i" % i, os.path.join(os.sep, "home", "user", "Share %i" % i))
+        for i in range(NUM_SHARES)
+    ]
+    folders = [
+        # Most folders are in the last shares in real life too
+        os.path.join(mapping[-1 - i % 3][1], "Artist %i" % (i // 10), "Album %i" % i)
+        for i in range(NUM_FOLDERS)
+    ]
+    files = [real2virtual(mapping, folder) + "\\01 - Track.mp3" for folder in folders]
+
+    print("%i shared folders, %i folders" % (NUM_SHARES, NUM_FOLDERS))
+
+    start = time.perf_counter()
+    pathmapping = VirtualPathMapping(mapping)
+    print("%-36s %6.3f s" % ("build VirtualPathMapping", time.perf_counter() - start))
+
+    run("real2virtual (share list)", lambda path: real2virtual(mapping, path), folders)
+    run("real2virtual (VirtualPathMapping)", pathmapping.real2virtual, folders)
+    run("virtual2real (share list)", lambda path: virtual2real(mapping, path), files)
+    run("virtual2real (VirtualPathMapping)", pathmapping.virtual2real, files)
+
+    for folder, path in zip(folders, files):
+        assert pathmapping.real2virtual(folder) == real2virtual(mapping, folder)
+        assert pathmapping.virtual2real(path) == virtual2real(mapping, path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import tempfile
+import time
+from queue import Queue
+from unittest.mock import Mock, MagicMock
+
+import pytest
+
+from pynicotine.slskmessages import ConnClose, DownloadFile, FileError, FileRequest, IncConn, IncPort, OutConn, PeerInit, UploadFile
+from pynicotine.utils import ApplyTranslation
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="asyncio backend requires Python 3.7")
+
+TRANSFER_SIZE = 4 * 1024 * 1024
+TIMEOUT = 10
+
+
+@pytest.fixture(scope="module", autouse=True)
+def apply_translations():
+    ApplyTranslation()
+
+
+def create_proto(portrange):
+    from pynicotine.slskprotoasync import AsyncSlskProtoThread
+
+    config = MagicMock()
+    config.sections = {'server': {'portrange': portrange, 'ipblocklist': {}}, 'transfers': {'downloadlimit': 0}}
+    messages = []
+
+    proto = AsyncSlskProtoThread(
+        ui_callback=messages.extend, queue=Queue(0), bindip='127.0.0.1',
+        port=None, config=config, eventprocessor=Mock()
+    )
+    return proto, messages
+
+
+def wait_for_message(messages, msgclass):
+    deadline = time.monotonic() + TIMEOUT
+
+    while time.monotonic() < deadline:
+        for msg in messages:
+            if isinstance(msg, msgclass):
+                return msg
+
+        time.sleep(0.01)
+
+    raise AssertionError("No %s message received" % msgclass.__name__)
+
+
+def test_file_transfer() -> None:
+    uploader, upmessages = create_proto((41300, 41400))
+    downloader, downmessages = create_proto((41500, 41600))
+
+    port = wait_for_message(downmessages, IncPort).port
+    data = os.urandom(TRANSFER_SIZE)
+
+    with tempfile.TemporaryFile() as source, tempfile.TemporaryFile() as target:
+        source.write(data)
+        source.flush()
+        source.seek(0)
+
+        try:
+            uploader._queue.put(OutConn(None, ('127.0.0.1', port), PeerInit(None, 'user', 'F', 0)))
+            conn = wait_for_message(upmessages, OutConn).conn
+
+            uploader._queue.put(PeerInit(conn, 'user', 'F', 0))
+            uploader._queue.put(FileRequest(conn, 1))
+            uploader._queue.put(UploadFile(conn, source, TRANSFER_SIZE, 0, None))
+
+            conn = wait_for_message(downmessages, FileRequest).conn
+            downloader._queue.put(DownloadFile(conn, 0, target, TRANSFER_SIZE))
+
+            deadline = time.monotonic() + TIMEOUT
+
+            while os.fstat(target.fileno()).st_size < TRANSFER_SIZE and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        finally:
+            uploader.abort()
+            downloader.abort()
+
+        target.seek(0)
+        assert target.read() == data
+
+
+def test_truncated_upload() -> None:
+    uploader, upmessages = create_proto((42100, 42200))
+    downloader, downmessages = create_proto((42300, 42400))
+
+    port = wait_for_message(downmessages, IncPort).port
+
+    with tempfile.TemporaryFile() as source, tempfile.TemporaryFile() as target:
+        # The file is smaller than the size announced to the downloader
+        source.write(os.urandom(TRANSFER_SIZE // 4))
+        source.flush()
+        source.seek(0)
+
+        try:
+            uploader._queue.put(OutConn(None, ('127.0.0.1', port), PeerInit(None, 'user', 'F', 0)))
+            conn = wait_for_message(upmessages, OutConn).conn
+
+            uploader._queue.put(PeerInit(conn, 'user', 'F', 0))
+            uploader._queue.put(FileRequest(conn, 1))
+            uploader._queue.put(UploadFile(conn, source, TRANSFER_SIZE, 0, None))
+
+            conn = wait_for_message(downmessages, FileRequest).conn
+            downloader._queue.put(DownloadFile(conn, 0, target, TRANSFER_SIZE))
+
+            assert wait_for_message(upmessages, FileError)
+            wait_for_message(upmessages, ConnClose)
+
+        finally:
+            uploader.abort()
+            downloader.abort()
+
+
+def test_socket_limit(monkeypatch) -> None:
+    # Room for the listening socket and two connections
+    monkeypatch.setattr("pynicotine.slskprotoasync.MAXFILELIMIT", 3)
+
+    client, clientmessages = create_proto((41700, 41800))
+    server, servermessages = create_proto((41900, 42000))
+
+    port = wait_for_message(servermessages, IncPort).port
+
+    try:
+        for _ in range(3):
+            client._queue.put(OutConn(None, ('127.0.0.1', port), PeerInit(None, 'user', 'P', 0)))
+
+        # The third connection replaces one without a transfer
+        wait_for_message(servermessages, ConnClose)
+
+        deadline = time.monotonic() + TIMEOUT
+
+        while len([msg for msg in servermessages if isinstance(msg, IncConn)]) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert len(server._conns) <= 2
+
+    finally:
+        client.abort()
+        server.abort()
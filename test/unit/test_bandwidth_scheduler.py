@@ -0,0 +1,132 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine.slskproto import BandwidthScheduler
+
+DURATION = 60
+TICK = 0.005
+LIMIT = 150 * 1024
+TOLERANCE = 0.05
+
+
+class Clock:
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SimulatedSocket:
+    """ A socket on a link that can carry link_speed bytes per second """
+
+    def __init__(self, clock: Clock, link_speed: int) -> None:
+        self.clock = clock
+        self.link_speed = link_speed
+        self.lastsend = 0.0
+        self.sentbytes = 0
+        self.resume = 0.0
+
+    def send(self, size: int) -> int:
+        capacity = int((self.clock.now - self.lastsend) * self.link_speed)
+        sent = min(size, capacity)
+
+        self.lastsend = self.clock.now
+        self.sentbytes += sent
+        return sent
+
+
+def simulate(scheduler: BandwidthScheduler, clock: Clock, sockets: list) -> None:
+    """ Mimics the network loop: ready sockets ask for an allowance, and
+    throttled sockets sleep until the scheduler lets them resume """
+
+    for sock in sockets:
+        scheduler.add_transfer(sock)
+
+    while clock.now < DURATION:
+        clock.now += TICK
+
+        for sock in sockets:
+            if clock.now < sock.resume:
+                continue
+
+            allowance = scheduler.allowance(sock)
+
+            if allowance == 0:
+                sock.resume = clock.now + scheduler.delay(sock)
+                continue
+
+            sent = sock.send(allowance if allowance is not None else 10 * 1024 * 1024)
+            scheduler.consume(sock, sent)
+
+
+def assert_rate(sentbytes: int, limit: int) -> None:
+    rate = sentbytes / DURATION
+    assert abs(rate - limit) <= limit * TOLERANCE, "rate %i, limit %i" % (rate, limit)
+
+
+def test_total_limit() -> None:
+    clock = Clock()
+    scheduler = BandwidthScheduler(clock)
+    scheduler.set_limit(LIMIT)
+    sockets = [SimulatedSocket(clock, 1024 * 1024) for _ in range(20)]
+
+    simulate(scheduler, clock, sockets)
+
+    assert_rate(sum(sock.sentbytes for sock in sockets), LIMIT)
+
+    # The limit is shared fairly between transfers
+    for sock in sockets:
+        assert_rate(sock.sentbytes, LIMIT / len(sockets))
+
+
+def test_total_limit_with_slow_transfers() -> None:
+    clock = Clock()
+    scheduler = BandwidthScheduler(clock)
+    scheduler.set_limit(LIMIT)
+    slow_sockets = [SimulatedSocket(clock, 2 * 1024) for _ in range(5)]
+    fast_sockets = [SimulatedSocket(clock, 10 * 1024 * 1024) for _ in range(3)]
+
+    simulate(scheduler, clock, slow_sockets + fast_sockets)
+
+    # Fast transfers use the bandwidth slow ones can't
+    assert_rate(sum(sock.sentbytes for sock in slow_sockets + fast_sockets), LIMIT)
+
+
+def test_per_transfer_limit() -> None:
+    clock = Clock()
+    scheduler = BandwidthScheduler(clock)
+    scheduler.set_limit(LIMIT, pertransfer=True)
+    sockets = [SimulatedSocket(clock, 1024 * 1024) for _ in range(5)]
+
+    simulate(scheduler, clock, sockets)
+
+    for sock in sockets:
+        assert_rate(sock.sentbytes, LIMIT)
+
+
+def test_no_limit() -> None:
+    clock = Clock()
+    scheduler = BandwidthScheduler(clock)
+    sock = SimulatedSocket(clock, 1024 * 1024)
+
+    simulate(scheduler, clock, [sock])
+
+    assert scheduler.allowance(sock) is None
+    assert_rate(sock.sentbytes, 1024 * 1024)
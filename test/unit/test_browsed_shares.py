@@ -0,0 +1,76 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+
+from pynicotine.browsedshares import BrowsedShares
+
+
+SHARES = [
+    ("Music\\Artist", [
+        [1, "01 - Intro.mp3", 4000000, "mp3", [320, 180]],
+        [1, "02 - Élan.flac", 2 ** 40, "flac", []]
+    ]),
+    ("Music\\Artist\\Live", [
+        [1, "cover.jpg", 0, "", []]
+    ]),
+    ("Music\\Empty", []),
+    ("Other", [
+        [1, "ab", 1, "", [1, 2, 3]],
+        [1, "cd", 2, "", [4294967295]]
+    ])
+]
+
+
+def test_round_trip() -> None:
+    shares = BrowsedShares()
+    shares.extend(SHARES[:2])
+    shares.extend(SHARES[2:])
+
+    assert len(shares) == 4
+    assert list(shares) == SHARES
+    assert shares.totalsize == 4000000 + 2 ** 40 + 3
+
+    assert "Music\\Empty" in shares
+    assert shares.get_files("Music\\Empty") == []
+    assert shares.get_files("Other") == SHARES[3][1]
+    assert shares.get_files("Missing") is None
+
+    restored = pickle.loads(pickle.dumps(shares))
+    assert list(restored) == SHARES
+    assert restored.get_files("Music\\Artist\\Live") == SHARES[1][1]
+
+
+def test_subdirectories() -> None:
+    shares = BrowsedShares(SHARES)
+
+    assert shares.get_subdirectories("Music") == ["Music\\Artist", "Music\\Artist\\Live", "Music\\Empty"]
+    assert shares.get_subdirectories("Music\\Artist") == ["Music\\Artist\\Live"]
+    assert shares.get_subdirectories("Other") == []
+
+
+def test_find() -> None:
+    shares = BrowsedShares(SHARES)
+
+    assert shares.find("live") == ["Music\\Artist\\Live"]
+    assert shares.find("élan") == ["Music\\Artist"]
+    assert shares.find(".jpg") == ["Music\\Artist\\Live"]
+
+    # Matches don't span two file names
+    assert shares.find("bc") == []
+    assert shares.find("nothing") == []
@@ -0,0 +1,113 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+import pytest
+
+from pynicotine.slskmessages import MessageChunks
+from pynicotine.slskproto import ConnectionBuffer
+
+
+def test_extend_and_consume() -> None:
+    buf = ConnectionBuffer(b"abc")
+    buf += b"def"
+    buf.extend(memoryview(b"gh"))
+
+    assert len(buf) == 8
+    assert buf[:] == b"abcdefgh"
+
+    buf.consume(3)
+    assert len(buf) == 5
+    assert buf[0] == ord("d")
+    assert buf[-1] == ord("h")
+    assert buf[1:3] == b"ef"
+    assert buf[10:20] == b""
+
+    buf.consume(5)
+    assert len(buf) == 0
+
+    with pytest.raises(IndexError):
+        buf[0]
+
+
+def test_unpack_from_cursor() -> None:
+    buf = ConnectionBuffer(struct.pack("<ii", 1, 2) + struct.pack("<Q", 3))
+    buf.consume(4)
+
+    assert buf.unpack_from("<i") == (2,)
+    assert buf.unpack_from("<Q", 4) == (3,)
+
+
+def test_view_is_relative_to_cursor() -> None:
+    buf = ConnectionBuffer(b"0123456789")
+    buf.consume(2)
+
+    with buf.view(3) as view:
+        assert bytes(view) == b"234"
+
+    with buf.view() as view:
+        assert bytes(view) == b"23456789"
+
+    # Views must be released before the buffer can grow again
+    buf += b"x"
+    assert buf[:] == b"23456789x"
+
+
+def test_compaction_keeps_unread_data() -> None:
+    chunk = bytes(range(256)) * 1024
+    buf = ConnectionBuffer()
+
+    for _ in range(4):
+        buf += chunk
+
+    buf.consume(len(chunk) * 3 + 10)
+
+    assert len(buf) == len(chunk) - 10
+    assert buf[:] == chunk[10:]
+
+
+def test_queued_chunks_are_sent_in_order() -> None:
+    chunks = MessageChunks((b"a" * 1000, b"b" * 3000))
+    buf = ConnectionBuffer(b"head")
+    buf += chunks
+    buf += b"tail"
+
+    assert len(buf) == 4 + 4000 + 4
+    assert buf[:] == b"head" + b"a" * 1000 + b"b" * 3000 + b"tail"
+
+    sent = bytearray()
+    sources = []
+
+    while buf:
+        with buf.view(700) as view:
+            sent += view
+            sources.append(view.obj)
+            size = len(view)
+
+        buf.consume(size)
+
+    assert sent == b"head" + b"a" * 1000 + b"b" * 3000 + b"tail"
+
+    # Chunks are sent from the queued bytes objects, without copying them
+    assert any(source is chunks.chunks[0] for source in sources)
+    assert any(source is chunks.chunks[1] for source in sources)
+
+    # Once the chunks are sent, data goes to the bytearray again
+    buf += b"next"
+    assert buf[:] == b"next"
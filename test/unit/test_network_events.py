@@ -0,0 +1,132 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine import slskmessages
+from pynicotine.networkevents import NetworkEventBatcher
+
+
+class Clock:
+
+    def __init__(self):
+        self.time = 100.0
+
+    def __call__(self):
+        return self.time
+
+
+def status(user, value):
+    msg = slskmessages.GetUserStatus(user)
+    msg.status = value
+    return msg
+
+
+def flush_now(batcher):
+    # The first batch is handed out right away
+    assert batcher.add([slskmessages.SayChatroom("room", "text")])
+
+
+def test_flush_rate() -> None:
+    clock = Clock()
+    batcher = NetworkEventBatcher(max_flushes=10, clock=clock)
+    flushes = 0
+
+    # 1000 chat messages per second, for 10 seconds
+    for _ in range(10000):
+        clock.time += 0.001
+
+        if batcher.add([slskmessages.SayChatroom("room", "text")]):
+            flushes += 1
+
+    assert flushes <= 10 * 10 + 1
+    assert batcher.counters["queued"] == 10000
+    assert batcher.counters["flushes"] == flushes
+
+    # Remaining messages are handed out by a delayed flush
+    assert batcher.schedule_flush()
+    assert not batcher.schedule_flush()
+
+    remaining = len(batcher.flush())
+    assert remaining > 0
+    assert batcher.flush() == []
+
+
+def test_max_pending() -> None:
+    batcher = NetworkEventBatcher(max_flushes=1, max_pending=100, clock=Clock())
+
+    flush_now(batcher)
+
+    batches = [batcher.add([slskmessages.SayChatroom("room", str(i))]) for i in range(250)]
+    assert [len(batch) for batch in batches if batch] == [100, 100]
+
+
+def test_coalesce_status() -> None:
+    clock = Clock()
+    batcher = NetworkEventBatcher(clock=clock)
+    flush_now(batcher)
+
+    joined = slskmessages.UserJoinedRoom()
+    assert batcher.add([status("alice", 0), status("bob", 1), joined, status("alice", 2)]) is None
+
+    batch = batcher.flush()
+    assert [(msg.__class__, getattr(msg, "status", None)) for msg in batch] == [
+        (slskmessages.GetUserStatus, 1),
+        (slskmessages.UserJoinedRoom, None),
+        (slskmessages.GetUserStatus, 2)
+    ]
+    assert batch[2].user == "alice"
+    assert batcher.counters["coalesced"] == 1
+
+
+def test_drop_progress() -> None:
+    clock = Clock()
+    batcher = NetworkEventBatcher(clock=clock)
+    flush_now(batcher)
+
+    for received in range(0, 1000, 100):
+        batcher.add([slskmessages.PeerTransfer("conn", 1000, received, slskmessages.SharedFileList)])
+
+    batcher.add([slskmessages.PeerTransfer("conn2", 1000, 0, slskmessages.SharedFileList)])
+
+    batch = batcher.flush()
+    assert [(msg.conn, msg.bytes) for msg in batch] == [("conn", 900), ("conn2", 0)]
+    assert batcher.counters["dropped"] == 9
+
+
+def test_transfer_progress() -> None:
+    clock = Clock()
+    batcher = NetworkEventBatcher(clock=clock)
+    flush_now(batcher)
+
+    for offset in range(5):
+        clock.time += 0.1
+        assert batcher.add([slskmessages.DownloadFile("conn", offset)]) is None
+
+    # Progress is held back, even when other messages are flushed
+    clock.time += 0.2
+    batch = batcher.add([slskmessages.SayChatroom("room", "text")])
+    assert [msg.__class__ for msg in batch] == [slskmessages.SayChatroom]
+
+    # ...until the connection closes
+    clock.time += 0.2
+    batch = batcher.add([slskmessages.DownloadFile("conn", 5), slskmessages.ConnClose("conn")])
+    assert [(msg.__class__, msg.conn) for msg in batch] == [
+        (slskmessages.DownloadFile, "conn"),
+        (slskmessages.ConnClose, "conn")
+    ]
+    assert batch[0].offset == 5
+    assert batcher.counters["dropped"] == 5
@@ -0,0 +1,86 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from pynicotine.peerconnections import PeerConnection
+from pynicotine.peerconnections import PeerConnectionTable
+from pynicotine.slskmessages import PeerInit
+
+
+def make_conn(username, type, **kwargs):
+    return PeerConnection(username=username, init=PeerInit(None, "me", type, 0), msgs=[], **kwargs)
+
+
+def test_lookups_follow_changes() -> None:
+    peerconns = PeerConnectionTable()
+    indirect = make_conn("user1", "P", addr="in_progress", token=1)
+    direct = make_conn("user1", "F", addr=("1.2.3.4", 2234))
+    parent = make_conn("user2", "D", addr=("1.2.3.5", 2234))
+
+    peerconns.append(indirect)
+    peerconns.extend([direct, parent])
+
+    assert peerconns.by_user_type("user1", "P") == [indirect]
+    assert peerconns.by_user_type("user1", "D") == []
+    assert peerconns.by_addr("in_progress") == [indirect]
+    assert peerconns.by_token(1) == [indirect]
+    assert peerconns.by_type("D") == [parent]
+
+    # The server sent the address, and the connection was established
+    sock = object()
+    indirect.addr = ("1.2.3.6", 2234)
+    indirect.conn = sock
+    indirect.token = None
+
+    assert peerconns.by_addr("in_progress") == []
+    assert peerconns.by_addr(("1.2.3.6", 2234)) == [indirect]
+    assert peerconns.by_conn(sock) == [indirect]
+    assert peerconns.by_token(1) == []
+    assert peerconns.by_conn(None) == []
+
+    # Connections are logged with vars()
+    assert "<PeerConnectionTable of 3 items>" in str(vars(indirect))
+
+
+def test_removed_connections_are_forgotten() -> None:
+    peerconns = PeerConnectionTable()
+    conns = [make_conn("user%i" % i, "D", conn=object()) for i in range(4)]
+    peerconns.extend(conns)
+
+    for conn in peerconns.by_type("D"):
+        if conn is not conns[2]:
+            peerconns.remove(conn)
+
+    assert list(peerconns) == [conns[2]]
+    assert conns[0] not in peerconns
+    assert peerconns.by_conn(conns[0].conn) == []
+    assert peerconns.by_type("D") == [conns[2]]
+
+    # Removed connections can change freely
+    conns[0].conn = None
+
+    with pytest.raises(ValueError):
+        peerconns.remove(conns[0])
+
+    with pytest.raises(ValueError):
+        PeerConnectionTable([conns[2]])
+
+    del peerconns[:]
+    assert peerconns.by_type("D") == []
+    assert peerconns.by_user_type("user2", "D") == []
@@ -0,0 +1,129 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket
+import time
+from unittest.mock import Mock, MagicMock
+
+import pytest
+
+from pynicotine.slskmessages import SetDownloadLimit
+from pynicotine.slskproto import SlskProtoThread
+from pynicotine.slskproto import WakeupQueue
+from pynicotine.utils import ApplyTranslation
+from test.unit.mock_socket import monkeypatch_socket
+
+LOGIN_DATAFILE = 'data/login/socket_localhost_22420.log'
+NUM_MESSAGES = 100
+
+# Upper bounds (in ms) of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, float('inf'))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def apply_translations():
+    ApplyTranslation()
+
+
+@pytest.fixture
+def config():
+    config = MagicMock()
+    config.sections = {'server': {'portrange': (1, 2)}, 'transfers': {'downloadlimit': 0}}
+    return config
+
+
+def latency_histogram(latencies):
+    histogram = dict.fromkeys(HISTOGRAM_BUCKETS, 0)
+
+    for latency in latencies:
+        for bucket in HISTOGRAM_BUCKETS:
+            if latency * 1000 <= bucket:
+                histogram[bucket] += 1
+                break
+
+    return histogram
+
+
+def test_queue_wakeup() -> None:
+    message_queue = WakeupQueue(0)
+    assert message_queue.fileno() >= 0
+
+    message_queue.put(SetDownloadLimit(0))
+    message_queue.put(SetDownloadLimit(0))
+
+    # Repeated puts only signal once, and clearing resets the wakeup
+    assert message_queue._signalled
+    message_queue.clear_wakeup()
+    assert not message_queue._signalled
+    assert message_queue.qsize() == 2
+
+    message_queue.close()
+
+
+def test_queue_latency(config, monkeypatch) -> None:
+    message_queue = WakeupQueue(0)
+
+    # The listen socket never becomes readable, so the networking loop only
+    # wakes up when a message is queued, or when select() times out
+    idle_socket, idle_peer = socket.socketpair()
+    mock_socket = monkeypatch_socket(monkeypatch, LOGIN_DATAFILE)
+    mock_socket.fileno.return_value = idle_socket.fileno()
+
+    processed = []
+    process_queue = SlskProtoThread.process_queue
+
+    def timed_process_queue(self, queue, *args, **kwargs):
+        processed.append(time.monotonic())
+        return process_queue(self, queue, *args, **kwargs)
+
+    monkeypatch.setattr(SlskProtoThread, 'process_queue', timed_process_queue)
+
+    proto = SlskProtoThread(
+        ui_callback=Mock(), queue=message_queue, bindip='',
+        port=None, config=config, eventprocessor=Mock()
+    )
+    latencies = []
+
+    try:
+        # Let the networking loop settle into select()
+        time.sleep(0.1)
+
+        for _ in range(NUM_MESSAGES):
+            del processed[:]
+            sent = time.monotonic()
+            message_queue.put(SetDownloadLimit(0))
+
+            while not processed and time.monotonic() - sent < 1:
+                time.sleep(0.0001)
+
+            assert processed
+            latencies.append(processed[0] - sent)
+            time.sleep(0.002)
+    finally:
+        proto.abort()
+        idle_socket.close()
+        idle_peer.close()
+        message_queue.close()
+
+    histogram = latency_histogram(latencies)
+    fast = sum(count for bucket, count in histogram.items() if bucket <= 1)
+    slow = sum(count for bucket, count in histogram.items() if bucket > SlskProtoThread.SELECT_TIMEOUT * 1000 / 5)
+
+    # Without the wakeup, messages wait for select() to time out
+    assert fast >= NUM_MESSAGES * 0.95
+    assert slow == 0
@@ -0,0 +1,151 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import struct
+
+from pynicotine.searchindex import intersect_postings
+from pynicotine.searchindex import SearchResultCache
+from pynicotine.searchindex import WordIndex
+
+
+def test_intersect_postings() -> None:
+    rand = random.Random(1)
+
+    for _ in range(200):
+        postings = [
+            sorted(rand.sample(range(2000), rand.randint(0, 1500)))
+            for _ in range(rand.randint(1, 4))
+        ]
+        expected = sorted(set.intersection(*[set(p) for p in postings]))
+
+        assert intersect_postings(postings) == expected
+        assert intersect_postings(postings, 3) == expected[:3]
+
+
+def test_intersect_postings_edges() -> None:
+    assert intersect_postings([]) == []
+    assert intersect_postings([[1, 2, 3]], 2) == [1, 2]
+    assert intersect_postings([[5], [1, 2, 3, 4, 5]]) == [5]
+    assert intersect_postings([[6], [1, 2, 3, 4, 5]]) == []
+    assert intersect_postings([[1, 9], [9, 10], [0, 1, 2, 9]]) == [9]
+
+
+def test_word_index_search() -> None:
+    index = WordIndex()
+    index.add(["music", "the", "doors", "the", "end", "mp3"], 0)
+    index.add(["music", "the", "who", "mp3"], 1)
+    index.add(["music", "the", "end", "flac"], 2)
+
+    assert list(index["the"]) == [0, 1, 2]
+    assert index.search(["the", "end"]) == [0, 2]
+    assert index.search(["the", "end"], 1) == [0]
+    assert index.search(["mp3", "missing"]) == []
+    assert index.search([]) == []
+
+
+def test_word_index_remove() -> None:
+    index = WordIndex()
+    index.add(["music", "the", "doors", "mp3"], 0)
+    index.add(["music", "the", "who", "mp3"], 1)
+    index.add(["music", "doors", "flac"], 2)
+
+    index.remove(["music", "the", "who", "mp3"], 1)
+    index.remove(["music", "doors", "flac", "missing"], 2)
+
+    assert index.search(["music"]) == [0]
+    assert index.search(["the", "mp3"]) == [0]
+    assert "who" not in index
+    assert "flac" not in index
+
+
+def test_word_index_save_load(tmpdir) -> None:
+    filename = os.path.join(str(tmpdir), "wordindex.idx")
+
+    index = WordIndex.from_dict({"héllo": [3, 1, 2, 2], "world": [7]}, filename)
+    index.close()
+
+    loaded = WordIndex.load(filename)
+    assert sorted(loaded) == ["héllo", "world"]
+    assert list(loaded["héllo"]) == [1, 2, 3]
+    assert loaded.search(["world"]) == [7]
+
+
+def test_word_index_mapped_changes(tmpdir) -> None:
+    filename = os.path.join(str(tmpdir), "wordindex.idx")
+
+    index = WordIndex.from_dict({"music": [0, 1, 2], "doors": [0, 2], "who": [1]}, filename)
+    index.filelist = b"compressed list"
+    index.save()
+
+    loaded = WordIndex.load(filename)
+    assert loaded.filelist == b"compressed list"
+    assert loaded.search(["music", "doors"]) == [0, 2]
+
+    # Mapped posting lists are copied before they change
+    loaded.add(["music", "doors", "new"], 3)
+    loaded.remove(["music", "who"], 1)
+
+    assert loaded.filelist is None
+    assert loaded.search(["music"]) == [0, 2, 3]
+    assert loaded.search(["new", "doors"]) == [3]
+    assert "who" not in loaded
+    assert sorted(loaded) == ["doors", "music", "new"]
+
+    # Saving over the mapped file
+    loaded.close()
+
+    reloaded = WordIndex.load(filename)
+    assert reloaded.filelist is None
+    assert sorted(reloaded) == ["doors", "music", "new"]
+    assert list(reloaded["doors"]) == [0, 2, 3]
+
+
+def test_word_index_load_version_1(tmpdir) -> None:
+    filename = os.path.join(str(tmpdir), "wordindex.idx")
+
+    with open(filename, "wb") as f:
+        f.write(struct.pack("<4sII", b"NPWI", 1, 1))
+        f.write(struct.pack("<I", 5) + b"music")
+        f.write(struct.pack("<III", 2, 4, 7))
+
+    index = WordIndex.load(filename)
+    assert index.search(["music"]) == [4, 7]
+
+
+def test_search_result_cache() -> None:
+    cache = SearchResultCache(maxsize=2)
+
+    assert cache.get("a") is None
+    cache.add("a", 1)
+    cache.add("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is the least recently used entry
+    cache.add("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+    assert cache.counters == {"hits": 2, "misses": 2, "invalidations": 0}
+    assert cache.hit_rate == 0.5
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get("a") is None
+    assert cache.counters["invalidations"] == 1
@@ -0,0 +1,112 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from pynicotine.sharescanner import FileInfoCache
+from pynicotine.sharescanner import FileInfoScanner
+from pynicotine.sharescanner import ShareFilter
+
+
+def get_lengths(files):
+    # Runs in the worker processes
+    return [(name, len(pathname), os.getpid()) for name, pathname in files]
+
+
+def scan(workers, numfiles):
+    results = []
+
+    with FileInfoScanner(get_lengths, workers) as scanner:
+        for i in range(numfiles):
+            results.extend(scanner.add(i, "file%i" % i, "x" * i))
+
+            # Only a few batches are queued at once
+            assert scanner.pending <= (2 * workers + 1) * FileInfoScanner.BATCH_SIZE
+
+        results.extend(scanner.finish())
+        assert scanner.pending == 0
+
+    return results
+
+
+def test_scan_in_order() -> None:
+    numfiles = 10 * FileInfoScanner.BATCH_SIZE + 5
+    results = scan(2, numfiles)
+
+    assert [(tag, name, length) for tag, (name, length, _pid) in results] == [
+        (i, "file%i" % i, i) for i in range(numfiles)
+    ]
+    assert os.getpid() not in [pid for _tag, (_name, _length, pid) in results]
+
+
+def test_scan_single_process() -> None:
+    results = scan(1, 100)
+
+    assert [tag for tag, _result in results] == list(range(100))
+    assert {pid for _tag, (_name, _length, pid) in results} == {os.getpid()}
+
+
+def test_file_info_cache(tmpdir) -> None:
+    filename = os.path.join(str(tmpdir), "fileinfo.cache")
+    path = os.path.join(str(tmpdir), "song.mp3")
+
+    with open(path, "wb") as f:
+        f.write(b"x" * 10)
+
+    cache = FileInfoCache.load(filename)
+    key = FileInfoCache.key(os.stat(path))
+
+    assert cache.get(key) is None
+    cache.add(key, ((320, 0), 180))
+    cache.add((0, 0, 0, 0), ((128, 0), 60))
+    cache.save()
+
+    cache = FileInfoCache.load(filename)
+    assert cache.get(key) == ((320, 0), 180)
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    # Entries that weren't used are kept unless pruning
+    cache.save(prune=False)
+    assert FileInfoCache.load(filename).get((0, 0, 0, 0)) == ((128, 0), 60)
+
+    # Entries that weren't used are dropped when saving
+    cache = FileInfoCache.load(filename)
+    assert cache.get(key) == ((320, 0), 180)
+    cache.save()
+    cache = FileInfoCache.load(filename)
+    assert cache.get((0, 0, 0, 0)) is None
+    assert cache.get(key) == ((320, 0), 180)
+
+    # Changing the file invalidates its entry
+    os.utime(path, ns=(1, 1))
+    assert cache.get(FileInfoCache.key(os.stat(path))) is None
+
+
+def test_share_filter(tmpdir) -> None:
+    sharefilter = ShareFilter([["*.nfo", 1], ["@eaDir", 1], ["thumbs\\.db|desktop\\.ini", 0], ["(invalid", 0]])
+
+    for name in (".hidden", "Info.NFO", "@eaDir", "Thumbs.db", "desktop.ini"):
+        assert sharefilter.excluded(name)
+
+    # Filters match whole names
+    for name in ("song.mp3", "info.nfo.mp3", "x@eaDir", "desktop.ini.bak"):
+        assert not sharefilter.excluded(name)
+
+    assert sharefilter.excluded_path(os.path.join(os.sep, "music", "@eaDir", "album"))
+    assert sharefilter.excluded_path(os.path.join(os.sep, "home", ".cache", "music"))
+    assert not ShareFilter().excluded_path(str(tmpdir))
@@ -0,0 +1,124 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+import pytest
+
+from pynicotine.sharestore import ShareStore
+
+
+FILES = {
+    "share": [],
+    "share\\album": [
+        ("01 intro.mp3", 1000, (320, 0), 60),
+        ("cover.jpg", 200, None, None)
+    ]
+}
+
+
+def open_store(tmpdir):
+    return ShareStore(os.path.join(str(tmpdir), "shares.sqlite"))
+
+
+def test_replace(tmpdir) -> None:
+    store = open_store(tmpdir)
+    assert store.created
+
+    fileindex = [("share\\album\\01 intro.mp3", 1000, (320, 0), 60), ("share\\album\\cover.jpg", 200, None, None)]
+    store.replace(ShareStore.NORMAL, FILES, {"share": b"a", "share\\album": b"b"}, fileindex, {"/music": 1.5})
+    store.close()
+
+    store = open_store(tmpdir)
+    assert not store.created
+
+    files = store.folder_files(ShareStore.NORMAL)
+    assert dict(files.items()) == FILES
+    assert files["share\\album"] == FILES["share\\album"]
+    assert files["share"] == []
+    assert "share\\missing" not in files
+    assert len(files) == 2
+
+    streams = store.folder_streams(ShareStore.NORMAL)
+    assert streams["share\\album"] == b"b"
+    assert sorted(streams) == ["share", "share\\album"]
+
+    index = store.file_index(ShareStore.NORMAL)
+    assert index["1"] == fileindex[1]
+    assert len(index) == 2
+    assert index.count() == 2
+
+    assert store.folder_mtimes(ShareStore.NORMAL)["/music"] == 1.5
+
+    # Shares are kept apart
+    assert not store.folder_files(ShareStore.BUDDY)
+    assert len(store.file_index(ShareStore.BUDDY)) == 0
+
+
+def test_incremental_updates(tmpdir) -> None:
+    store = open_store(tmpdir)
+    files = store.folder_files(ShareStore.BUDDY)
+    streams = store.folder_streams(ShareStore.BUDDY)
+    index = store.file_index(ShareStore.BUDDY)
+
+    files["share\\album"] = FILES["share\\album"]
+    streams["share\\album"] = bytearray(b"stream")
+    assert files.get("share\\album") == FILES["share\\album"]
+    assert streams["share\\album"] == b"stream"
+
+    del files["share\\album"]
+    assert "share\\album" not in files
+    assert "share\\album" in streams
+
+    del streams["share\\album"]
+    assert store.execute("SELECT COUNT(*) FROM folders")[0][0] == 0
+
+    index["0"] = ("share\\a.mp3", 1, None, None)
+    index["1"] = ("share\\b.mp3", 2, None, None)
+    index["0"] = None
+
+    # Removed files keep their index
+    assert index["0"] is None
+    assert index.get("0") is None
+    assert len(index) == 2
+    assert index.count() == 1
+    assert dict(index.items()) == {"1": ("share\\b.mp3", 2, None, None)}
+
+
+def test_transaction(tmpdir) -> None:
+    store = open_store(tmpdir)
+    mtimes = store.folder_mtimes(ShareStore.NORMAL)
+
+    with pytest.raises(ValueError):
+        with store.transaction():
+            mtimes["/a"] = 1.0
+
+            with store.transaction():
+                mtimes["/b"] = 2.0
+
+            raise ValueError
+
+    assert not mtimes
+
+    with store.transaction():
+        mtimes["/a"] = 1.0
+        mtimes["/b"] = 2.0
+
+    del mtimes["/a"]
+    assert dict(mtimes.items()) == {"/b": 2.0}
@@ -0,0 +1,119 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import queue
+
+import pytest
+
+from pynicotine.sharewatcher import InotifyShareWatcher
+from pynicotine.sharewatcher import PollingShareWatcher
+from pynicotine.sharewatcher import ShareWatcher
+from pynicotine.sharewatcher import merge_changes
+
+
+def start_watcher(watcher_class, folder, **kwargs):
+    changes = queue.Queue()
+    watcher = watcher_class([folder], changes.put, delay=0.2, **kwargs)
+
+    watcher.start()
+
+    # Changes made before the folders are watched would be missed
+    assert watcher.ready.wait(5)
+
+    return watcher, changes
+
+
+def test_merge_changes() -> None:
+    changes = {}
+
+    merge_changes(changes, {"/a": {"1.mp3"}, "/b": None})
+    merge_changes(changes, {"/a": {"2.mp3"}, "/b": {"3.mp3"}, "/c": set()})
+
+    assert changes == {"/a": {"1.mp3", "2.mp3"}, "/b": None, "/c": set()}
+
+    merge_changes(changes, {"/a": None})
+    assert changes["/a"] is None
+
+
+def test_base_watcher(tmpdir) -> None:
+    watcher, changes = start_watcher(ShareWatcher, str(tmpdir))
+
+    os.mkdir(os.path.join(str(tmpdir), "new"))
+
+    watcher.stop()
+    watcher.join(5)
+
+    assert not watcher.is_alive()
+    assert changes.empty()
+
+
+def test_polling_watcher(tmpdir) -> None:
+    folder = str(tmpdir)
+    os.mkdir(os.path.join(folder, "old"))
+
+    watcher, changes = start_watcher(PollingShareWatcher, folder, interval=0.1)
+
+    try:
+        os.mkdir(os.path.join(folder, "new"))
+        os.rmdir(os.path.join(folder, "old"))
+
+        assert changes.get(timeout=5) == {
+            folder: None,
+            os.path.join(folder, "new"): None,
+            os.path.join(folder, "old"): None
+        }
+    finally:
+        watcher.stop()
+        watcher.join()
+
+
+@pytest.mark.skipif(not InotifyShareWatcher.is_available(), reason="inotify is not available")
+def test_inotify_watcher(tmpdir) -> None:
+    folder = str(tmpdir)
+    subfolder = os.path.join(folder, "album")
+    os.mkdir(os.path.join(folder, "removed"))
+
+    watcher, changes = start_watcher(InotifyShareWatcher, folder)
+
+    try:
+        # Bursts of changes are reported at once
+        for i in range(3):
+            with open(os.path.join(folder, "%i.mp3" % i), "wb") as f:
+                f.write(b"x")
+
+        os.mkdir(subfolder)
+        os.rmdir(os.path.join(folder, "removed"))
+
+        assert changes.get(timeout=5) == {
+            folder: {"0.mp3", "1.mp3", "2.mp3"},
+            subfolder: None,
+            os.path.join(folder, "removed"): None
+        }
+
+        # New folders are watched too
+        os.rename(os.path.join(folder, "0.mp3"), os.path.join(subfolder, "0.mp3"))
+
+        assert changes.get(timeout=5) == {
+            folder: {"0.mp3"},
+            subfolder: {"0.mp3"}
+        }
+    finally:
+        watcher.stop()
+        watcher.join()
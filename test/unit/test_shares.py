@@ -0,0 +1,106 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("gi")
+pytest.importorskip("taglib")
+
+from pynicotine import shares  # noqa: E402
+
+
+@pytest.fixture
+def sharedir(tmpdir):
+    sharedir = os.path.join(str(tmpdir), "share")
+
+    for folder in ("a", "b", "c"):
+        os.makedirs(os.path.join(sharedir, folder))
+
+        with open(os.path.join(sharedir, folder, "song.mp3"), "wb") as f:
+            f.write(b"x" * 10)
+
+    return sharedir
+
+
+def create_shares(sharedir):
+    np = MagicMock()
+    np.logMessage = None
+    np.config.sections = {
+        "transfers": {
+            "shared": [("share", sharedir)], "buddyshared": [], "enablebuddyshares": False,
+            "sharedownloaddir": False, "downloaddir": "", "sharefilters": [], "scanworkers": 1,
+            "sharedfilesstreams": None, "bsharedfilesstreams": None, "wordindex": None, "bwordindex": None
+        }
+    }
+    return shares.Shares(np)
+
+
+def test_incremental_scan_keeps_cache(sharedir, tmpdir, monkeypatch) -> None:
+    cachefile = os.path.join(str(tmpdir), "fileinfo.cache")
+    read = []
+
+    def get_files_info(files):
+        read.extend(pathname for _name, pathname in files)
+        return [((name, 10, None, None), None) for name, _pathname in files]
+
+    monkeypatch.setattr(shares, "get_files_info", get_files_info)
+    share = create_shares(sharedir)
+
+    mtimes = share.getDirsMtimes([sharedir])
+    files = share.getFilesList(mtimes, {}, {}, cachefile=cachefile)
+    assert len(read) == 3
+
+    # Only folder a changed, b and c are taken from the previous scan
+    with open(os.path.join(sharedir, "a", "new.mp3"), "wb") as f:
+        f.write(b"x" * 10)
+
+    os.utime(os.path.join(sharedir, "a"), ns=(1, 1))
+    del read[:]
+
+    newmtimes = share.getDirsMtimes([sharedir])
+    share.getFilesList(newmtimes, mtimes, files, cachefile=cachefile)
+    assert read == [os.path.join(sharedir, "a", "new.mp3")]
+
+    # The files of the folders skipped above are still cached
+    del read[:]
+
+    share.getFilesList(newmtimes, newmtimes, {}, rebuild=True, cachefile=cachefile)
+    assert read == []
+
+
+def test_excluded_download(sharedir) -> None:
+    share = create_shares(sharedir)
+    share.config.sections["transfers"].update({
+        "sharedownloaddir": True, "downloaddir": sharedir,
+        "sharedfiles": {}, "fileindex": {}, "sharedmtimes": {}
+    })
+    share.config.sections["transfers"]["sharefilters"] = [["*.nfo", 1]]
+
+    assert share.excludedFromShares(os.path.join(sharedir, "a"), "info.nfo")
+    assert share.excludedFromShares(os.path.join(sharedir, "a"), ".hidden.mp3")
+    assert share.excludedFromShares(os.path.join(sharedir, ".a"), "song.mp3")
+    assert not share.excludedFromShares(os.path.join(sharedir, "a"), "song.mp3")
+
+    # Excluded downloads don't reach the shares database
+    share.addToShared(os.path.join(sharedir, "a", "info.nfo"))
+    assert not share.config.sharestore.transaction.called
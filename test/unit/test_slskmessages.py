@@ -0,0 +1,180 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import struct
+import zlib
+
+import pytest
+
+from pynicotine.slskmessages import compress_segment
+from pynicotine.slskmessages import FileSearchResult
+from pynicotine.slskmessages import join_compressed
+from pynicotine.slskmessages import MessageChunks
+from pynicotine.slskmessages import read_int32
+from pynicotine.slskmessages import read_string
+from pynicotine.slskmessages import read_uint32
+from pynicotine.slskmessages import read_uint64
+from pynicotine.slskmessages import SharedFileList
+from pynicotine.slskmessages import SharedFileListDecoder
+from pynicotine.slskmessages import SlskMessage
+
+
+def test_read_integers() -> None:
+    message = struct.pack("<iIQ", -5, 7, 2 ** 40)
+
+    pos, value = read_int32(message)
+    assert (pos, value) == (4, -5)
+
+    pos, value = read_uint32(message, pos)
+    assert (pos, value) == (8, 7)
+
+    pos, value = read_uint64(memoryview(message), pos)
+    assert (pos, value) == (16, 2 ** 40)
+
+    with pytest.raises(struct.error):
+        read_uint32(message, pos)
+
+
+def test_read_uint64_fallback() -> None:
+    # Some clients send 32-bit sizes at the end of a message
+    pos, value = read_uint64(struct.pack("<I", 123))
+    assert (pos, value) == (4, 123)
+
+
+def test_read_string() -> None:
+    packer = SlskMessage()
+    message = packer.packObject("héllo") + packer.packObject(b"\xe9t\xe9")
+
+    pos, value = read_string(message)
+    assert value == "héllo"
+
+    # Not UTF-8, falls back to Latin-1
+    pos, value = read_string(memoryview(message), pos)
+    assert value == "été"
+    assert pos == len(message)
+
+    pos, value = read_string(message, 0, rawbytes=True)
+    assert value == "héllo".encode("utf-8")
+
+    # Missing string at the end of a message
+    assert read_string(message, len(message)) == (len(message) + 4, "")
+
+
+def make_shares(numdirs=2000):
+    packer = SlskMessage()
+    shares = {}
+
+    for i in range(numdirs):
+        stream = bytearray(packer.packObject(10))
+
+        for j in range(10):
+            stream.extend(bytes([1]))
+            stream.extend(packer.packObject("%02i - Track.mp3" % j))
+            stream.extend(packer.packObject(4000000 + j, unsignedlonglong=True))
+            stream.extend(packer.packObject("mp3"))
+            stream.extend(packer.packObject(2))
+            stream.extend(packer.packObject(0) + packer.packObject(320))
+            stream.extend(packer.packObject(1) + packer.packObject(180 + j))
+
+        shares["Music\\Artist %i\\Album %i" % (i % 50, i)] = stream
+
+    return shares
+
+
+def make_shared_file_list(numdirs=2000):
+    return bytes(SharedFileList(None, make_shares(numdirs)).makeNetworkMessage())
+
+
+def test_shared_file_list_chunks(monkeypatch) -> None:
+    monkeypatch.setattr(SharedFileList, "CHUNK_SIZE", 1024)
+
+    # Random data doesn't compress, so that zlib has output for many chunks
+    shares = {"Music\\Folder %i" % i: os.urandom(1000) for i in range(200)}
+    chunks = SharedFileList(None, shares).makeNetworkMessage()
+    uncompressed = SharedFileList(None, shares).makeNetworkMessage(nozlib=1)
+
+    assert isinstance(chunks, MessageChunks)
+    assert len(chunks.chunks) > 1
+    assert len(chunks) == sum(len(chunk) for chunk in chunks)
+    assert zlib.decompress(bytes(chunks)) == uncompressed
+
+    # The header goes in front without copying the chunks
+    message = chunks.prepend(b"header")
+    assert bytes(message) == b"header" + bytes(chunks)
+    assert message.chunks[1] is chunks.chunks[0]
+
+
+def test_shared_file_list_decoder_chunks() -> None:
+    data = make_shared_file_list()
+
+    expected = SharedFileList(None)
+    expected.parseNetworkMessage(data)
+
+    for chunk_size in (1, 777, 65536, len(data)):
+        decoder = SharedFileListDecoder(len(data))
+        directories = []
+
+        for offset in range(0, len(data), chunk_size):
+            directories.extend(decoder.feed(data[offset:offset + chunk_size]))
+
+        assert decoder.done
+        assert not decoder.failed
+        assert directories == expected.list
+
+
+def test_shared_file_list_decoder_corrupt() -> None:
+    data = bytearray(make_shared_file_list(10))
+    data[len(data) // 2:] = b"\x00" * (len(data) - len(data) // 2)
+
+    decoder = SharedFileListDecoder(len(data))
+    list(decoder.feed(data))
+
+    assert decoder.done
+    assert decoder.failed
+
+
+def test_join_compressed() -> None:
+    segment = compress_segment(b"files" * 1000)
+
+    for header, footer in ((b"", b""), (b"user", b"\x01\x02"), (b"x" * 100000, b"y")):
+        stream = join_compressed(header, segment, footer)
+        assert zlib.decompress(stream) == header + b"files" * 1000 + footer
+
+
+def test_file_search_result_cached_file_list() -> None:
+    fileindex = {
+        "0": ("Music\\a.mp3", 1000, (320, 0), 180),
+        "1": ("Music\\b.flac", 2000, None, None)
+    }
+
+    filelist = FileSearchResult(None, shares=[0, 1], fileindex=fileindex).packFileList()
+
+    for token in (1, 2):
+        message = FileSearchResult(None, "user", 0, token, [0, 1], fileindex, 1, 100, [3], 0, filelist)
+
+        parsed = FileSearchResult(None)
+        parsed.parseNetworkMessage(message.makeNetworkMessage())
+
+        assert parsed.user == "user"
+        assert parsed.token == token
+        assert parsed.list == [
+            [1, "Music\\a.mp3", 1000, "mp3", [320, 180, 0]],
+            [1, "Music\\b.flac", 2000, "", []]
+        ]
+        assert (parsed.freeulslots, parsed.ulspeed, parsed.inqueue) == (1, 100, 3)
@@ -0,0 +1,108 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from pynicotine.timerqueue import TimerQueue
+
+
+class Clock:
+
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_timers_run_in_order() -> None:
+    clock = Clock()
+    wakeups = []
+    calls = []
+    timers = TimerQueue(wakeup=wakeups.append, clock=clock)
+
+    timers.add(30, calls.append, "transfer")
+    assert wakeups == [30]
+
+    timers.add(120, calls.append, "connection")
+    assert wakeups == [30]
+
+    timers.add(15, calls.append, "server")
+    assert wakeups == [30, 15]
+
+    clock.now += 20
+    assert timers.run_due() == 10
+    assert calls == ["server"]
+    assert wakeups[-1] == 10
+
+    clock.now += 100
+    assert timers.run_due() is None
+    assert calls == ["server", "transfer", "connection"]
+    assert len(timers) == 0
+
+
+def test_cancel() -> None:
+    clock = Clock()
+    calls = []
+    timers = TimerQueue(clock=clock)
+    threads = threading.active_count()
+
+    handles = [timers.add(i, calls.append, i) for i in range(1000)]
+    assert threading.active_count() == threads
+    assert len(timers) == 1000
+
+    for handle in handles[:900]:
+        handle.cancel()
+
+    # Cancelling twice, or after running, does nothing
+    timers.cancel(handles[0])
+    assert not handles[0].active
+    assert len(timers) == 100
+
+    # Cancelled timers are dropped once they make up most of the queue
+    assert len(timers._heap) < 1000
+
+    assert timers.next_timeout() == 900
+    clock.now += 950
+    timers.run_due()
+
+    handles[920].cancel()
+    assert calls == list(range(900, 951))
+    assert timers.next_timeout() == 1
+
+
+def test_callbacks_add_timers() -> None:
+    clock = Clock()
+    calls = []
+    timers = TimerQueue(clock=clock)
+
+    def retry(attempt):
+        calls.append(attempt)
+
+        if attempt < 3:
+            timers.add(0, retry, attempt + 1)
+
+    def fail():
+        raise ValueError("broken")
+
+    timers.add(0, fail)
+    timers.add(0, retry, 1)
+
+    # Timers added by callbacks run in the same call if they're due
+    assert timers.run_due() is None
+    assert calls == [1, 2, 3]
@@ -0,0 +1,86 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from pynicotine.transferregistry import Transfer
+from pynicotine.transferregistry import TransferRegistry
+
+
+def test_lookups_follow_changes() -> None:
+    uploads = TransferRegistry()
+    first = Transfer(user="user1", filename="a.mp3", status="Queued")
+    second = Transfer(user="user1", filename="b.mp3", status="Queued", req=5)
+    third = Transfer(user="user2", filename="a.mp3", status="Getting status")
+
+    uploads.append(first)
+    uploads.extend([second, third])
+
+    assert uploads.by_user("user1") == [first, second]
+    assert uploads.by_file("user1", "a.mp3") == [first]
+    assert uploads.by_file("user2", "b.mp3") == []
+    assert uploads.by_req(5) == [second]
+    assert uploads.by_status("Queued") == [first, second]
+    assert uploads.count_status("Queued") == 2
+
+    first.status = "Transferring"
+    first.conn = conn = object()
+    second.req = None
+
+    assert uploads.by_status("Queued") == [second]
+    assert uploads.by_status("Transferring") == [first]
+    assert uploads.by_conn(conn) == [first]
+    assert uploads.by_req(5) == []
+
+    # Unset connections and requests aren't indexed
+    assert uploads.by_conn(None) == []
+    assert uploads.by_req(None) == []
+
+
+def test_removed_transfers_are_forgotten() -> None:
+    downloads = TransferRegistry()
+    transfers = [Transfer(user="user", filename="%i.mp3" % i, status="Queued", req=i) for i in range(5)]
+    downloads.extend(transfers)
+
+    # Lookups return copies, transfers can be removed while going through them
+    for transfer in downloads.by_status("Queued"):
+        if transfer.req % 2:
+            downloads.remove(transfer)
+
+    del downloads[0]
+    downloads.pop()
+
+    assert list(downloads) == [transfers[2]]
+    assert transfers[2] in downloads
+    assert transfers[0] not in downloads
+    assert downloads.by_user("user") == [transfers[2]]
+
+    # Transfers that left the registry can change freely, and join another one
+    transfers[0].status = "Finished"
+    other = TransferRegistry([transfers[0]])
+    assert other.by_status("Finished") == [transfers[0]]
+
+    with pytest.raises(ValueError):
+        downloads.append(transfers[0])
+
+    with pytest.raises(ValueError):
+        downloads.remove(transfers[1])
+
+    downloads.clear()
+    assert downloads.by_user("user") == []
+    assert downloads.count_status("Queued") == 0
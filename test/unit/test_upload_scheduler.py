@@ -0,0 +1,191 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from pynicotine.transferregistry import Transfer
+from pynicotine.transferregistry import TransferRegistry
+from pynicotine.uploadscheduler import UploadScheduler
+
+
+def make_uploads(privileged=(), fifo=False):
+
+    scheduler = UploadScheduler(lambda user: 0 if user in privileged else 1, fifo=fifo)
+    return scheduler, TransferRegistry(scheduler=scheduler)
+
+
+def queue_upload(uploads, user, filename, timequeued):
+
+    transfer = Transfer(user=user, filename=filename, status="Queued", timequeued=timequeued)
+    uploads.append(transfer)
+    return transfer
+
+
+def test_round_robin() -> None:
+    scheduler, uploads = make_uploads()
+
+    first = queue_upload(uploads, "user1", "a.mp3", 10)
+    second = queue_upload(uploads, "user1", "b.mp3", 11)
+    other = queue_upload(uploads, "user2", "a.mp3", 12)
+
+    assert scheduler.next_candidate() is first
+    assert scheduler.queued("user1") == [first, second]
+
+    # Users with an upload in progress have to wait
+    first.status = "Getting status"
+    first.req = 1
+    assert scheduler.next_candidate() is other
+    assert scheduler.active_users == ["user1"]
+
+    first.status = "Transferring"
+    first.req = None
+    first.conn = object()
+    assert scheduler.active == [first]
+
+    # Finished uploads send the user to the back of the queue
+    first.conn = None
+    first.status = "Finished"
+
+    for transfer in uploads.by_user("user1"):
+        transfer.timequeued = 20
+
+    assert scheduler.next_candidate() is other
+    assert scheduler.active == []
+
+    uploads.remove(other)
+    assert scheduler.next_candidate() is second
+
+    second.status = "Cancelled"
+    assert scheduler.next_candidate() is None
+    assert scheduler.queued("user1") == []
+
+
+def test_fifo() -> None:
+    scheduler, uploads = make_uploads(fifo=True)
+
+    first = queue_upload(uploads, "user1", "a.mp3", 20)
+    second = queue_upload(uploads, "user2", "a.mp3", 10)
+    queue_upload(uploads, "user1", "b.mp3", 5)
+
+    assert scheduler.next_candidate() is first
+
+    scheduler.fifo = False
+    assert scheduler.next_candidate() is second
+
+    scheduler.fifo = True
+    first.status = "Getting status"
+    assert scheduler.next_candidate() is second
+
+
+def test_tiers() -> None:
+    privileged = set()
+    scheduler, uploads = make_uploads(privileged)
+
+    regular = queue_upload(uploads, "user1", "a.mp3", 10)
+    buddy = queue_upload(uploads, "user2", "a.mp3", 20)
+
+    assert scheduler.next_candidate() is regular
+
+    privileged.add("user2")
+    scheduler.update_user("user2")
+    assert scheduler.next_candidate() is buddy
+
+    # Lower tiers are served once no one of a higher tier is waiting
+    buddy.status = "Getting status"
+    assert scheduler.next_candidate() is regular
+
+    privileged.clear()
+    scheduler.update_user("user2")
+    buddy.status = "Queued"
+    assert scheduler.next_candidate() is regular
+
+
+def test_many_changes() -> None:
+    scheduler, uploads = make_uploads(fifo=True)
+    transfers = [queue_upload(uploads, "user%i" % (i % 50), "%i.mp3" % i, i) for i in range(2000)]
+
+    for transfer in transfers[:1500]:
+        transfer.status = "Getting status"
+        transfer.status = "Finished"
+
+    assert scheduler.next_candidate() is transfers[1500]
+
+    # Outdated heap entries are dropped as they pile up
+    assert sum(len(heap) for heap in scheduler._heaps.values()) < 200
+
+    # Uploads are numbered again as they come and go
+    for i in range(10000):
+        uploads.remove(queue_upload(uploads, "user", "%i.flac" % i, i))
+
+    assert scheduler._nextseq <= 2 * len(uploads) + 4096
+    assert scheduler.next_candidate() is transfers[1500]
+    assert scheduler.place(transfers[1501]) == 2
+    assert scheduler.queued("user0") == transfers[1500::50]
+
+
+def test_queue_places() -> None:
+    privileged = {"user%i" % i for i in range(0, 2000, 50)}
+    scheduler, uploads = make_uploads(privileged, fifo=True)
+
+    for i in range(50000):
+        queue_upload(uploads, "user%i" % (i * 7 % 2000), "%i.mp3" % i, i)
+
+    # Start and finish some uploads, and change some tiers
+    for i in range(0, 50000, 7):
+        uploads[i].status = "Getting status"
+
+        if i % 2:
+            uploads[i].status = "Finished"
+
+    for user in ("user0", "user1", "user2"):
+        if user in privileged:
+            privileged.remove(user)
+        else:
+            privileged.add(user)
+
+        scheduler.update_user(user)
+
+    queued = [transfer for transfer in uploads if transfer.status == "Queued"]
+    active = {transfer.user for transfer in uploads if transfer.status == "Getting status"}
+    userqueues = {}
+
+    for transfer in queued:
+        userqueues.setdefault(transfer.user, []).append(transfer)
+
+    assert scheduler.num_queued() == len(queued)
+    assert scheduler.num_queued_users() == len(userqueues)
+    assert scheduler.num_queued_users(0) == len([user for user in userqueues if user in privileged])
+
+    for transfer in queued[::997]:
+        user = transfer.user
+        num = userqueues[user].index(transfer) + 1
+
+        # Every upload queued before it, unless it's privileged and they aren't
+        fifoplace = sum(
+            1 for i in queued[:queued.index(transfer) + 1] if user not in privileged or i.user in privileged
+        )
+
+        others = sum(
+            1 for other, queue in userqueues.items() if other != user and other not in active and len(queue) >= num
+        )
+
+        scheduler.fifo = True
+        assert scheduler.place(transfer) == fifoplace
+
+        scheduler.fifo = False
+        assert scheduler.place(transfer) == num + num * others
+
+    assert scheduler.place(uploads[7]) == 0
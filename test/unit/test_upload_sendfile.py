@@ -0,0 +1,133 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+# COPYRIGHT (C) 2020 Lene Preuss <lene.preuss@gmail.com>
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import selectors
+import socket
+
+from unittest.mock import Mock, MagicMock
+
+import pytest
+
+from pynicotine.slskmessages import ConnClose
+from pynicotine.slskmessages import FileError
+from pynicotine.slskmessages import UploadFile
+from pynicotine.slskproto import PeerConnection
+from pynicotine.slskproto import SlskProtoThread
+from pynicotine.utils import ApplyTranslation
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "sendfile"), reason="sendfile() is not available")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def apply_translations():
+    ApplyTranslation()
+
+
+@pytest.fixture
+def proto():
+    config = MagicMock()
+    config.sections = {'server': {'portrange': (1, 2)}, 'transfers': {'downloadlimit': 10}}
+
+    proto = SlskProtoThread(
+        ui_callback=Mock(), queue=Mock(), bindip='',
+        port=None, config=config, eventprocessor=Mock()
+    )
+
+    # Drive writeData() by hand, without the networking loop
+    proto.abort()
+
+    if proto.is_alive():
+        proto.join(5)
+
+    proto._ui_callback.reset_mock()
+    proto.selector = selectors.DefaultSelector()
+    yield proto
+    proto.selector.close()
+
+
+def add_upload(proto, sock, path, size):
+    conn = PeerConnection(conn=sock, addr=("127.0.0.1", 2234))
+    conn.fileupl = UploadFile(conn=sock, file=open(path, "rb"), size=size, offset=0)
+    proto._add_connection(sock, conn)
+    return conn
+
+
+def posted_messages(proto):
+    return [msg for call in proto._ui_callback.call_args_list for msg in call[0][0]]
+
+
+def test_upload_complete_file(proto, tmp_path) -> None:
+    path = tmp_path / "complete.bin"
+    path.write_bytes(b"x" * 4096)
+
+    local, remote = socket.socketpair()
+    conn = add_upload(proto, local, path, 4096)
+
+    proto.writeData(None, proto._conns, local)
+
+    assert conn.fileupl.sentbytes == 4096
+    assert remote.recv(8192) == b"x" * 4096
+    assert local in proto._conns
+    assert proto.selector.get_key(local).events == selectors.EVENT_READ
+
+    conn.fileupl.file.close()
+    local.close()
+    remote.close()
+
+
+def test_upload_truncated_file(proto, tmp_path) -> None:
+    path = tmp_path / "truncated.bin"
+    path.write_bytes(b"x" * 4096)
+
+    local, remote = socket.socketpair()
+    conn = add_upload(proto, local, path, 4096)
+
+    # The file shrinks after the upload was announced with its old size
+    os.truncate(path, 1024)
+    proto.writeData(None, proto._conns, local)
+    assert conn.fileupl.sentbytes == 1024
+
+    proto.writeData(None, proto._conns, local)
+    messages = posted_messages(proto)
+
+    assert local not in proto._conns
+    assert not proto.selector.get_map()
+    assert local.fileno() == -1
+    assert [msg.__class__ for msg in messages[-2:]] == [FileError, ConnClose]
+    assert messages[-2].conn is conn
+
+    conn.fileupl.file.close()
+    remote.close()
+
+
+def test_upload_closed_file(proto, tmp_path) -> None:
+    path = tmp_path / "closed.bin"
+    path.write_bytes(b"x" * 4096)
+
+    local, remote = socket.socketpair()
+    conn = add_upload(proto, local, path, 4096)
+
+    conn.fileupl.file.close()
+    proto.writeData(None, proto._conns, local)
+
+    assert local not in proto._conns
+    assert [msg.__class__ for msg in posted_messages(proto)] == [FileError, ConnClose]
+
+    remote.close()
@@ -0,0 +1,67 @@
+# COPYRIGHT (C) 2020 Nicotine+ Team
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from pynicotine.virtualpaths import VirtualPathMapping
+
+
+def make_mapping():
+    return VirtualPathMapping([
+        ("Music", os.path.join(os.sep, "home", "user", "Music")),
+        ("Rock", os.path.join(os.sep, "home", "user", "Music", "Rock")),
+        ("Music Videos", os.path.join(os.sep, "home", "user", "Videos")),
+        ("Downloaded", os.path.join(os.sep, "home", "user", "Downloads"))
+    ])
+
+
+def test_real2virtual() -> None:
+    mapping = make_mapping()
+    home = os.path.join(os.sep, "home", "user")
+
+    assert mapping.real2virtual(os.path.join(home, "Music")) == "Music"
+    assert mapping.real2virtual(os.path.join(home, "Music", "Album", "01.mp3")) == "Music\\Album\\01.mp3"
+    assert mapping.real2virtual(os.path.join(home, "Videos", "clip.mkv")) == "Music Videos\\clip.mkv"
+    assert mapping.real2virtual(os.path.join(home, "Downloads", "x", "..", "y.mp3")) == "Downloaded\\y.mp3"
+
+    # The folder listed first wins, like the share list was searched in order
+    assert mapping.real2virtual(os.path.join(home, "Music", "Rock", "a.mp3")) == "Music\\Rock\\a.mp3"
+
+    # Sharing a folder doesn't share folders with a similar name
+    assert mapping.real2virtual(os.path.join(home, "Musical", "a.mp3")) is None
+    assert mapping.real2virtual(home) is None
+
+
+def test_virtual2real() -> None:
+    mapping = make_mapping()
+    home = os.path.join(os.sep, "home", "user")
+
+    assert mapping.virtual2real("Music") == os.path.join(home, "Music")
+    assert mapping.virtual2real("Music\\Album\\01.mp3") == os.path.join(home, "Music", "Album", "01.mp3")
+    assert mapping.virtual2real("Rock\\a.mp3") == os.path.join(home, "Music", "Rock", "a.mp3")
+    assert mapping.virtual2real("Music Videos\\clip.mkv") == os.path.join(home, "Videos", "clip.mkv")
+
+    assert mapping.virtual2real("Musical\\a.mp3") is None
+    assert mapping.virtual2real("Other") is None
+
+
+def test_round_trip() -> None:
+    mapping = make_mapping()
+    path = os.path.join(os.sep, "home", "user", "Downloads", "Artist", "Album", "02.flac")
+
+    assert mapping.virtual2real(mapping.real2virtual(path)) == path